@@ -0,0 +1,25 @@
+"""Pub/sub consumer groups
+
+Revision ID: 0032_7c2d4e19
+Revises: 0031_5a1e0c37
+Create Date: 2016-10-25 14:21:08
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0032_7c2d4e19'
+down_revision = '0031_5a1e0c37'
+
+from alembic import op
+import sqlalchemy as sa
+
+# Zato
+from zato.common.odb import model
+
+# ################################################################################################################################
+
+def upgrade():
+    op.add_column(model.PubSubConsumer.__tablename__, sa.Column('group_name', sa.String(200), nullable=True))
+
+def downgrade():
+    op.drop_column(model.PubSubConsumer.__tablename__, 'group_name')
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import logging
+
+# Zato
+from zato.common import BROKER, KVDB
+
+logger = logging.getLogger(__name__)
+
+# ################################################################################################################################
+
+class AsyncQueue(object):
+    """ A work queue of messages to be invoked asynchronously, kept in a KVDB list. Each message is delivered to exactly one
+    consumer which atomically moves it to a processing list of its own and removes it from there once the message has been
+    handled. Consumers keep refreshing a key of theirs so that if one of them is not heard from for longer than consumer_ttl
+    seconds, any other can put its in-flight messages back in the queue, hence each message is delivered at least once.
+
+    Consumers block while waiting for messages, which is why they should be given a consumer_conn of their own
+    rather than share conn with publishers.
+    """
+    def __init__(self, conn, consumer_name, batch_size=BROKER.DEFAULT_QUEUE_BATCH_SIZE,
+            consumer_ttl=BROKER.QUEUE_CONSUMER_TTL, consumer_conn=None):
+        self.conn = conn
+        self.consumer_conn = consumer_conn or conn
+        self.consumer_name = consumer_name
+        self.batch_size = batch_size
+        self.consumer_ttl = consumer_ttl
+
+        self.processing_key = KVDB.BROKER_ASYNC_QUEUE_PROCESSING + consumer_name
+        self.alive_key = KVDB.BROKER_ASYNC_QUEUE_ALIVE + consumer_name
+
+        # Statistics
+        self.delivered = 0
+        self.recovered = 0
+        self.queue_depth = 0
+        self.in_flight = 0
+
+    def put(self, *msgs):
+        self.conn.lpush(KVDB.BROKER_ASYNC_QUEUE, *msgs)
+
+    def register(self):
+        """ Makes other consumers aware of this one.
+        """
+        self.heartbeat()
+        self.conn.sadd(KVDB.BROKER_ASYNC_QUEUE_CONSUMERS, self.consumer_name)
+
+    def heartbeat(self):
+        """ Signals that the consumer is still alive and updates the queue's metrics.
+        """
+        with self.conn.pipeline() as pipe:
+            pipe.set(self.alive_key, 1, ex=self.consumer_ttl)
+            pipe.llen(KVDB.BROKER_ASYNC_QUEUE)
+            pipe.llen(self.processing_key)
+            _, self.queue_depth, self.in_flight = pipe.execute()
+
+    def get(self, timeout=BROKER.QUEUE_POP_TIMEOUT):
+        """ Blocks for up to timeout seconds waiting for a message and returns a list of up to batch_size of them,
+        which is empty if there were none. Each message is in the consumer's processing list until it is acknowledged.
+        """
+        msg = self.consumer_conn.brpoplpush(KVDB.BROKER_ASYNC_QUEUE, self.processing_key, timeout)
+        if msg is None:
+            return []
+
+        out = [msg]
+
+        if self.batch_size > 1:
+            with self.consumer_conn.pipeline(False) as pipe:
+                for _ in range(self.batch_size - 1):
+                    pipe.rpoplpush(KVDB.BROKER_ASYNC_QUEUE, self.processing_key)
+                out.extend(elem for elem in pipe.execute() if elem is not None)
+
+        self.delivered += len(out)
+
+        return out
+
+    def ack(self, msg):
+        """ Removes a message that has been handled from the processing list.
+        """
+        self.conn.lrem(self.processing_key, -1, msg)
+
+    def recover(self):
+        """ Puts messages of consumers whose heartbeats expired back in the queue. Each message is moved atomically so
+        it is safe for many consumers to recover the same one concurrently. Returns the number of messages recovered.
+        """
+        count = 0
+
+        for consumer_name in self.conn.smembers(KVDB.BROKER_ASYNC_QUEUE_CONSUMERS):
+            if consumer_name == self.consumer_name or self.conn.exists(KVDB.BROKER_ASYNC_QUEUE_ALIVE + consumer_name):
+                continue
+
+            processing_key = KVDB.BROKER_ASYNC_QUEUE_PROCESSING + consumer_name
+            consumer_count = 0
+
+            while self.conn.rpoplpush(processing_key, KVDB.BROKER_ASYNC_QUEUE) is not None:
+                consumer_count += 1
+
+            self.conn.srem(KVDB.BROKER_ASYNC_QUEUE_CONSUMERS, consumer_name)
+
+            if consumer_count:
+                logger.warn('Recovered %s in-flight message(s) of broker queue consumer `%s`', consumer_count, consumer_name)
+
+            count += consumer_count
+
+        self.recovered += count
+
+        return count
+
+    def get_stats(self):
+        return {
+            'queue_depth': self.queue_depth,
+            'in_flight': self.in_flight,
+            'delivered': self.delivered,
+            'recovered': self.recovered,
+        }
+
+# ################################################################################################################################
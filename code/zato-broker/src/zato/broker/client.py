@@ -25,10 +25,11 @@ from gevent import sleep
 import redis
 
 # Zato
+from zato.broker.async_queue import AsyncQueue
 from zato.common import BROKER, ZATO_NONE
-from zato.common.broker_message import KEYS, MESSAGE_TYPE, TOPICS
+from zato.common.broker_message import KEYS, MESSAGE_TYPE, OUTGOING, SCHEDULER, SERVICE, TOPICS
 from zato.common.kvdb import LuaContainer
-from zato.common.util import new_cid, spawn_greenlet
+from zato.common.util import DispatchPool, new_cid, spawn_greenlet
 
 logger = logging.getLogger(__name__)
 has_debug = logger.isEnabledFor(logging.DEBUG)
@@ -46,7 +47,27 @@ NEEDS_TMP_KEY = [v for k,v in TOPICS.items() if k in(
 CODE_RENAMED = 10
 CODE_NO_SUCH_FROM_KEY = 11
 
-def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
+# Each group of broker messages, e.g. OUTGOING or SECURITY, has that many action codes
+CODES_PER_GROUP = 200
+
+# Invocations of services and messages sent through connectors, none of which need to wait for each other
+UNORDERED_ACTIONS = (SERVICE.PUBLISH.value, SCHEDULER.JOB_EXECUTED.value, OUTGOING.AMQP_PUBLISH.value,
+    OUTGOING.JMS_WMQ_SEND.value, OUTGOING.ZMQ_SEND.value)
+
+def get_dispatch_key(msg):
+    """ Returns the key of messages that need to be handled one after another, in the order they were published in,
+    or None if msg can be handled concurrently with any other. Changes to configuration are ordered within each group
+    of messages so that, for instance, an EDIT of an object is never applied after a DELETE of the same one.
+    """
+    action = msg.get('action')
+
+    if not action or action in UNORDERED_ACTIONS:
+        return None
+
+    return int(action) // CODES_PER_GROUP
+
+def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs, dispatch_pool_size=0,
+        async_mode=BROKER.ASYNC_MODE.FAN_OUT, queue_batch_size=BROKER.DEFAULT_QUEUE_BATCH_SIZE):
 
     # Imported here so it's guaranteed to be monkey-patched using gevent.monkey.patch_all by whoever called us
     from thread import start_new_thread
@@ -134,11 +155,32 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
            that bad as it may seem, there will be at most as many clients as there
            are servers in the cluster and truth to be told, Zero MQ < 3.x also would
            do client-side PUB/SUB filtering and it did scale nicely.
+
+           Alternatively, if async_mode is 'queue', messages are added to a KVDB list
+           instead and each one is popped off it by exactly one of the clients, without
+           waking up all the other ones. Clients that subscribe to such messages handle
+           both kinds so that publishers using either mode can be mixed.
         """
-        def __init__(self, kvdb, client_type, topic_callbacks, initial_lua_programs):
+        def __init__(self, kvdb, client_type, topic_callbacks, initial_lua_programs, dispatch_pool_size=0,
+                async_mode=BROKER.ASYNC_MODE.FAN_OUT, queue_batch_size=BROKER.DEFAULT_QUEUE_BATCH_SIZE):
             self.kvdb = kvdb
             self.decrypt_func = kvdb.decrypt_func
             self.name = '{}-{}'.format(client_type, new_cid())
+
+            # Callbacks are run in a bounded pool without waiting for them or, if there is no pool, by spawn_greenlet
+            self.dispatch_pool = DispatchPool(dispatch_pool_size, self.name) if dispatch_pool_size else None
+
+            # Consumers of the queue block on a connection of their own, outside of the pool the rest of the client uses
+            if async_mode == BROKER.ASYNC_MODE.QUEUE:
+                self.async_queue_kvdb = self.kvdb.copy()
+                self.async_queue_kvdb.init()
+                self.async_queue = AsyncQueue(self.kvdb.conn, self.name, queue_batch_size,
+                    consumer_conn=self.async_queue_kvdb.conn)
+            else:
+                self.async_queue_kvdb = None
+                self.async_queue = None
+
+            self.keep_consuming = False
             self.topic_callbacks = topic_callbacks
             self.lua_container = LuaContainer(self.kvdb.conn, initial_lua_programs)
             self.ready = False
@@ -153,6 +195,11 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
             start_new_thread(self.pub_client.run, ())
             start_new_thread(self.sub_client.run, ())
 
+            if self.async_queue and TOPICS[MESSAGE_TYPE.TO_PARALLEL_ANY] in self.topic_callbacks:
+                self.keep_consuming = True
+                start_new_thread(self.heartbeat_async_queue, ())
+                start_new_thread(self.consume_async_queue, ())
+
             for client in(self.pub_client, self.sub_client):
                 while client.keep_running == ZATO_NONE:
                     time.sleep(0.01)
@@ -163,15 +210,34 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
             topic = TOPICS[msg_type]
             self.pub_client.publish(topic, dumps(msg))
 
-        def invoke_async(self, msg, msg_type=MESSAGE_TYPE.TO_PARALLEL_ANY, expiration=BROKER.DEFAULT_EXPIRATION):
+        def publish_many(self, msgs, msg_type=MESSAGE_TYPE.TO_PARALLEL_ALL, *ignored_args, **ignored_kwargs):
+            """ Publishes all the messages in a single KVDB round-trip.
+            """
+            topic = TOPICS[msg_type]
+
+            with self.kvdb.conn.pipeline(False) as pipe:
+                for msg in msgs:
+                    msg['msg_type'] = msg_type
+                    pipe.publish(topic, dumps(msg))
+                pipe.execute()
+
+        def _dumps_async(self, msg, msg_type):
             msg['msg_type'] = msg_type
 
             try:
-                msg = dumps(msg)
+                return dumps(msg)
             except Exception, e:
                 error_msg = 'JSON serialization failed for msg:[%r], e:[%s]'
                 logger.error(error_msg, msg, format_exc(e))
                 raise
+
+        def invoke_async(self, msg, msg_type=MESSAGE_TYPE.TO_PARALLEL_ANY, expiration=BROKER.DEFAULT_EXPIRATION):
+            msg = self._dumps_async(msg, msg_type)
+
+            # Queued messages do not expire, they wait until a consumer is available
+            if self.async_queue and msg_type == MESSAGE_TYPE.TO_PARALLEL_ANY:
+                self.async_queue.put(msg)
+
             else:
                 topic = TOPICS[msg_type]
                 key = broker_msg = b'zato:broker{}:{}'.format(KEYS[msg_type], new_cid())
@@ -181,6 +247,27 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
 
                 self.pub_client.publish(topic, broker_msg)
 
+        def invoke_async_many(self, msgs, msg_type=MESSAGE_TYPE.TO_PARALLEL_ANY, expiration=BROKER.DEFAULT_EXPIRATION):
+            """ Same as invoke_async but for a list of messages all of which are sent in a single KVDB round-trip.
+            """
+            msgs = [self._dumps_async(msg, msg_type) for msg in msgs]
+
+            if not msgs:
+                return
+
+            if self.async_queue and msg_type == MESSAGE_TYPE.TO_PARALLEL_ANY:
+                self.async_queue.put(*msgs)
+
+            else:
+                topic = TOPICS[msg_type]
+
+                with self.kvdb.conn.pipeline(False) as pipe:
+                    for msg in msgs:
+                        key = b'zato:broker{}:{}'.format(KEYS[msg_type], new_cid())
+                        pipe.set(key, str(msg), ex=expiration)
+                        pipe.publish(topic, key)
+                    pipe.execute()
+
         def on_message(self, msg):
             if has_debug:
                 logger.debug('Got broker message `%s`', msg)
@@ -208,19 +295,84 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
                     if has_debug:
                         logger.debug('Got broker message payload `%s`', payload)
 
-                    callback = self.topic_callbacks[msg.channel]
-                    spawn_greenlet(callback, payload)
+                    self.dispatch_in_order(get_dispatch_key(payload), self.topic_callbacks[msg.channel], payload)
 
                 else:
                     if has_debug:
                         logger.debug('No payload in msg: `%s`', msg)
 
+        def dispatch(self, callback, *args):
+            if self.dispatch_pool:
+                self.dispatch_pool.spawn(callback, *args)
+            else:
+                spawn_greenlet(callback, *args)
+
+        def dispatch_in_order(self, key, callback, *args):
+            if self.dispatch_pool:
+                self.dispatch_pool.spawn_in_order(key, callback, *args)
+            else:
+                spawn_greenlet(callback, *args)
+
+        def consume_async_queue(self):
+            """ Pops messages off the async queue and hands them to the same callback that messages published
+            to TO_PARALLEL_ANY are given to.
+            """
+            callback = self.topic_callbacks[TOPICS[MESSAGE_TYPE.TO_PARALLEL_ANY]]
+
+            while self.keep_consuming:
+                try:
+                    for msg in self.async_queue.get():
+                        self.dispatch(self.on_async_queue_message, callback, msg)
+
+                except Exception, e:
+                    logger.warn('Could not consume broker async queue, e:`%s`', format_exc(e))
+                    sleep(1)
+
+        def heartbeat_async_queue(self):
+            """ Keeps this consumer of the async queue registered and recovers messages of consumers that are not alive anymore.
+            Runs on its own so that heartbeats are not delayed by waiting for messages nor for free greenlets to dispatch them to.
+            """
+            registered = False
+
+            while self.keep_consuming:
+                try:
+                    if registered:
+                        self.async_queue.heartbeat()
+                    else:
+                        self.async_queue.register()
+                        registered = True
+
+                    self.async_queue.recover()
+
+                except Exception, e:
+                    logger.warn('Could not send broker async queue heartbeat, e:`%s`', format_exc(e))
+
+                sleep(BROKER.QUEUE_HEARTBEAT_INTERVAL)
+
+        def on_async_queue_message(self, callback, msg):
+            try:
+                payload = Bunch(loads(msg))
+                if has_debug:
+                    logger.debug('Got broker async queue payload `%s`', payload)
+
+                callback(payload)
+            except Exception, e:
+                logger.warn('Could not handle broker async queue message `%s`, e:`%s`', msg, format_exc(e))
+            finally:
+                self.async_queue.ack(msg)
+
         def close(self):
+            self.keep_consuming = False
+
+            if self.async_queue_kvdb:
+                self.async_queue_kvdb.close()
+
             for client in(self.pub_client, self.sub_client):
                 client.keep_running = False
                 client.kvdb.close()
 
-    client = _BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs)
+    client = _BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs, dispatch_pool_size, async_mode,
+        queue_batch_size)
     start_new_thread(client.run, ())
 
     return client
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Compares async invocations delivered through the fan-out of PUBLISH + rename_if_exists with those delivered through
+# AsyncQueue, for 2, 8 and 32 consumers, each standing for a server's worker. It needs a Redis server and uses one of its
+# databases, 15 by default, which should not be used by anything else, e.g. python bench_async_queue.py localhost 6379 15
+
+# gevent
+from gevent.monkey import patch_all
+patch_all()
+
+# stdlib
+import sys
+from timeit import default_timer
+
+# anyjson
+from anyjson import dumps
+
+# gevent
+from gevent import killall, spawn
+from gevent.event import Event
+
+# Redis
+from redis import StrictRedis
+
+# Zato
+from zato.broker.async_queue import AsyncQueue
+from zato.broker.client import CODE_NO_SUCH_FROM_KEY
+from zato.cli.create_server import lua_zato_rename_if_exists
+from zato.common.util import new_cid
+
+# ################################################################################################################################
+
+TOPIC = 'zato:bench:async-queue:fan-out'
+
+def get_msg():
+    return dumps({'action': '101802', 'service': 'zato.ping', 'payload': 'a' * 200, 'cid': new_cid(),
+        'data_format': 'json', 'channel': 'invoke-async', 'transport': None, 'msg_type': '0001'})
+
+def get_command_count(conn):
+    return sum(elem['calls'] for elem in conn.info('commandstats').values())
+
+# ################################################################################################################################
+
+def run_fan_out(conn, consumers, how_many, received, done):
+    rename_if_exists = conn.register_script(lua_zato_rename_if_exists)
+
+    def _consume():
+        pubsub = conn.pubsub()
+        pubsub.subscribe(TOPIC)
+
+        try:
+            for msg in pubsub.listen():
+                if msg['type'] != 'message':
+                    continue
+
+                # Each consumer competes for each message, as in _BrokerClient.on_message
+                tmp_key = '{}.tmp'.format(msg['data'])
+                if rename_if_exists([msg['data'], tmp_key]) != CODE_NO_SUCH_FROM_KEY:
+                    conn.get(tmp_key)
+                    conn.delete(tmp_key)
+
+                    received.append(1)
+                    if len(received) == how_many:
+                        done.set()
+        finally:
+            pubsub.close()
+
+    def _produce():
+        for _ in range(how_many):
+            key = 'zato:bench:async-queue:{}'.format(new_cid())
+            conn.set(key, get_msg())
+            conn.expire(key, 15)
+            conn.publish(TOPIC, key)
+
+    greenlets = [spawn(_consume) for _ in range(consumers)]
+
+    while conn.pubsub_numsub(TOPIC)[0][1] < consumers:
+        done.wait(0.01)
+
+    return greenlets, _produce
+
+def run_queue(conn, consumers, how_many, received, done):
+
+    def _consume(queue):
+        queue.register()
+
+        while True:
+            for msg in queue.get():
+                queue.ack(msg)
+
+                received.append(1)
+                if len(received) == how_many:
+                    done.set()
+
+    def _produce():
+        queue = AsyncQueue(conn, 'producer')
+        for _ in range(how_many):
+            queue.put(get_msg())
+
+    return [spawn(_consume, AsyncQueue(conn, 'consumer-{}'.format(idx))) for idx in range(consumers)], _produce
+
+# ################################################################################################################################
+
+def run(conn, consumers, how_many=5000):
+
+    for name, func in (('fan-out', run_fan_out), ('queue', run_queue)):
+        conn.flushdb()
+
+        received = []
+        done = Event()
+        greenlets, produce = func(conn, consumers, how_many, received, done)
+
+        commands_before = get_command_count(conn)
+        start = default_timer()
+
+        produce()
+        done.wait()
+
+        elapsed = default_timer() - start
+        commands = get_command_count(conn) - commands_before
+
+        killall(greenlets)
+
+        print('{:>3} consumers, {:>7}: {:10.0f} msg/s, {:6.1f} Redis commands/msg'.format(
+            consumers, name, how_many / elapsed, commands / how_many))
+
+    conn.flushdb()
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    host = args[0] if len(args) > 0 else 'localhost'
+    port = int(args[1]) if len(args) > 1 else 6379
+    db = int(args[2]) if len(args) > 2 else 15
+
+    conn = StrictRedis(host, port, db)
+
+    for consumers in (2, 8, 32):
+        run(conn, consumers)
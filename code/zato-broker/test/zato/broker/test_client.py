@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import sleep
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.broker.client import get_dispatch_key
+from zato.common.broker_message import EMAIL, OUTGOING, SERVICE
+from zato.common.util import DispatchPool
+
+# ################################################################################################################################
+
+class DispatchKeyTestCase(TestCase):
+
+    def test_get_dispatch_key(self):
+        eq_(get_dispatch_key(Bunch(action=OUTGOING.SQL_CREATE_EDIT.value)),
+            get_dispatch_key(Bunch(action=OUTGOING.SQL_DELETE.value)))
+        self.assertNotEqual(get_dispatch_key(Bunch(action=OUTGOING.SQL_CREATE_EDIT.value)),
+            get_dispatch_key(Bunch(action=EMAIL.SMTP_EDIT.value)))
+
+        eq_(get_dispatch_key(Bunch(action=SERVICE.PUBLISH.value)), None)
+        eq_(get_dispatch_key(Bunch(action=OUTGOING.AMQP_PUBLISH.value)), None)
+        eq_(get_dispatch_key(Bunch()), None)
+
+    def test_edit_delete_order(self):
+        pool = DispatchPool(10)
+        out = []
+
+        def callback(msg):
+            if msg.action == OUTGOING.SQL_CREATE_EDIT.value:
+                sleep(0.05)
+            out.append(msg.action)
+
+        for action in(OUTGOING.SQL_CREATE_EDIT.value, OUTGOING.SQL_DELETE.value):
+            msg = Bunch(action=action, name='my.sql')
+            pool.spawn_in_order(get_dispatch_key(msg), callback, msg)
+
+        pool.join()
+
+        # The DELETE is applied last even though the EDIT handler is slow
+        eq_(out, [OUTGOING.SQL_CREATE_EDIT.value, OUTGOING.SQL_DELETE.value])
+
+# ################################################################################################################################
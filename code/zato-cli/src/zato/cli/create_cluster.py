@@ -114,6 +114,7 @@ zato_services = {
     'zato.http-soap.delete':'zato.server.service.internal.http_soap.Delete',
     'zato.http-soap.edit':'zato.server.service.internal.http_soap.Edit',
     'zato.http-soap.get-list':'zato.server.service.internal.http_soap.GetList',
+    'zato.http-soap.get-url-path-cache-stats':'zato.server.service.internal.http_soap.GetURLPathCacheStats',
     'zato.http-soap.ping':'zato.server.service.internal.http_soap.Ping',
 
     # Clusters - Connections map
@@ -216,12 +217,14 @@ zato_services = {
     'zato.pubsub.delete-expired':'zato.server.service.internal.pubsub.DeleteExpired',
     'zato.pubsub.invoke-callbacks':'zato.server.service.internal.pubsub.InvokeCallbacks',
     'zato.pubsub.move-to-target-queues':'zato.server.service.internal.pubsub.MoveToTargetQueues',
+    'zato.pubsub.redeliver-group-messages':'zato.server.service.internal.pubsub.RedeliverGroupMessages',
     'zato.pubsub.rest-handler':'zato.server.service.internal.pubsub.RESTHandler',
 
     # Publish/subscribe - consumer
     'zato.pubsub.consumers.create':'zato.server.service.internal.pubsub.consumers.Create',
     'zato.pubsub.consumers.delete':'zato.server.service.internal.pubsub.consumers.Delete',
     'zato.pubsub.consumers.edit':'zato.server.service.internal.pubsub.consumers.Edit',
+    'zato.pubsub.consumers.get-group-list':'zato.server.service.internal.pubsub.consumers.GetGroupList',
     'zato.pubsub.consumers.get-info':'zato.server.service.internal.pubsub.consumers.GetInfo',
     'zato.pubsub.consumers.get-list':'zato.server.service.internal.pubsub.consumers.GetList',
 
@@ -387,7 +390,11 @@ zato_services = {
     # Servers
     'zato.server.delete':'zato.server.service.internal.server.Delete',
     'zato.server.edit':'zato.server.service.internal.server.Edit',
+    'zato.server.get-broker-dispatch-stats':'zato.server.service.internal.server.GetBrokerDispatchStats',
+    'zato.server.get-broker-queue-stats':'zato.server.service.internal.server.GetBrokerQueueStats',
     'zato.server.get-by-id':'zato.server.service.internal.server.GetByID',
+    'zato.server.get-connection-queue-stats':'zato.server.service.internal.server.GetConnectionQueueStats',
+    'zato.server.get-service-cache-stats':'zato.server.service.internal.server.GetServiceCacheStats',
 
     # Services
     'zato.service.configure-request-response':'zato.server.service.internal.service.ConfigureRequestResponse',
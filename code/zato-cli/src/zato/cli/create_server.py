@@ -71,6 +71,7 @@ work_dir=../../work
 backup_history=100
 backup_format=bztar
 delete_after_pick_up=False
+incremental=True
 
 # These three are relative to work_dir
 current_work_dir=./hot-deploy/current
@@ -108,6 +109,10 @@ internal_services_may_be_deleted=False
 initial_cluster_name={{initial_cluster_name}}
 initial_server_name={{initial_server_name}}
 queue_build_cap=30 # All queue-based connections need to initialize in that many seconds
+queue_acquire_timeout=10 # In seconds, how long requests wait for free connections of queue-based outconns, 0 = no waiting
+queue_max_pool_size_factor=2 # Queue-based outconns may have up to pool_size * that many connections under load, 1 = fixed pools
+queue_idle_timeout=300 # In seconds, connections beyond pool_size not used for that long are closed
+queue_validate_after=30 # In seconds, connections idle for that long are checked before use, 0 = never checked
 http_proxy=
 locale=
 ensure_sql_connections_exist=True
@@ -115,11 +120,29 @@ http_server_header=Zato
 zeromq_connect_sleep=0.1
 aws_host=
 use_soap_envelope=True
-fifo_response_buffer_size=0.2 # In MB
 jwt_secret={{jwt_secret}}
+url_path_cache_size=10000 # How many URL paths matched by HTTP channels each worker keeps in its cache, 0 = no cache
+jwt_token_cache_size=10000 # How many verified JWT tokens each worker keeps in its cache, 0 = no cache
+jwt_renew_interval=60 # In seconds, how often at most TTLs of cached JWT tokens are renewed in KVDB and ODB
+broker_dispatch_pool_size=100 # How many broker messages each worker handles concurrently, 0 = no limit but each may stall the broker client up to 0.2s
+broker_async_mode=queue # Either 'queue' (each async message is popped off a list by one worker) or 'fan-out' (all workers compete for each one)
+broker_queue_batch_size=10 # How many async messages a worker pops off the queue at a time
+service_cache_local_size=10000 # How many entries of self.cache each worker keeps in memory, 0 = each get goes to KVDB
+service_cache_local_ttl=60 # In seconds, for how long at most each worker keeps an entry of self.cache in memory
+service_cache_write_behind_interval=5 # In seconds, how often ODB copies of self.cache's entries are stored, 0 = on each put
+distlock_backend=kvdb # Either 'kvdb' (Redis, waiters are woken up when a lock is released) or 'odb' (SQL or fcntl under SQLite)
+http_audit_writer=buffered # Either 'buffered' (audit records of HTTP channels are stored in bulk) or 'sync' (each in its request)
+http_audit_flush_size=100 # How many complete audit records make a worker store them before flush_interval elapses
+http_audit_flush_interval=1 # In seconds, how often each worker stores audit records of HTTP channels
+http_audit_max_buffer_mb=50 # How much memory, roughly, each worker may use for audit records not stored yet
+http_audit_overflow=drop-oldest # Either 'drop-oldest' (to make room for new audit records) or 'block' (requests wait for room)
+startup_config_snapshot=True # Whether the first worker reads config from ODB at startup on behalf of all the other ones
+startup_config_snapshot_max_age=60 # In seconds, workers starting later than that after the first one read config from ODB
 
 [stats]
 expire_after=168 # In hours, 168 = 7 days = 1 week
+collector=batched # Either 'batched' (kept in memory, flushed every flush_interval seconds) or 'legacy' (stored on each invocation)
+flush_interval=5 # In seconds
 
 [kvdb]
 host={{kvdb_host}}
@@ -142,6 +165,7 @@ zato.notif.init-notifiers=
 zato.pubsub.move-to-target-queues=
 zato.pubsub.delete-expired=
 zato.pubsub.invoke-callbacks=
+zato.pubsub.redeliver-group-messages=
 zato.kvdb.log-connection-info=
 zato.updates.check-updates=
 
@@ -149,9 +173,11 @@ zato.updates.check-updates=
 zato.helpers.input-logger=Sample payload for a startup service (any worker)
 
 [pubsub]
-move_to_target_queues_interval=3 # In seconds
+move_to_target_queues_interval=30 # In seconds, messages are moved as soon as they are published, this is only a safety net
 delete_expired_interval=180 # In seconds
 invoke_callbacks_interval=2 # In seconds
+redeliver_group_messages_interval=10 # In seconds
+group_redelivery_timeout=60 # In seconds, messages not acknowledged by a consumer group's member are given to another one
 
 [profiler]
 enabled=False
@@ -405,6 +405,12 @@ class KVDB(Attrs):
 
     LOCK_ASYNC_INVOKE_WITH_TARGET_PATTERN = '{}async-invoke-with-pattern:{{}}:{{}}'.format(LOCK_PREFIX)
 
+    SERVICE_CACHE_PREFIX = 'zato:cache:service:'
+
+    DISTLOCK_PREFIX = 'zato:distlock:'
+    DISTLOCK_WAKE_UP_PREFIX = 'zato:distlock-wake-up:'
+    DISTLOCK_FENCING_TOKEN = 'zato:distlock-fencing-token'
+
     TRANSLATION = 'zato:kvdb:data-dict:translation'
     TRANSLATION_ID = TRANSLATION + ':id'
 
@@ -417,6 +423,8 @@ class KVDB(Attrs):
     SERVICE_TIME_AGGREGATED_BY_DAY = 'zato:stats:service:time:aggr-by-day:'
     SERVICE_TIME_AGGREGATED_BY_MONTH = 'zato:stats:service:time:aggr-by-month:'
     SERVICE_TIME_SLOW = 'zato:stats:service:time:slow:'
+    SERVICE_TIME_HISTOGRAM_BY_MINUTE = 'zato:stats:service:time:histogram-by-minute:'
+    SERVICE_TIME_INDEX = 'zato:stats:index:'
 
     SERVICE_SUMMARY_PREFIX_PATTERN = 'zato:stats:service:summary:{}:'
     SERVICE_SUMMARY_BY_DAY = 'zato:stats:service:summary:by-day:'
@@ -427,6 +435,11 @@ class KVDB(Attrs):
     ZMQ_CONFIG_READY_PREFIX = 'zato:zmq.config.ready.{}'
 
     REQ_RESP_SAMPLE = 'zato:req-resp:sample:'
+
+    BROKER_ASYNC_QUEUE = 'zato:broker:async-queue'
+    BROKER_ASYNC_QUEUE_CONSUMERS = 'zato:broker:async-queue:consumers'
+    BROKER_ASYNC_QUEUE_PROCESSING = 'zato:broker:async-queue:processing:'
+    BROKER_ASYNC_QUEUE_ALIVE = 'zato:broker:async-queue:alive:'
     RESP_SLOW = 'zato:resp:slow:'
 
     DELIVERY_PREFIX = 'zato:delivery:'
@@ -452,6 +465,18 @@ class SCHEDULER:
         DELETE = 'delete'
         INACTIVATE = 'inactivate'
 
+class SERVICE_STATS:
+
+    class COLLECTOR(Attrs):
+        LEGACY = 'legacy' # Each invocation updates KVDB directly
+        BATCHED = 'batched' # Invocations are accumulated in memory and flushed to KVDB periodically
+
+    DEFAULT_COLLECTOR = COLLECTOR.BATCHED
+    DEFAULT_FLUSH_INTERVAL = 5 # In seconds
+
+    # For how long per-minute histograms of processing times are kept, in seconds - AggregateByMinute must run before they expire
+    HISTOGRAM_BY_MINUTE_EXPIRE = 300
+
 class CHANNEL(Attrs):
     AMQP = 'amqp'
     AUDIT = 'audit'
@@ -527,11 +552,35 @@ class DELIVERY_CALLBACK_INVOKER(Attrs):
 
 class BROKER:
     DEFAULT_EXPIRATION = 15 # In seconds
+    DEFAULT_DISPATCH_POOL_SIZE = 100 # Using 0 means each message is handled by spawn_greenlet, without a pool
+
+    class ASYNC_MODE(Attrs):
+        FAN_OUT = 'fan-out' # Messages are stored under their own keys and each broker client competes for each of them
+        QUEUE = 'queue' # Messages are added to a list and each of them is popped off it by exactly one broker client
+
+    DEFAULT_ASYNC_MODE = ASYNC_MODE.FAN_OUT # New servers are configured to use QUEUE in server.conf
+    DEFAULT_QUEUE_BATCH_SIZE = 10 # Up to that many messages are popped off the queue at a time
+    QUEUE_POP_TIMEOUT = 1 # In seconds
+    QUEUE_HEARTBEAT_INTERVAL = 5 # In seconds
+
+    # In seconds - in-flight messages of consumers not heard from in that long are put back in the queue
+    QUEUE_CONSUMER_TTL = 30
 
 class MISC:
     DEFAULT_HTTP_TIMEOUT=10
     DEFAULT_AUDIT_BACK_LOG = 24 * 60 # 24 hours * 60 days ≅ 2 months
     DEFAULT_AUDIT_MAX_PAYLOAD = 0 # Using 0 means there's no limit
+    DEFAULT_URL_PATH_CACHE_SIZE = 10000 # Using 0 means URL paths are not cached at all
+    DEFAULT_JWT_TOKEN_CACHE_SIZE = 10000 # Using 0 means verified JWT tokens are not cached at all
+    DEFAULT_JWT_RENEW_INTERVAL = 60 # In seconds
+    DEFAULT_SERVICE_CACHE_LOCAL_SIZE = 10000 # Using 0 means each worker goes to KVDB on each get
+    DEFAULT_SERVICE_CACHE_LOCAL_TTL = 60 # In seconds
+    DEFAULT_SERVICE_CACHE_WRITE_BEHIND_INTERVAL = 5 # In seconds, using 0 means entries are stored in ODB on each put
+    DEFAULT_QUEUE_ACQUIRE_TIMEOUT = 0 # In seconds, using 0 means there is no waiting for free connections to outconns
+    DEFAULT_QUEUE_MAX_POOL_SIZE_FACTOR = 1 # Using 1 means pools of connections to outconns never grow
+    DEFAULT_QUEUE_IDLE_TIMEOUT = 300 # In seconds
+    DEFAULT_QUEUE_VALIDATE_AFTER = 0 # In seconds, using 0 means connections are never validated when they are borrowed
+    DEFAULT_ODB_BATCH_SIZE = 500 # How many rows at most to look up in a single IN clause or to insert in a single statement
     OAUTH_SIG_METHODS = ['HMAC-SHA1', 'PLAINTEXT']
     PIDFILE = 'pidfile'
     SEPARATOR = ':::'
@@ -543,6 +592,25 @@ class ADAPTER_PARAMS:
 class AUDIT_LOG:
     REPLACE_WITH = SECRET_SHADOW
 
+    class WRITER:
+        BUFFERED = 'buffered'
+        SYNC = 'sync'
+
+    class OVERFLOW:
+        DROP_OLDEST = 'drop-oldest'
+        BLOCK = 'block'
+
+    DEFAULT_FLUSH_SIZE = 100
+    DEFAULT_FLUSH_INTERVAL = 1 # In seconds
+    DEFAULT_MAX_BUFFER_SIZE = 50 # In MB
+    DEFAULT_IN_FLIGHT_TIMEOUT = 60 # In seconds, requests with no responses for that long are stored without them
+    RECORD_OVERHEAD = 2048 # In bytes, roughly how much memory a buffered record needs on top of its payloads
+
+class CONFIG_SNAPSHOT:
+    DEFAULT_MAX_AGE = 60 # In seconds
+    FILE_NAME = 'config-snapshot.pickle'
+    FORMAT_VERSION = 1 # Needs to be increased each time the layout of what workers read from ODB at startup changes
+
 class INFO_FORMAT:
     DICT = 'dict'
     TEXT = 'text'
@@ -634,6 +702,9 @@ class PUB_SUB:
     DEFAULT_IS_FIFO = True
     DEFAULT_MAX_DEPTH = 500
     DEFAULT_MAX_BACKLOG = 1000
+    DIRTY_TOPICS_WAIT_TIMEOUT = 5 # In seconds
+    GROUP_REDELIVERY_TIMEOUT = 60 # In seconds
+    GROUP_REDELIVERY_INTERVAL = 10 # In seconds
 
     class QUEUE_TYPE:
         MESSAGE = 'message'
@@ -921,6 +992,7 @@ class StatsElem(object):
     mean_all_services - an arithmetical average of all the mean response times  of all services (in ms)
     usage_perc_all_services - this service's usage as a percentage of all_services_usage (up to 2 decimal points)
     time_perc_all_services - this service's share as a percentage of all_services_time (up to 2 decimal points)
+    p50, p90, p99, p999 - response times at 50th, 90th, 99th and 99.9th percentile (in ms)
     expected_time_elems - an OrderedDict of all the time slots mapped to a mean time and rate
     temp_rate - a temporary place for keeping request rates, needed to get a weighted mean of uneven execution periods
     temp_mean - just like temp_rate but for mean response times
@@ -941,6 +1013,10 @@ class StatsElem(object):
         self.mean_all_services = 0
         self.usage_perc_all_services = 0
         self.time_perc_all_services = 0
+        self.p50 = 0
+        self.p90 = 0
+        self.p99 = 0
+        self.p999 = 0
         self.expected_time_elems = OrderedDict()
         self.temp_rate = 0
         self.temp_mean = 0
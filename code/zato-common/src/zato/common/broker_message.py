@@ -141,6 +141,8 @@ class SECURITY(Constants):
     TLS_KEY_CERT_EDIT = ValueConstant('')
     TLS_KEY_CERT_DELETE = ValueConstant('')
 
+    JWT_TOKEN_DELETE = ValueConstant('')
+
 class DEFINITION(Constants):
     code_start = 100600
 
@@ -397,6 +399,11 @@ class RBAC(Constants):
     ROLE_PERMISSION_EDIT = ValueConstant('')
     ROLE_PERMISSION_DELETE = ValueConstant('')
 
+class CACHE(Constants):
+    code_start = 105400
+
+    INVALIDATE = ValueConstant('')
+
 code_to_name = {}
 
 # To prevent 'RuntimeError: dictionary changed size during iteration'
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from math import ceil
+
+# ################################################################################################################################
+
+# All values below 2 ** precision are stored exactly, each bucket above that spans a range no wider
+# than 1 / 2 ** (precision - 1) of its lower bound, i.e. 1.6% with the default precision of 7.
+DEFAULT_PRECISION = 7
+
+# How bucket counters are prefixed when histograms are stored in KVDB hashes
+BUCKET_PREFIX = 'h:'
+
+# Names of percentiles exposed by statistics and the percentiles themselves
+PERCENTILES = (('p50', 50.0), ('p90', 90.0), ('p99', 99.0), ('p999', 99.9))
+
+# ################################################################################################################################
+
+def get_bucket(value, precision=DEFAULT_PRECISION):
+    """ Returns the index of a bucket a given non-negative integer value belongs to.
+    """
+    value = int(value)
+    sub_bucket_count = 1 << precision
+
+    if value < sub_bucket_count:
+        return max(value, 0)
+
+    half_count = sub_bucket_count >> 1
+    shift = value.bit_length() - precision
+
+    return sub_bucket_count + (shift - 1) * half_count + (value >> shift) - half_count
+
+def get_bucket_range(idx, precision=DEFAULT_PRECISION):
+    """ Returns a tuple of the lowest and highest value a given bucket can hold.
+    """
+    sub_bucket_count = 1 << precision
+
+    if idx < sub_bucket_count:
+        return idx, idx
+
+    half_count = sub_bucket_count >> 1
+    idx -= sub_bucket_count
+    shift = idx // half_count + 1
+    mantissa = idx % half_count + half_count
+
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+def get_bucket_field(value, precision=DEFAULT_PRECISION):
+    """ Returns name of a KVDB hash field under which a counter of a given value is kept.
+    """
+    return '{}{}'.format(BUCKET_PREFIX, get_bucket(value, precision))
+
+# ################################################################################################################################
+
+class Histogram(object):
+    """ A compact, mergeable histogram of integer values, such as processing times in milliseconds, using logarithmic
+    buckets in the manner of HDR histograms. Only buckets that were actually used are kept. Two histograms of the same
+    precision can be merged by adding up their counters which lets one aggregate statistics of many workers
+    and time periods without having to keep individual values around.
+    """
+    def __init__(self, precision=DEFAULT_PRECISION):
+        self.precision = precision
+        self.counts = {}
+        self.count = 0
+        self.sum = 0
+
+    def __nonzero__(self):
+        return self.count > 0
+
+    def record(self, value, count=1):
+        idx = get_bucket(value, self.precision)
+        self.counts[idx] = self.counts.get(idx, 0) + count
+        self.count += count
+        self.sum += value * count
+
+    def merge(self, other):
+        """ Adds all values from another histogram to this one.
+        """
+        for idx, count in other.counts.iteritems():
+            self.counts[idx] = self.counts.get(idx, 0) + count
+        self.count += other.count
+        self.sum += other.sum
+
+        return self
+
+    @property
+    def min(self):
+        return get_bucket_range(min(self.counts), self.precision)[0] if self.counts else 0
+
+    @property
+    def max(self):
+        return get_bucket_range(max(self.counts), self.precision)[1] if self.counts else 0
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0
+
+    def get_percentiles(self, percentiles=PERCENTILES):
+        """ Returns a dictionary of values at given percentiles, the latter being an iterable of (name, percentile) pairs.
+        As in HDR histograms, each value is the highest one equivalent to the bucket the percentile falls into.
+        """
+        out = {}
+        if not self.count:
+            return dict((name, 0) for name, _ in percentiles)
+
+        percentiles = sorted(percentiles, key=lambda elem: elem[1])
+        targets = [(name, max(int(ceil(self.count * percentile / 100.0)), 1)) for name, percentile in percentiles]
+        target_idx = 0
+        total = 0
+
+        for idx in sorted(self.counts):
+            total += self.counts[idx]
+            while target_idx < len(targets) and total >= targets[target_idx][1]:
+                out[targets[target_idx][0]] = get_bucket_range(idx, self.precision)[1]
+                target_idx += 1
+
+            if target_idx == len(targets):
+                break
+
+        return out
+
+    def get_value_at_percentile(self, percentile):
+        return self.get_percentiles((('value', percentile),))['value']
+
+    def to_dict(self):
+        """ Returns the histogram in a form suitable for storing in a KVDB hash.
+        """
+        out = dict(('{}{}'.format(BUCKET_PREFIX, idx), count) for idx, count in self.counts.iteritems())
+        out['sum'] = self.sum
+
+        return out
+
+    @staticmethod
+    def from_dict(data, precision=DEFAULT_PRECISION):
+        """ Creates a histogram out of a dictionary previously returned by to_dict, e.g. a KVDB hash. Keys not belonging
+        to the histogram are ignored so the dictionary may contain other data as well.
+        """
+        histogram = Histogram(precision)
+        prefix_len = len(BUCKET_PREFIX)
+
+        for key, value in data.iteritems():
+            if key.startswith(BUCKET_PREFIX):
+                count = int(float(value))
+                histogram.counts[int(key[prefix_len:])] = count
+                histogram.count += count
+
+        if histogram.count:
+            histogram.sum = float(data.get('sum') or 0)
+
+        return histogram
+
+# ################################################################################################################################
@@ -34,7 +34,7 @@ class Request(object):
         self.request_id = request_id or 'ipc.{}'.format(new_cid())
         self.target_pid = None
         self.reply_to_tag = ''
-        self.reply_to_fifo = ''
+        self.is_async = False
         self.in_reply_to = ''
         self.creation_time_utc = datetime.utcnow()
 
@@ -52,6 +52,19 @@ class Request(object):
 
 # ################################################################################################################################
 
+class Response(object):
+    def __init__(self, in_reply_to, publisher_pid, payload=None, is_ok=True):
+        self.in_reply_to = in_reply_to
+        self.publisher_pid = publisher_pid
+        self.payload = payload
+        self.is_ok = is_ok
+        self.creation_time_utc = datetime.utcnow()
+
+    def __repr__(self):
+        return make_repr(self)
+
+# ################################################################################################################################
+
 class IPCBase(object):
     """ Base class for core IPC objects.
     """
@@ -9,24 +9,18 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
-import errno
 import logging
-import os
-import stat
-import tempfile
-from datetime import datetime, timedelta
 from traceback import format_exc
-from uuid import uuid4
-
-# gevent
-from gevent import sleep
 
 # pyrapidjson
 from rapidjson import loads
 
 # Zato
+from zato.common import IPC_ACTION
+from zato.common.ipc import Request
 from zato.common.ipc.forwarder import Forwarder
 from zato.common.ipc.publisher import Publisher
+from zato.common.ipc.router import Router, RouterClient
 from zato.common.ipc.subscriber import Subscriber
 from zato.common.util import spawn_greenlet
 
@@ -36,11 +30,6 @@ logger = logging.getLogger(__name__)
 
 # ################################################################################################################################
 
-fifo_create_mode = stat.S_IRUSR | stat.S_IWUSR
-fifo_ignore_err = errno.EAGAIN, errno.EWOULDBLOCK
-
-# ################################################################################################################################
-
 class IPCAPI(object):
     """ API through which IPC is performed.
     """
@@ -59,65 +48,47 @@ class IPCAPI(object):
             self.subscriber = Subscriber(self.on_message_callback, self.name, self.pid)
             spawn_greenlet(self.subscriber.serve_forever)
 
+            self.router = Router(self.on_message_callback, self.name, self.pid)
+            self.router_client = RouterClient(self.name, self.pid)
+            spawn_greenlet(self.router.serve_forever)
+
     def publish(self, payload):
         self.publisher.publish(payload)
 
-    def _get_response(self, fifo, buffer_size, fifo_ignore_err=fifo_ignore_err, empty=('', None)):
-
-        try:
-            response = os.read(fifo, buffer_size)
-
-            if response not in empty:
-                return loads(response)
-
-        except OSError, e:
-            if e.errno not in fifo_ignore_err:
-                raise
-
-    def invoke_by_pid(self, service, payload, target_pid, fifo_response_buffer_size, timeout=5, is_async=False):
+    def invoke_by_pid(self, service, payload, target_pid, timeout=5, is_async=False, empty=('', None)):
         """ Invokes a service through IPC, synchronously or in background. If target_pid is an exact PID then this one worker
         process will be invoked if it exists at all.
         """
+        request = Request(self.name, self.pid)
 
-        # Create a FIFO pipe to receive replies to come through
-        fifo_path = os.path.join(tempfile.tempdir, 'zato-ipc-fifo-{}'.format(uuid4().hex))
-        os.mkfifo(fifo_path, fifo_create_mode)
+        request.payload = payload
+        request.service = service
+        request.action = IPC_ACTION.INVOKE_SERVICE
+        request.target_pid = target_pid
+        request.is_async = is_async
 
         try:
-            self.publisher.publish(payload, service, target_pid, reply_to_fifo=fifo_path)
+            response = self.router_client.invoke(request, timeout)
 
             # Async = we do not need to wait for any response
             if is_async:
                 return
 
-            response = None
-
-            try:
-
-                # Open the pipe for reading ..
-                fifo = os.open(fifo_path, os.O_RDONLY|os.O_NONBLOCK)
-
-                # .. and wait for response ..
-
-                now = datetime.utcnow()
-                until = now + timedelta(seconds=timeout)
-
-                while now < until:
-                    sleep(0.05)
-                    response = self._get_response(fifo, fifo_response_buffer_size)
-                    if response:
-                        break
-                    else:
-                        now = datetime.utcnow()
+            if not response:
+                logger.warn('No response from pid `%s` to IPC request `%s` (%s) within %ss',
+                    target_pid, request.request_id, service, timeout)
+                return
 
-            finally:
-                os.close(fifo)
+            if not response.is_ok:
+                logger.warn('IPC request `%s` (%s) failed in pid `%s`, e:`%s`',
+                    request.request_id, service, target_pid, response.payload)
+                return
 
-            return response
+            # Responses are pickled so a payload does not need to be JSON if the service did not serialize it
+            if response.payload not in empty:
+                return loads(response.payload) if isinstance(response.payload, basestring) else response.payload
 
         except Exception, e:
             logger.warn(format_exc(e))
-        finally:
-            os.remove(fifo_path)
 
 # ################################################################################################################################
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import os
+from cPickle import dumps, HIGHEST_PROTOCOL, loads
+from tempfile import gettempdir
+from traceback import format_exc
+
+# gevent
+from gevent import killall, spawn
+from gevent.event import AsyncResult
+from gevent.lock import RLock
+
+# ZeroMQ
+import zmq.green as zmq
+
+# Zato
+from zato.common.ipc import IPCBase, Response
+from zato.common.util import get_logger_for_class, make_repr
+
+# ################################################################################################################################
+
+def get_worker_address(name, pid):
+    """ Returns the address of the endpoint through which a worker process of a given server receives requests
+    addressed to it by its PID.
+    """
+    return 'ipc://{}'.format(os.path.join(gettempdir(), 'zato-ipc-{}-worker-{}'.format(name, pid)))
+
+# ################################################################################################################################
+
+class Router(IPCBase):
+    """ A worker's own endpoint for requests addressed to its PID. Each response is sent back over the connection the request
+    came through, with no limit to its size.
+    """
+    def __init__(self, on_message_callback, name, pid):
+        self.on_message_callback = on_message_callback
+        self.address = get_worker_address(name, pid)
+        self.send_lock = RLock()
+        super(Router, self).__init__(name, pid)
+
+    def set_up_sockets(self):
+        self.socket = self.ctx.socket(zmq.ROUTER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.bind(self.address)
+
+    def log_connected(self):
+        self.logger.info('Established router/bind to %s (pid: %s)', self.address, self.pid)
+
+    def serve_forever(self):
+        while self.keep_running:
+            identity, data = self.socket.recv_multipart()
+            spawn(self.handle, identity, loads(data))
+
+    def handle(self, identity, request):
+        response = Response(request.request_id, self.pid)
+
+        try:
+            response.payload = self.on_message_callback(request)
+        except Exception, e:
+            response.is_ok = False
+            response.payload = format_exc(e)
+            self.logger.warn('Could not handle IPC request `%s`, e:`%s`', request.request_id, response.payload)
+
+        if request.is_async:
+            return
+
+        # Frames of responses sent from different greenlets must not interleave
+        with self.send_lock:
+            self.socket.send_multipart([identity, dumps(response, HIGHEST_PROTOCOL)])
+
+    def close(self):
+        self.keep_running = False
+        self.socket.close()
+        self.ctx.term()
+
+# ################################################################################################################################
+
+class RouterClient(object):
+    """ Sends requests to Router endpoints of other workers, each over a connection of its own that is kept open
+    for as long as the client exists, and correlates the responses with requests by their IDs.
+    """
+    def __init__(self, name, pid):
+        self.name = name
+        self.pid = pid
+        self.ctx = zmq.Context()
+        self.sockets = {}
+        self.pending = {}
+        self.greenlets = []
+        self.lock = RLock()
+        self.keep_running = True
+        self.logger = get_logger_for_class(self.__class__)
+
+    def __repr__(self):
+        return make_repr(self)
+
+    def _get_socket(self, target_pid):
+        socket = self.sockets.get(target_pid)
+
+        if not socket:
+            with self.lock:
+                socket = self.sockets.get(target_pid)
+                if not socket:
+                    address = get_worker_address(self.name, target_pid)
+
+                    socket = self.ctx.socket(zmq.DEALER)
+                    socket.setsockopt(zmq.LINGER, 0)
+                    socket.connect(address)
+                    self.greenlets.append(spawn(self._receive, socket))
+
+                    self.sockets[target_pid] = socket
+                    self.logger.info('Established dealer/connect to %s (pid: %s)', address, self.pid)
+
+        return socket
+
+    def _receive(self, socket):
+        while self.keep_running:
+            response = loads(socket.recv())
+
+            # There will be no one waiting for a response that arrived after its timeout
+            result = self.pending.pop(response.in_reply_to, None)
+            if result:
+                result.set(response)
+
+    def invoke(self, request, timeout):
+        """ Sends a request to the worker process it is addressed to and, unless the request is an async one, blocks for up
+        to timeout seconds waiting for a response. Returns None if there was no response.
+        """
+        socket = self._get_socket(request.target_pid)
+        data = dumps(request, HIGHEST_PROTOCOL)
+
+        if request.is_async:
+            socket.send(data, zmq.NOBLOCK)
+            return
+
+        result = self.pending[request.request_id] = AsyncResult()
+
+        try:
+            socket.send(data, zmq.NOBLOCK)
+            return result.wait(timeout)
+        finally:
+            self.pending.pop(request.request_id, None)
+
+    def close(self):
+        self.keep_running = False
+        killall(self.greenlets)
+
+        for socket in self.sockets.values():
+            socket.close()
+        self.ctx.term()
+
+# ################################################################################################################################
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from collections import OrderedDict
+
+# ################################################################################################################################
+
+class LRUCache(object):
+    """ A size-bounded cache which evicts least recently used entries once it is full. Keeps count of hits, misses
+    and evictions. Setting max_size to 0 disables the cache - nothing will be stored in it.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        """ Returns a value stored under a given key, marking it as the most recently used one, or default if there
+        is no such key.
+        """
+        try:
+            value = self.data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        else:
+            self.data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """ Stores a value under a given key, evicting the least recently used entry if the cache is full.
+        """
+        if self.max_size <= 0:
+            return
+
+        self.data.pop(key, None)
+
+        if len(self.data) >= self.max_size:
+            self.data.popitem(False)
+            self.evictions += 1
+
+        self.data[key] = value
+
+    def delete(self, key):
+        """ Deletes a value by its key, does nothing if there is no such key.
+        """
+        self.data.pop(key, None)
+
+    def clear(self):
+        """ Deletes all the entries, counters are left intact.
+        """
+        self.data.clear()
+
+    def get_stats(self):
+        """ Returns a dictionary of counters and current size of the cache.
+        """
+        return {
+            'size': len(self.data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+# ################################################################################################################################
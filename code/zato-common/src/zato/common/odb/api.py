@@ -10,6 +10,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import logging
+from collections import OrderedDict
 from contextlib import closing
 from copy import deepcopy
 from cStringIO import StringIO
@@ -23,7 +24,7 @@ from traceback import format_exc
 from springpython.context import DisposableObject
 
 # SQLAlchemy
-from sqlalchemy import create_engine, event
+from sqlalchemy import and_, bindparam, create_engine, event
 from sqlalchemy.exc import IntegrityError, ProgrammingError
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.pool import NullPool
@@ -486,6 +487,142 @@ class ODBManager(SessionWrapper):
             logger.error('Could not add service, name:[%s], e:[%s]', name, format_exc(e).decode('utf-8'))
             self._session.rollback()
 
+    def _get_services_by_name(self, session, names, batch_size):
+        """ Returns IDs, is_active flags and slow thresholds of services of given names, looked up batch_size names at a time.
+        """
+        out = {}
+
+        for idx in range(0, len(names), batch_size):
+            for item in session.query(Service.id, Service.name, Service.is_active, Service.slow_threshold).\
+                filter(Service.cluster_id==self.cluster.id).\
+                filter(Service.name.in_(names[idx:idx+batch_size])):
+
+                out[item.name] = item.id, item.is_active, item.slow_threshold
+
+        return out
+
+    def _update_deployed_services(self, session, rows, batch_size):
+        ds_table = DeployedService.__table__
+        update = ds_table.update().where(and_(
+            ds_table.c.server_id==bindparam('b_server_id'), ds_table.c.service_id==bindparam('b_service_id')))
+
+        for idx in range(0, len(rows), batch_size):
+            session.execute(update, rows[idx:idx+batch_size])
+
+    def _add_services(self, session, items, batch_size):
+        service_table = Service.__table__
+        ds_table = DeployedService.__table__
+
+        # Services that have not been added by this or other servers yet are inserted first ..
+        services = self._get_services_by_name(session, items.keys(), batch_size)
+        missing = [item for name, item in items.iteritems() if name not in services]
+
+        for idx in range(0, len(missing), batch_size):
+            session.execute(service_table.insert(), [{
+                'name': item.name,
+                'is_active': True,
+                'impl_name': item.impl_name,
+                'is_internal': item.is_internal,
+                'cluster_id': self.cluster.id,
+            } for item in missing[idx:idx+batch_size]])
+
+        if missing:
+            services.update(self._get_services_by_name(session, [item.name for item in missing], batch_size))
+
+        # .. and now the deployed services - ones from a previous deployment are updated and the rest are inserted.
+        service_ids = [services[name][0] for name in items]
+        already_deployed = set()
+
+        for idx in range(0, len(service_ids), batch_size):
+            for item in session.query(DeployedService.service_id).\
+                filter(DeployedService.server_id==self.server.id).\
+                filter(DeployedService.service_id.in_(service_ids[idx:idx+batch_size])):
+
+                already_deployed.add(item.service_id)
+
+        to_insert = []
+        to_update = []
+
+        for name, item in items.iteritems():
+            service_id = services[name][0]
+            row = {
+                'deployment_time': item.deployment_time,
+                'details': item.details,
+                'source': item.source_info.source,
+                'source_path': item.source_info.path,
+                'source_hash': item.source_info.hash,
+                'source_hash_method': item.source_info.hash_method,
+            }
+
+            if service_id in already_deployed:
+                row['b_server_id'] = self.server.id
+                row['b_service_id'] = service_id
+                to_update.append(row)
+            else:
+                row['server_id'] = self.server.id
+                row['service_id'] = service_id
+                to_insert.append(row)
+
+        self._update_deployed_services(session, to_update, batch_size)
+
+        for idx in range(0, len(to_insert), batch_size):
+            session.execute(ds_table.insert(), to_insert[idx:idx+batch_size])
+
+        return services
+
+    def add_services(self, items, batch_size=MISC.DEFAULT_ODB_BATCH_SIZE):
+        """ Adds information about many of the server's services, and about their being deployed on this server, into the ODB
+        in a single transaction. Each item is a Bunch with the same keys that add_service expects. Returns a dictionary
+        of service names to (id, is_active, slow_threshold) tuples. Should the batch fail, e.g. because another server
+        has just added some of the same services, each service is added individually instead.
+        """
+        # Should there be more than one service of a given name, the last one is deployed, like with add_service
+        by_name = OrderedDict((item.name, item) for item in items)
+
+        with closing(self.session()) as session:
+            try:
+                services = self._add_services(session, by_name, batch_size)
+                session.commit()
+            except Exception, e:
+                logger.warn('Could not add services in bulk, will add them one by one, e:`%s`', format_exc(e).decode('utf-8'))
+                session.rollback()
+            else:
+                return dict((name, services[name]) for name in by_name)
+
+        out = {}
+
+        for item in by_name.itervalues():
+            result = self.add_service(
+                item.name, item.impl_name, item.is_internal, item.deployment_time, item.details, item.source_info)
+            if result:
+                out[item.name] = result
+
+        return out
+
+    def update_deployed_services(self, items, batch_size=MISC.DEFAULT_ODB_BATCH_SIZE):
+        """ Updates, in bulk, information about services already deployed on this server, e.g. their source code, without
+        adding the services themselves again. Each item is a Bunch with the service_id, deployment_time, details
+        and source_info keys.
+        """
+        rows = [{
+            'deployment_time': item.deployment_time,
+            'details': item.details,
+            'source': item.source_info.source,
+            'source_path': item.source_info.path,
+            'source_hash': item.source_info.hash,
+            'source_hash_method': item.source_info.hash_method,
+            'b_server_id': self.server.id,
+            'b_service_id': item.service_id,
+        } for item in items]
+
+        with closing(self.session()) as session:
+            try:
+                self._update_deployed_services(session, rows, batch_size)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+
     def drop_deployed_services(self, server_id):
         """ Removes all the deployed services from a server.
         """
@@ -499,6 +499,9 @@ class HTTPSOAP(Base):
     url_params_pri = Column(String(200), nullable=True, default=URL_PARAMS_PRIORITY.DEFAULT)
     params_pri = Column(String(200), nullable=True, default=PARAMS_PRIORITY.DEFAULT)
 
+    # Channels only - whether services read request bodies on their own and may produce responses in chunks
+    is_streaming = Column(Boolean, nullable=True, default=False)
+
     audit_enabled = Column(Boolean, nullable=False, default=False)
     audit_back_log = Column(Integer, nullable=False, default=MISC.DEFAULT_AUDIT_BACK_LOG)
     audit_max_payload = Column(Integer, nullable=False, default=MISC.DEFAULT_AUDIT_MAX_PAYLOAD)
@@ -522,7 +525,8 @@ class HTTPSOAP(Base):
                  url_path=None, method=None, soap_action=None, soap_version=None, data_format=None, ping_method=None,
                  pool_size=None, merge_url_params_req=None, url_params_pri=None, params_pri=None, serialization_type=None,
                  timeout=None, sec_tls_ca_cert_id=None, service_id=None, service=None, security=None, cluster_id=None,
-                 cluster=None, service_name=None, security_id=None, has_rbac=None, security_name=None, content_type=None):
+                 cluster=None, service_name=None, security_id=None, has_rbac=None, security_name=None, content_type=None,
+                 is_streaming=None):
         self.id = id
         self.name = name
         self.is_active = is_active
@@ -553,6 +557,7 @@ class HTTPSOAP(Base):
         self.has_rbac = has_rbac
         self.security_name = security_name
         self.content_type = content_type
+        self.is_streaming = is_streaming
 
 # ################################################################################################################################
 
@@ -1543,6 +1548,9 @@ class PubSubConsumer(Base):
     callback_id = Column(Integer, ForeignKey('http_soap.id', ondelete='CASCADE'), nullable=True)
     callback_type = Column(String(20), nullable=True, default=PUB_SUB.CALLBACK_TYPE.OUTCONN_PLAIN_HTTP)
 
+    # Consumers of a topic sharing a group name compete for its messages, each message is delivered to one of them only.
+    group_name = Column(String(200), nullable=True)
+
     topic_id = Column(Integer, ForeignKey('pub_sub_topic.id', ondelete='CASCADE'), nullable=False)
     topic = relationship(PubSubTopic, backref=backref('consumers', order_by=max_depth, cascade='all, delete, delete-orphan'))
 
@@ -1555,7 +1563,7 @@ class PubSubConsumer(Base):
     http_soap = relationship(SecurityBase, backref=backref('pubsub_consumers', order_by=max_depth, cascade='all, delete, delete-orphan'))
 
     def __init__(self, id=None, is_active=None, sub_key=None, max_depth=None, delivery_mode=None, callback_id=None,
-                callback_type=None, topic_id=None, sec_def_id=None, cluster_id=None):
+                callback_type=None, topic_id=None, sec_def_id=None, cluster_id=None, group_name=None):
         self.id = id
         self.is_active = is_active
         self.sub_key = sub_key
@@ -1563,6 +1571,7 @@ class PubSubConsumer(Base):
         self.delivery_mode = delivery_mode
         self.callback_id = callback_id
         self.callback_type = callback_type
+        self.group_name = group_name
         self.topic_id = topic_id
         self.sec_def_id = sec_def_id
         self.cluster_id = cluster_id
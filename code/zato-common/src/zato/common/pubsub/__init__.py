@@ -14,6 +14,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 from datetime import datetime, timedelta
 from json import dumps, loads
 from logging import getLogger
+from math import ceil
 from sys import maxint
 from traceback import format_exc
 import logging
@@ -129,6 +130,16 @@ class PubCtx(HasAutoRepr):
 
 # ################################################################################################################################
 
+class PubManyCtx(HasAutoRepr):
+    """ A set of data describing a batch of messages to publish to one topic.
+    """
+    def __init__(self, client_id=None, topic=None, msgs=None):
+        self.client_id = client_id
+        self.topic = topic
+        self.msgs = msgs or []
+
+# ################################################################################################################################
+
 class SubCtx(HasAutoRepr):
     """ Subscription context - what to subscribe to.
     """
@@ -189,7 +200,8 @@ class Consumer(Client):
     """ Pub/sub consumer.
     """
     def __init__(self, id, name, is_active=True, sub_key=None, max_depth=PUB_SUB.DEFAULT_MAX_BACKLOG,
-            delivery_mode=PUB_SUB.DELIVERY_MODE.PULL.id, callback_id='', callback_name=None, callback_type=ZATO_NOT_GIVEN):
+            delivery_mode=PUB_SUB.DELIVERY_MODE.PULL.id, callback_id='', callback_name=None, callback_type=ZATO_NOT_GIVEN,
+            group_name=None):
         super(Consumer, self).__init__(id, name, is_active)
         self.sub_key = sub_key
         self.max_depth = max_depth
@@ -197,6 +209,7 @@ class Consumer(Client):
         self.callback_id = callback_id
         self.callback_name = callback_name
         self.callback_type = callback_type
+        self.group_name = group_name # Members of a group compete for messages, each is delivered to one of them only
 
 # ################################################################################################################################
 
@@ -228,6 +241,9 @@ class PubSub(object):
         self.cons_to_topic = {} # String to set, key = client_id, value = topics it's subscribed to
         self.topic_to_cons = {} # String to set, key = topic, value = client_ids subscribed to it
 
+        # Consumer groups
+        self.groups = {} # Tuple to set, key = (topic, group_name), value = client_ids of the group's members
+
         # Producers and topics
         self.prod_to_topic = {} # String to set, key = client_id, value = topics it can publish to
         self.topic_to_prod = {} # String to set, key = topic, value = client_ids allowed to publish to it
@@ -368,8 +384,35 @@ class PubSub(object):
             self.sub_to_cons[client.sub_key] = client.id
             self.cons_to_sub[client.id] = client.sub_key
 
+            self._set_group(client.id, client.group_name, topic.name)
+
             self.logger.info('Added consumer `%s` for topic:`%s`', client, topic)
 
+    def _set_group(self, client_id, group_name, topic_name):
+        """ Makes a consumer a member of the group it names for a given topic, if any, and removes it from other groups
+        of that topic. Must be called with self.update_lock held.
+        """
+        for key, members in self.groups.items():
+            if key[0] == topic_name:
+                members.discard(client_id)
+                if not members:
+                    del self.groups[key]
+
+        if group_name:
+            self.groups.setdefault((topic_name, group_name), set()).add(client_id)
+
+    def get_group_members(self, topic_name, group_name):
+        """ Returns members of a consumer group subscribed to a topic, an empty list if there is no such group.
+        """
+        with self.update_lock:
+            return [self.consumers[client_id] for client_id in self.groups.get((topic_name, group_name), [])]
+
+    def get_consumer_groups(self, client_id):
+        """ Returns (topic, group_name) tuples of all the groups a consumer is a member of.
+        """
+        with self.update_lock:
+            return [key for key, members in self.groups.items() if client_id in members]
+
     def update_consumer(self, client, topic):
         """ Updates a consumer.
         """
@@ -378,6 +421,9 @@ class PubSub(object):
             self.consumers[client.id].max_depth = client.max_depth
             self.consumers[client.id].delivery_mode = client.delivery_mode
             self.consumers[client.id].callback_id = client.callback_id
+            self.consumers[client.id].group_name = client.group_name
+
+            self._set_group(client.id, client.group_name, topic.name)
 
             self.logger.info('Updated consumer `%s` for topic:`%s`', client, topic)
 
@@ -401,6 +447,8 @@ class PubSub(object):
             del self.sub_to_cons[client.sub_key]
             del self.cons_to_sub[client.id]
 
+            self._set_group(client.id, None, topic.name)
+
             self.delete_consumer_metadata(client)
 
             self.logger.info('Deleted consumer `%s` for topic:`%s`', client, topic)
@@ -415,7 +463,8 @@ class PubSub(object):
     def _not_implemented(self, *ignored_args, **ignored_kwargs):
         raise NotImplementedError('Must be overridden in subclasses')
 
-    publish = subscribe = get = acknowledge_delete = reject = create = _not_implemented
+    publish = publish_many = subscribe = get = get_and_ack = acknowledge_delete = acknowledge_many = reject = create = \
+        _not_implemented
 
 # ################################################################################################################################
 
@@ -424,14 +473,18 @@ class RedisPubSub(PubSub, LuaContainer):
     """
     # Main public API
     LUA_PUBLISH = 'lua-publish'
+    LUA_PUBLISH_MANY = 'lua-publish-many'
     LUA_GET_FROM_CONSUMER_QUEUE = 'lua-get-from-consumer-queue'
+    LUA_GET_AND_ACK = 'lua-get-and-ack'
     LUA_REJECT = 'lua-reject'
     LUA_ACK_DELETE = 'lua-ack-delete'
+    LUA_ACK_MANY = 'lua-ack-many'
 
     # Background tasks
     LUA_DELETE_EXPIRED_TOPIC = 'lua-delete-expired-topic'
     LUA_DELETE_EXPIRED_CONSUMER = 'lua-delete-expired-consumer'
     LUA_MOVE_TO_TARGET_QUEUES = 'lua-move-to-target-queues'
+    LUA_REDELIVER = 'lua-redeliver'
 
     # Message browsing
     LUA_GET_MESSAGE_LIST = 'lua-get-message-list'
@@ -449,6 +502,7 @@ class RedisPubSub(PubSub, LuaContainer):
         self.MSG_IDS_PREFIX = '{}{}'.format(key_prefix, 'zset:msg-ids:{}')
         self.BACKLOG_FULL_KEY = '{}{}'.format(key_prefix, 'hash:backlog-full')
         self.CONSUMER_MSG_IDS_PREFIX = '{}{}'.format(key_prefix, 'list:consumer:msg-ids:{}')
+        self.GROUP_MSG_IDS_PREFIX = '{}{}'.format(key_prefix, 'list:group:msg-ids:{}:{}') # Topic and group name
         self.CONSUMER_IN_FLIGHT_IDS_PREFIX = '{}{}'.format(key_prefix, 'set:consumer:in-flight:ids:{}')
         self.CONSUMER_IN_FLIGHT_DATA_PREFIX = '{}{}'.format(key_prefix, 'hash:consumer:in-flight:data:{}')
         self.MSG_VALUES_KEY = '{}{}'.format(key_prefix, 'hash:msg-values')
@@ -458,9 +512,15 @@ class RedisPubSub(PubSub, LuaContainer):
         self.LAST_PUB_TIME_KEY = '{}{}'.format(key_prefix, 'hash:last-pub-time') # In UTC
         self.LAST_SEEN_CONSUMER_KEY = '{}{}'.format(key_prefix, 'hash:last-seen-consumer') # In UTC
         self.LAST_SEEN_PRODUCER_KEY = '{}{}'.format(key_prefix, 'hash:last-seen-producer') # In UTC
+        self.DIRTY_TOPICS_KEY = '{}{}'.format(key_prefix, 'set:dirty-topics')
+        self.DIRTY_TOPICS_NOTIFY_KEY = '{}{}'.format(key_prefix, 'list:dirty-topics-notify')
 
         self.add_lua_program(self.LUA_PUBLISH, lua.lua_publish)
+        self.add_lua_program(self.LUA_PUBLISH_MANY, lua.lua_publish_many)
+        self.add_lua_program(self.LUA_GET_AND_ACK, lua.lua_get_and_ack)
+        self.add_lua_program(self.LUA_ACK_MANY, lua.lua_ack_many)
         self.add_lua_program(self.LUA_MOVE_TO_TARGET_QUEUES, lua.lua_move_to_target_queues)
+        self.add_lua_program(self.LUA_REDELIVER, lua.lua_redeliver)
         self.add_lua_program(self.LUA_GET_FROM_CONSUMER_QUEUE, lua.lua_get_from_cons_queue)
         self.add_lua_program(self.LUA_REJECT, lua.lua_reject)
         self.add_lua_program(self.LUA_ACK_DELETE, lua.lua_ack_delete)
@@ -509,8 +569,8 @@ class RedisPubSub(PubSub, LuaContainer):
     def _raise_cant_publish_error(self, ctx):
         raise PermissionDenied("Permision denied. Can't publish to `{}`".format(ctx.topic))
 
-    def publish(self, ctx):
-        """ Publishes a message on a selected topic.
+    def _validate_publish(self, ctx):
+        """ Raises PermissionDenied if the client cannot publish to the topic.
         """
         # Note that the client always receives the same response but logs contain details
         with self.update_lock:
@@ -530,6 +590,11 @@ class RedisPubSub(PubSub, LuaContainer):
                 self.logger.warn('Producer `%s` is not active. Producer `%s`.', ctx.client_id, ctx.topic)
                 self._raise_cant_publish_error(ctx)
 
+    def publish(self, ctx):
+        """ Publishes a message on a selected topic.
+        """
+        self._validate_publish(ctx)
+
         if self.get_topic_depth(ctx.topic) >= self.topics[ctx.topic].max_depth:
             self.logger.warn('Topic full, `%s`, max depth `%s`', ctx.topic, self.topics[ctx.topic].max_depth)
             raise ItemFull('Topic full', ctx.topic, self.topics[ctx.topic].max_depth)
@@ -552,7 +617,7 @@ class RedisPubSub(PubSub, LuaContainer):
             self.run_lua(
                 self.LUA_PUBLISH, [
                     id_key, self.MSG_VALUES_KEY, self.MSG_METADATA_KEY, self.MSG_EXPIRE_AT_KEY, self.LAST_PUB_TIME_KEY,
-                       self.LAST_SEEN_PRODUCER_KEY],
+                       self.LAST_SEEN_PRODUCER_KEY, self.DIRTY_TOPICS_KEY, self.DIRTY_TOPICS_NOTIFY_KEY],
                     [score, ctx.msg.msg_id, ctx.msg.expire_at_utc.isoformat(), ctx.msg.payload, ctx.msg.to_json(),
                        ctx.topic, datetime.utcnow().isoformat(), ctx.client_id])
         except Exception, e:
@@ -562,6 +627,42 @@ class RedisPubSub(PubSub, LuaContainer):
             self.logger.info('Published `%s` to `%s`, exp `%s`', ctx.msg.msg_id, ctx.topic, ctx.msg.expire_at_utc.isoformat())
             return ctx
 
+    def publish_many(self, ctx):
+        """ Publishes a batch of messages on a selected topic. Either all of them are published or, if they would not fit
+        in the topic, none is.
+        """
+        self._validate_publish(ctx)
+
+        max_depth = self.topics[ctx.topic].max_depth
+
+        if self.get_topic_depth(ctx.topic) + len(ctx.msgs) > max_depth:
+            self.logger.warn('Topic full, `%s`, max depth `%s`, batch size `%s`', ctx.topic, max_depth, len(ctx.msgs))
+            raise ItemFull('Topic full', ctx.topic, max_depth)
+
+        # Scores are built as in self.publish so, just like there, messages of equal priority published in one batch
+        # are not guaranteed to be received in any particular order.
+        now = datetime.utcnow()
+        now_seconds = datetime_to_seconds(now)
+        args = [ctx.topic, now.isoformat(), ctx.client_id]
+
+        for msg in ctx.msgs:
+            msg.topic = ctx.topic
+            score = '{}{}'.format(msg.priority, now_seconds)
+            args.extend([score, msg.msg_id, msg.expire_at_utc.isoformat(), msg.payload, msg.to_json()])
+
+        try:
+            self.run_lua(
+                self.LUA_PUBLISH_MANY, [
+                    self.MSG_IDS_PREFIX.format(ctx.topic), self.MSG_VALUES_KEY, self.MSG_METADATA_KEY, self.MSG_EXPIRE_AT_KEY,
+                       self.LAST_PUB_TIME_KEY, self.LAST_SEEN_PRODUCER_KEY, self.DIRTY_TOPICS_KEY, self.DIRTY_TOPICS_NOTIFY_KEY],
+                    args)
+        except Exception, e:
+            self.logger.error('Pub error `%s`', format_exc(e))
+            raise
+        else:
+            self.logger.info('Published `%s` message(s) to `%s`', len(ctx.msgs), ctx.topic)
+            return ctx
+
 # ################################################################################################################################
 
     def subscribe(self, ctx, sub_key=None):
@@ -577,6 +678,63 @@ class RedisPubSub(PubSub, LuaContainer):
         self.logger.info('Client `%s` sub to topics `%s`', ctx.client_id, ', '.join(ctx.topics))
         return sub_key
 
+# ################################################################################################################################
+
+    def redeliver_group_messages(self, timeout=PUB_SUB.GROUP_REDELIVERY_TIMEOUT):
+        """ Puts messages that members of consumer groups have not acknowledged in timeout seconds back in their groups'
+        queues so that other members can fetch them. Returns a dictionary of group queue -> IDs of messages redelivered.
+        """
+        with self.update_lock:
+
+            out = {}
+            cutoff = (datetime.utcnow() - timedelta(seconds=timeout)).isoformat()
+
+            for (topic, group_name), members in self.groups.items():
+                group_queue = self.GROUP_MSG_IDS_PREFIX.format(topic, group_name)
+
+                for member in members:
+                    sub_key = self.cons_to_sub[member]
+                    keys = [self.CONSUMER_IN_FLIGHT_IDS_PREFIX.format(sub_key),
+                        self.CONSUMER_IN_FLIGHT_DATA_PREFIX.format(sub_key), group_queue, self.MSG_METADATA_KEY]
+
+                    redelivered = self.run_lua(self.LUA_REDELIVER, keys, [cutoff, topic])
+                    if redelivered:
+                        self.logger.warn('Redelivering `%s` from `%s` to group `%s`', redelivered, sub_key, group_queue)
+                        out.setdefault(group_queue, []).extend(redelivered)
+
+            return out
+
+    def get_delivery_plan(self, consumers):
+        """ Given consumers whose queues have new messages, returns (consumer, max_batch_size) tuples in the order
+        the consumers should be delivered messages to. Members of a group having the fewest messages in flight come first
+        and each is given an equal share of the group's queue, any other consumer is delivered all of its messages.
+        """
+        out = []
+        groups = {}
+
+        for consumer in consumers:
+            for key in self.get_consumer_groups(consumer.id):
+                groups.setdefault(key, []).append(consumer)
+
+        in_groups = set(consumer.id for members in groups.values() for consumer in members)
+
+        for (topic, group_name), members in sorted(groups.items()):
+            depth = self.get_group_queue_current_depth(topic, group_name)
+            if not depth:
+                continue
+
+            members.sort(key=lambda consumer: self.get_consumer_queue_in_flight_depth(consumer.sub_key))
+            share = int(ceil(depth / len(members)))
+
+            for consumer in members:
+                out.append((consumer, share))
+
+        for consumer in consumers:
+            if consumer.id not in in_groups:
+                out.append((consumer, PUB_SUB.DEFAULT_GET_MAX_BATCH_SIZE))
+
+        return out
+
 # ################################################################################################################################
 
     def get(self, ctx):
@@ -600,11 +758,13 @@ class RedisPubSub(PubSub, LuaContainer):
                 cons_in_flight_ids = self.CONSUMER_IN_FLIGHT_IDS_PREFIX.format(ctx.sub_key)
                 cons_in_flight_data = self.CONSUMER_IN_FLIGHT_DATA_PREFIX.format(ctx.sub_key)
 
+                client_id = self.sub_to_cons[ctx.sub_key]
+
                 messages = self.run_lua(
                     self.LUA_GET_FROM_CONSUMER_QUEUE,
                     [cons_queue, cons_in_flight_ids, cons_in_flight_data, self.LAST_SEEN_CONSUMER_KEY,
-                         self.MSG_METADATA_KEY, self.MSG_VALUES_KEY],
-                    [ctx.max_batch_size, datetime.utcnow().isoformat(), self.sub_to_cons[ctx.sub_key]])
+                         self.MSG_METADATA_KEY, self.MSG_VALUES_KEY] + self._get_group_queues(client_id),
+                    [ctx.max_batch_size, datetime.utcnow().isoformat(), client_id])
 
                 self.logger.debug('Get messages `%s`:`%r`', ctx.sub_key, messages)
 
@@ -615,13 +775,43 @@ class RedisPubSub(PubSub, LuaContainer):
                     else:
                         self.logger.info('Get result: sub_key `%s`, metadata `%s`', ctx.sub_key, msg[1])
 
-                    payload = msg[0][0] if msg[0] else None
-                    metadata = loads(msg[1][0])
+                    yield self._get_message(ctx, msg)
 
-                    if ctx.get_format == PUB_SUB.GET_FORMAT.JSON.id:
-                        yield {'payload': payload, 'metadata':metadata}
-                    else:
-                        yield Message(payload=payload, **metadata)
+    def _get_group_queues(self, client_id):
+        """ Returns keys of queues of all the consumer groups a given client is a member of.
+        """
+        return [self.GROUP_MSG_IDS_PREFIX.format(*key) for key in sorted(self.get_consumer_groups(client_id))]
+
+    def _get_message(self, ctx, msg):
+        """ Turns a message returned by a Lua program into the format requested by the client.
+        """
+        payload = msg[0][0] if msg[0] else None
+        metadata = loads(msg[1][0])
+
+        if ctx.get_format == PUB_SUB.GET_FORMAT.JSON.id:
+            return {'payload': payload, 'metadata':metadata}
+        else:
+            return Message(payload=payload, **metadata)
+
+    def get_and_ack(self, ctx):
+        """ Returns a list of messages for a given sub_key, acknowledging all of them at once, i.e. they are never in-flight
+        and cannot be rejected.
+        """
+        self.validate_sub_key(ctx.sub_key)
+
+        with self.update_lock:
+            client_id = self.sub_to_cons[ctx.sub_key]
+            group_queues = self._get_group_queues(client_id)
+
+        messages = self.run_lua(
+            self.LUA_GET_AND_ACK,
+            [self.CONSUMER_MSG_IDS_PREFIX.format(ctx.sub_key), self.LAST_SEEN_CONSUMER_KEY, self.MSG_METADATA_KEY,
+                 self.MSG_VALUES_KEY, self.MSG_EXPIRE_AT_KEY, self.UNACK_COUNTER_KEY] + group_queues,
+            [ctx.max_batch_size, datetime.utcnow().isoformat(), client_id])
+
+        self.logger.info('Get and ack: sub_key `%s`, `%s` message(s)', ctx.sub_key, len(messages))
+
+        return [self._get_message(ctx, msg) for msg in messages]
 
 # ################################################################################################################################
 
@@ -648,6 +838,28 @@ class RedisPubSub(PubSub, LuaContainer):
 
         return result
 
+    def acknowledge_many(self, ctxs):
+        """ Consumers confirm and accept messages - each of the input contexts describes one consumer and its messages,
+        all of them are confirmed in one Lua invocation. Returns a dictionary of sub_keys and IDs confirmed for each.
+        """
+        keys = [self.UNACK_COUNTER_KEY, self.MSG_VALUES_KEY, self.MSG_EXPIRE_AT_KEY, self.MSG_METADATA_KEY]
+        args = []
+
+        for ctx in ctxs:
+            self.validate_sub_key(ctx.sub_key)
+
+            keys.append(self.CONSUMER_IN_FLIGHT_IDS_PREFIX.format(ctx.sub_key))
+            keys.append(self.CONSUMER_IN_FLIGHT_DATA_PREFIX.format(ctx.sub_key))
+
+            args.append(len(ctx.msg_ids))
+            args.extend(ctx.msg_ids)
+
+        result = dict(zip([ctx.sub_key for ctx in ctxs], self.run_lua(self.LUA_ACK_MANY, keys=keys, args=args)))
+
+        self.logger.info('Ack: result `%s`', result)
+
+        return result
+
     def reject(self, ctx):
         """ Rejects a set of messages for a given consumer. The messages will be placed back onto consumer's queue
         and delivered again at a later time.
@@ -699,19 +911,46 @@ class RedisPubSub(PubSub, LuaContainer):
                 self.logger.info('Delete expired (consumer) `%r` for keys `%s`',
                     self.run_lua(self.LUA_DELETE_EXPIRED_CONSUMER, keys=keys, args=[now]), keys)
 
+            # Delete from group queues - their messages are never in flight, members take them out of a group's queue
+            # once they fetch them, hence no in-flight key is given.
+            for topic, group_name in self.groups:
+                keys = [self.GROUP_MSG_IDS_PREFIX.format(topic, group_name), '', self.MSG_VALUES_KEY, self.MSG_EXPIRE_AT_KEY,
+                        self.UNACK_COUNTER_KEY]
+
+                self.logger.info('Delete expired (group) `%r` for keys `%s`',
+                    self.run_lua(self.LUA_DELETE_EXPIRED_CONSUMER, keys=keys, args=[now]), keys)
+
 # ############################################################################################################################
 
-    def move_to_target_queues(self):
-        """ Invoked periodically in order to fetch data sent to a topic and move it to each consumer's queue.
+    def get_dirty_topics(self, timeout=PUB_SUB.DIRTY_TOPICS_WAIT_TIMEOUT):
+        """ Blocks for up to timeout seconds until a message is published and returns names of all the topics published to
+        since the previous call, an empty list if there were none. Each topic is returned to one caller only.
         """
-        # TODO: We currently deliver messages to each consumer. However, we also need to support
-        # the delivery to only one consumer chosen randomly from each of the subscribed ones.
+        if not self.kvdb.brpop(self.DIRTY_TOPICS_NOTIFY_KEY, timeout):
+            return []
+
+        # Topics become dirty again only after this transaction so any message published later on will wake up a mover
+        # whereas all the earlier ones are already in topics that the caller will move messages from.
+        with self.kvdb.pipeline() as pipe:
+            pipe.smembers(self.DIRTY_TOPICS_KEY)
+            pipe.delete(self.DIRTY_TOPICS_KEY)
+            pipe.delete(self.DIRTY_TOPICS_NOTIFY_KEY)
+            topics, _, _ = pipe.execute()
+
+        return list(topics)
 
+# ############################################################################################################################
+
+    def move_to_target_queues(self, topics=None):
+        """ Fetches data sent to topics and moves it to each consumer's queue. Invoked for topics that have just been published
+        to and periodically for all of them, in case any message was not moved right after its publication.
+        Each consumer group of a topic is a single target whose queue its members compete for.
+        """
         with self.update_lock:
 
             out = []
 
-            for topic in self.topic_to_prod:
+            for topic in (self.topic_to_prod if topics is None else set(topics) & set(self.topic_to_prod)):
 
                 source_queue = self.MSG_IDS_PREFIX.format(topic)
                 topic_info = self.topics[topic]
@@ -732,7 +971,20 @@ class RedisPubSub(PubSub, LuaContainer):
 
                 consumers = self.topic_to_cons.get(topic, [])
                 if consumers:
+                    grouped = set()
+
+                    for (group_topic, group_name), members in sorted(self.groups.items()):
+                        if group_topic == topic:
+                            self.logger.debug('Move: Found group `%s` for topic `%s` of `%s`', group_name, topic, members)
+
+                            keys.append(self.GROUP_MSG_IDS_PREFIX.format(topic, group_name))
+                            args.append(max(self.consumers[member].max_depth for member in members))
+                            grouped.update(members)
+
                     for consumer in consumers:
+                        if consumer in grouped:
+                            continue
+
                         sub_key = self.cons_to_sub[consumer]
                         self.logger.debug('Move: Found sub `%s` for topic `%s` by consumer `%s`', sub_key, topic, consumer)
 
@@ -763,6 +1015,22 @@ class RedisPubSub(PubSub, LuaContainer):
         """
         return self.kvdb.llen(self.CONSUMER_MSG_IDS_PREFIX.format(sub_key))
 
+    def get_group_queue_current_depth(self, topic, group_name):
+        """ Returns current depth of the queue shared by members of a consumer group. Doesn't held onto any locks
+        so by the time the data is returned to the caller the depth may have already changed.
+        """
+        return self.kvdb.llen(self.GROUP_MSG_IDS_PREFIX.format(topic, group_name))
+
+    def get_sub_keys_by_queue(self, queue):
+        """ Returns sub_keys of all the consumers who can fetch messages from a given consumer or group queue.
+        """
+        with self.update_lock:
+            for (topic, group_name), members in self.groups.items():
+                if queue == self.GROUP_MSG_IDS_PREFIX.format(topic, group_name):
+                    return [self.cons_to_sub[member] for member in members]
+
+        return [queue.replace(self.CONSUMER_MSG_IDS_PREFIX.format(''), '', 1)]
+
     def get_consumer_queue_in_flight_depth(self, sub_key):
         """ Returns current depth of an in-flight consumer's queue. Doesn't held onto any locks so by the time the data
         is returned to the caller the depth may have already changed.
@@ -856,14 +1124,18 @@ class RedisPubSub(PubSub, LuaContainer):
 
         return out
 
-    def get_callback_consumers(self):
-        """ Returns these consumers who specified their messages should be delivered through callback URLs.
+    def get_callback_consumers(self, sub_keys=None):
+        """ Returns these consumers who specified their messages should be delivered through callback URLs,
+        optionally only those of the sub_keys given on input.
         """
         with self.update_lock:
             for consumer in self.consumers.values():
                 if not consumer.is_active:
                     continue
 
+                if sub_keys is not None and consumer.sub_key not in sub_keys:
+                    continue
+
                 if consumer.delivery_mode == PUB_SUB.DELIVERY_MODE.CALLBACK_URL.id:
                     yield consumer
 
@@ -889,6 +1161,28 @@ class PubSubAPI(object):
 
         return self.impl.publish(ctx)
 
+    def publish_many(self, payloads, topic, mime_type=None, priority=None, expiration=None, client_id=None):
+        """ Publishes a batch of messages to a given topic. Each element of payloads is either a payload, published using
+        the rest of parameters provided, or a Message object with parameters of its own.
+        """
+        client_id = client_id or self.get_default_producer().id
+        producer = self.impl.producers[client_id].name
+
+        ctx = PubManyCtx()
+        ctx.client_id = client_id
+        ctx.topic = topic
+
+        for payload in payloads:
+            if isinstance(payload, Message):
+                payload.producer = producer
+                ctx.msgs.append(payload)
+            else:
+                ctx.msgs.append(Message(
+                    payload, topic, mime_type or PUB_SUB.DEFAULT_MIME_TYPE, priority or PUB_SUB.DEFAULT_PRIORITY,
+                    expiration or PUB_SUB.DEFAULT_EXPIRATION, None, producer))
+
+        return self.impl.publish_many(ctx)
+
     def subscribe(self, client_id, topics, sub_key=None):
         """ Subscribes a client to one or more topic. Returns a subscription key assigned.
         """
@@ -911,6 +1205,12 @@ class PubSubAPI(object):
         """
         return self.impl.get(GetCtx(sub_key, max_batch_size, is_fifo, get_format))
 
+    def get_and_ack(self, sub_key, max_batch_size=PUB_SUB.DEFAULT_GET_MAX_BATCH_SIZE, is_fifo=PUB_SUB.DEFAULT_IS_FIFO,
+            get_format=PUB_SUB.GET_FORMAT.DEFAULT.id):
+        """ Gets one or more message, if any are available, for the given subscription key and acknowledges them.
+        """
+        return self.impl.get_and_ack(GetCtx(sub_key, max_batch_size, is_fifo, get_format))
+
     def acknowledge(self, sub_key, msg_ids):
         """ Acknowledges one or more message IDs for a given subscription key.
         """
@@ -920,6 +1220,12 @@ class PubSubAPI(object):
 
         return self.impl.acknowledge_delete(ctx)
 
+    def acknowledge_many(self, msg_ids):
+        """ Acknowledges message IDs for a number of subscription keys at once, msg_ids is a dictionary
+        of subscription keys and the IDs to acknowledge for each.
+        """
+        return self.impl.acknowledge_many([AckCtx(sub_key, list(ids)) for sub_key, ids in msg_ids.items()])
+
     def reject(self, sub_key, msg_ids):
         """ Rejects one or more message IDs for a given subscription key.
         """
@@ -971,6 +1277,21 @@ class PubSubAPI(object):
     def get_consumer_queue_in_flight_depth(self, sub_key):
         return self.impl.get_consumer_queue_in_flight_depth(sub_key)
 
+    def get_group_queue_current_depth(self, topic, group_name):
+        return self.impl.get_group_queue_current_depth(topic, group_name)
+
+    def get_group_members(self, topic, group_name):
+        return self.impl.get_group_members(topic, group_name)
+
+    def get_sub_keys_by_queue(self, queue):
+        return self.impl.get_sub_keys_by_queue(queue)
+
+    def get_delivery_plan(self, consumers):
+        return self.impl.get_delivery_plan(consumers)
+
+    def redeliver_group_messages(self, timeout=PUB_SUB.GROUP_REDELIVERY_TIMEOUT):
+        return self.impl.redeliver_group_messages(timeout)
+
     def get_consumer_by_sub_key(self, sub_key):
         return self.impl.get_consumer_by_sub_key(sub_key)
 
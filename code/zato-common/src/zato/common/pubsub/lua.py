@@ -16,6 +16,8 @@ lua_publish = """
    local msg_expire_at = KEYS[4]
    local last_pub_time_key = KEYS[5]
    local last_seen_producer_key = KEYS[6]
+   local dirty_topics_key = KEYS[7]
+   local dirty_topics_notify_key = KEYS[8]
 
    local score = ARGV[1]
    local msg_id = ARGV[2]
@@ -32,6 +34,44 @@ lua_publish = """
    redis.pcall('hset', msg_expire_at, msg_id, expire_at)
    redis.pcall('hset', last_pub_time_key, topic_name, utc_now)
    redis.pcall('hset', last_seen_producer_key, client_id, utc_now)
+
+   -- Movers are woken up only when a topic becomes dirty, there is no need to wake them again until they pick it up
+   if redis.call('sadd', dirty_topics_key, topic_name) == 1 then
+       redis.call('lpush', dirty_topics_notify_key, topic_name)
+   end
+"""
+
+lua_publish_many = """
+
+   local id_key = KEYS[1]
+   local msg_values = KEYS[2]
+   local msg_metadata_key = KEYS[3]
+   local msg_expire_at = KEYS[4]
+   local last_pub_time_key = KEYS[5]
+   local last_seen_producer_key = KEYS[6]
+   local dirty_topics_key = KEYS[7]
+   local dirty_topics_notify_key = KEYS[8]
+
+   local topic_name = ARGV[1]
+   local utc_now = ARGV[2]
+   local client_id = ARGV[3]
+
+   -- Each message is described by five consecutive arguments - score, msg_id, expire_at, msg_value and msg_metadata
+   for idx = 4, #ARGV, 5 do
+       local msg_id = ARGV[idx+1]
+
+       redis.pcall('zadd', id_key, ARGV[idx], msg_id)
+       redis.pcall('hset', msg_values, msg_id, ARGV[idx+3])
+       redis.pcall('hset', msg_metadata_key, msg_id, ARGV[idx+4])
+       redis.pcall('hset', msg_expire_at, msg_id, ARGV[idx+2])
+   end
+
+   redis.pcall('hset', last_pub_time_key, topic_name, utc_now)
+   redis.pcall('hset', last_seen_producer_key, client_id, utc_now)
+
+   if redis.call('sadd', dirty_topics_key, topic_name) == 1 then
+       redis.call('lpush', dirty_topics_notify_key, topic_name)
+   end
 """
 
 lua_move_to_target_queues = """
@@ -119,14 +159,25 @@ lua_get_from_cons_queue = """
    local utc_now = ARGV[2]
    local client_id = ARGV[3]
 
-   local ids = redis.pcall('lrange', cons_queue, 0, max_batch_size)
+   -- Keys from 7 onwards are queues of consumer groups the client is a member of, read after the client's own queue.
+   local queues = {cons_queue}
+   for idx = 7, #KEYS do
+       table.insert(queues, KEYS[idx])
+   end
+
    local values = {}
 
    redis.pcall('hset', last_seen_consumer_key, client_id, utc_now)
 
-    -- It may well be the case that there are no messages for this client
-    if #ids > 0 then
+   for queue_idx, queue in ipairs(queues) do
+
+       if #values > max_batch_size then
+           break
+       end
 
+       local ids = redis.pcall('lrange', queue, 0, max_batch_size - #values)
+
+       -- It may well be the case that there are no messages for this client
        for id_idx, id in ipairs(ids) do
 
            local msg = redis.pcall('hmget', msg_key, id)
@@ -135,7 +186,68 @@ lua_get_from_cons_queue = """
 
            redis.pcall('sadd', cons_in_flight_ids, id)
            redis.pcall('hset', cons_in_flight_data, id, utc_now)
-           redis.pcall('lrem', cons_queue, 0, id)
+           redis.pcall('lrem', queue, 0, id)
+       end
+    end
+
+    return values
+
+"""
+
+lua_get_and_ack = """
+
+   local cons_queue = KEYS[1]
+   local last_seen_consumer_key = KEYS[2]
+   local msg_metadata_key = KEYS[3]
+   local msg_key = KEYS[4]
+   local msg_expire_at = KEYS[5]
+   local unack_counter = KEYS[6]
+
+   local max_batch_size = tonumber(ARGV[1])
+   local utc_now = ARGV[2]
+   local client_id = ARGV[3]
+
+   -- Keys from 7 onwards are queues of consumer groups the client is a member of, read after the client's own queue.
+   local ids = {}
+   local values = {}
+
+   redis.pcall('hset', last_seen_consumer_key, client_id, utc_now)
+
+   for idx = 1, #KEYS do
+       if idx == 1 or idx >= 7 then
+
+           if #ids >= max_batch_size then
+               break
+           end
+
+           local queue_ids = redis.pcall('lrange', KEYS[idx], 0, max_batch_size - #ids - 1)
+
+           -- The messages never become in-flight so they can be removed from the queue all at once
+           if #queue_ids > 0 then
+               redis.pcall('ltrim', KEYS[idx], #queue_ids, -1)
+           end
+
+           for id_idx, id in ipairs(queue_ids) do
+               table.insert(ids, id)
+           end
+       end
+   end
+
+    if #ids > 0 then
+
+       for id_idx, id in ipairs(ids) do
+
+           local msg = redis.pcall('hmget', msg_key, id)
+           local metadata = redis.pcall('hmget', msg_metadata_key, id)
+           table.insert(values, {msg, metadata})
+
+           -- It was the last confirmation we were waiting for so let's delete all traces of the message.
+           if redis.pcall('hincrby', unack_counter, id, -1) <= 0 then
+               redis.pcall('hdel', unack_counter, id)
+               redis.pcall('hdel', msg_key, id)
+               redis.pcall('hdel', msg_metadata_key, id)
+               redis.pcall('hdel', msg_expire_at, id)
+           end
        end
     end
 
@@ -189,16 +301,26 @@ lua_ack_delete = """
 
     for id_idx, id in ipairs(ids) do
 
+        local is_found = false
+
         -- We're deleting a message from a consumer's queue, not merely ack'ing it.
         if is_delete == '1' then
-            redis.pcall('lrem', cons_queue, 0, id)
+            is_found = redis.pcall('lrem', cons_queue, 0, id) > 0
         end
 
         if redis.pcall('srem', cons_in_flight_ids, id) == 1 then
             table.insert(out, id)
+            is_found = true
         end
         redis.pcall('hdel', cons_in_flight_data, id)
-        unack_id_count = redis.pcall('hincrby', unack_counter, id, -1)
+
+        -- A message may have been already redelivered to another member of a consumer group in which case
+        -- a late confirmation from the original member must not count.
+        if is_found then
+            unack_id_count = redis.pcall('hincrby', unack_counter, id, -1)
+        else
+            unack_id_count = -1
+        end
 
         -- It was the last confirmation we were waiting for so let's delete all traces of the message.
 
@@ -215,6 +337,85 @@ lua_ack_delete = """
 
 """
 
+lua_ack_many = """
+
+    local unack_counter = KEYS[1]
+    local msg_values = KEYS[2]
+    local msg_expire_at = KEYS[3]
+    local msg_metadata_key = KEYS[4]
+
+    local argv_idx = 1
+    local out = {}
+
+    -- Keys from 5 onwards are pairs of in-flight keys, one pair for each consumer. In ARGV, each consumer is described
+    -- by the number of its IDs followed by the IDs themselves.
+    for keys_idx = 5, #KEYS, 2 do
+
+        local cons_in_flight_ids = KEYS[keys_idx]
+        local cons_in_flight_data = KEYS[keys_idx+1]
+        local count = tonumber(ARGV[argv_idx])
+        local acked = {}
+
+        for id_idx = argv_idx + 1, argv_idx + count do
+            local id = ARGV[id_idx]
+
+            -- Only messages that are still in flight are confirmed so that acknowledging one twice changes nothing.
+            if redis.pcall('srem', cons_in_flight_ids, id) == 1 then
+                table.insert(acked, id)
+                redis.pcall('hdel', cons_in_flight_data, id)
+
+                if redis.pcall('hincrby', unack_counter, id, -1) <= 0 then
+                    redis.pcall('hdel', unack_counter, id)
+                    redis.pcall('hdel', msg_values, id)
+                    redis.pcall('hdel', msg_metadata_key, id)
+                    redis.pcall('hdel', msg_expire_at, id)
+                end
+            end
+        end
+
+        table.insert(out, acked)
+        argv_idx = argv_idx + count + 1
+    end
+
+    return out
+
+"""
+
+lua_redeliver = """
+
+    local cons_in_flight_ids = KEYS[1]
+    local cons_in_flight_data = KEYS[2]
+    local group_queue = KEYS[3]
+    local msg_metadata_key = KEYS[4]
+
+    local cutoff_utc = tostring(ARGV[1])
+    local topic_name = ARGV[2]
+    local redelivered = {}
+
+    for id_idx, id in ipairs(redis.pcall('smembers', cons_in_flight_ids)) do
+
+        -- In-flight times can be compared lexicographically because we use ISO-8601, i.e. 2014-02-16T02:51:24.013459
+        local in_flight_since = redis.pcall('hget', cons_in_flight_data, id)
+
+        if in_flight_since and tostring(in_flight_since) < cutoff_utc then
+
+            -- A member of more than one group keeps all of their messages in the same in-flight set so each message
+            -- needs to be put back in the queue of the group of the message's topic.
+            local metadata = redis.pcall('hget', msg_metadata_key, id)
+
+            if metadata and cjson.decode(metadata)['topic'] == topic_name then
+                redis.pcall('srem', cons_in_flight_ids, id)
+                redis.pcall('hdel', cons_in_flight_data, id)
+                redis.pcall('lpush', group_queue, id)
+                table.insert(redelivered, id)
+            end
+        end
+    end
+
+    return redelivered
+
+"""
+
 lua_delete_expired_topic = """
 
     local id_key = KEYS[1]
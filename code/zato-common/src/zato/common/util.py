@@ -25,7 +25,8 @@ import threading
 import traceback
 import sys
 from ast import literal_eval
-from contextlib import closing
+from collections import deque
+from contextlib import closing, contextmanager
 from cStringIO import StringIO
 from datetime import datetime, timedelta
 from glob import glob
@@ -43,7 +44,8 @@ from subprocess import Popen, PIPE
 from tempfile import NamedTemporaryFile
 from threading import current_thread
 from time import sleep
-from traceback import format_exc
+from timeit import default_timer
+from traceback import format_exc, format_exception
 from urlparse import urlparse
 
 # alembic
@@ -65,6 +67,7 @@ from dateutil.parser import parse
 from gevent import sleep as gevent_sleep, spawn, Timeout
 from gevent.greenlet import Greenlet
 from gevent.hub import Hub
+from gevent.pool import Pool
 
 # lxml
 from lxml import etree, objectify
@@ -1196,9 +1199,12 @@ def delete_tls_material_from_fs(server, info, full_path_func):
 
 # ################################################################################################################################
 
-def ping_solr(config):
+def ping_solr(config, session=requests):
+    """ Pings Solr, optionally through the HTTP session of an existing client, and raises an exception unless it replies
+    with a success status.
+    """
     result = urlparse(config.address)
-    requests.get('{}://{}{}'.format(result.scheme, result.netloc, config.ping_path))
+    session.get('{}://{}{}'.format(result.scheme, result.netloc, config.ping_path)).raise_for_status()
 
 # ################################################################################################################################
 
@@ -1559,6 +1565,96 @@ def spawn_greenlet(callable, *args, **kwargs):
 
 # ################################################################################################################################
 
+class DispatchPool(object):
+    """ Runs callables in a bounded pool of greenlets. Unlike spawn_greenlet, callers never wait for a callable to complete,
+    failures are logged by a callback invoked once each greenlet is done. When all the greenlets are busy, callers block
+    until one of them is free, which applies backpressure to whoever produces the work, e.g. a broker client's subscriber.
+
+    Callables that must not overtake each other, e.g. an EDIT and a DELETE of the same object, can be given to spawn_in_order
+    under a common key. They run one after another, in the order they were given in, using a single greenlet of the pool.
+    """
+    def __init__(self, size, name='dispatch'):
+        self.size = size
+        self.name = name
+        self.pool = Pool(size)
+
+        # Key -> callables waiting for the one of the same key currently running
+        self.in_order = {}
+
+        # Statistics
+        self.dispatched = 0
+        self.failed = 0
+        self.saturated = 0 # How many times a caller had to wait for a free greenlet
+        self.max_in_use = 0
+
+    def spawn(self, callable, *args, **kwargs):
+        if self.pool.full():
+            self.saturated += 1
+            logger.info('Dispatch pool `%s` is full (size:%s), waiting for a free greenlet', self.name, self.size)
+
+        # Blocks if there are no free greenlets
+        g = self.pool.spawn(callable, *args, **kwargs)
+        g.link(lambda g: self.on_done(g, callable))
+
+        self.dispatched += 1
+        self.max_in_use = max(self.max_in_use, len(self.pool))
+
+        return g
+
+    def spawn_in_order(self, key, callable, *args, **kwargs):
+        """ Same as spawn but if key is not None, callable runs only after all the previous ones of the same key are done.
+        """
+        if key is None:
+            return self.spawn(callable, *args, **kwargs)
+
+        waiting = self.in_order.get(key)
+
+        if waiting is not None:
+            waiting.append((callable, args, kwargs))
+            self.dispatched += 1
+        else:
+            self.in_order[key] = deque()
+            return self.spawn(self._run_in_order, key, callable, args, kwargs)
+
+    def _run_in_order(self, key, callable, args, kwargs):
+        waiting = self.in_order[key]
+
+        try:
+            while True:
+                try:
+                    callable(*args, **kwargs)
+                except Exception:
+                    self.failed += 1
+                    logger.warn('Could not run `%s` in dispatch pool `%s`, e:`%s`', callable, self.name, format_exc())
+
+                if not waiting:
+                    break
+
+                callable, args, kwargs = waiting.popleft()
+        finally:
+            del self.in_order[key]
+
+    def on_done(self, g, callable):
+        if not g.successful():
+            self.failed += 1
+            logger.warn('Could not run `%s` in dispatch pool `%s`, e:`%s`', callable, self.name,
+                ''.join(format_exception(*g.exc_info)))
+
+    def get_stats(self):
+        return {
+            'size': self.size,
+            'in_use': len(self.pool),
+            'dispatched': self.dispatched,
+            'failed': self.failed,
+            'saturated': self.saturated,
+            'max_in_use': self.max_in_use,
+        }
+
+    def join(self, timeout=None):
+        return self.pool.join(timeout)
+
+# ################################################################################################################################
+
 def get_logger_for_class(class_):
     return logging.getLogger('{}.{}'.format(inspect.getmodule(class_).__name__, class_.__name__))
 
@@ -1606,3 +1702,26 @@ def require_tcp_port(address):
         raise Exception('Invalid TCP port in {}'.format(address))
 
 # ################################################################################################################################
+
+class PhaseTimer(object):
+    """ Measures how long each phase of a longer process, such as a server's startup, takes.
+    """
+    def __init__(self, _timer=default_timer):
+        self._timer = _timer
+        self.phases = [] # (name, seconds) tuples in the order the phases took place
+
+    @contextmanager
+    def __call__(self, name):
+        start = self._timer()
+        try:
+            yield
+        finally:
+            self.phases.append((name, self._timer() - start))
+
+    def get_summary(self):
+        """ Returns a string summing up all the phases, in the order they took place.
+        """
+        total = sum(took for _, took in self.phases)
+        return 'total:{:.3f}s, {}'.format(total, ', '.join('{}:{:.3f}s'.format(name, took) for name, took in self.phases))
+
+# ################################################################################################################################
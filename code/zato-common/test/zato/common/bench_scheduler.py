@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Compares memory used by and dispatch jitter of 100k interval-based jobs run by the scheduler from its single dispatcher
+# greenlet with the same jobs run each from a greenlet of its own, which is how the scheduler used to run them. Jitter is how
+# late each run is compared to the time it was planned for, which for the greenlet-per-job mode is start + n * interval so
+# that drift is counted in too. Each mode runs in a subprocess of its own so that their peak RSS can be told apart.
+# Run it directly, e.g. python bench_scheduler.py [how_many] [duration]
+
+# stdlib
+import subprocess
+import sys
+from datetime import datetime, timedelta
+from random import randint
+from resource import getrusage, RUSAGE_SELF
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import sleep, spawn, spawn_later
+
+# Zato
+from zato.common import SCHEDULER
+from zato.scheduler.backend import Interval, Job, Scheduler
+
+# ################################################################################################################################
+
+def noop(*ignored_args, **ignored_kwargs):
+    pass
+
+def get_config():
+    config = Bunch()
+    config.on_job_executed_cb = noop
+    config._add_startup_jobs = False
+    config._add_scheduler_jobs = False
+    config.startup_jobs = []
+    config.odb = None
+    config.job_log_level = 'debug'
+    return config
+
+def get_jobs(how_many):
+    now = datetime.utcnow()
+    return [Job(idx, 'job-{}'.format(idx), SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(in_seconds=randint(2, 10)),
+        now + timedelta(milliseconds=randint(500, 2500)), clone_start_time=True) for idx in xrange(how_many)]
+
+def get_maxrss_mb():
+    return getrusage(RUSAGE_SELF).ru_maxrss / 1024.0
+
+# ################################################################################################################################
+
+def run_heap(jobs, duration, lateness):
+    scheduler = Scheduler(get_config(), None)
+    _run_job = scheduler.run_job
+
+    def run_job(job, run_time, now):
+        lateness.append((datetime.utcnow() - run_time).total_seconds())
+        _run_job(job, run_time, now)
+
+    scheduler.run_job = run_job
+
+    for job in jobs:
+        scheduler.create(job, spawn=False)
+
+    def stop():
+        scheduler.keep_running = False
+        scheduler.timers_changed.set()
+
+    spawn_later(duration, stop)
+    scheduler.run()
+
+def run_greenlet_per_job(jobs, duration, lateness):
+    keep_running = [True]
+
+    def main_loop(job):
+        interval = job.interval.in_seconds
+        sleep((job.start_time - datetime.utcnow()).total_seconds())
+
+        while keep_running[0]:
+            job.current_run += 1
+            planned = job.start_time + timedelta(seconds=(job.current_run - 1) * interval)
+            lateness.append((datetime.utcnow() - planned).total_seconds())
+            spawn(noop, ctx=job.get_context())
+            sleep(interval)
+
+    greenlets = [spawn(main_loop, job) for job in jobs]
+
+    sleep(duration)
+    keep_running[0] = False
+
+    for greenlet in greenlets:
+        greenlet.kill()
+
+# ################################################################################################################################
+
+def run_mode(mode, how_many, duration):
+    rss_before = get_maxrss_mb()
+    jobs = get_jobs(how_many)
+    lateness = []
+
+    {'heap': run_heap, 'greenlet-per-job': run_greenlet_per_job}[mode](jobs, duration, lateness)
+
+    lateness.sort()
+    ms = lambda idx: lateness[min(idx, len(lateness) - 1)] * 1000 if lateness else 0
+
+    print('{:>28}: {:8.1f} MB peak RSS growth, {} runs, lateness p50 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms'.format(
+        mode, get_maxrss_mb() - rss_before, len(lateness), ms(len(lateness) // 2), ms(int(len(lateness) * 0.99)),
+        ms(len(lateness) - 1)))
+
+def run(how_many=100000, duration=15):
+    for mode in ('heap', 'greenlet-per-job'):
+        subprocess.check_call([sys.executable, __file__, mode, str(how_many), str(duration)])
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4:
+        run_mode(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        run(*[int(elem) for elem in sys.argv[1:3]])
@@ -19,8 +19,8 @@ from dateutil.parser import parse
 # Zato
 from zato.common import PUB_SUB
 from zato.common.log_message import CID_LENGTH
-from zato.common.pubsub import AckCtx, Client, Consumer, GetCtx, Message, PubCtx, PubSubAPI, PubSubException, RedisPubSub, \
-     RejectCtx, SubCtx, Topic
+from zato.common.pubsub import AckCtx, Client, Consumer, GetCtx, ItemFull, Message, PubCtx, PubSubAPI, PubSubException, \
+     RedisPubSub, RejectCtx, SubCtx, Topic
 from zato.common.test import rand_bool, rand_date_utc, rand_int, rand_string
 from .common import RedisPubSubCommonTestCase
 
@@ -638,6 +638,7 @@ class CtxObjectsTestCase(TestCase):
         self.assertEquals(consumer.max_depth, PUB_SUB.DEFAULT_MAX_BACKLOG)
         self.assertEquals(consumer.delivery_mode, PUB_SUB.DELIVERY_MODE.PULL.id)
         self.assertEquals(consumer.callback_id, '')
+        self.assertEquals(consumer.group_name, None)
 
     def test_consumer_custom_attrs(self):
         id = rand_int()
@@ -716,3 +717,251 @@ class CtxObjectsTestCase(TestCase):
         self.assertDictEqual(unjsonified, expected)
 
 # ################################################################################################################################
+
+class RedisPubSubBatchTestCase(RedisPubSubCommonTestCase):
+
+    def setUp(self):
+        super(RedisPubSubBatchTestCase, self).setUp()
+        self.api = PubSubAPI(RedisPubSub(self.kvdb, self.key_prefix))
+
+        self.topic = Topic(rand_string(), max_depth=10)
+        self.api.add_topic(self.topic)
+
+        self.producer = Client(rand_int(), rand_string())
+        self.api.add_producer(self.producer, self.topic)
+
+    def _add_consumer(self):
+        consumer = Consumer(rand_int(), rand_string(), sub_key=rand_string())
+        self.api.add_consumer(consumer, self.topic)
+        return consumer
+
+    def test_publish_many(self):
+        if not self.has_redis:
+            return
+
+        payloads = [rand_string() for _ in range(5)]
+        msg = Message(rand_string(), priority=9)
+
+        ctx = self.api.publish_many(payloads + [msg], self.topic.name, client_id=self.producer.id)
+
+        self.assertEquals(len(ctx.msgs), 6)
+        self.assertEquals(self.api.get_topic_depth(self.topic.name), 6)
+
+        msg_values = self.kvdb.hgetall(self.api.impl.MSG_VALUES_KEY)
+        for item in ctx.msgs:
+            self.assertEquals(item.topic, self.topic.name)
+            self.assertEquals(item.producer, self.producer.name)
+            self.assertEquals(msg_values[item.msg_id], item.payload)
+
+        # Higher priority messages come first
+        msg_ids = self.kvdb.zrevrange(self.api.impl.MSG_IDS_PREFIX.format(self.topic.name), 0, -1)
+        self.assertEquals(msg_ids[0], msg.msg_id)
+        self.assertEquals(sorted(msg_ids[1:]), sorted(item.msg_id for item in ctx.msgs[:5]))
+
+        # The topic has room for 4 more messages only so none of the 5 below is published
+        self.assertRaises(ItemFull, self.api.publish_many, payloads, self.topic.name, client_id=self.producer.id)
+        self.assertEquals(self.api.get_topic_depth(self.topic.name), 6)
+
+    def test_get_and_ack(self):
+        if not self.has_redis:
+            return
+
+        consumer1 = self._add_consumer()
+        consumer2 = self._add_consumer()
+
+        ctx = self.api.publish_many([rand_string() for _ in range(3)], self.topic.name, client_id=self.producer.id)
+        self.api.impl.move_to_target_queues()
+
+        messages = self.api.get_and_ack(consumer1.sub_key, max_batch_size=2, get_format=PUB_SUB.GET_FORMAT.JSON.id)
+        self.assertEquals(len(messages), 2)
+
+        messages.extend(self.api.get_and_ack(consumer1.sub_key, get_format=PUB_SUB.GET_FORMAT.JSON.id))
+        self.assertEquals(len(messages), 3)
+        self.assertEquals(self.api.get_and_ack(consumer1.sub_key), [])
+
+        self.assertEquals(sorted(msg['metadata']['msg_id'] for msg in messages), sorted(item.msg_id for item in ctx.msgs))
+
+        # Nothing is in flight and the other consumer still has not received the messages so they are all still kept
+        self.assertEquals(self.api.get_consumer_queue_in_flight_depth(consumer1.sub_key), 0)
+        self.assertEquals(len(self.kvdb.hgetall(self.api.impl.MSG_VALUES_KEY)), 3)
+
+        # Now that everyone has received the messages they are deleted
+        self.assertEquals(len(self.api.get_and_ack(consumer2.sub_key)), 3)
+        self.assertEquals(self.kvdb.hgetall(self.api.impl.MSG_VALUES_KEY), {})
+        self.assertEquals(self.kvdb.hgetall(self.api.impl.UNACK_COUNTER_KEY), {})
+
+    def test_acknowledge_many(self):
+        if not self.has_redis:
+            return
+
+        consumer1 = self._add_consumer()
+        consumer2 = self._add_consumer()
+
+        ctx = self.api.publish_many([rand_string() for _ in range(3)], self.topic.name, client_id=self.producer.id)
+        self.api.impl.move_to_target_queues()
+
+        msg_ids1 = [msg.msg_id for msg in self.api.get(consumer1.sub_key, get_format=PUB_SUB.GET_FORMAT.OBJECT.id)]
+        msg_ids2 = [msg.msg_id for msg in self.api.get(consumer2.sub_key, get_format=PUB_SUB.GET_FORMAT.OBJECT.id)]
+
+        # The first consumer acknowledges all of its messages, the other one only the first of them, and an ID not in flight
+        result = self.api.acknowledge_many({consumer1.sub_key: msg_ids1, consumer2.sub_key: msg_ids2[:1] + [rand_string()]})
+
+        self.assertEquals(sorted(result[consumer1.sub_key]), sorted(item.msg_id for item in ctx.msgs))
+        self.assertEquals(result[consumer2.sub_key], msg_ids2[:1])
+
+        self.assertEquals(self.api.get_consumer_queue_in_flight_depth(consumer1.sub_key), 0)
+        self.assertEquals(self.api.get_consumer_queue_in_flight_depth(consumer2.sub_key), 2)
+
+        # Only the message both consumers acknowledged is deleted
+        self.assertEquals(sorted(self.kvdb.hkeys(self.api.impl.MSG_VALUES_KEY)), sorted(msg_ids2[1:]))
+
+        # Acknowledging the same messages again changes nothing
+        result = self.api.acknowledge_many({consumer1.sub_key: msg_ids1})
+        self.assertEquals(result[consumer1.sub_key], [])
+        self.assertEquals(sorted(self.kvdb.hkeys(self.api.impl.MSG_VALUES_KEY)), sorted(msg_ids2[1:]))
+
+# ################################################################################################################################
+
+class RedisPubSubGroupTestCase(RedisPubSubCommonTestCase):
+
+    def setUp(self):
+        super(RedisPubSubGroupTestCase, self).setUp()
+        self.api = PubSubAPI(RedisPubSub(self.kvdb, self.key_prefix))
+
+        self.topic = Topic(rand_string())
+        self.api.add_topic(self.topic)
+
+        self.producer = Client(rand_int(), rand_string())
+        self.api.add_producer(self.producer, self.topic)
+
+    def _add_consumer(self, group_name=None):
+        consumer = Consumer(rand_int(), rand_string(), sub_key=rand_string(), group_name=group_name)
+        self.api.add_consumer(consumer, self.topic)
+        return consumer
+
+    def test_group_members(self):
+        consumer1 = self._add_consumer('group1')
+        consumer2 = self._add_consumer('group1')
+        consumer3 = self._add_consumer()
+
+        members = self.api.get_group_members(self.topic.name, 'group1')
+        self.assertEquals(sorted(item.id for item in members), sorted([consumer1.id, consumer2.id]))
+        self.assertEquals(self.api.impl.get_consumer_groups(consumer3.id), [])
+
+        # Moving to another group removes a consumer from the previous one
+        consumer2.group_name = 'group2'
+        self.api.update_consumer(consumer2, self.topic)
+
+        self.assertEquals([item.id for item in self.api.get_group_members(self.topic.name, 'group1')], [consumer1.id])
+        self.assertEquals(self.api.impl.get_consumer_groups(consumer2.id), [(self.topic.name, 'group2')])
+
+        # Groups left with no members are deleted, deleting a consumer needs Redis to delete its metadata
+        if self.has_redis:
+            self.api.delete_consumer(consumer2, self.topic)
+
+            self.assertEquals(self.api.get_group_members(self.topic.name, 'group2'), [])
+            self.assertEquals(self.api.impl.groups.keys(), [(self.topic.name, 'group1')])
+
+    def test_get_sub_keys_by_queue(self):
+        consumer1 = self._add_consumer('group1')
+        consumer2 = self._add_consumer('group1')
+        consumer3 = self._add_consumer()
+
+        impl = self.api.impl
+
+        self.assertEquals(
+            sorted(self.api.get_sub_keys_by_queue(impl.GROUP_MSG_IDS_PREFIX.format(self.topic.name, 'group1'))),
+            sorted([consumer1.sub_key, consumer2.sub_key]))
+
+        self.assertEquals(
+            self.api.get_sub_keys_by_queue(impl.CONSUMER_MSG_IDS_PREFIX.format(consumer3.sub_key)), [consumer3.sub_key])
+
+    def test_one_of_group(self):
+        if not self.has_redis:
+            return
+
+        consumer1 = self._add_consumer('group1')
+        consumer2 = self._add_consumer('group1')
+        consumer3 = self._add_consumer()
+
+        ctx = self.api.publish_many([rand_string() for _ in range(4)], self.topic.name, client_id=self.producer.id)
+        self.api.impl.move_to_target_queues()
+
+        msg_ids = sorted(item.msg_id for item in ctx.msgs)
+
+        # The group shares one queue, members of a group do not receive messages in queues of their own
+        self.assertEquals(self.api.get_group_queue_current_depth(self.topic.name, 'group1'), 4)
+        self.assertEquals(self.api.get_consumer_queue_current_depth(consumer1.sub_key), 0)
+        self.assertEquals(self.api.get_consumer_queue_current_depth(consumer3.sub_key), 4)
+
+        # Each message is delivered to one member only
+        received1 = [msg.msg_id for msg in self.api.get(consumer1.sub_key, 2, get_format=PUB_SUB.GET_FORMAT.OBJECT.id)]
+        received2 = [msg.msg_id for msg in self.api.get(consumer2.sub_key, get_format=PUB_SUB.GET_FORMAT.OBJECT.id)]
+
+        self.assertEquals(sorted(received1 + received2), msg_ids)
+        self.assertEquals(set(received1) & set(received2), set())
+        self.assertEquals(self.api.get_group_queue_current_depth(self.topic.name, 'group1'), 0)
+
+        # A message is deleted once the group and the other consumer have both acknowledged it
+        self.api.acknowledge(consumer1.sub_key, received1)
+        self.api.acknowledge(consumer2.sub_key, received2)
+        self.assertEquals(sorted(self.kvdb.hkeys(self.api.impl.MSG_VALUES_KEY)), msg_ids)
+
+        self.api.get_and_ack(consumer3.sub_key)
+        self.assertEquals(self.kvdb.hgetall(self.api.impl.MSG_VALUES_KEY), {})
+        self.assertEquals(self.kvdb.hgetall(self.api.impl.UNACK_COUNTER_KEY), {})
+
+    def test_redeliver_group_messages(self):
+        if not self.has_redis:
+            return
+
+        consumer1 = self._add_consumer('group1')
+        consumer2 = self._add_consumer('group1')
+
+        ctx = self.api.publish_many([rand_string() for _ in range(2)], self.topic.name, client_id=self.producer.id)
+        self.api.impl.move_to_target_queues()
+
+        msg_ids = sorted(item.msg_id for item in ctx.msgs)
+        received = [msg.msg_id for msg in self.api.get(consumer1.sub_key, get_format=PUB_SUB.GET_FORMAT.OBJECT.id)]
+        self.assertEquals(sorted(received), msg_ids)
+
+        # Still within the timeout
+        self.assertEquals(self.api.redeliver_group_messages(60), {})
+
+        group_queue = self.api.impl.GROUP_MSG_IDS_PREFIX.format(self.topic.name, 'group1')
+        redelivered = self.api.redeliver_group_messages(0)
+
+        self.assertEquals(redelivered.keys(), [group_queue])
+        self.assertEquals(sorted(redelivered[group_queue]), msg_ids)
+        self.assertEquals(self.api.get_consumer_queue_in_flight_depth(consumer1.sub_key), 0)
+
+        # Another member receives the messages and a late confirmation from the first one does not count
+        received = [msg.msg_id for msg in self.api.get(consumer2.sub_key, get_format=PUB_SUB.GET_FORMAT.OBJECT.id)]
+        self.assertEquals(sorted(received), msg_ids)
+
+        self.assertEquals(self.api.acknowledge(consumer1.sub_key, msg_ids), [])
+        self.assertEquals(sorted(self.kvdb.hkeys(self.api.impl.MSG_VALUES_KEY)), msg_ids)
+
+        self.api.acknowledge(consumer2.sub_key, msg_ids)
+        self.assertEquals(self.kvdb.hgetall(self.api.impl.MSG_VALUES_KEY), {})
+
+    def test_get_delivery_plan(self):
+        if not self.has_redis:
+            return
+
+        consumer1 = self._add_consumer('group1')
+        consumer2 = self._add_consumer('group1')
+        consumer3 = self._add_consumer()
+
+        self.api.publish_many([rand_string() for _ in range(5)], self.topic.name, client_id=self.producer.id)
+        self.api.impl.move_to_target_queues()
+
+        # The first member already has a message in flight so the other one comes first
+        list(self.api.get(consumer1.sub_key, 0))
+
+        plan = self.api.get_delivery_plan([consumer1, consumer2, consumer3])
+
+        self.assertEquals([(consumer.id, max_batch_size) for consumer, max_batch_size in plan], [
+            (consumer2.id, 2), (consumer1.id, 2), (consumer3.id, PUB_SUB.DEFAULT_GET_MAX_BATCH_SIZE)])
+
+# ################################################################################################################################
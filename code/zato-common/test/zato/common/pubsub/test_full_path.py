@@ -810,4 +810,74 @@ class RedisPubSubInternalTestCase(RedisPubSubCommonTestCase):
         eq_(consumer2.sub_key, sub_key2)
         eq_(consumer2.callback_id, callback_id2)
 
+        # Only consumers of sub_keys given on input are returned
+        consumers = list(ps.get_callback_consumers(set([sub_key2, consumer_pull.sub_key])))
+        eq_(len(consumers), 1)
+        eq_(consumers[0].sub_key, sub_key2)
+
+# ######################################################################################################################
+
+    def test_get_dirty_topics(self):
+        if not self.has_redis:
+            return
+
+        ps = RedisPubSub(self.kvdb, self.key_prefix)
+
+        topic1 = Topic('/test/dirty1')
+        topic2 = Topic('/test/dirty2')
+        topic3 = Topic('/test/dirty3')
+
+        producer = Client('Producer', 'producer')
+
+        for topic in (topic1, topic2, topic3):
+            ps.add_topic(topic)
+            ps.add_producer(producer, topic)
+
+        # Nothing has been published yet
+        eq_(ps.get_dirty_topics(1), [])
+
+        for topic in (topic1, topic2, topic1):
+            ps.publish(PubCtx(producer.id, topic.name, Message('"msg_value"')))
+
+        # Each topic is returned once no matter how many messages were published to it
+        eq_(sorted(ps.get_dirty_topics(1)), ['/test/dirty1', '/test/dirty2'])
+        eq_(ps.get_dirty_topics(1), [])
+
+        ps.publish(PubCtx(producer.id, topic3.name, Message('"msg_value"')))
+        eq_(ps.get_dirty_topics(1), ['/test/dirty3'])
+
+# ######################################################################################################################
+
+    def test_move_to_target_queues_topics(self):
+        if not self.has_redis:
+            return
+
+        ps = RedisPubSub(self.kvdb, self.key_prefix)
+
+        topic1 = Topic('/test/move1')
+        topic2 = Topic('/test/move2')
+
+        producer = Client('Producer', 'producer')
+        consumer = Consumer('Consumer', 'consumer', sub_key=new_cid())
+
+        for topic in (topic1, topic2):
+            ps.add_topic(topic)
+            ps.add_producer(producer, topic)
+            ps.add_consumer(consumer, topic)
+
+        msg_id1 = ps.publish(PubCtx(producer.id, topic1.name, Message('"msg_value"'))).msg.msg_id
+        msg_id2 = ps.publish(PubCtx(producer.id, topic2.name, Message('"msg_value"'))).msg.msg_id
+
+        # Only messages from topics given on input are moved, unknown topics are ignored
+        ps.move_to_target_queues([topic1.name, '/test/no-such-topic'])
+
+        eq_(self.kvdb.lrange(ps.CONSUMER_MSG_IDS_PREFIX.format(consumer.sub_key), 0, -1), [msg_id1])
+        eq_(self.kvdb.zrange(ps.MSG_IDS_PREFIX.format(topic2.name), 0, -1), [msg_id2])
+
+        # All topics are checked by default
+        ps.move_to_target_queues()
+
+        eq_(self.kvdb.lrange(ps.CONSUMER_MSG_IDS_PREFIX.format(consumer.sub_key), 0, -1), [msg_id2, msg_id1])
+        eq_(self.kvdb.zrange(ps.MSG_IDS_PREFIX.format(topic2.name), 0, -1), [])
+
 # ######################################################################################################################
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from random import Random
+from unittest import TestCase
+
+# Nose
+from nose.tools import eq_
+
+# Zato
+from zato.common.histogram import get_bucket, get_bucket_range, Histogram
+
+# ################################################################################################################################
+
+class HistogramTestCase(TestCase):
+
+    def test_buckets(self):
+
+        # Small values have buckets of their own
+        for value in range(128):
+            eq_(get_bucket(value), value)
+            eq_(get_bucket_range(value), (value, value))
+
+        # Each value is within its bucket's range, buckets are contiguous and their width is bounded
+        prev_high = 127
+        for idx in range(128, get_bucket(10 ** 7) + 1):
+            low, high = get_bucket_range(idx)
+            eq_(low, prev_high + 1)
+            eq_(get_bucket(low), idx)
+            eq_(get_bucket(high), idx)
+            self.assertLessEqual(high - low + 1, low / 64.0)
+            prev_high = high
+
+    def test_percentiles(self):
+        histogram = Histogram()
+        for value in range(1, 101):
+            histogram.record(value)
+
+        eq_(histogram.count, 100)
+        eq_(histogram.sum, 5050)
+        eq_(histogram.mean, 50.5)
+        eq_(histogram.min, 1)
+        eq_(histogram.max, 100)
+        eq_(histogram.get_percentiles(), {'p50': 50, 'p90': 90, 'p99': 99, 'p999': 100})
+        eq_(histogram.get_value_at_percentile(100), 100)
+
+        # No data
+        eq_(Histogram().get_percentiles(), {'p50': 0, 'p90': 0, 'p99': 0, 'p999': 0})
+        eq_(Histogram().mean, 0)
+
+    def test_percentile_accuracy(self):
+        random = Random(1)
+        values = sorted(int(random.expovariate(1 / 500.0)) for x in range(10000))
+
+        histogram = Histogram()
+        for value in values:
+            histogram.record(value)
+
+        for percentile in (50, 90, 99, 99.9):
+            expected = values[int(len(values) * percentile / 100.0) - 1]
+            given = histogram.get_value_at_percentile(percentile)
+            self.assertLessEqual(abs(given - expected), expected / 64.0 + 1)
+
+    def test_merge_dict(self):
+        histogram1 = Histogram()
+        histogram2 = Histogram()
+
+        for value in (1, 2, 3000):
+            histogram1.record(value)
+
+        for value in (2, 70000):
+            histogram2.record(value)
+
+        data = histogram1.to_dict()
+        data['usage'] = '3' # Any other keys are ignored
+
+        merged = Histogram.from_dict(data).merge(histogram2)
+
+        eq_(merged.count, 5)
+        eq_(merged.sum, 73005)
+        eq_(merged.counts[2], 2)
+        eq_(merged.min, 1)
+        eq_(get_bucket(merged.max), get_bucket(70000))
+
+        self.assertFalse(Histogram.from_dict({'usage': '1'}))
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from json import dumps
+from unittest import TestCase
+
+# gevent
+from gevent import sleep, spawn
+from gevent.event import Event
+
+# Nose
+from nose.tools import eq_
+
+# Zato
+from zato.common.ipc import Request
+from zato.common.ipc.api import IPCAPI
+from zato.common.ipc.router import Router, RouterClient
+from zato.common.util import new_cid
+
+# ################################################################################################################################
+
+class RouterTestCase(TestCase):
+
+    def setUp(self):
+        self.name = 'test-{}'.format(new_cid())
+        self.requests = []
+        self.router = Router(self.on_message, self.name, 1001)
+        self.router_greenlet = spawn(self.router.serve_forever)
+        self.client = RouterClient(self.name, 2002)
+
+    def tearDown(self):
+        self.router_greenlet.kill()
+        self.router.close()
+        self.client.close()
+
+    def on_message(self, msg):
+        self.requests.append(msg)
+
+        if msg.service == 'sleep':
+            sleep(msg.payload)
+
+        elif msg.service == 'error':
+            raise ValueError('Error {}'.format(msg.payload))
+
+        return dumps({'service': msg.service, 'payload': msg.payload})
+
+    def get_request(self, service, payload, target_pid=1001, is_async=False):
+        request = Request(self.name, 2002, payload)
+        request.service = service
+        request.target_pid = target_pid
+        request.is_async = is_async
+        return request
+
+    def test_invoke(self):
+        request = self.get_request('abc', 'def')
+        response = self.client.invoke(request, 1)
+
+        eq_(response.in_reply_to, request.request_id)
+        eq_(response.publisher_pid, 1001)
+        eq_(response.is_ok, True)
+        eq_(response.payload, dumps({'service': 'abc', 'payload': 'def'}))
+
+        eq_(len(self.requests), 1)
+        eq_(self.requests[0].publisher_pid, 2002)
+        eq_(self.client.pending, {})
+
+    def test_invoke_large_response(self):
+        payload = 'a' * 5 * 10**6
+        response = self.client.invoke(self.get_request('abc', payload), 5)
+        eq_(response.payload, dumps({'service': 'abc', 'payload': payload}))
+
+    def test_invoke_correlates_responses(self):
+
+        # The first request is responded to last, still each caller receives its own response
+        results = {}
+
+        def _invoke(delay):
+            results[delay] = self.client.invoke(self.get_request('sleep', delay), 2).payload
+
+        greenlets = [spawn(_invoke, delay) for delay in (0.3, 0.1, 0.2)]
+        for greenlet in greenlets:
+            greenlet.join()
+
+        for delay in (0.1, 0.2, 0.3):
+            eq_(results[delay], dumps({'service': 'sleep', 'payload': delay}))
+
+        # All the requests went over the same connection
+        eq_(len(self.client.sockets), 1)
+
+    def test_invoke_error(self):
+        response = self.client.invoke(self.get_request('error', 'xyz'), 1)
+        eq_(response.is_ok, False)
+        self.assertIn('ValueError: Error xyz', response.payload)
+
+    def test_invoke_async(self):
+        eq_(self.client.invoke(self.get_request('abc', 'def', is_async=True), 1), None)
+
+        while not self.requests:
+            sleep(0.01)
+
+        eq_(self.requests[0].payload, 'def')
+        eq_(self.client.pending, {})
+
+    def test_invoke_timeout(self):
+
+        # There is no worker with such a PID
+        response = self.client.invoke(self.get_request('abc', 'def', 3003), 0.1)
+
+        eq_(response, None)
+        eq_(self.client.pending, {})
+        eq_(self.requests, [])
+
+# ################################################################################################################################
+
+class IPCAPITestCase(TestCase):
+
+    def test_invoke_by_pid(self):
+        name = 'test-{}'.format(new_cid())
+        invoked = Event()
+
+        def on_message(msg):
+            invoked.set()
+            return dumps({'pid': msg.target_pid, 'service': msg.service, 'payload': msg.payload})
+
+        api1 = IPCAPI(False, name, on_message, 1001)
+        api2 = IPCAPI(False, name, on_message, 2002)
+
+        api1.router = Router(on_message, name, 1001)
+        api1.router_client = RouterClient(name, 1001)
+        api2.router_client = RouterClient(name, 2002)
+
+        greenlet = spawn(api1.router.serve_forever)
+
+        try:
+            eq_(api2.invoke_by_pid('abc', {'a': 1}, 1001), {'pid': 1001, 'service': 'abc', 'payload': {'a': 1}})
+
+            invoked.clear()
+            eq_(api2.invoke_by_pid('abc', {'a': 1}, 1001, is_async=True), None)
+            invoked.wait(1)
+            eq_(invoked.is_set(), True)
+
+            # No such worker
+            eq_(api1.invoke_by_pid('abc', {'a': 1}, 2002, timeout=0.1), None)
+
+        finally:
+            greenlet.kill()
+            api1.router.close()
+            api1.router_client.close()
+            api2.router_client.close()
+
+# ################################################################################################################################
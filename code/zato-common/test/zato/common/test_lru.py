@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Nose
+from nose.tools import eq_
+
+# Zato
+from zato.common.lru import LRUCache
+
+# ################################################################################################################################
+
+class LRUCacheTestCase(TestCase):
+
+    def test_get_set(self):
+        cache = LRUCache(2)
+
+        self.assertIsNone(cache.get('a'))
+        eq_(cache.get('a', 123), 123)
+
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        eq_(cache.get('a'), 1)
+        eq_(cache.get('b'), 2)
+        eq_(len(cache), 2)
+
+        eq_(cache.hits, 2)
+        eq_(cache.misses, 2)
+        eq_(cache.evictions, 0)
+
+    def test_eviction_by_recency(self):
+        cache = LRUCache(2)
+
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        # 'a' is now the most recently used one so 'b' will be evicted
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        eq_(cache.evictions, 1)
+
+        # Overwriting an existing key does not evict anything
+        cache.set('c', 33)
+        eq_(cache.get('c'), 33)
+        eq_(cache.evictions, 1)
+
+    def test_delete_clear(self):
+        cache = LRUCache(10)
+
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+
+        cache.delete('a')
+        cache.delete('zzz')
+        self.assertNotIn('a', cache)
+        eq_(len(cache), 1)
+
+        cache.clear()
+        eq_(len(cache), 0)
+
+        eq_(cache.get_stats(), {'size': 0, 'max_size': 10, 'hits': 1, 'misses': 0, 'evictions': 0})
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.set('a', 1)
+
+        eq_(len(cache), 0)
+        self.assertIsNone(cache.get('a'))
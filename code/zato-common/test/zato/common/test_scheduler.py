@@ -9,7 +9,6 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
-import time
 from datetime import datetime, timedelta
 from random import choice, seed
 from unittest import TestCase
@@ -24,7 +23,7 @@ from crontab import CronTab
 from dateutil.parser import parse
 
 # gevent
-from gevent import sleep, spawn
+from gevent import sleep, spawn, spawn_later
 
 # mock
 from mock import patch
@@ -60,12 +59,15 @@ def get_job(name=None, interval_in_seconds=None, start_time=None, max_repeats=No
     return Job(rand_int(), name, SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(in_seconds=interval_in_seconds),
         start_time, callback, max_repeats=max_repeats)
 
-def iter_cb(scheduler, stop_time):
-    """ Stop the scheduler after stop_time is reached (test_wait_time seconds from test's start time) -
-    which should plenty enough for all the jobs to be spawned and the iteration loop to
+def stop_after(scheduler, wait_time):
+    """ Stops the scheduler's dispatcher after wait_time seconds - which should be plenty enough for all the jobs
+    to be run as many times as the tests need it.
     """
-    if datetime.utcnow() >= stop_time:
+    def _stop():
         scheduler.keep_running = False
+        scheduler.timers_changed.set()
+
+    spawn_later(wait_time, _stop)
 
 def get_scheduler_config():
     config = Bunch()
@@ -219,143 +221,69 @@ class JobTestCase(TestCase):
 
             self.assertDictEqual(ctx, expected)
 
-    def test_main_loop_keep_running_false(self):
-
-        job = get_job()
-        job.keep_running = False
-
-        self.assertTrue(job.main_loop())
-        self.assertFalse(job.keep_running)
-        self.assertFalse(job.max_repeats_reached)
-
-        self.assertEquals(job.current_run, 0)
-
-    def test_main_loop_max_repeats_reached(self):
+    def test_run(self):
 
-        runs_ctx = []
+        spawn_history = []
+        reached = []
 
-        def callback(ctx):
-            runs_ctx.append(ctx)
+        def spawn(*args, **kwargs):
+            spawn_history.append([args, kwargs])
 
         cb_kwargs = {
             rand_string():rand_string(),
             rand_string():rand_string()
         }
 
-        interval_in_seconds = 0.01
+        interval_in_seconds = rand_int()
         max_repeats = choice(range(2, 5))
 
         job = get_job(interval_in_seconds=interval_in_seconds, max_repeats=max_repeats)
-        job.callback = callback
+        job.start_time = datetime.utcnow()
         job.cb_kwargs = cb_kwargs
+        job.on_max_repeats_reached_cb = reached.append
 
-        self.assertTrue(job.main_loop())
-        sleep(0.2)
-
-        len_runs_ctx = len(runs_ctx)
-        self.assertEquals(len_runs_ctx, max_repeats)
+        with patch('zato.scheduler.backend.Job._spawn', spawn):
+            for idx in range(max_repeats):
+                self.assertTrue(job.keep_running)
+                job.run()
 
         self.assertFalse(job.keep_running)
-        self.assertIs(job.callback, callback)
-
-        for idx, ctx in enumerate(runs_ctx, 1):
-            self.check_ctx(ctx, job, interval_in_seconds, max_repeats, idx, cb_kwargs, len_runs_ctx)
-
-    def test_main_loop_sleep_spawn_called(self):
-
-        wait_time = 0.2
-        sleep_time = rand_int()
-
-        now_values = [parse('2019-12-23 22:19:03'), parse('2021-05-13 17:35:48')]
-
-        sleep_history = []
-        spawn_history = []
-        sleep_time_history = []
-
-        def sleep(value):
-            if value != wait_time:
-                sleep_history.append(value)
-
-        def spawn(*args, **kwargs):
-            spawn_history.append([args, kwargs])
-
-        def get_sleep_time(*args, **kwargs):
-            sleep_time_history.append(args[1])
-            return sleep_time
-
-        with patch('gevent.sleep', sleep):
-            with patch('zato.scheduler.backend.Job._spawn', spawn):
-                with patch('zato.scheduler.backend.Job.get_sleep_time', get_sleep_time):
-                    for now in now_values:
-                        self.now = now
-                        with patch('zato.scheduler.backend.datetime', self._datetime):
-                            for job_type in SCHEDULER.JOB_TYPE.CRON_STYLE, SCHEDULER.JOB_TYPE.INTERVAL_BASED:
-
-                                max_repeats = choice(range(2, 5))
-
-                                cb_kwargs = {
-                                    rand_string():rand_string(),
-                                    rand_string():rand_string()
-                                }
-
-                                interval = Interval(seconds=sleep_time) if job_type == SCHEDULER.JOB_TYPE.INTERVAL_BASED \
-                                    else CronTab(DEFAULT_CRON_DEFINITION)
-
-                                job = Job(rand_int(), rand_string(), job_type, interval, max_repeats=max_repeats)
-
-                                if job.type == SCHEDULER.JOB_TYPE.CRON_STYLE:
-                                    job.cron_definition = DEFAULT_CRON_DEFINITION
-
-                                job.cb_kwargs = cb_kwargs
-                                job.start_time = datetime.utcnow()
-                                job.callback = dummy_callback
-
-                                self.assertTrue(job.main_loop())
-                                time.sleep(0.5)
-
-                                self.assertEquals(max_repeats, len(sleep_history))
-                                self.assertEquals(max_repeats, len(spawn_history))
-
-                                for item in sleep_history:
-                                    self.assertEquals(sleep_time, item)
-
-                                for idx, (callback, ctx_dict) in enumerate(spawn_history, 1):
-                                    self.assertEquals(2, len(callback))
-                                    callback = callback[1]
-                                    self.check_ctx(
-                                        ctx_dict['ctx'], job, sleep_time, max_repeats, idx, cb_kwargs, len(spawn_history), job_type)
-                                    self.assertIs(callback, dummy_callback)
+        self.assertTrue(job.max_repeats_reached)
+        self.assertEquals(reached, [job])
+        self.assertEquals(len(spawn_history), max_repeats)
 
-                                del sleep_history[:]
-                                del spawn_history[:]
+        for idx, (args, kwargs) in enumerate(spawn_history, 1):
+            self.assertEquals(2, len(args))
+            self.assertIs(args[1], dummy_callback)
+            self.check_ctx(kwargs['ctx'], job, interval_in_seconds, max_repeats, idx, cb_kwargs, len(spawn_history))
 
-                            for item in sleep_time_history:
-                                self.assertEquals(item, now)
+    def test_get_next_run_time_interval(self):
 
-                            del sleep_time_history[:]
+        job = get_job(interval_in_seconds=10, start_time=datetime.utcnow())
+        run_time = parse('2019-12-23 22:19:00')
 
-    def test_run(self):
+        # The next run is planned relative to the previous planned one, no matter how late the latter took place
+        self.assertEquals(job.get_next_run_time(run_time, parse('2019-12-23 22:19:00')), parse('2019-12-23 22:19:10'))
+        self.assertEquals(job.get_next_run_time(run_time, parse('2019-12-23 22:19:04.5')), parse('2019-12-23 22:19:10'))
 
-        data = {'main_loop_called':False, 'sleep': False}
+        # Runs missed in the meantime are skipped
+        self.assertEquals(job.get_next_run_time(run_time, parse('2019-12-23 22:19:10')), parse('2019-12-23 22:19:20'))
+        self.assertEquals(job.get_next_run_time(run_time, parse('2019-12-23 22:19:35')), parse('2019-12-23 22:19:40'))
 
-        def main_loop():
-            data['main_loop_called'] = True
-
-        def sleep(value):
-            data['sleep'] = value # Should not be executed if start_time is None
+        # No more runs
+        job.keep_running = False
+        self.assertIs(job.get_next_run_time(run_time, run_time), None)
 
-        start_time = datetime.utcnow() + timedelta(seconds=1.2)
+    def test_get_next_run_time_one_time_cron(self):
 
-        with patch('gevent.sleep', sleep):
+        now = parse('2019-12-23 22:19:03')
 
-            job = get_job()
-            job.main_loop = main_loop
-            job.start_time = start_time
+        job = Job(rand_int(), rand_string(), SCHEDULER.JOB_TYPE.ONE_TIME, Interval(seconds=5), datetime.utcnow())
+        self.assertIs(job.get_next_run_time(now, now), None)
 
-            job.run()
-
-            self.assertTrue(data['main_loop_called'])
-            self.assertEquals(data['sleep'], 1)
+        with patch('zato.scheduler.backend.Job.get_sleep_time', lambda self, now: 57):
+            job = Job(rand_int(), rand_string(), SCHEDULER.JOB_TYPE.CRON_STYLE, CronTab(DEFAULT_CRON_DEFINITION), now)
+            self.assertEquals(job.get_next_run_time(now - timedelta(seconds=1), now), parse('2019-12-23 22:20:00'))
 
     def test_hash_eq(self):
         job1 = get_job(name='a')
@@ -402,39 +330,17 @@ class JobStartTimeTestCase(TestCase):
         expected = parse(expected)
 
         interval = 1 # Days
-        data = {'start_time':[], 'now':[]}
-
-        def wait_iter_cb(start_time, now, *ignored):
-            data['start_time'].append(start_time)
-            data['now'].append(now)
 
         with patch('zato.scheduler.backend.datetime', self._datetime):
 
             interval = Interval(days=interval)
             job = Job(rand_int(), rand_string(), SCHEDULER.JOB_TYPE.INTERVAL_BASED, start_time=start_time, interval=interval)
-            job.wait_iter_cb = wait_iter_cb
-            job.wait_sleep_time = 0.1
 
             self.assertEquals(job.start_time, expected)
             self.assertTrue(job.keep_running)
             self.assertFalse(job.max_repeats_reached)
             self.assertIs(job.max_repeats_reached_at, None)
 
-            spawn(job.run)
-            sleep(0.2)
-
-            len_start_time = len(data['start_time'])
-            len_now = len(data['now'])
-
-            self.assertNotEquals(len_start_time, 0)
-            self.assertNotEquals(len_now, 0)
-
-            for item in data['start_time']:
-                self.assertEquals(expected, item)
-
-            for item in data['now']:
-                self.assertEquals(self.now, item)
-
     def test_get_start_time_result_in_future(self):
         self.check_get_start_time('2017-03-20 19:11:37', '2017-03-21 15:11:37', '2017-03-21 19:11:37')
 
@@ -458,121 +364,90 @@ class JobStartTimeTestCase(TestCase):
 
 class SchedulerTestCase(TestCase):
 
-    def test_create(self):
+    def get_live_timers(self, scheduler):
+        return sorted(timer[2].name for timer in scheduler.timers if timer[2])
 
-        data = {'spawned_jobs': 0}
+    def test_create(self):
 
         def on_job_executed(*ignored):
             pass
 
-        def job_run(*ignored):
-            pass
-
-        def spawn(scheduler_instance, func):
-            self.assertIs(func, job_run)
-            data['spawned_jobs'] += 1
-
-        with patch('zato.scheduler.backend.Scheduler._spawn', spawn):
-
-            scheduler = Scheduler(get_scheduler_config(), None)
-            scheduler.lock = RLock()
-            scheduler.on_job_executed = on_job_executed
-
-            job1 = get_job()
-            job1.run = job_run
-
-            job2 = get_job()
-            job2.run = job_run
+        scheduler = Scheduler(get_scheduler_config(), None)
+        scheduler.lock = RLock()
+        scheduler.on_job_executed = on_job_executed
 
-            job3 = get_job(name=job2.name)
-            job3.run = job_run
+        job1 = get_job()
+        job2 = get_job()
+        job3 = get_job(name=job2.name)
+        job4 = get_job()
+        job5 = get_job()
 
-            job4 = get_job()
-            job5 = get_job()
+        job6 = get_job(prefix='inactive')
+        job6.is_active = False
 
-            job6 = get_job(prefix='inactive')
-            job6.is_active = False
+        scheduler.create(job1)
+        scheduler.create(job2)
 
-            scheduler.create(job1)
-            scheduler.create(job2)
+        # These two won't be added because scheduler.jobs is a set hashed by a job's name
+        # and the timer job2 had is replaced with a new one.
+        scheduler.create(job2)
+        scheduler.create(job3)
 
-            # These two won't be added because scheduler.jobs is a set hashed by a job's name.
-            scheduler.create(job2)
-            scheduler.create(job3)
+        # The first one won't be spawned but the second one will.
+        scheduler.create(job4, spawn=False)
+        scheduler.create(job5, spawn=True)
 
-            # The first one won't be spawned but the second one will.
-            scheduler.create(job4, spawn=False)
-            scheduler.create(job5, spawn=True)
+        # Won't be added anywhere nor spawned because it's inactive.
+        scheduler.create(job6)
 
-            # Won't be added anywhere nor spawned because it's inactive.
-            scheduler.create(job6)
+        self.assertEquals(scheduler.lock.called, 7)
+        self.assertEquals(len(scheduler.jobs), 5)
 
-            self.assertEquals(scheduler.lock.called, 7)
-            self.assertEquals(len(scheduler.jobs), 5)
+        self.assertIn(job1, scheduler.jobs)
+        self.assertIn(job2, scheduler.jobs)
+        self.assertIs(scheduler.job_by_name[job1.name], job1)
+        self.assertIs(scheduler.job_by_name[job2.name], job2)
 
-            self.assertIn(job1, scheduler.jobs)
-            self.assertIn(job2, scheduler.jobs)
+        self.assertIs(job1.callback, scheduler.on_job_executed)
+        self.assertIs(job2.callback, scheduler.on_job_executed)
 
-            self.assertIs(job1.callback, scheduler.on_job_executed)
-            self.assertIs(job2.callback, scheduler.on_job_executed)
+        # One timer for each job spawned
+        self.assertEquals(self.get_live_timers(scheduler), sorted([job1.name, job2.name, job5.name]))
+        self.assertEquals(sorted(scheduler.job_timers), sorted([job1.name, job2.name, job5.name]))
 
-            self.assertEquals(data['spawned_jobs'], 4)
+        # The earliest of them is always the first one
+        self.assertEquals(scheduler.timers[0][0], min(job.start_time for job in (job1, job2, job3, job5)))
 
     def test_run(self):
 
         test_wait_time = 0.3
-        sched_sleep_time = 0.1
 
-        data = {'sleep': [], 'jobs':set()}
-
-        def _sleep(value):
-            data['sleep'].append(value)
+        data = {'jobs':set()}
 
         def spawn_job(job):
             data['jobs'].add(job)
 
-        def job_run(self):
-            pass
-
         job1, job2, job3 = [get_job(str(x)) for x in range(3)]
 
         # Already run out of max_repeats and should not be started
         job4 = Job(rand_int(), rand_string(), SCHEDULER.JOB_TYPE.INTERVAL_BASED, start_time=parse('1997-12-23 21:24:27'),
             interval=Interval(seconds=5), max_repeats=3)
 
-        job1.run = job_run
-        job2.run = job_run
-        job3.run = job_run
-        job4.run = job_run
-
-        config = Bunch()
-        config.on_job_executed_cb = dummy_callback
-        config._add_startup_jobs = False
-        config._add_scheduler_jobs = False
-        config.startup_jobs = []
-        config.odb = None
-        config.job_log_level = 'info'
-
         scheduler = Scheduler(get_scheduler_config(), None)
         scheduler.spawn_job = spawn_job
         scheduler.lock = RLock()
-        scheduler.sleep = _sleep
-        scheduler.sleep_time = sched_sleep_time
-        scheduler.iter_cb = iter_cb
-        scheduler.iter_cb_args = (scheduler, datetime.utcnow() + timedelta(seconds=test_wait_time))
 
         scheduler.create(job1, spawn=False)
         scheduler.create(job2, spawn=False)
         scheduler.create(job3, spawn=False)
         scheduler.create(job4, spawn=False)
 
+        stop_after(scheduler, test_wait_time)
         scheduler.run()
 
         self.assertEquals(3, len(data['jobs']))
         self.assertTrue(scheduler.lock.called)
-
-        for item in data['sleep']:
-            self.assertEquals(sched_sleep_time, item)
+        self.assertTrue(scheduler.ready)
 
         for job in job1, job2, job3:
             self.assertIn(job, data['jobs'])
@@ -582,13 +457,11 @@ class SchedulerTestCase(TestCase):
     def test_on_max_repeats_reached(self):
 
         test_wait_time = 0.5
-        job_sleep_time = 0.02
         job_max_repeats = 3
 
         data = {'job':None, 'called':0}
 
         job = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
-        job.wait_sleep_time = job_sleep_time
 
         # Just to make sure it's inactive by default.
         self.assertTrue(job.is_active)
@@ -602,10 +475,9 @@ class SchedulerTestCase(TestCase):
             data['old_on_max_repeats_reached'](job)
 
         scheduler.on_max_repeats_reached = on_max_repeats_reached
-        scheduler.iter_cb = iter_cb
-        scheduler.iter_cb_args = (scheduler, datetime.utcnow() + timedelta(seconds=test_wait_time))
 
         scheduler.create(job)
+        stop_after(scheduler, test_wait_time)
         scheduler.run()
 
         now = datetime.utcnow()
@@ -618,27 +490,24 @@ class SchedulerTestCase(TestCase):
         self.assertTrue(job.max_repeats_reached_at < now)
         self.assertTrue(job.max_repeats_reached_at >= now + timedelta(seconds=-test_wait_time))
 
-        # Having run out of max_repeats it should not be active now.
+        # Having run out of max_repeats it should not be active now and it has no timer anymore.
         self.assertFalse(job.is_active)
+        self.assertEquals(job.current_run, job_max_repeats)
+        self.assertNotIn(job.name, scheduler.job_timers)
 
     def test_delete(self):
         test_wait_time = 0.5
-        job_sleep_time = 10
         job_max_repeats = 30
 
         job1 = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
-        job1.wait_sleep_time = job_sleep_time
-
         job2 = Job(rand_int(), 'b', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
-        job2.wait_sleep_time = job_sleep_time
 
         scheduler = Scheduler(get_scheduler_config(), None)
-        scheduler.lock = RLock()
-        scheduler.iter_cb = iter_cb
-        scheduler.iter_cb_args = (scheduler, datetime.utcnow() + timedelta(seconds=test_wait_time))
 
         scheduler.create(job1)
         scheduler.create(job2)
+
+        stop_after(scheduler, test_wait_time)
         scheduler.run()
 
         scheduler.unschedule(job1)
@@ -647,69 +516,120 @@ class SchedulerTestCase(TestCase):
         self.assertNotIn(job1, scheduler.jobs)
         self.assertFalse(job1.keep_running)
 
-        # run - 1
-        # create - 2
-        # delete - 1
-        # on_max_repeats_reached - 0 (because of how long it takes to run job_max_repeats with test_wait_time)
-        # 1+2+1 = 4
-        self.assertEquals(scheduler.lock.called, 4)
+        # The timer is left in the heap but it won't run the job anymore
+        self.assertEquals(self.get_live_timers(scheduler), ['b'])
+
+        scheduler.unschedule_by_name('b')
+        scheduler.unschedule_by_name('no-such-job')
+
+        self.assertEquals(scheduler.jobs, set())
+        self.assertEquals(scheduler.job_by_name, {})
+        self.assertEquals(scheduler.job_timers, {})
+        self.assertFalse(job2.keep_running)
+
+    def test_job_timers(self):
+
+        job1 = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=10))
+        job2 = Job(rand_int(), 'b', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=10))
+
+        scheduler = Scheduler(get_scheduler_config(), None)
+        scheduler.lock = RLock()
+
+        scheduler.create(job1)
+        scheduler.create(job2)
+
+        self.assertIs(scheduler.job_timers[job1.name][2], job1)
+        self.assertIs(scheduler.job_timers[job2.name][2], job2)
+
+        self.assertTrue(job1.keep_running)
+        self.assertTrue(job2.keep_running)
+
+        timer1 = scheduler.job_timers[job1.name]
+        scheduler.unschedule(job1)
+
+        self.assertFalse(job1.keep_running)
+        self.assertTrue(job2.keep_running)
+
+        self.assertNotIn(job1.name, scheduler.job_timers)
+        self.assertIs(timer1[2], None)
+        self.assertIs(scheduler.job_timers[job2.name][2], job2)
 
-    def test_job_greenlets(self):
+    def test_drift_free(self):
 
-        data = {'spawned':[], 'stopped': []}
+        interval = 0.05
+        run_times = []
 
-        class FakeGreenlet(object):
-            def __init__(_self, run):
-                _self.run = _self._run = run
+        job = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(in_seconds=interval))
 
-            def kill(_self, *args, **kwargs):
-                data['stopped'].append([_self, args, kwargs])
+        scheduler = Scheduler(get_scheduler_config(), None)
+        run_job = scheduler.run_job
 
-        def spawn(scheduler_instance, job, *args, **kwargs):
-            g = FakeGreenlet(job)
-            data['spawned'].append(g)
-            return g
+        def _run_job(job, run_time, now):
+            run_times.append(run_time)
+            run_job(job, run_time, now)
 
-        with patch('zato.scheduler.backend.Scheduler._spawn', spawn):
+        scheduler.run_job = _run_job
+        scheduler.create(job)
 
-            test_wait_time = 0.5
-            job_sleep_time = 10
-            job_max_repeats = 30
+        stop_after(scheduler, 0.5)
+        scheduler.run()
 
-            job1 = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
-            job1.wait_sleep_time = job_sleep_time
+        self.assertTrue(len(run_times) > 5)
 
-            job2 = Job(rand_int(), 'b', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
-            job2.wait_sleep_time = job_sleep_time
+        # Each run is planned a multiple of the interval after the first one
+        for idx, run_time in enumerate(run_times):
+            self.assertEquals(run_time, job.start_time + timedelta(seconds=interval * idx))
 
-            scheduler = Scheduler(get_scheduler_config(), None)
-            scheduler.lock = RLock()
-            scheduler.iter_cb = iter_cb
-            scheduler.iter_cb_args = (scheduler, datetime.utcnow() + timedelta(seconds=test_wait_time))
+    def test_dispatcher_wakes_up_for_earlier_jobs(self):
 
-            scheduler.create(job1)
-            scheduler.create(job2)
-            scheduler.run()
+        executed = []
 
-            self.assertEquals(scheduler.job_greenlets[job1.name]._run, job1.run)
-            self.assertEquals(scheduler.job_greenlets[job2.name]._run, job2.run)
+        config = get_scheduler_config()
+        config.on_job_executed_cb = executed.append
+
+        scheduler = Scheduler(config, None)
+        scheduler.create(get_job('late', interval_in_seconds=3600, start_time=datetime.utcnow() + timedelta(hours=1)))
+
+        stop_after(scheduler, 0.5)
+        greenlet = spawn(scheduler.run)
+        sleep(0.1)
 
-            self.assertTrue(job1.keep_running)
-            self.assertTrue(job2.keep_running)
+        # The dispatcher waits for the late job but it runs this one as soon as it is due
+        scheduler.create(get_job('early', interval_in_seconds=3600, start_time=datetime.utcnow() + timedelta(seconds=0.1)))
 
-            scheduler.unschedule(job1)
+        greenlet.join()
 
-            self.assertFalse(job1.keep_running)
-            self.assertTrue(job2.keep_running)
+        self.assertEquals([ctx['name'] for ctx in executed], ['early'])
 
-            self.assertNotIn(job1.name, scheduler.job_greenlets)
-            self.assertEquals(scheduler.job_greenlets[job2.name]._run, job2.run)
+    def test_next_run_time_error(self):
 
-            self.assertEquals(len(data['stopped']), 1)
-            g, args, kwargs = data['stopped'][0]
-            self.assertIs(g.run.im_func, job1.run.im_func) # That's how we know it was job1 deleted not job2
-            self.assertIs(args, ())
-            self.assertDictEqual(kwargs, {'timeout':2.0, 'block':False})
+        executed = []
+
+        config = get_scheduler_config()
+        config.on_job_executed_cb = executed.append
+
+        start_time = datetime.utcnow()
+        broken = get_job('broken', interval_in_seconds=0.05, start_time=start_time)
+        working = get_job('working', interval_in_seconds=0.05, start_time=start_time)
+
+        def get_next_run_time(*ignored):
+            raise ValueError('Invalid interval')
+
+        broken.get_next_run_time = get_next_run_time
+
+        scheduler = Scheduler(config, None)
+        scheduler.create(broken)
+        scheduler.create(working)
+
+        stop_after(scheduler, 0.5)
+        scheduler.run()
+
+        # The broken job ran once and lost its timer whereas the other one kept running
+        names = [ctx['name'] for ctx in executed]
+
+        self.assertEquals(names.count('broken'), 1)
+        self.assertTrue(names.count('working') > 5)
+        self.assertNotIn('broken', scheduler.job_timers)
 
     def test_edit(self):
 
@@ -722,24 +642,20 @@ class SchedulerTestCase(TestCase):
         start_time = datetime.utcnow()
         test_wait_time = 0.5
         job_interval1, job_interval2 = 2, 3
-        job_sleep_time = 10
         job_max_repeats1, job_max_repeats2 = 20, 30
 
         scheduler = Scheduler(get_scheduler_config(), None)
         scheduler.lock = RLock()
-        scheduler.iter_cb = iter_cb
-        scheduler.iter_cb_args = (scheduler, datetime.utcnow() + timedelta(seconds=test_wait_time))
 
         def check(scheduler, job, label):
-            self.assertIn(job.name, scheduler.job_greenlets)
+            self.assertIn(job.name, scheduler.job_timers)
             self.assertIn(job, scheduler.jobs)
 
-            self.assertEquals(1, len(scheduler.job_greenlets))
+            self.assertEquals(1, len(scheduler.job_timers))
             self.assertEquals(1, len(scheduler.jobs))
 
-            self.assertIs(job.run.im_func, scheduler.job_greenlets.values()[0]._run.im_func)
-
             clone = list(scheduler.jobs)[0]
+            self.assertIs(scheduler.job_timers.values()[0][2], clone)
 
             for name in 'name', 'interval', 'cb_kwargs', 'max_repeats', 'is_active':
                 expected = getattr(job, name)
@@ -762,21 +678,20 @@ class SchedulerTestCase(TestCase):
                 self.assertIs(clone_cb.im_func, scheduler.on_job_executed.im_func)
                 self.assertIs(clone_on_max_cb.im_func, scheduler.on_max_repeats_reached.im_func)
 
-        job1 = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=job_interval1), start_time, max_repeats=job_max_repeats1)
+        job1 = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=job_interval1), start_time,
+            max_repeats=job_max_repeats1)
         job1.callback = callback
         job1.on_max_repeats_reached_cb = on_max_repeats_reached_cb
-        job1.wait_sleep_time = job_sleep_time
 
-        job2 = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=job_interval2), start_time, max_repeats=job_max_repeats2)
+        job2 = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=job_interval2), start_time,
+            max_repeats=job_max_repeats2)
         job2.callback = callback
         job2.on_max_repeats_reached_cb = on_max_repeats_reached_cb
-        job2.wait_sleep_time = job_sleep_time
 
+        stop_after(scheduler, test_wait_time)
         scheduler.run()
         scheduler.create(job1)
 
-        sleep(test_wait_time)
-
         # We have only job1 at this point
         check(scheduler, job1, 'first')
 
@@ -799,22 +714,21 @@ class SchedulerTestCase(TestCase):
             data['runs'].append(ctx)
 
         test_wait_time = 0.5
-        job_sleep_time = 0.1
         job_max_repeats = 10
 
         job = Job(rand_int(), 'a', SCHEDULER.JOB_TYPE.INTERVAL_BASED, Interval(seconds=0.1), max_repeats=job_max_repeats)
-        job.wait_sleep_time = job_sleep_time
         job.get_context = get_context
 
         scheduler = Scheduler(get_scheduler_config(), None)
         scheduler.lock = RLock()
-        scheduler.iter_cb = iter_cb
-        scheduler.iter_cb_args = (scheduler, datetime.utcnow() + timedelta(seconds=test_wait_time))
         scheduler.on_job_executed_cb = on_job_executed_cb
 
         scheduler.create(job, spawn=False)
+
+        stop_after(scheduler, test_wait_time)
         scheduler.run()
 
+        self.assertTrue(data['runs'])
         self.assertEquals(len(data['runs']), len(data['ctx']))
 
         for idx, item in enumerate(data['runs']):
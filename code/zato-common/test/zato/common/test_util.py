@@ -16,6 +16,9 @@ from uuid import uuid4
 # Bunch
 from bunch import Bunch
 
+# gevent
+from gevent.event import Event
+
 # lxml
 from lxml import etree
 
@@ -66,6 +69,22 @@ class UtilsTestCase(TestCase):
         self.assertEquals(util.uncamelify(original), expected1)
         self.assertEquals(util.uncamelify(original, '_', unicode.upper), expected2)
 
+    def test_ping_solr(self):
+        urls = []
+
+        class Session(object):
+            def get(self, url):
+                urls.append(url)
+                return Bunch(raise_for_status=self.raise_for_status)
+
+            def raise_for_status(self):
+                raise ValueError('503 Server Error')
+
+        config = Bunch(address='http://localhost:8983/solr/my-core', ping_path='/solr/admin/ping')
+
+        self.assertRaises(ValueError, util.ping_solr, config, Session())
+        self.assertEquals(urls, ['http://localhost:8983/solr/admin/ping'])
+
 # ################################################################################################################################
 
 class XPathTestCase(TestCase):
@@ -126,3 +145,84 @@ class TestUpdateBindPort(TestCase):
         self.assertEquals(config2.bind_port, 16254)
 
 # ################################################################################################################################
+
+class DispatchPoolTestCase(TestCase):
+
+    def test_spawn(self):
+        pool = util.DispatchPool(2)
+        event = Event()
+        out = []
+
+        def _callback(value):
+            event.wait()
+            out.append(value)
+
+        def _error():
+            raise ValueError()
+
+        # Spawning does not wait for callbacks to complete
+        pool.spawn(_callback, 1)
+        pool.spawn(_callback, 2)
+
+        stats = pool.get_stats()
+        self.assertEquals(out, [])
+        self.assertEquals(stats['in_use'], 2)
+        self.assertEquals(stats['saturated'], 0)
+
+        event.set()
+        pool.join()
+        self.assertEquals(sorted(out), [1, 2])
+
+        pool.spawn(_error)
+        pool.join()
+
+        stats = pool.get_stats()
+        self.assertEquals(stats['in_use'], 0)
+        self.assertEquals(stats['dispatched'], 3)
+        self.assertEquals(stats['failed'], 1)
+        self.assertEquals(stats['max_in_use'], 2)
+
+    def test_backpressure(self):
+        pool = util.DispatchPool(1)
+        event = Event()
+        out = []
+
+        pool.spawn(event.wait)
+
+        # The pool is full so the caller waits until the first greenlet completes
+        util.spawn(pool.spawn, out.append, 1)
+        util.gevent_sleep(0.01)
+
+        self.assertEquals(out, [])
+        self.assertEquals(pool.get_stats()['saturated'], 1)
+
+        event.set()
+        util.gevent_sleep(0.01)
+        pool.join()
+
+        self.assertEquals(out, [1])
+        self.assertEquals(pool.get_stats()['max_in_use'], 1)
+
+    def test_in_order(self):
+        pool = util.DispatchPool(10)
+        out = []
+
+        def edit(name):
+            util.gevent_sleep(0.05)
+            out.append(('edit', name))
+
+        def delete(name):
+            out.append(('delete', name))
+
+        # The slow EDIT is still applied before the DELETE of the same object whereas other objects are not held up
+        pool.spawn_in_order('sql', edit, 'a')
+        pool.spawn_in_order('sql', delete, 'a')
+        pool.spawn_in_order('email', delete, 'b')
+        pool.spawn_in_order(None, delete, 'c')
+        pool.join()
+
+        self.assertEquals(out, [('delete', 'b'), ('delete', 'c'), ('edit', 'a'), ('delete', 'a')])
+        self.assertEquals(pool.in_order, {})
+        self.assertEquals(pool.get_stats()['dispatched'], 4)
+
+# ################################################################################################################################
@@ -14,12 +14,18 @@ import os
 from datetime import datetime, timedelta
 from errno import ENOENT
 from hashlib import sha256
+from heapq import heapify, heappop, heappush
+from itertools import count
+from math import ceil
 from pwd import getpwuid
 from tempfile import gettempdir
 from threading import current_thread
+from traceback import format_exc
+from uuid import uuid4
 
 # gevent
 from gevent import sleep, spawn
+from gevent.event import Event
 
 # portalocket
 from portalocker import lock, LockException, LOCK_NB, LOCK_EX, unlock
@@ -28,6 +34,7 @@ from portalocker import lock, LockException, LOCK_NB, LOCK_EX, unlock
 from sqlalchemy import func
 
 # Zato
+from zato.common import KVDB
 from zato.common.util import make_repr
 
 # ################################################################################################################################
@@ -45,6 +52,7 @@ class DEFAULT:
     TTL = 60
     BLOCK = 10
     BLOCK_INTERVAL = 1
+    WAKE_UP_TTL = 10000 # In milliseconds, how long a notification of a lock's release waits for someone to pick it up
 
 class LOCK_TYPE:
     PERMANENT = 'permanent'
@@ -60,9 +68,10 @@ class LockTimeout(Exception):
 
 class LockInfo(object):
     __slots__ = ('lock', 'namespace', 'name', 'priv_id', 'pub_id', 'ttl', 'acquired', 'lock_type', 'block', 'block_interval',
-        'release')
+        'release', 'fencing_token')
 
-    def __init__(self, lock, namespace, name, priv_id, pub_id, ttl, acquired, lock_type, block, block_interval):
+    def __init__(self, lock, namespace, name, priv_id, pub_id, ttl, acquired, lock_type, block, block_interval,
+            fencing_token=None):
         self.lock = lock
         self.namespace = namespace
         self.name = name
@@ -74,6 +83,7 @@ class LockInfo(object):
         self.block = block
         self.block_interval = block_interval
         self.release = self.lock.release
+        self.fencing_token = fencing_token
 
     def __repr__(self):
         return make_repr(self)
@@ -83,13 +93,79 @@ class LockInfo(object):
 
 # ################################################################################################################################
 
+class ExpiryTimer(object):
+    """ Releases permanent locks once their TTLs are reached, all of them from a single greenlet which sleeps until
+    the earliest of the TTLs is due. Locks released before their TTLs are left in the heap until their time comes
+    or until there are enough of them for the heap to be rebuilt without them.
+    """
+    def __init__(self, compact_at=1024):
+        self.timers = [] # A heap of [expires_at, seq, lock] lists
+        self.seq = count()
+        self.changed = Event()
+        self.greenlet = None
+        self.min_compact_at = self.compact_at = compact_at
+
+    def add(self, lock, _utcnow=datetime.utcnow, _timedelta=timedelta):
+        """ Schedules a lock to be released after its TTL.
+        """
+        if len(self.timers) >= self.compact_at:
+            self.timers = [timer for timer in self.timers if not timer[2].released]
+            heapify(self.timers)
+            self.compact_at = max(self.min_compact_at, len(self.timers) * 2)
+
+        timer = [_utcnow() + _timedelta(seconds=lock.ttl), next(self.seq), lock]
+        heappush(self.timers, timer)
+
+        if not self.greenlet:
+            self.greenlet = spawn(self._run)
+
+        # Wake up the greenlet only if the new lock is to be released before any other
+        elif self.timers[0] is timer:
+            self.changed.set()
+
+    def _run(self, _utcnow=datetime.utcnow):
+        timers = self.timers
+
+        while True:
+            timeout = None
+
+            # Compaction may have replaced the heap in the meantime
+            if timers is not self.timers:
+                timers = self.timers
+
+            while timers:
+                expires_at, _, lock = timers[0]
+
+                if lock.released:
+                    heappop(timers)
+                    continue
+
+                now = _utcnow()
+                if expires_at > now:
+                    timeout = (expires_at - now).total_seconds()
+                    break
+
+                heappop(timers)
+
+                try:
+                    lock.release()
+                except Exception, e:
+                    logger.warn('Could not release lock `%s` `%s` after its TTL, e:`%s`', lock.namespace, lock.name,
+                        format_exc(e))
+
+            self.changed.clear()
+            self.changed.wait(timeout)
+
+# ################################################################################################################################
+
 class Lock(object):
     """ Base class for all backend-specific locks.
     """
-    def __init__(self, os_user_name, session, namespace, name, ttl, block, block_interval, _permanent=LOCK_TYPE.PERMANENT,
-            _transient=LOCK_TYPE.TRANSIENT):
+    def __init__(self, os_user_name, session, namespace, name, ttl, block, block_interval, manager=None,
+            _permanent=LOCK_TYPE.PERMANENT, _transient=LOCK_TYPE.TRANSIENT):
         self.os_user_name = os_user_name
         self.session = session() if session else None
+        self.manager = manager
         self.namespace = namespace
         self.name = name
         self.ttl = ttl
@@ -100,6 +176,7 @@ class Lock(object):
         self.released = False
         self.block = block
         self.block_interval = block_interval
+        self.fencing_token = None
 
     def _acquire_impl(self, *args, **kwargs):
         raise NotImplementedError('Must be implemented in subclasses')
@@ -122,7 +199,7 @@ class Lock(object):
             self._sustain()
 
         return LockInfo(self, self.namespace, self.name, self.priv_id, self.pub_id, self.ttl, self.acquired, self.lock_type,
-            self.block, self.block_interval)
+            self.block, self.block_interval, self.fencing_token)
 
     acquire = __enter__
 
@@ -161,30 +238,13 @@ class Lock(object):
 
         return acquired
 
-# ################################################################################################################################
-
-    def _wait_in_greenlet(self, _utcnow=datetime.utcnow, _timedelta=timedelta):
-        """ Sleeps until self.ttl is reached or until the lock is released and then releases the lock if it is still held.
-        """
-        now = _utcnow()
-        until = now + _timedelta(seconds=self.ttl)
-
-        while now < until:
-            if self.released:
-                break
-            now = _utcnow()
-            sleep(0.1)
-
-        if not self.released:
-            self.release()
-
 # ################################################################################################################################
 
     def _sustain(self):
-        """ Spawns a greenlet that will sustain the lock for at least self.ttl,
-        possibly less if self.__exit__ is called earlier.
+        """ Sustains the lock for at least self.ttl, possibly less if self.__exit__ is called earlier, after which
+        the lock manager's expiry timer releases it.
         """
-        spawn(self._wait_in_greenlet)
+        self.manager.expiry_timer.add(self)
 
 # ################################################################################################################################
 
@@ -271,6 +331,9 @@ user={}
             return True
 
     def release(self, _has_debug=has_debug):
+        if self.released:
+            return
+
         unlock(self.tmp_file)
         self.tmp_file.close()
 
@@ -283,27 +346,155 @@ user={}
             if e.errno != ENOENT:
                 raise
 
+        self.released = True
+
         if _has_debug:
             logger.debug('Unlocked `%s`', self.tmp_file)
 
 # ################################################################################################################################
 
+# KEYS[1] - lock's key
+# KEYS[2] - key of the counter fencing tokens are taken from
+# ARGV[1] - ID of the lock's owner
+# ARGV[2] - TTL in milliseconds, 0 = no TTL
+#
+# Returns {1, fencing token} if the lock was acquired or {0, PTTL of the lock} if it was not.
+lua_acquire = """
+    local acquired
+
+    if tonumber(ARGV[2]) > 0 then
+        acquired = redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2])
+    else
+        acquired = redis.call('set', KEYS[1], ARGV[1], 'NX')
+    end
+
+    if acquired then
+        return {1, redis.call('incr', KEYS[2])}
+    end
+
+    return {0, redis.call('pttl', KEYS[1])}
+"""
+
+# KEYS[1] - lock's key
+# KEYS[2] - list through which one of the lock's waiters is woken up
+# ARGV[1] - ID of the lock's owner
+# ARGV[2] - for how long in milliseconds the wake-up notification is kept if there are no waiters
+#
+# Returns 1 if the lock was released or 0 if it had expired or been taken over by someone else in the meantime.
+lua_release = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        redis.call('del', KEYS[1], KEYS[2])
+        redis.call('rpush', KEYS[2], '1')
+        redis.call('pexpire', KEYS[2], ARGV[2])
+        return 1
+    end
+
+    return 0
+"""
+
+class RedisLock(Lock):
+    """ Distributed locks based on Redis. Each acquired lock has a fencing token, always greater than any token given out
+    before. Instead of polling every block_interval, waiters block on a list that a release notifies exactly one of them
+    through, for no longer than until the lock's TTL runs out.
+    """
+    def __init__(self, *args, **kwargs):
+        super(RedisLock, self).__init__(*args, **kwargs)
+        self.key = '{}{}:{}'.format(KVDB.DISTLOCK_PREFIX, self.namespace, self.name)
+        self.wake_up_key = '{}{}:{}'.format(KVDB.DISTLOCK_WAKE_UP_PREFIX, self.namespace, self.name)
+        self.owner_id = uuid4().hex
+
+    def _acquire_impl(self):
+        is_acquired, value = self.manager.lua_acquire(
+            [self.key, KVDB.DISTLOCK_FENCING_TOKEN], [self.owner_id, int((self.ttl or 0) * 1000)])
+
+        if is_acquired:
+            self.fencing_token = value
+            return True, None
+
+        return False, value
+
+    def _acquire(self, _utcnow=datetime.utcnow, _timedelta=timedelta, _has_debug=has_debug):
+        acquired, pttl = self._acquire_impl()
+
+        if self.block and not acquired:
+
+            conn = self.manager.kvdb.conn
+            until = _utcnow() + _timedelta(seconds=self.block)
+
+            while True:
+                remaining = (until - _utcnow()).total_seconds()
+
+                if remaining <= 0:
+                    msg = 'Could not obtain lock for `{}` `{}` within {}s'.format(self.namespace, self.name, self.block)
+                    logger.warn(msg)
+                    raise LockTimeout(msg)
+
+                # -2 means the lock was released just now, -1 that it has no TTL
+                if pttl != -2:
+                    timeout = remaining if pttl == -1 else min(remaining, pttl / 1000.0)
+
+                    # BLPOP's timeouts are in whole seconds, with 0 meaning no timeout at all
+                    if timeout < 1:
+                        sleep(timeout)
+                    else:
+                        conn.blpop(self.wake_up_key, int(ceil(timeout)))
+
+                acquired, pttl = self._acquire_impl()
+                if acquired:
+                    break
+
+        if _has_debug:
+            logger.debug('Acquired status for %s (%s %s) is %s, fencing token:`%s`', self.priv_id, self.namespace, self.name,
+                acquired, self.fencing_token)
+
+        return acquired
+
+    def release(self, _has_debug=has_debug):
+        """ Releases the lock if it has not been released already assuming we managed to acquire the lock at all,
+        waking up one of its waiters, if there are any.
+        """
+        if self.acquired and not self.released:
+
+            self.manager.lua_release([self.key, self.wake_up_key], [self.owner_id, DEFAULT.WAKE_UP_TTL])
+            self.released = True
+
+            if _has_debug:
+                logger.debug('Released %s (%s %s)', self.priv_id, self.namespace, self.name)
+
+# ################################################################################################################################
+
 class LockManager(object):
-    """ A distributed lock manager based on SQL or, if only IPC is needed, on fcntl.
+    """ A distributed lock manager based on SQL or Redis or, if only IPC is needed, on fcntl.
     """
     _lock_impl = {
         'postgresql+pg8000': PostgresSQLLock,
         'oracle': OracleLock,
         'mysql+pymysql': MySQLLock,
         'fcntl': FCNTLLock,
+        'redis': RedisLock,
         }
 
-    def __init__(self, backend_type, default_namespace, session=None):
+    def __init__(self, backend_type, default_namespace, session=None, kvdb=None):
         self.backend_type = backend_type
         self.default_namespace = default_namespace
         self.session = session
+        self.kvdb = kvdb
         self._lock_class = self._lock_impl[backend_type]
         self.user_name = getpwuid(os.getuid()).pw_name
+        self.expiry_timer = ExpiryTimer()
+        self._lua_acquire = None
+        self._lua_release = None
+
+    def lua_acquire(self, keys, args):
+        # KVDB connects only after the manager is created
+        if not self._lua_acquire:
+            self._lua_acquire = self.kvdb.conn.register_script(lua_acquire)
+        return self._lua_acquire(keys, args)
+
+    def lua_release(self, keys, args):
+        if not self._lua_release:
+            self._lua_release = self.kvdb.conn.register_script(lua_release)
+        return self._lua_release(keys, args)
 
     def __call__(self, name, namespace='', ttl=DEFAULT.TTL, block=DEFAULT.BLOCK, block_interval=DEFAULT.BLOCK_INTERVAL,
             max_len_ns=MAX.LEN_NS, max_len_name=MAX.LEN_NAME):
@@ -319,7 +510,7 @@ class LockManager(object):
             raise ValueError(msg)
 
         return self._lock_class(
-            self.user_name, self.session, namespace or self.default_namespace, name, ttl, block, block_interval)
+            self.user_name, self.session, namespace or self.default_namespace, name, ttl, block, block_interval, self)
 
     def acquire(self, *args, **kwargs):
         return self(*args, **kwargs).acquire()
@@ -10,7 +10,10 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from unittest import TestCase
 
 # gevent
-from gevent import sleep
+from gevent import sleep, spawn
+
+# Redis
+from redis import StrictRedis
 
 # Zato
 from zato.common.test import rand_int, rand_string
@@ -24,6 +27,9 @@ class _Base(TestCase):
     backend_type = None
     is_set_up = False
 
+    def get_lock_manager(self, default_ns):
+        return LockManager(self.backend_type, default_ns)
+
 # ################################################################################################################################
 
     def test_lock_info_name_no_namespace(self):
@@ -33,7 +39,7 @@ class _Base(TestCase):
 
         name = rand_string()
         default_ns = rand_string()
-        lock_manager = LockManager(self.backend_type, default_ns)
+        lock_manager = self.get_lock_manager(default_ns)
 
         with lock_manager(name) as lock_info:
             self.assertEquals(lock_info.namespace, default_ns)
@@ -54,7 +60,7 @@ class _Base(TestCase):
         name = rand_string()
         default_ns = rand_string()
         ns = rand_string(7)
-        lock_manager = LockManager(self.backend_type, default_ns)
+        lock_manager = self.get_lock_manager(default_ns)
 
         with lock_manager(name, ns) as lock_info:
             self.assertEquals(lock_info.namespace, ns)
@@ -78,7 +84,7 @@ class _Base(TestCase):
         ttl = rand_int()
         block = rand_int()
         block_interval = rand_int()
-        lock_manager = LockManager(self.backend_type, default_ns)
+        lock_manager = self.get_lock_manager(default_ns)
 
         with lock_manager(name, ns, ttl, block, block_interval) as lock_info:
             self.assertEquals(lock_info.namespace, ns)
@@ -99,7 +105,7 @@ class _Base(TestCase):
         name = rand_string()
         default_ns = rand_string()
 
-        lock_manager = LockManager(self.backend_type, default_ns)
+        lock_manager = self.get_lock_manager(default_ns)
 
         lock1 = lock_manager.acquire(name, ttl=1)
         self.assertEquals(lock1.acquired, True)
@@ -123,7 +129,7 @@ class _Base(TestCase):
         name = rand_string()
         default_ns = rand_string()
 
-        lock_manager = LockManager(self.backend_type, default_ns)
+        lock_manager = self.get_lock_manager(default_ns)
 
         lock1 = lock_manager.acquire(name, ttl=10)
         self.assertEquals(lock1.acquired, True)
@@ -148,7 +154,7 @@ class _Base(TestCase):
         name = rand_string()
         default_ns = rand_string()
 
-        lock_manager = LockManager(self.backend_type, default_ns)
+        lock_manager = self.get_lock_manager(default_ns)
 
         lock1 = lock_manager.acquire(name, ttl=2)
         self.assertEquals(lock1.acquired, True)
@@ -162,6 +168,32 @@ class _Base(TestCase):
         else:
             self.fail('Expected a LockTimeout here')
 
+# ################################################################################################################################
+
+    def test_expiry_timer(self):
+
+        if not self.is_set_up:
+            return
+
+        lock_manager = self.get_lock_manager(rand_string())
+
+        # The one released earlier expires first even though it was acquired last
+        lock1 = lock_manager.acquire(rand_string(), ttl=10)
+        lock2 = lock_manager.acquire(rand_string(), ttl=0.2)
+        lock3 = lock_manager.acquire(rand_string(), ttl=0.1)
+
+        sleep(0.5)
+
+        self.assertFalse(lock1.lock.released)
+        self.assertTrue(lock2.lock.released)
+        self.assertTrue(lock3.lock.released)
+
+        lock1.release()
+
+        # All of them were released from the same greenlet
+        self.assertEquals(len(lock_manager.expiry_timer.timers), 1)
+        self.assertTrue(lock_manager.expiry_timer.greenlet)
+
 # ################################################################################################################################
 
 class FCNTLLockTestCase(_Base):
@@ -187,3 +219,60 @@ class PostgresSQLLockTestCase(_Base):
         self.is_set_up = False
 
 # ################################################################################################################################
+
+class _KVDB(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+class RedisLockTestCase(_Base):
+    backend_type = 'redis'
+
+    def setUp(self):
+        self.conn = StrictRedis(socket_timeout=5)
+
+        try:
+            self.conn.ping()
+        except Exception:
+            self.is_set_up = False
+        else:
+            self.is_set_up = True
+
+    def get_lock_manager(self, default_ns):
+        return LockManager(self.backend_type, default_ns, kvdb=_KVDB(self.conn))
+
+    def test_fencing_token(self):
+
+        if not self.is_set_up:
+            return
+
+        name = rand_string()
+        lock_manager = self.get_lock_manager(rand_string())
+
+        with lock_manager(name) as lock1:
+            pass
+
+        with lock_manager(name) as lock2:
+            pass
+
+        self.assertTrue(lock2.fencing_token > lock1.fencing_token)
+
+    def test_wake_up_on_release(self):
+
+        if not self.is_set_up:
+            return
+
+        name = rand_string()
+        lock_manager = self.get_lock_manager(rand_string())
+        lock1 = lock_manager.acquire(name, ttl=30)
+
+        # The waiter is woken up by the release rather than by its TTL or block running out
+        waiter = spawn(lock_manager.acquire, name, block=20)
+        sleep(0.2)
+        lock1.release()
+
+        lock2 = waiter.get(timeout=2)
+        self.assertEquals(lock2.acquired, True)
+        self.assertTrue(lock2.fencing_token > lock1.fencing_token)
+        lock2.release()
+
+# ################################################################################################################################
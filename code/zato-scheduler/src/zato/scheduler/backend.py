@@ -10,6 +10,8 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import datetime
+from heapq import heappop, heappush
+from itertools import count
 from logging import getLogger, DEBUG
 from traceback import format_exc
 
@@ -17,8 +19,8 @@ from traceback import format_exc
 from dateutil.rrule import rrule, SECONDLY
 
 # gevent
-import gevent # Imported directly so it can be mocked out in tests
 from gevent import lock
+from gevent.event import Event
 
 # paodate
 from paodate import Delta
@@ -81,10 +83,6 @@ class Job(object):
         else:
             self.start_time = self.get_start_time(start_time if start_time is not None else datetime.datetime.utcnow())
 
-        self.wait_sleep_time = 1
-        self.wait_iter_cb = None
-        self.wait_iter_cb_args = ()
-
         # TODO: Add skip_days, skip_hours and skip_dates
 
     def __str__(self):
@@ -198,87 +196,53 @@ class Job(object):
         else:
             raise ValueError('Unsupported job type `{}` ({})'.format(self.type, self.name))
 
-    def _spawn(self, *args, **kwargs):
-        """ A thin wrapper so that it is easier to mock this method out in unit-tests.
+    def get_next_run_time(self, run_time, now):
+        """ Returns the time the job should run at after the run planned for run_time, or None if it should not run anymore.
+        Runs of interval-based jobs are always a multiple of the interval apart so that they do not drift, and any runs missed
+        in the meantime, e.g. because the scheduler was busy, are skipped rather than all taking place at once.
         """
-        return spawn_greenlet(*args, **kwargs)
-
-    def main_loop(self):
-
-        if logger.isEnabledFor(DEBUG):
-            logger.debug('Job entering main loop `%s`', self)
-
-        _sleep = gevent.sleep
-
-        try:
-            while self.keep_running:
-                try:
-                    self.current_run += 1
-
-                    # Perhaps we've already been executed enough times
-                    if self.max_repeats and self.current_run == self.max_repeats:
-                        self.keep_running = False
-                        self.max_repeats_reached = True
-                        self.max_repeats_reached_at = datetime.datetime.utcnow()
+        if self.type == SCHEDULER.JOB_TYPE.ONE_TIME or not self.keep_running:
+            return
 
-                        if self.on_max_repeats_reached_cb:
-                            self.on_max_repeats_reached_cb(self)
+        if self.type == SCHEDULER.JOB_TYPE.INTERVAL_BASED:
+            interval = datetime.timedelta(seconds=self.interval.in_seconds)
+            next_run_time = run_time + interval
 
-                    # Invoke callback in a new greenlet so it doesn't block the current one.
-                    self._spawn(self.callback, **{'ctx':self.get_context()})
+            if next_run_time <= now:
+                next_run_time += interval * (int((now - next_run_time).total_seconds() // self.interval.in_seconds) + 1)
 
-                except Exception, e:
-                    logger.warn(format_exc(e))
+            return next_run_time
 
-                finally:
-                    # Pause the greenlet for however long is needed if it is not a one-off job
-                    if self.type == SCHEDULER.JOB_TYPE.ONE_TIME:
-                        return True
-                    else:
-                        _sleep(self.get_sleep_time(datetime.datetime.utcnow()))
+        # Cron-style jobs run at points in time given by their definitions so they cannot drift
+        return now + datetime.timedelta(seconds=self.get_sleep_time(now))
 
-            if logger.isEnabledFor(DEBUG):
-                logger.debug('Job leaving main loop `%s` after %d iterations', self, self.current_run)
-
-        except Exception, e:
-            logger.warn(format_exc(e))
-
-        return True
+    def _spawn(self, *args, **kwargs):
+        """ A thin wrapper so that it is easier to mock this method out in unit-tests.
+        """
+        return spawn_greenlet(*args, **kwargs)
 
     def run(self):
+        """ Invokes the job's callback once, in a new greenlet so that it doesn't block the scheduler.
+        """
+        self.current_run += 1
 
-        # OK, we're ready
-        try:
-
-            if not self.start_time:
-                logger.warn('Job `%s` cannot start without start_time set', self.name)
-                return
-
-            if logger.isEnabledFor(DEBUG):
-                logger.debug('Job starting `%s`', self)
-
-            _utcnow = datetime.datetime.utcnow
-            _sleep = gevent.sleep
-
-            # If the job has a start time in the future, sleep until it's ready to go.
-            now = _utcnow()
-
-            while self.start_time > now:
-                _sleep(self.wait_sleep_time)
-
-                if self.wait_iter_cb:
-                    self.wait_iter_cb(self.start_time, now, *self.wait_iter_cb_args)
+        # Perhaps we've already been executed enough times
+        if self.max_repeats and self.current_run == self.max_repeats:
+            self.keep_running = False
+            self.max_repeats_reached = True
+            self.max_repeats_reached_at = datetime.datetime.utcnow()
 
-                now = _utcnow()
+            if self.on_max_repeats_reached_cb:
+                self.on_max_repeats_reached_cb(self)
 
-            self.main_loop()
-
-        except Exception, e:
-            logger.warn(format_exc(e))
+        self._spawn(self.callback, **{'ctx':self.get_context()})
 
 # ################################################################################################################################
 
 class Scheduler(object):
+    """ Runs all the jobs from a single greenlet. Each active job has a timer in a heap ordered by the time the job
+    should run at next and the greenlet sleeps until the earliest of the timers is due or a new one is added before it.
+    """
     def __init__(self, config, api):
         self.config = config
         self.api = api
@@ -286,12 +250,13 @@ class Scheduler(object):
         self.startup_jobs = config.startup_jobs
         self.odb = config.odb
         self.jobs = set()
-        self.job_greenlets = {}
+        self.job_by_name = {}
+        self.timers = []     # A heap of [run_time, seq, job] lists, job is None if the timer was cancelled
+        self.job_timers = {} # Job name -> its timer in self.timers
+        self.timer_seq = count() # Keeps jobs planned for the same time in the order they were added in
+        self.timers_changed = Event()
         self.keep_running = True
         self.lock = lock.RLock()
-        self.sleep_time = 0.1
-        self.iter_cb = None
-        self.iter_cb_args = ()
         self.ready = False
         self._add_startup_jobs = config._add_startup_jobs
         self._add_scheduler_jobs = config._add_scheduler_jobs
@@ -307,6 +272,7 @@ class Scheduler(object):
         """
         try:
             self.jobs.add(job)
+            self.job_by_name.setdefault(job.name, job)
 
             if job.is_active:
                 if spawn:
@@ -334,6 +300,26 @@ class Scheduler(object):
             self.unschedule(job)
             self.create(job.clone(), True)
 
+    def _add_timer(self, job, run_time):
+        """ Plans for a job to run at run_time. Must be called with self.lock held.
+        """
+        timer = [run_time, next(self.timer_seq), job]
+        self.job_timers[job.name] = timer
+        heappush(self.timers, timer)
+
+        # Wake up the dispatcher only if it has to run the job before any other
+        if self.timers[0] is timer:
+            self.timers_changed.set()
+
+    def _cancel_timer(self, name):
+        """ Cancels a job's timer, if it has one, which is left in the heap until its time comes. Must be called
+        with self.lock held.
+        """
+        timer = self.job_timers.pop(name, None)
+        if timer:
+            timer[2] = None
+            return True
+
     def _unschedule(self, job):
         """ Actually unschedules a job. Must be called with self.lock held.
         """
@@ -342,11 +328,10 @@ class Scheduler(object):
 
         if job in self.jobs:
             self.jobs.remove(job)
+            self.job_by_name.pop(job.name, None)
             found = True
 
-        if job.name in self.job_greenlets:
-            self.job_greenlets[job.name].kill(block=False, timeout=2.0)
-            del self.job_greenlets[job.name]
+        if self._cancel_timer(job.name):
             found = True
 
         return found
@@ -371,17 +356,10 @@ class Scheduler(object):
     def unschedule_by_name(self, name):
         """ Deletes a job by its name.
         """
-        _job = None
-
         with self.lock:
-            for job in self.jobs:
-                if job.name == name:
-                    _job = job
-                    break
-
-        # We can't do it with self.lock because deleting changes the set = RuntimeError
-        if _job:
-            self.unschedule(job)
+            job = self.job_by_name.get(name)
+            if job:
+                self._unschedule_stop(job, 'unscheduled')
 
     def stop_job(self, job):
         """ Stops a job by deleting it.
@@ -397,19 +375,16 @@ class Scheduler(object):
             for job in jobs:
                 self._unschedule_stop(job.clone(), 'stopped')
 
-    def sleep(self, value):
-        """ A method introduced so the class is easier to mock out in tests.
-        """
-        gevent.sleep(value)
+            self.keep_running = False
+            self.timers_changed.set()
 
     def execute(self, name):
         """ Executes a job no matter if it's active or not. One-time job are not unscheduled afterwards.
         """
         with self.lock:
-            for job in self.jobs:
-                if job.name == name:
-                    self.on_job_executed(job.get_context(), False)
-                    break
+            job = self.job_by_name.get(name)
+            if job:
+                self.on_job_executed(job.get_context(), False)
             else:
                 logger.warn('No such job `%s` in `%s`', name, [elem.get_context() for elem in self.jobs])
 
@@ -421,17 +396,76 @@ class Scheduler(object):
         if ctx['type'] == SCHEDULER.JOB_TYPE.ONE_TIME and unschedule_one_time:
             self.unschedule_by_name(ctx['name'])
 
-    def _spawn(self, *args, **kwargs):
-        """ As in the Job class, this is a thin wrapper so that it is easier to mock this method out in unit-tests.
-        """
-        return spawn_greenlet(*args, **kwargs)
-
     def spawn_job(self, job):
-        """ Spawns a job's greenlet. Must be called with self.lock held.
+        """ Plans the first run of a job. Must be called with self.lock held.
         """
         job.callback = self.on_job_executed
         job.on_max_repeats_reached_cb = self.on_max_repeats_reached
-        self.job_greenlets[job.name] = self._spawn(job.run)
+
+        if not job.start_time:
+            logger.warn('Job `%s` cannot start without start_time set', job.name)
+            return
+
+        self._cancel_timer(job.name)
+        self._add_timer(job, job.start_time)
+
+    def run_job(self, job, run_time, now):
+        """ Runs a job whose time has come and plans its next run, if there is to be any. Must be called with self.lock held.
+        """
+        try:
+            job.run()
+        except Exception, e:
+            logger.warn(format_exc(e))
+
+        # An error here affects this job only - it will not run again until it is edited but all the other ones will
+        try:
+            next_run_time = job.get_next_run_time(run_time, now)
+            if next_run_time:
+                self._add_timer(job, next_run_time)
+                return
+        except Exception, e:
+            logger.warn('Could not plan the next run of job `%s`, e:`%s`', job.name, format_exc(e))
+
+        self.job_timers.pop(job.name, None)
+
+    def dispatch(self):
+        """ Runs jobs as their times come, until the scheduler is stopped.
+        """
+        _utcnow = datetime.datetime.utcnow
+        timers = self.timers
+
+        while self.keep_running:
+
+            try:
+                with self.lock:
+                    now = _utcnow()
+                    timeout = None
+
+                    while timers:
+                        run_time, _, job = timers[0]
+
+                        # Cancelled in the meantime
+                        if not job:
+                            heappop(timers)
+                            continue
+
+                        if run_time > now:
+                            timeout = (run_time - now).total_seconds()
+                            break
+
+                        heappop(timers)
+                        self.run_job(job, run_time, now)
+
+                    # Any timer added from now on will set it again
+                    self.timers_changed.clear()
+
+            except Exception, e:
+                logger.error('Error in scheduler dispatcher, e:`%s`', format_exc(e))
+
+                # Try again in a moment, the dispatcher must keep running for the sake of all the other jobs
+                timeout = 1
+
+            self.timers_changed.wait(timeout)
 
     def run(self):
 
@@ -446,9 +480,6 @@ class Scheduler(object):
             if self._add_scheduler_jobs:
                 add_scheduler_jobs(self.api, self.odb, self.config.main.cluster.id, spawn=False)
 
-            _sleep = self.sleep
-            _sleep_time = self.sleep_time
-
             with self.lock:
                 for job in sorted(self.jobs):
                     if job.max_repeats_reached:
@@ -461,11 +492,7 @@ class Scheduler(object):
 
             logger.info('Scheduler started')
 
-            while self.keep_running:
-                _sleep(_sleep_time)
-
-                if self.iter_cb:
-                    self.iter_cb(*self.iter_cb_args)
+            self.dispatch()
 
         except Exception, e:
             logger.warn(format_exc(e))
@@ -14,6 +14,7 @@ from datetime import datetime
 from logging import INFO
 from re import IGNORECASE
 from tempfile import mkstemp
+from traceback import format_exc
 from uuid import uuid4
 
 # anyjson
@@ -36,15 +37,15 @@ from springpython.context import DisposableObject
 from zato.broker import BrokerMessageReceiver
 from zato.broker.client import BrokerClient
 from zato.bunch import Bunch
-from zato.common import KVDB, SERVER_UP_STATUS, ZATO_ODB_POOL_NAME
+from zato.common import BROKER, CONFIG_SNAPSHOT, KVDB, SERVER_UP_STATUS, ZATO_ODB_POOL_NAME
 from zato.common.broker_message import HOT_DEPLOY, MESSAGE_TYPE, TOPICS
 from zato.common.ipc.api import IPCAPI
 from zato.common.time_util import TimeUtil
 from zato.common.util import absolutize, get_config, get_kvdb_config_for_log, get_user_config_name, hot_deploy, \
-     invoke_startup_services as _invoke_startup_services, spawn_greenlet, StaticConfig, register_diag_handlers
+     invoke_startup_services as _invoke_startup_services, PhaseTimer, spawn_greenlet, StaticConfig, register_diag_handlers
 from zato.distlock import LockManager
 from zato.server.base.worker import WorkerStore
-from zato.server.config import ConfigStore
+from zato.server.config import ConfigSnapshot, ConfigStore
 from zato.server.connection.server import Servers
 from zato.server.base.parallel.config import ConfigLoader
 from zato.server.base.parallel.http import HTTPHandler
@@ -55,8 +56,6 @@ from zato.server.pickup import PickupManager
 logger = logging.getLogger(__name__)
 kvdb_logger = logging.getLogger('zato_kvdb')
 
-megabyte = 10**6
-
 # ################################################################################################################################
 
 class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTPHandler):
@@ -104,6 +103,7 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
         self.delivery_store = None
         self.static_config = None
         self.component_enabled = Bunch()
+        self.stats_collector = None
         self.client_address_headers = ['HTTP_X_ZATO_FORWARDED_FOR', 'HTTP_X_FORWARDED_FOR', 'REMOTE_ADDR']
         self.broker_client = None
         self.time_util = None
@@ -111,11 +111,12 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
         self.crypto_use_tls = None
         self.servers = None
         self.zato_lock_manager = None
+        self.config_snapshot = None
+        self.startup_timer = PhaseTimer()
         self.pid = None
         self.sync_internal = None
         self.ipc_api = IPCAPI(False)
         self.ipc_forwarder = IPCAPI(True)
-        self.fifo_response_buffer_size = 0.1 # In megabytes
 
         # Allows users store arbitrary data across service invocations
         self.user_ctx = Bunch()
@@ -185,14 +186,17 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
             # (re-)deploy the services from a clear state
             locally_deployed = []
 
-            locally_deployed.extend(self.service_store.import_internal_services(
-                self.internal_service_modules, self.base_dir, self.sync_internal, is_first))
+            with self.startup_timer('internal_services'):
+                locally_deployed.extend(self.service_store.import_internal_services(
+                    self.internal_service_modules, self.base_dir, self.sync_internal, is_first))
 
-            locally_deployed.extend(self.service_store.import_services_from_anywhere(
-                self.service_modules + self.service_sources, self.base_dir))
+            with self.startup_timer('user_services'):
+                locally_deployed.extend(self.service_store.import_services_from_anywhere(
+                    self.service_modules + self.service_sources, self.base_dir))
 
             # Migrations
-            self.odb.add_channels_2_0()
+            with self.startup_timer('migrations'):
+                self.odb.add_channels_2_0()
 
             return set(locally_deployed)
 
@@ -221,11 +225,24 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
                 logger.debug('Got lock_name:`%s`, ttl:`%s`', lock_name, self.deployment_lock_expires)
 
                 # .. Remove all the deployed services from the DB ..
-                self.odb.drop_deployed_services(server.id)
+                with self.startup_timer('drop_deployed_services'):
+                    self.odb.drop_deployed_services(server.id)
 
-                # .. deploy them back including any missing ones found on other servers.
+                # .. deploy them back including any missing ones found on other servers ..
                 locally_deployed = import_initial_services_jobs(is_first)
 
+                # .. read configuration from ODB on behalf of all the workers ..
+                if self.config_snapshot:
+                    with self.startup_timer('config_snapshot_save'):
+                        try:
+                            self.config_snapshot.save(self.get_odb_config(server.cluster.id))
+                        except Exception, e:
+                            logger.warn('Could not save config snapshot `%s`, e:`%s`', self.config_snapshot.path, format_exc(e))
+                        else:
+                            # No worker will use the snapshot once it is older than max_age so there is no reason
+                            # to keep the credentials it contains on disk any longer than that.
+                            gevent.spawn_later(self.config_snapshot.max_age, self._delete_config_snapshot)
+
                 # Add the flag to Redis indicating that this server has already
                 # deployed its services. Note that by default the expiration
                 # time is more than a century in the future. It will be cleared out
@@ -266,13 +283,15 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
         self.kvdb.config = self.fs_server_config.kvdb
         self.kvdb.server = self
         self.kvdb.decrypt_func = self.crypto_manager.decrypt
-        self.kvdb.init()
 
-        kvdb_logger.info('Worker config `%s`', kvdb_config)
+        with self.startup_timer('kvdb'):
+            self.kvdb.init()
 
-        # Lua programs, both internal and user defined ones.
-        for name, program in self.get_lua_programs():
-            self.kvdb.lua_container.add_lua_program(name, program)
+            kvdb_logger.info('Worker config `%s`', kvdb_config)
+
+            # Lua programs, both internal and user defined ones.
+            for name, program in self.get_lua_programs():
+                self.kvdb.lua_container.add_lua_program(name, program)
 
         # TimeUtil needs self.kvdb so it can be set now
         self.time_util = TimeUtil(self.kvdb)
@@ -293,9 +312,6 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
 
             self.user_config[get_user_config_name(file_name)] = conf
 
-        # Convert size of FIFO response buffers to megabytes
-        self.fifo_response_buffer_size = int(float(self.fs_server_config.misc.fifo_response_buffer_size) * megabyte)
-
         is_first, locally_deployed = self.maybe_on_first_worker(server, self.kvdb.conn)
 
         return is_first, locally_deployed
@@ -330,25 +346,39 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
 
         register_diag_handlers()
 
-        # Store the ODB configuration, create an ODB connection pool and have self.odb use it
-        self.config.odb_data = self.get_config_odb_data(self)
-        self.set_odb_pool()
+        with self.startup_timer('odb'):
 
-        # Now try grabbing the basic server's data from the ODB. No point
-        # in doing anything else if we can't get past this point.
-        server = self.odb.fetch_server(self.config.odb_data)
+            # Store the ODB configuration, create an ODB connection pool and have self.odb use it
+            self.config.odb_data = self.get_config_odb_data(self)
+            self.set_odb_pool()
+
+            # Now try grabbing the basic server's data from the ODB. No point
+            # in doing anything else if we can't get past this point.
+            server = self.odb.fetch_server(self.config.odb_data)
 
         if not server:
             raise Exception('Server does not exist in the ODB')
 
         # Set up the server-wide default lock manager
-        odb_data = self.config.odb_data
-        backend_type = 'fcntl' if odb_data.engine == 'sqlite' else odb_data.engine
-        self.zato_lock_manager = LockManager(backend_type, 'zato', self.odb.session)
+        if self.fs_server_config.misc.get('distlock_backend', 'odb') == 'kvdb':
+
+            # KVDB is not connected to yet so, unlike with ODB, there is no way to check the lock manager at this point
+            self.zato_lock_manager = LockManager('redis', 'zato', kvdb=self.kvdb)
+
+        else:
+            odb_data = self.config.odb_data
+            backend_type = 'fcntl' if odb_data.engine == 'sqlite' else odb_data.engine
+            self.zato_lock_manager = LockManager(backend_type, 'zato', self.odb.session)
 
-        # Just to make sure distributed locking is configured correctly
-        with self.zato_lock_manager(uuid4().hex):
-            pass
+            # Just to make sure distributed locking is configured correctly
+            with self.zato_lock_manager(uuid4().hex):
+                pass
+
+        # Configuration read from ODB at startup is shared by all the workers through a snapshot
+        if asbool(self.fs_server_config.misc.get('startup_config_snapshot', False)):
+            work_dir = os.path.normpath(os.path.join(self.repo_location, self.fs_server_config.hot_deploy.work_dir))
+            self.config_snapshot = ConfigSnapshot(os.path.join(work_dir, CONFIG_SNAPSHOT.FILE_NAME), self.deployment_key,
+                float(self.fs_server_config.misc.get('startup_config_snapshot_max_age', CONFIG_SNAPSHOT.DEFAULT_MAX_AGE)))
 
         # Basic metadata
         self.id = server.id
@@ -372,8 +402,15 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
             TOPICS[MESSAGE_TYPE.TO_PARALLEL_ALL]: self.worker_store.on_broker_msg,
         }
 
-        self.broker_client = BrokerClient(self.kvdb, 'parallel', broker_callbacks, self.get_lua_programs())
-        self.worker_store.set_broker_client(self.broker_client)
+        misc_config = self.fs_server_config.misc
+        dispatch_pool_size = int(misc_config.get('broker_dispatch_pool_size', BROKER.DEFAULT_DISPATCH_POOL_SIZE))
+        async_mode = misc_config.get('broker_async_mode', BROKER.DEFAULT_ASYNC_MODE)
+        queue_batch_size = int(misc_config.get('broker_queue_batch_size', BROKER.DEFAULT_QUEUE_BATCH_SIZE))
+
+        with self.startup_timer('broker_client'):
+            self.broker_client = BrokerClient(self.kvdb, 'parallel', broker_callbacks, self.get_lua_programs(),
+                dispatch_pool_size, async_mode, queue_batch_size)
+            self.worker_store.set_broker_client(self.broker_client)
 
         self.odb.server_up_down(server.token, SERVER_UP_STATUS.RUNNING, True, self.host,
             self.port, self.preferred_address, use_tls)
@@ -387,10 +424,14 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
         self.hot_deploy_config.backup_history = int(self.fs_server_config.hot_deploy.backup_history)
         self.hot_deploy_config.backup_format = self.fs_server_config.hot_deploy.backup_format
 
-        for name in('current_work_dir', 'backup_work_dir', 'last_backup_work_dir', 'delete_after_pick_up'):
+        for name in('current_work_dir', 'backup_work_dir', 'last_backup_work_dir', 'delete_after_pick_up', 'incremental'):
+
+            # Unchanged modules and services are not deployed again
+            if name == 'incremental':
+                self.hot_deploy_config[name] = asbool(self.fs_server_config.hot_deploy.get(name, False))
 
             # New in 2.0
-            if name == 'delete_after_pick_up':
+            elif name == 'delete_after_pick_up':
                 value = asbool(self.fs_server_config.hot_deploy.get(name, True))
                 self.hot_deploy_config[name] = value
             else:
@@ -415,6 +456,8 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
         spawn_greenlet(self.ipc_api.run)
 
         logger.info('Started `%s@%s` (pid: %s)', server.name, server.cluster.name, self.pid)
+        logger.info('Startup phases of `%s@%s` (pid: %s): %s', server.name, server.cluster.name, self.pid,
+            self.startup_timer.get_summary())
 
 # ################################################################################################################################
 
@@ -489,7 +532,7 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
     def invoke_by_pid(self, service, request, target_pid, *args, **kwargs):
         """ Invokes a service in a worker process by the latter's PID.
         """
-        self.ipc_api.publish(request)
+        return self.ipc_api.invoke_by_pid(service, request, target_pid, *args, **kwargs)
 
 # ################################################################################################################################
 
@@ -503,7 +546,7 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
             # We need it only in the other branch, not here.
             kwargs.pop('data_format', None)
 
-            return self.ipc_api.invoke_by_pid(service, request, target_pid, self.fifo_response_buffer_size, *args, **kwargs)
+            return self.ipc_api.invoke_by_pid(service, request, target_pid, *args, **kwargs)
         else:
             return self.worker_store.invoke(service, request, data_format=kwargs.pop('data_format'), *args, **kwargs)
 
@@ -522,6 +565,42 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver, ConfigLoader, HTTP
         """
         ParallelServer.start_server(worker.app.zato_wsgi_app, arbiter.zato_deployment_key)
 
+    @staticmethod
+    def worker_exit(arbiter, worker):
+        """ A Gunicorn hook which cleans up after a worker, in the worker's own process, once it stops.
+        """
+        worker.app.zato_wsgi_app.cleanup_worker()
+
+    def _delete_config_snapshot(self):
+        """ Deletes the config snapshot after all the workers have had a chance to read it.
+        """
+        try:
+            self.config_snapshot.delete()
+        except Exception, e:
+            logger.warn('Could not delete config snapshot `%s`, e:`%s`', self.config_snapshot.path, format_exc(e))
+
+    def cleanup_worker(self):
+        """ Writes out everything a worker keeps in memory only, e.g. statistics of services not flushed to KVDB yet.
+        """
+        if self.stats_collector:
+            try:
+                self.stats_collector.stop()
+            except Exception, e:
+                logger.warn('Could not flush service statistics on shutdown, e:`%s`', format_exc(e))
+
+        if self.worker_store.cache:
+            try:
+                self.worker_store.cache.stop()
+            except Exception, e:
+                logger.warn('Could not flush cache entries to ODB on shutdown, e:`%s`', format_exc(e))
+
+        audit_buffer = self.worker_store.request_dispatcher.url_data.audit_buffer
+        if audit_buffer:
+            try:
+                audit_buffer.stop()
+            except Exception, e:
+                logger.warn('Could not store HTTP audit log on shutdown, e:`%s`', format_exc(e))
+
 # ################################################################################################################################
 
     @staticmethod
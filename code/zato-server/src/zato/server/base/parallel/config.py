@@ -11,15 +11,19 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 # stdlib
 import os
 
+# gevent
+from gevent import spawn
+
 # Paste
 from paste.util.converters import asbool
 
 # Zato
 from zato.bunch import Bunch
-from zato.common import MISC
+from zato.common import MISC, SERVICE_STATS
 from zato.common.pubsub import PubSubAPI, RedisPubSub
 from zato.server.config import ConfigDict
 from zato.server.connection.http_soap.url_data import Matcher
+from zato.server.stats import StatsCollector
 
 # ################################################################################################################################
 
@@ -35,6 +39,14 @@ class ConfigLoader(object):
         self.component_enabled.stats = asbool(self.fs_server_config.component_enabled.stats)
         self.component_enabled.slow_response = asbool(self.fs_server_config.component_enabled.slow_response)
 
+        # Service statistics are either stored in KVDB by each invocation or accumulated in memory and flushed periodically
+        stats_config = self.fs_server_config.get('stats', {})
+        if self.component_enabled.stats and \
+           stats_config.get('collector', SERVICE_STATS.DEFAULT_COLLECTOR) == SERVICE_STATS.COLLECTOR.BATCHED:
+            self.stats_collector = StatsCollector(
+                self.kvdb.conn, float(stats_config.get('flush_interval', SERVICE_STATS.DEFAULT_FLUSH_INTERVAL)))
+            spawn(self.stats_collector.run)
+
         # Pub/sub
         self.pubsub = PubSubAPI(RedisPubSub(self.kvdb.conn))
 
@@ -42,15 +54,62 @@ class ConfigLoader(object):
         # the server's configuration from.
         self.config.repo_location = self.repo_location
 
+        # Configuration from ODB, read by the server's first worker and shared with the other ones through a snapshot,
+        # unless there is no snapshot to read it from.
+        with self.startup_timer('odb_config'):
+            odb_config = self.config_snapshot.load() if self.config_snapshot else None
+            if odb_config is None:
+                odb_config = self.get_odb_config(server.cluster.id)
+
+        for name, value in odb_config.items():
+            setattr(self.config, name, value)
+
+        for item in self.config.http_soap:
+            item.match_target_compiled = Matcher(item.match_target)
+
+        # SimpleIO
+        self.config.simple_io = ConfigDict('simple_io', Bunch())
+        self.config.simple_io['int_parameters'] = self.int_parameters
+        self.config.simple_io['int_parameter_suffixes'] = self.int_parameter_suffixes
+        self.config.simple_io['bool_parameter_prefixes'] = self.bool_parameter_prefixes
+
+        # Assign config to worker
+        self.worker_store.worker_config = self.config
+        self.worker_store.pubsub = self.pubsub
+
+        with self.startup_timer('worker_store'):
+            self.worker_store.init()
+
+        # Deployed missing services found on other servers
+        if locally_deployed:
+            with self.startup_timer('missing_services'):
+                self.deploy_missing_services(locally_deployed)
+
+        # Signal to ODB that we are done with deploying everything
+        self.odb.on_deployment_finished()
+
+        # Default content type
+        self.json_content_type = self.fs_server_config.content_type.json
+        self.plain_xml_content_type = self.fs_server_config.content_type.plain_xml
+        self.soap11_content_type = self.fs_server_config.content_type.soap11
+        self.soap12_content_type = self.fs_server_config.content_type.soap12
+
+# ################################################################################################################################
+
+    def get_odb_config(self, cluster_id):
+        """ Returns all the configuration that each worker reads from ODB at startup.
+        """
+        config = Bunch()
+
         #
         # Cassandra - start
         #
 
-        query = self.odb.get_cassandra_conn_list(server.cluster.id, True)
-        self.config.cassandra_conn = ConfigDict.from_query('cassandra_conn', query)
+        query = self.odb.get_cassandra_conn_list(cluster_id, True)
+        config.cassandra_conn = ConfigDict.from_query('cassandra_conn', query)
 
-        query = self.odb.get_cassandra_query_list(server.cluster.id, True)
-        self.config.cassandra_query = ConfigDict.from_query('cassandra_query', query)
+        query = self.odb.get_cassandra_query_list(cluster_id, True)
+        config.cassandra_query = ConfigDict.from_query('cassandra_query', query)
 
         #
         # Cassandra - end
@@ -60,11 +119,11 @@ class ConfigLoader(object):
         # Search - start
         #
 
-        query = self.odb.get_search_es_list(server.cluster.id, True)
-        self.config.search_es = ConfigDict.from_query('search_es', query)
+        query = self.odb.get_search_es_list(cluster_id, True)
+        config.search_es = ConfigDict.from_query('search_es', query)
 
-        query = self.odb.get_search_solr_list(server.cluster.id, True)
-        self.config.search_solr = ConfigDict.from_query('search_solr', query)
+        query = self.odb.get_search_solr_list(cluster_id, True)
+        config.search_solr = ConfigDict.from_query('search_solr', query)
 
         #
         # Search - end
@@ -76,11 +135,11 @@ class ConfigLoader(object):
 
         # OpenStack - Swift
 
-        query = self.odb.get_cloud_openstack_swift_list(server.cluster.id, True)
-        self.config.cloud_openstack_swift = ConfigDict.from_query('cloud_openstack_swift', query)
+        query = self.odb.get_cloud_openstack_swift_list(cluster_id, True)
+        config.cloud_openstack_swift = ConfigDict.from_query('cloud_openstack_swift', query)
 
-        query = self.odb.get_cloud_aws_s3_list(server.cluster.id, True)
-        self.config.cloud_aws_s3 = ConfigDict.from_query('cloud_aws_s3', query)
+        query = self.odb.get_cloud_aws_s3_list(cluster_id, True)
+        config.cloud_aws_s3 = ConfigDict.from_query('cloud_aws_s3', query)
 
         #
         # Cloud - end
@@ -89,16 +148,16 @@ class ConfigLoader(object):
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
         # Services
-        query = self.odb.get_service_list(server.cluster.id, True)
-        self.config.service = ConfigDict.from_query('service_list', query)
+        query = self.odb.get_service_list(cluster_id, True)
+        config.service = ConfigDict.from_query('service_list', query)
 
         #
         # Channels - start
         #
 
         # STOMP
-        query = self.odb.get_channel_stomp_list(server.cluster.id, True)
-        self.config.channel_stomp = ConfigDict.from_query('channel_stomp', query)
+        query = self.odb.get_channel_stomp_list(cluster_id, True)
+        config.channel_stomp = ConfigDict.from_query('channel_stomp', query)
 
         #
         # Channels - end
@@ -109,48 +168,48 @@ class ConfigLoader(object):
         #
 
         # AMQP
-        query = self.odb.get_out_amqp_list(server.cluster.id, True)
-        self.config.out_amqp = ConfigDict.from_query('out_amqp', query)
+        query = self.odb.get_out_amqp_list(cluster_id, True)
+        config.out_amqp = ConfigDict.from_query('out_amqp', query)
 
         # FTP
-        query = self.odb.get_out_ftp_list(server.cluster.id, True)
-        self.config.out_ftp = ConfigDict.from_query('out_ftp', query)
+        query = self.odb.get_out_ftp_list(cluster_id, True)
+        config.out_ftp = ConfigDict.from_query('out_ftp', query)
 
         # JMS WMQ
-        query = self.odb.get_out_jms_wmq_list(server.cluster.id, True)
-        self.config.out_jms_wmq = ConfigDict.from_query('out_jms_wmq', query)
+        query = self.odb.get_out_jms_wmq_list(cluster_id, True)
+        config.out_jms_wmq = ConfigDict.from_query('out_jms_wmq', query)
 
         # Odoo
-        query = self.odb.get_out_odoo_list(server.cluster.id, True)
-        self.config.out_odoo = ConfigDict.from_query('out_odoo', query)
+        query = self.odb.get_out_odoo_list(cluster_id, True)
+        config.out_odoo = ConfigDict.from_query('out_odoo', query)
 
         # Plain HTTP
-        query = self.odb.get_http_soap_list(server.cluster.id, 'outgoing', 'plain_http', True)
-        self.config.out_plain_http = ConfigDict.from_query('out_plain_http', query)
+        query = self.odb.get_http_soap_list(cluster_id, 'outgoing', 'plain_http', True)
+        config.out_plain_http = ConfigDict.from_query('out_plain_http', query)
 
         # SOAP
-        query = self.odb.get_http_soap_list(server.cluster.id, 'outgoing', 'soap', True)
-        self.config.out_soap = ConfigDict.from_query('out_soap', query)
+        query = self.odb.get_http_soap_list(cluster_id, 'outgoing', 'soap', True)
+        config.out_soap = ConfigDict.from_query('out_soap', query)
 
         # SQL
-        query = self.odb.get_out_sql_list(server.cluster.id, True)
-        self.config.out_sql = ConfigDict.from_query('out_sql', query)
+        query = self.odb.get_out_sql_list(cluster_id, True)
+        config.out_sql = ConfigDict.from_query('out_sql', query)
 
         # STOMP
-        query = self.odb.get_out_stomp_list(server.cluster.id, True)
-        self.config.out_stomp = ConfigDict.from_query('out_stomp', query)
+        query = self.odb.get_out_stomp_list(cluster_id, True)
+        config.out_stomp = ConfigDict.from_query('out_stomp', query)
 
         # ZMQ channels
-        query = self.odb.get_channel_zmq_list(server.cluster.id, True)
-        self.config.channel_zmq = ConfigDict.from_query('channel_zmq', query)
+        query = self.odb.get_channel_zmq_list(cluster_id, True)
+        config.channel_zmq = ConfigDict.from_query('channel_zmq', query)
 
         # ZMQ outgoing
-        query = self.odb.get_out_zmq_list(server.cluster.id, True)
-        self.config.out_zmq = ConfigDict.from_query('out_zmq', query)
+        query = self.odb.get_out_zmq_list(cluster_id, True)
+        config.out_zmq = ConfigDict.from_query('out_zmq', query)
 
         # WebSocket channels
-        query = self.odb.get_channel_web_socket_list(server.cluster.id, True)
-        self.config.channel_web_socket = ConfigDict.from_query('channel_web_socket', query)
+        query = self.odb.get_channel_web_socket_list(cluster_id, True)
+        config.channel_web_socket = ConfigDict.from_query('channel_web_socket', query)
 
         #
         # Outgoing connections - end
@@ -163,12 +222,12 @@ class ConfigLoader(object):
         #
 
         # OpenStack Swift
-        query = self.odb.get_notif_cloud_openstack_swift_list(server.cluster.id, True)
-        self.config.notif_cloud_openstack_swift = ConfigDict.from_query('notif_cloud_openstack_swift', query)
+        query = self.odb.get_notif_cloud_openstack_swift_list(cluster_id, True)
+        config.notif_cloud_openstack_swift = ConfigDict.from_query('notif_cloud_openstack_swift', query)
 
         # SQL
-        query = self.odb.get_notif_sql_list(server.cluster.id, True)
-        self.config.notif_sql = ConfigDict.from_query('notif_sql', query)
+        query = self.odb.get_notif_sql_list(cluster_id, True)
+        config.notif_sql = ConfigDict.from_query('notif_sql', query)
 
         #
         # Notifications - end
@@ -181,72 +240,72 @@ class ConfigLoader(object):
         #
 
         # API keys
-        query = self.odb.get_apikey_security_list(server.cluster.id, True)
-        self.config.apikey = ConfigDict.from_query('apikey', query)
+        query = self.odb.get_apikey_security_list(cluster_id, True)
+        config.apikey = ConfigDict.from_query('apikey', query)
 
         # AWS
-        query = self.odb.get_aws_security_list(server.cluster.id, True)
-        self.config.aws = ConfigDict.from_query('aws', query)
+        query = self.odb.get_aws_security_list(cluster_id, True)
+        config.aws = ConfigDict.from_query('aws', query)
 
         # HTTP Basic Auth
-        query = self.odb.get_basic_auth_list(server.cluster.id, None, True)
-        self.config.basic_auth = ConfigDict.from_query('basic_auth', query)
+        query = self.odb.get_basic_auth_list(cluster_id, None, True)
+        config.basic_auth = ConfigDict.from_query('basic_auth', query)
 
         # HTTP Basic Auth
-        query = self.odb.get_jwt_list(server.cluster.id, None, True)
-        self.config.jwt = ConfigDict.from_query('jwt', query)
+        query = self.odb.get_jwt_list(cluster_id, None, True)
+        config.jwt = ConfigDict.from_query('jwt', query)
 
         # NTLM
-        query = self.odb.get_ntlm_list(server.cluster.id, True)
-        self.config.ntlm = ConfigDict.from_query('ntlm', query)
+        query = self.odb.get_ntlm_list(cluster_id, True)
+        config.ntlm = ConfigDict.from_query('ntlm', query)
 
         # OAuth
-        query = self.odb.get_oauth_list(server.cluster.id, True)
-        self.config.oauth = ConfigDict.from_query('oauth', query)
+        query = self.odb.get_oauth_list(cluster_id, True)
+        config.oauth = ConfigDict.from_query('oauth', query)
 
         # OpenStack
-        query = self.odb.get_openstack_security_list(server.cluster.id, True)
-        self.config.openstack_security = ConfigDict.from_query('openstack_security', query)
+        query = self.odb.get_openstack_security_list(cluster_id, True)
+        config.openstack_security = ConfigDict.from_query('openstack_security', query)
 
         # RBAC - permissions
-        query = self.odb.get_rbac_permission_list(server.cluster.id, True)
-        self.config.rbac_permission = ConfigDict.from_query('rbac_permission', query)
+        query = self.odb.get_rbac_permission_list(cluster_id, True)
+        config.rbac_permission = ConfigDict.from_query('rbac_permission', query)
 
         # RBAC - roles
-        query = self.odb.get_rbac_role_list(server.cluster.id, True)
-        self.config.rbac_role = ConfigDict.from_query('rbac_role', query)
+        query = self.odb.get_rbac_role_list(cluster_id, True)
+        config.rbac_role = ConfigDict.from_query('rbac_role', query)
 
         # RBAC - client roles
-        query = self.odb.get_rbac_client_role_list(server.cluster.id, True)
-        self.config.rbac_client_role = ConfigDict.from_query('rbac_client_role', query)
+        query = self.odb.get_rbac_client_role_list(cluster_id, True)
+        config.rbac_client_role = ConfigDict.from_query('rbac_client_role', query)
 
         # RBAC - role permission
-        query = self.odb.get_rbac_role_permission_list(server.cluster.id, True)
-        self.config.rbac_role_permission = ConfigDict.from_query('rbac_role_permission', query)
+        query = self.odb.get_rbac_role_permission_list(cluster_id, True)
+        config.rbac_role_permission = ConfigDict.from_query('rbac_role_permission', query)
 
         # Technical accounts
-        query = self.odb.get_tech_acc_list(server.cluster.id, True)
-        self.config.tech_acc = ConfigDict.from_query('tech_acc', query)
+        query = self.odb.get_tech_acc_list(cluster_id, True)
+        config.tech_acc = ConfigDict.from_query('tech_acc', query)
 
         # TLS CA certs
-        query = self.odb.get_tls_ca_cert_list(server.cluster.id, True)
-        self.config.tls_ca_cert = ConfigDict.from_query('tls_ca_cert', query)
+        query = self.odb.get_tls_ca_cert_list(cluster_id, True)
+        config.tls_ca_cert = ConfigDict.from_query('tls_ca_cert', query)
 
         # TLS channel security
-        query = self.odb.get_tls_channel_sec_list(server.cluster.id, True)
-        self.config.tls_channel_sec = ConfigDict.from_query('tls_channel_sec', query)
+        query = self.odb.get_tls_channel_sec_list(cluster_id, True)
+        config.tls_channel_sec = ConfigDict.from_query('tls_channel_sec', query)
 
         # TLS key/cert pairs
-        query = self.odb.get_tls_key_cert_list(server.cluster.id, True)
-        self.config.tls_key_cert = ConfigDict.from_query('tls_key_cert', query)
+        query = self.odb.get_tls_key_cert_list(cluster_id, True)
+        config.tls_key_cert = ConfigDict.from_query('tls_key_cert', query)
 
         # WS-Security
-        query = self.odb.get_wss_list(server.cluster.id, True)
-        self.config.wss = ConfigDict.from_query('wss', query)
+        query = self.odb.get_wss_list(cluster_id, True)
+        config.wss = ConfigDict.from_query('wss', query)
 
         # XPath
-        query = self.odb.get_xpath_sec_list(server.cluster.id, True)
-        self.config.xpath_sec = ConfigDict.from_query('xpath_sec', query)
+        query = self.odb.get_xpath_sec_list(cluster_id, True)
+        config.xpath_sec = ConfigDict.from_query('xpath_sec', query)
 
         #
         # Security - end
@@ -256,7 +315,7 @@ class ConfigLoader(object):
 
         # All the HTTP/SOAP channels.
         http_soap = []
-        for item in self.odb.get_http_soap_list(server.cluster.id, 'channel'):
+        for item in self.odb.get_http_soap_list(cluster_id, 'channel'):
 
             hs_item = Bunch()
             for key in item.keys():
@@ -266,75 +325,52 @@ class ConfigLoader(object):
             hs_item.replace_patterns_xpath = item.replace_patterns_xpath
 
             hs_item.match_target = '{}{}{}'.format(hs_item.soap_action, MISC.SEPARATOR, hs_item.url_path)
-            hs_item.match_target_compiled = Matcher(hs_item.match_target)
 
             http_soap.append(hs_item)
 
-        self.config.http_soap = http_soap
+        config.http_soap = http_soap
 
         # Namespaces
-        query = self.odb.get_namespace_list(server.cluster.id, True)
-        self.config.msg_ns = ConfigDict.from_query('msg_ns', query)
+        query = self.odb.get_namespace_list(cluster_id, True)
+        config.msg_ns = ConfigDict.from_query('msg_ns', query)
 
         # XPath
-        query = self.odb.get_xpath_list(server.cluster.id, True)
-        self.config.xpath = ConfigDict.from_query('msg_xpath', query)
+        query = self.odb.get_xpath_list(cluster_id, True)
+        config.xpath = ConfigDict.from_query('msg_xpath', query)
 
         # JSON Pointer
-        query = self.odb.get_json_pointer_list(server.cluster.id, True)
-        self.config.json_pointer = ConfigDict.from_query('json_pointer', query)
-
-        # SimpleIO
-        self.config.simple_io = ConfigDict('simple_io', Bunch())
-        self.config.simple_io['int_parameters'] = self.int_parameters
-        self.config.simple_io['int_parameter_suffixes'] = self.int_parameter_suffixes
-        self.config.simple_io['bool_parameter_prefixes'] = self.bool_parameter_prefixes
+        query = self.odb.get_json_pointer_list(cluster_id, True)
+        config.json_pointer = ConfigDict.from_query('json_pointer', query)
 
         # Pub/sub config
-        self.config.pubsub = Bunch()
-        self.config.pubsub.default_consumer = Bunch()
-        self.config.pubsub.default_producer = Bunch()
+        config.pubsub = Bunch()
+        config.pubsub.default_consumer = Bunch()
+        config.pubsub.default_producer = Bunch()
 
-        query = self.odb.get_pubsub_topic_list(server.cluster.id, True)
-        self.config.pubsub.topics = ConfigDict.from_query('pubsub_topics', query)
+        query = self.odb.get_pubsub_topic_list(cluster_id, True)
+        config.pubsub.topics = ConfigDict.from_query('pubsub_topics', query)
 
-        id, name = self.odb.get_pubsub_default_client(server.cluster.id, 'zato.pubsub.default-consumer')
-        self.config.pubsub.default_consumer.id, self.config.pubsub.default_consumer.name = id, name
+        id, name = self.odb.get_pubsub_default_client(cluster_id, 'zato.pubsub.default-consumer')
+        config.pubsub.default_consumer.id, config.pubsub.default_consumer.name = id, name
 
-        id, name = self.odb.get_pubsub_default_client(server.cluster.id, 'zato.pubsub.default-producer')
-        self.config.pubsub.default_producer.id, self.config.pubsub.default_producer.name = id, name
+        id, name = self.odb.get_pubsub_default_client(cluster_id, 'zato.pubsub.default-producer')
+        config.pubsub.default_producer.id, config.pubsub.default_producer.name = id, name
 
-        query = self.odb.get_pubsub_producer_list(server.cluster.id, True)
-        self.config.pubsub.producers = ConfigDict.from_query('pubsub_producers', query, list_config=True)
+        query = self.odb.get_pubsub_producer_list(cluster_id, True)
+        config.pubsub.producers = ConfigDict.from_query('pubsub_producers', query, list_config=True)
 
-        query = self.odb.get_pubsub_consumer_list(server.cluster.id, True)
-        self.config.pubsub.consumers = ConfigDict.from_query('pubsub_consumers', query, list_config=True)
+        query = self.odb.get_pubsub_consumer_list(cluster_id, True)
+        config.pubsub.consumers = ConfigDict.from_query('pubsub_consumers', query, list_config=True)
 
         # E-mail - SMTP
-        query = self.odb.get_email_smtp_list(server.cluster.id, True)
-        self.config.email_smtp = ConfigDict.from_query('email_smtp', query)
+        query = self.odb.get_email_smtp_list(cluster_id, True)
+        config.email_smtp = ConfigDict.from_query('email_smtp', query)
 
         # E-mail - IMAP
-        query = self.odb.get_email_imap_list(server.cluster.id, True)
-        self.config.email_imap = ConfigDict.from_query('email_imap', query)
-
-        # Assign config to worker
-        self.worker_store.worker_config = self.config
-        self.worker_store.pubsub = self.pubsub
-        self.worker_store.init()
+        query = self.odb.get_email_imap_list(cluster_id, True)
+        config.email_imap = ConfigDict.from_query('email_imap', query)
 
-        # Deployed missing services found on other servers
-        if locally_deployed:
-            self.deploy_missing_services(locally_deployed)
-
-        # Signal to ODB that we are done with deploying everything
-        self.odb.on_deployment_finished()
-
-        # Default content type
-        self.json_content_type = self.fs_server_config.content_type.json
-        self.plain_xml_content_type = self.fs_server_config.content_type.plain_xml
-        self.soap11_content_type = self.fs_server_config.content_type.soap11
-        self.soap12_content_type = self.fs_server_config.content_type.soap12
+        return config
 
 # ################################################################################################################################
 
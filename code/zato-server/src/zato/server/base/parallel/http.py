@@ -25,6 +25,7 @@ from tzlocal import get_localzone
 # Zato
 from zato.common import ACCESS_LOG_DT_FORMAT
 from zato.common.util import new_cid
+from zato.server.connection.http_soap import is_stream, iter_stream, StreamingBody
 
 logger = getLogger(__name__)
 
@@ -68,6 +69,9 @@ class HTTPHandler(object):
             payload = error_msg
             raise
 
+        # Streamed responses are sent using chunked transfer encoding, as they are produced by the service
+        needs_stream = is_stream(payload)
+
         channel_item = wsgi_environ['zato.http.channel_item']
 
         if channel_item:
@@ -77,7 +81,8 @@ class HTTPHandler(object):
 
             # Note that this call is asynchronous and we do it the last possible moment.
             if wsgi_environ['zato.http.channel_item'].get('audit_enabled'):
-                self.worker_store.request_dispatcher.url_data.audit_set_response(cid, payload, wsgi_environ)
+                self.worker_store.request_dispatcher.url_data.audit_set_response(
+                    cid, b'' if needs_stream else payload, wsgi_environ)
 
         else:
             # 404 Not Found since we cannot find the channel
@@ -89,6 +94,17 @@ class HTTPHandler(object):
         if isinstance(payload, unicode):
             payload = payload.encode('utf-8')
 
+        if needs_stream:
+
+            # Files can be possibly sent by the WSGI server itself, e.g. with sendfile
+            file_wrapper = wsgi_environ.get('wsgi.file_wrapper')
+            if file_wrapper and hasattr(payload, 'read'):
+                response = file_wrapper(payload, StreamingBody.chunk_size)
+            else:
+                response = iter_stream(payload)
+        else:
+            response = [payload]
+
         if self.needs_access_log:
 
             self.access_logger.info('', extra = {
@@ -101,8 +117,8 @@ class HTTPHandler(object):
                 'path': wsgi_environ['PATH_INFO'],
                 'http_version': wsgi_environ['SERVER_PROTOCOL'],
                 'status_code': wsgi_environ['zato.http.response.status'].split()[0],
-                'response_size': len(payload),
+                'response_size': '-' if needs_stream else len(payload),
                 'user_agent': wsgi_environ.get('HTTP_USER_AGENT', '(None)'),
             })
 
-        return [payload]
+        return response
@@ -39,8 +39,8 @@ from gunicorn.workers.sync import SyncWorker as GunicornSyncWorker
 # Zato
 from zato.broker import BrokerMessageReceiver
 from zato.bunch import Bunch
-from zato.common import broker_message, CHANNEL, DATA_FORMAT, HTTP_SOAP_SERIALIZATION_TYPE, KVDB, MSG_PATTERN_TYPE, NOTIF, \
-     PUB_SUB, SEC_DEF_TYPE, simple_types, TRACE1, ZATO_NONE, ZATO_ODB_POOL_NAME, ZMQ
+from zato.common import AUDIT_LOG, broker_message, CHANNEL, DATA_FORMAT, HTTP_SOAP_SERIALIZATION_TYPE, KVDB, MISC, \
+     MSG_PATTERN_TYPE, NOTIF, PUB_SUB, SEC_DEF_TYPE, simple_types, TRACE1, ZATO_NONE, ZATO_ODB_POOL_NAME, ZMQ
 from zato.common.broker_message import code_to_name, SERVICE
 from zato.common.dispatch import dispatcher
 from zato.common.match import Matcher
@@ -50,6 +50,7 @@ from zato.common.util import get_tls_ca_cert_full_path, get_tls_key_cert_full_pa
      import_module_from_path, new_cid, pairwise, parse_extra_into_dict, parse_tls_channel_security_definition, start_connectors, \
      store_tls, update_bind_port, visit_py_source
 from zato.server.base.worker.common import WorkerImpl
+from zato.server.cache import RobustCache
 from zato.server.connection.cassandra import CassandraAPI, CassandraConnStore
 from zato.server.connection.connector import ConnectorStore, connector_type
 from zato.server.connection.cloud.aws.s3 import S3Wrapper
@@ -60,6 +61,7 @@ from zato.server.connection.http_soap.channel import RequestDispatcher, RequestH
 from zato.server.connection.http_soap.outgoing import HTTPSOAPWrapper, SudsSOAPWrapper
 from zato.server.connection.http_soap.url_data import URLData
 from zato.server.connection.odoo import OdooWrapper
+from zato.server.connection.queue import ConnectionQueue
 from zato.server.connection.search.es import ElasticSearchAPI, ElasticSearchConnStore
 from zato.server.connection.search.solr import SolrAPI, SolrConnStore
 from zato.server.connection.stomp import ChannelSTOMPConnStore, STOMPAPI, channel_main_loop as stomp_channel_main_loop, \
@@ -130,6 +132,7 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
         self.kvdb = server.kvdb
         self.broker_client = None
         self.pubsub = None
+        self.cache = None
         self.rbac = RBAC()
         self.worker_idx = int(os.environ['ZATO_SERVER_WORKER_IDX'])
 
@@ -149,6 +152,16 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
         # Statistics maintenance
         self.stats_maint = MaintenanceTool(self.kvdb.conn)
 
+        # Cache services access as self.cache
+        misc = self.server.fs_server_config.misc
+        self.cache = RobustCache(self.kvdb, self.server.odb, cluster_id=self.server.cluster_id,
+            key_prefix=KVDB.SERVICE_CACHE_PREFIX,
+            local_cache_size=int(misc.get('service_cache_local_size', MISC.DEFAULT_SERVICE_CACHE_LOCAL_SIZE)),
+            local_ttl=float(misc.get('service_cache_local_ttl', MISC.DEFAULT_SERVICE_CACHE_LOCAL_TTL)),
+            write_behind_interval=float(misc.get('service_cache_write_behind_interval',
+                MISC.DEFAULT_SERVICE_CACHE_WRITE_BEHIND_INTERVAL)),
+            broker_client=self.broker_client)
+
         self.msg_ns_store = NamespaceStore()
         self.json_pointer_store = JSONPointerStore()
         self.xpath_store = XPathStore()
@@ -225,7 +238,15 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
             self.worker_config.tech_acc, self.worker_config.wss, self.worker_config.apikey, self.worker_config.aws,
             self.worker_config.openstack_security, self.worker_config.xpath_sec, self.worker_config.tls_channel_sec,
             self.worker_config.tls_key_cert, self.kvdb, self.broker_client, self.server.odb, self.json_pointer_store,
-            self.xpath_store, self.server.jwt_secret)
+            self.xpath_store, self.server.jwt_secret,
+            int(self.server.fs_server_config.misc.get('url_path_cache_size', MISC.DEFAULT_URL_PATH_CACHE_SIZE)),
+            int(self.server.fs_server_config.misc.get('jwt_token_cache_size', MISC.DEFAULT_JWT_TOKEN_CACHE_SIZE)),
+            float(self.server.fs_server_config.misc.get('jwt_renew_interval', MISC.DEFAULT_JWT_RENEW_INTERVAL)),
+            self.server.fs_server_config.misc.get('http_audit_writer', AUDIT_LOG.WRITER.SYNC),
+            int(self.server.fs_server_config.misc.get('http_audit_flush_size', AUDIT_LOG.DEFAULT_FLUSH_SIZE)),
+            float(self.server.fs_server_config.misc.get('http_audit_flush_interval', AUDIT_LOG.DEFAULT_FLUSH_INTERVAL)),
+            float(self.server.fs_server_config.misc.get('http_audit_max_buffer_mb', AUDIT_LOG.DEFAULT_MAX_BUFFER_SIZE)),
+            self.server.fs_server_config.misc.get('http_audit_overflow', AUDIT_LOG.OVERFLOW.DROP_OLDEST))
 
         self.request_dispatcher.request_handler = RequestHandler(self.server)
 
@@ -250,6 +271,9 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
     def set_broker_client(self, broker_client):
         self.broker_client = broker_client
 
+        if self.cache:
+            self.cache.broker_client = broker_client
+
 # ################################################################################################################################
 
     def filter(self, msg):
@@ -259,7 +283,16 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
 # ################################################################################################################################
 
     def _update_queue_build_cap(self, item):
-        item.queue_build_cap = float(self.server.fs_server_config.misc.queue_build_cap)
+        """ Copies to a connection's config everything from server.conf that its queue of connections is built with.
+        """
+        misc = self.server.fs_server_config.misc
+
+        item['queue_build_cap'] = float(misc.queue_build_cap)
+        item['queue_acquire_timeout'] = float(misc.get('queue_acquire_timeout', MISC.DEFAULT_QUEUE_ACQUIRE_TIMEOUT))
+        item['queue_max_pool_size_factor'] = float(
+            misc.get('queue_max_pool_size_factor', MISC.DEFAULT_QUEUE_MAX_POOL_SIZE_FACTOR))
+        item['queue_idle_timeout'] = float(misc.get('queue_idle_timeout', MISC.DEFAULT_QUEUE_IDLE_TIMEOUT))
+        item['queue_validate_after'] = float(misc.get('queue_validate_after', MISC.DEFAULT_QUEUE_VALIDATE_AFTER))
 
 # ################################################################################################################################
 
@@ -333,7 +366,7 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
         wrapper_config['tls_verify'] = tls_verify
 
         if wrapper_config['serialization_type'] == HTTP_SOAP_SERIALIZATION_TYPE.SUDS.id:
-            wrapper_config['queue_build_cap'] = float(self.server.fs_server_config.misc.queue_build_cap)
+            self._update_queue_build_cap(wrapper_config)
             wrapper = SudsSOAPWrapper(wrapper_config)
             wrapper.build_client_queue()
             return wrapper
@@ -398,7 +431,7 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
                 config = config_attr[name]['config']
                 if isinstance(wrapper, S3Wrapper):
                     self._update_aws_config(config)
-                config.queue_build_cap = float(self.server.fs_server_config.misc.queue_build_cap)
+                self._update_queue_build_cap(config)
                 config_attr[name].conn = wrapper(config, self.server)
                 config_attr[name].conn.build_queue()
 
@@ -619,7 +652,7 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
         for name in names:
             item = config = self.worker_config.out_odoo[name]
             config = item['config']
-            config.queue_build_cap = float(self.server.fs_server_config.misc.queue_build_cap)
+            self._update_queue_build_cap(config)
             item.conn = OdooWrapper(config, self.server)
             item.conn.build_queue()
 
@@ -675,7 +708,7 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
                 self.pubsub.add_consumer(
                     Consumer(
                         config.client_id, config.name, config.is_active, config.sub_key, config.max_depth,
-                        config.delivery_mode, config.callback_id, config.callback_name, callback_type),
+                        config.delivery_mode, config.callback_id, config.callback_name, callback_type, config.group_name),
                     Topic(config.topic_name))
 
 # ################################################################################################################################
@@ -929,6 +962,11 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
         self._update_auth(msg, code_to_name[msg.action], SEC_DEF_TYPE.JWT,
                 self._visit_wrapper_change_password)
 
+    def on_broker_msg_SECURITY_JWT_TOKEN_DELETE(self, msg, *args):
+        """ Deletes a JWT token from the cache of verified ones.
+        """
+        dispatcher.notify(broker_message.SECURITY.JWT_TOKEN_DELETE.value, msg)
+
 # ################################################################################################################################
 
     def oauth_get(self, name):
@@ -1308,6 +1346,8 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
                 log_func('Could not access wrapper, e:[{}]'.format(format_exc(e)))
             else:
                 try:
+                    if isinstance(getattr(wrapper, 'client', None), ConnectionQueue):
+                        wrapper.client.close()
                     wrapper.session.close()
                 finally:
                     del config_dict[name]
@@ -1575,7 +1615,7 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
         self._delete_config_close_wrapper(del_name, config_dict, conn_type, logger.debug)
 
         # .. and create a new one
-        msg['queue_build_cap'] = float(self.server.fs_server_config.misc.queue_build_cap)
+        self._update_queue_build_cap(msg)
         wrapper = wrapper_class(msg, self.server)
         wrapper.build_queue()
 
@@ -1643,7 +1683,7 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
         self.pubsub.add_consumer(
             Consumer(
                 msg.client_id, msg.client_name, msg.is_active, msg.sub_key, msg.max_depth,
-                msg.delivery_mode, msg.callback_id, msg.callback_name, msg.callback_type),
+                msg.delivery_mode, msg.callback_id, msg.callback_name, msg.callback_type, msg.get('group_name')),
             Topic(msg.topic_name))
 
     def on_broker_msg_PUB_SUB_CONSUMER_CREATE(self, msg):
@@ -1845,6 +1885,14 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
     def on_broker_msg_RBAC_ROLE_PERMISSION_DELETE(self, msg):
         self.rbac.delete_role_permission_allow(msg.role_id, msg.perm_id, msg.service_id)
 
+# ################################################################################################################################
+
+    def on_broker_msg_CACHE_INVALIDATE(self, msg):
+        """ Deletes a key of self.cache that was put or deleted, possibly on another server, from this worker's memory.
+        """
+        if self.cache:
+            self.cache.on_invalidate(msg)
+
 # ################################################################################################################################
 
     def zmq_channel_create_edit(self, name, msg, action, lock_timeout, start):
@@ -1942,9 +1990,6 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
 
         # We get here if there is no target_pid or if there is one and it matched that of ours.
 
-        response = self.invoke(msg.service, msg.payload, channel=CHANNEL.IPC, data_format=msg.data_format)
-
-        with open(msg.reply_to_fifo, 'wb') as fifo:
-            fifo.write(response)
+        return self.invoke(msg.service, msg.payload, channel=CHANNEL.IPC, data_format=msg.data_format)
 
 # ################################################################################################################################
@@ -12,11 +12,18 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import datetime
 from contextlib import closing
 from logging import getLogger
+from time import time
+from uuid import uuid4
 
 # gevent
 import gevent
 
+# SQLAlchemy
+from sqlalchemy import and_, bindparam
+
 # Zato
+from zato.common.broker_message import CACHE
+from zato.common.lru import LRUCache
 from zato.common.odb.model import KVData
 
 # ################################################################################################################################
@@ -27,15 +34,43 @@ logger = getLogger(__name__)
 
 class RobustCache(object):
     """ Robust Cache that uses KVDB as a first option but keeps ODB as a fail-safe alternative.
+
+    Optionally, each worker keeps up to local_cache_size entries in memory, for no longer than local_ttl seconds each,
+    and lets other workers know through the broker to drop their own copies of keys that were put or deleted.
+    With write_behind_interval set, ODB copies of entries are not stored on each put but in bulk, every that many seconds
+    and when the worker stops. Each entry is stored as of the time it was put or deleted at and rows more recent than that,
+    e.g. written by other workers in the meantime, are not overwritten.
     """
 
 # ################################################################################################################################
 
-    def __init__(self, kvdb, odb, miss_fallback=False, cluster_id=None):
+    def __init__(self, kvdb, odb, miss_fallback=False, cluster_id=None, key_prefix='', local_cache_size=0, local_ttl=60,
+            write_behind_interval=0, broker_client=None):
         self.kvdb = kvdb
         self.odb = odb
         self.miss_fallback = miss_fallback
         self.cluster_id = cluster_id
+        self.key_prefix = key_prefix
+        self.local = LRUCache(local_cache_size)
+        self.local_ttl = local_ttl
+        self.write_behind_interval = write_behind_interval
+        self.broker_client = broker_client
+
+        # So that a worker can tell its own invalidations from other ones
+        self.origin = uuid4().hex
+
+        # Incremented on each invalidation so that values read from KVDB in the meantime are not kept in memory
+        self.generation = 0
+
+        # Key -> (when it was put or deleted, (value, ttl) or None if the key is to be deleted)
+        self.pending = {}
+        self.flusher = None
+
+        # Statistics
+        self.local_hits = 0
+        self.kvdb_hits = 0
+        self.kvdb_misses = 0
+        self.odb_flushed = 0
 
 # ################################################################################################################################
 
@@ -53,6 +88,15 @@ class RobustCache(object):
         except Exception:
             logger.exception('KVDB Exception while putting %s.', key)
 
+# ################################################################################################################################
+
+    def _kvdb_put_invalidate(self, key, value, ttl):
+        """ Other workers are told to drop their copies of a key only once its new value is in KVDB, otherwise they could
+        read the previous one again and keep it in memory.
+        """
+        self._kvdb_put(key, value, ttl)
+        self._publish_invalidation(key)
+
 # ################################################################################################################################
 
     def _odb_put(self, key, value, ttl):
@@ -70,7 +114,7 @@ class RobustCache(object):
                 item.key = key
                 item.value = value
                 item.creation_time = now
-                item.expiry_time = now + datetime.timedelta(seconds=ttl)
+                item.expiry_time = now + datetime.timedelta(seconds=ttl) if ttl else None
 
                 session.add(item)
                 session.commit()
@@ -84,8 +128,144 @@ class RobustCache(object):
 # ################################################################################################################################
 
     def _odb_get(self, key):
+
+        # Not stored in ODB yet
+        if key in self.pending:
+            item = self.pending[key][1]
+            return item[0] if item else None
+
+        with closing(self.odb.session()) as session:
+            item = session.query(KVData).filter_by(key=self._get_odb_key(key)).first()
+
+            if item and not (item.expiry_time and item.expiry_time < datetime.datetime.utcnow()):
+                return item.value
+
+# ################################################################################################################################
+
+    def _local_put(self, key, value, ttl, _time=time):
+        if self.local.max_size:
+            self.local.set(key, (value, _time() + min(ttl or self.local_ttl, self.local_ttl)))
+
+    def invalidate_local(self, key):
+        """ Deletes a key from this worker's memory, if it is there.
+        """
+        self.generation += 1
+        self.local.delete(key)
+
+    def _invalidate(self, key):
+        """ Lets all workers know they should not use their own copies of a key anymore.
+        """
+        self.invalidate_local(key)
+        self._publish_invalidation(key)
+
+    def _publish_invalidation(self, key):
+        """ Lets other workers know they should not use their own copies of a key anymore.
+        """
+        if self.local.max_size and self.broker_client:
+            self.broker_client.publish({
+                'action': CACHE.INVALIDATE.value,
+                'key': key,
+                'origin': self.origin,
+            })
+
+    def on_invalidate(self, msg):
+        """ Handles invalidations published by workers, possibly on other servers.
+        """
+        if msg.origin != self.origin:
+            self.invalidate_local(msg.key)
+
+# ################################################################################################################################
+
+    def _write_behind(self, key, item):
+        """ Makes a key be stored in or deleted from ODB along with any other ones on the next flush.
+        """
+        self.pending[key] = (datetime.datetime.utcnow(), item)
+
+        if not self.flusher:
+            self.flusher = gevent.spawn(self._flush_forever)
+
+    def _flush_forever(self):
+        while True:
+            gevent.sleep(self.write_behind_interval)
+
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not flush cache entries to ODB')
+
+    def stop(self):
+        """ Stops flushing entries in background and flushes all the pending ones.
+        """
+        if self.flusher:
+            self.flusher.kill()
+            self.flusher = None
+
+        self.flush()
+
+    def flush(self, _chunk_size=500):
+        """ Stores in ODB all the entries put or deleted since the last flush, as a single bulk update and insert
+        of all the keys in their latest versions, with no ODB round-trips for each put on its own. Rows written
+        after a given entry was put or deleted are left as they are.
+        """
+        pending, self.pending = self.pending, {}
+
+        if not pending:
+            return
+
+        table = KVData.__table__
+
+        to_store = {}
+        to_delete = []
+
+        for key, (when, item) in pending.iteritems():
+            odb_key = self._get_odb_key(key)
+            if item:
+                value, ttl = item
+                to_store[odb_key] = {'b_key': odb_key, 'b_value': value, 'b_creation_time': when,
+                    'b_expiry_time': when + datetime.timedelta(seconds=ttl) if ttl else None}
+            else:
+                to_delete.append({'b_key': odb_key, 'b_creation_time': when})
+
         with closing(self.odb.session()) as session:
-            return session.query(KVData).filter_by(key=self._get_odb_key(key)).first()
+            try:
+                keys = to_store.keys()
+                existing = set()
+
+                for idx in range(0, len(keys), _chunk_size):
+                    chunk = keys[idx:idx+_chunk_size]
+                    existing.update(elem.key for elem in session.query(KVData.key).filter(KVData.key.in_(chunk)))
+
+                to_update = [value for key, value in to_store.iteritems() if key in existing]
+                to_insert = [{'key': value['b_key'], 'value': value['b_value'], 'creation_time': value['b_creation_time'],
+                    'expiry_time': value['b_expiry_time']} for key, value in to_store.iteritems() if key not in existing]
+
+                # Rows are updated or deleted only if no other worker wrote them more recently
+                not_newer = table.c.creation_time <= bindparam('b_creation_time')
+
+                if to_delete:
+                    session.execute(table.delete().where(and_(table.c.key==bindparam('b_key'), not_newer)), to_delete)
+
+                if to_update:
+                    session.execute(table.update().where(and_(table.c.key==bindparam('b_key'), not_newer)).values(
+                        value=bindparam('b_value'), creation_time=bindparam('b_creation_time'),
+                        expiry_time=bindparam('b_expiry_time')), to_update)
+
+                if to_insert:
+                    session.execute(table.insert(), to_insert)
+
+                session.commit()
+
+            except Exception:
+                session.rollback()
+
+                # Try again on the next flush, unless the keys were put or deleted once more in the meantime
+                for key, entry in pending.iteritems():
+                    self.pending.setdefault(key, entry)
+
+                raise
+
+            else:
+                self.odb_flushed += len(pending)
 
 # ################################################################################################################################
 
@@ -95,36 +275,78 @@ class RobustCache(object):
         if async is False, we join the greenlets until they are done.
         otherwise, we do not wait for them to finish.
         """
-        greenlets = [
-            gevent.spawn(self._kvdb_put, key, value, ttl),
-            gevent.spawn(self._odb_put, key, value, ttl)
-        ]
+        key = self.key_prefix + key
+
+        if self.write_behind_interval:
+            self._write_behind(key, (value, ttl))
+            greenlets = [gevent.spawn(self._kvdb_put_invalidate, key, value, ttl)]
+
+            if not async:
+                greenlets.append(gevent.spawn(self.flush))
+        else:
+            greenlets = [
+                gevent.spawn(self._kvdb_put_invalidate, key, value, ttl),
+                gevent.spawn(self._odb_put, key, value, ttl)
+            ]
+
+        self.invalidate_local(key)
+        self._local_put(key, value, ttl)
 
         if not async:
             gevent.joinall(greenlets)
 
 # ################################################################################################################################
 
-    def get(self, key):
+    def get(self, key, _time=time):
+        key = self.key_prefix + key
+
+        if self.local.max_size:
+            entry = self.local.get(key)
+            if entry:
+                if _time() < entry[1]:
+                    self.local_hits += 1
+                    return entry[0]
+                self.local.delete(key)
+
+        generation = self.generation
+
         try:
-            return self.kvdb.conn.get(key)
+            value = self.kvdb.conn.get(key)
 
         except Exception:
             logger.exception('KVDB Exception while getting key %s. Falling back to ODB.', key)
             return self._odb_get(key)
 
-        if self.miss_fallback:
-            logger.warning('Key %s not found in KVDB. Falling back to ODB.', key)
-            return self._odb_get(key)
+        if value is None:
+            self.kvdb_misses += 1
+
+            if self.miss_fallback:
+                logger.warning('Key %s not found in KVDB. Falling back to ODB.', key)
+                return self._odb_get(key)
+
+        else:
+            self.kvdb_hits += 1
+
+            # Unless the key was invalidated while it was being read
+            if generation == self.generation:
+                self._local_put(key, value, None)
+
+        return value
 
 # ################################################################################################################################
 
     def delete(self, key):
+        key = self.key_prefix + key
 
         # Delete from KVDB
         self.kvdb.conn.delete(key)
+        self._invalidate(key)
 
         # Delete from ODB
+        if self.write_behind_interval:
+            self._write_behind(key, None)
+            return
+
         key = self._get_odb_key(key)
 
         with closing(self.odb.session()) as session:
@@ -134,4 +356,25 @@ class RobustCache(object):
                 session.delete(item)
                 session.commit()
 
+# ################################################################################################################################
+
+    def get_stats(self):
+        """ Returns statistics of both the in-memory cache and KVDB, including the ratio of hits to all gets.
+        """
+        hits = self.local_hits + self.kvdb_hits
+        total = hits + self.kvdb_misses
+
+        return {
+            'size': len(self.local),
+            'max_size': self.local.max_size,
+            'evictions': self.local.evictions,
+            'local_hits': self.local_hits,
+            'kvdb_hits': self.kvdb_hits,
+            'kvdb_misses': self.kvdb_misses,
+            'hit_ratio': hits / total if total else 0.0,
+            'local_hit_ratio': self.local_hits / total if total else 0.0,
+            'odb_pending': len(self.pending),
+            'odb_flushed': self.odb_flushed,
+        }
+
 # ################################################################################################################################
@@ -9,9 +9,14 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
+import os
 from copy import deepcopy
+from errno import ENOENT
+from cPickle import dump, HIGHEST_PROTOCOL, load
 from logging import getLogger
+from tempfile import NamedTemporaryFile
 from threading import RLock
+from time import time
 
 # Paste
 from paste.util.multidict import MultiDict
@@ -20,7 +25,7 @@ from paste.util.multidict import MultiDict
 from zato.bunch import Bunch
 
 # Zato
-from zato.common import ZATO_NONE
+from zato.common import CONFIG_SNAPSHOT, ZATO_NONE
 
 logger = getLogger(__name__)
 
@@ -38,6 +43,15 @@ class ConfigDict(object):
         self._impl = _bunch
         self.lock = RLock()
 
+    def __getstate__(self):
+        with self.lock:
+            return {'name': self.name, '_impl': self._impl}
+
+    def __setstate__(self, state):
+        self.name = state['name']
+        self._impl = state['_impl']
+        self.lock = RLock()
+
     def get(self, key, default=None):
         with self.lock:
             return self._impl.get(key, default)
@@ -154,6 +168,86 @@ class ConfigDict(object):
 
         return config_dict
 
+class ConfigSnapshot(object):
+    """ A copy of configuration that workers read from ODB at startup, stored in a file by a server's first worker
+    for the other ones to read it from instead of running the same queries each. A snapshot is used only if it is
+    of the current format, was taken during the current deployment, i.e. since the server was last started,
+    and is not older than max_age seconds, so that workers do not start with configuration that may have changed
+    before they could receive updates through the broker. Because the configuration includes credentials, the file is
+    readable to its owner only and the first worker deletes it as soon as max_age seconds pass.
+    """
+    def __init__(self, path, deployment_key, max_age=CONFIG_SNAPSHOT.DEFAULT_MAX_AGE):
+        self.path = path
+        self.deployment_key = deployment_key
+        self.max_age = max_age
+
+    def save(self, config, _time=time):
+        """ Stores a snapshot of a given configuration, replacing any previous one atomically.
+        """
+        stamp = {
+            'format_version': CONFIG_SNAPSHOT.FORMAT_VERSION,
+            'deployment_key': self.deployment_key,
+            'created': _time(),
+        }
+
+        with NamedTemporaryFile(dir=os.path.dirname(self.path), prefix='.config-snapshot-', delete=False) as f:
+            try:
+                dump(stamp, f, HIGHEST_PROTOCOL)
+                dump(config, f, HIGHEST_PROTOCOL)
+            except Exception:
+                os.remove(f.name)
+                raise
+
+        os.rename(f.name, self.path)
+
+    def load(self, _time=time):
+        """ Returns configuration from the snapshot or None if there is none that could be used.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                stamp = load(f)
+
+                if stamp['format_version'] != CONFIG_SNAPSHOT.FORMAT_VERSION:
+                    reason = 'format version is `{}` instead of `{}`'.format(
+                        stamp['format_version'], CONFIG_SNAPSHOT.FORMAT_VERSION)
+
+                elif stamp['deployment_key'] != self.deployment_key:
+                    reason = 'it was taken during deployment `{}`'.format(stamp['deployment_key'])
+
+                elif _time() - stamp['created'] > self.max_age:
+                    reason = 'it is older than {}s'.format(self.max_age)
+
+                else:
+                    config = load(f)
+                    logger.info('Using config snapshot `%s`', self.path)
+                    return config
+
+        except IOError:
+            logger.info('Not using config snapshot `%s` because it does not exist, reading config from ODB', self.path)
+            return
+
+        except Exception, e:
+            reason = 'it could not be read, e:`{}`'.format(e)
+
+        logger.info('Not using config snapshot `%s` because %s, reading config from ODB', self.path, reason)
+
+        # A snapshot that cannot be used, e.g. one left over after a previous deployment, is of no use to anyone
+        try:
+            self.delete()
+        except Exception, e:
+            logger.warn('Could not delete config snapshot `%s`, e:`%s`', self.path, e)
+
+    def delete(self):
+        """ Deletes the snapshot, if there is any.
+        """
+        try:
+            os.remove(self.path)
+        except OSError, e:
+            if e.errno != ENOENT:
+                raise
+        else:
+            logger.info('Deleted config snapshot `%s`', self.path)
+
 class ConfigStore(object):
     """ The central place for storing a Zato server's thread configuration.
     May /not/ be shared across threads - each thread should get its own copy
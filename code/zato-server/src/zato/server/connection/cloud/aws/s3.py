@@ -68,3 +68,9 @@ class S3Wrapper(Wrapper):
         conn.sanity_check()
 
         self.client.put_client(conn)
+
+    def validate_client(self, client):
+        client.sanity_check()
+
+    def close_client(self, client):
+        client.impl.close()
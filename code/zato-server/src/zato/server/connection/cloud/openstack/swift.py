@@ -20,7 +20,7 @@ from swiftclient.client import Connection
 
 # Zato
 from zato.common.util import parse_extra_into_dict
-from zato.server.connection.queue import ConnectionQueue
+from zato.server.connection.queue import ConnectionQueue, get_queue_config
 
 class SwiftWrapper(object):
     """ Wraps a queue of connections to OpenStack Swift.
@@ -31,7 +31,7 @@ class SwiftWrapper(object):
 
         self.client = ConnectionQueue(
             self.config.pool_size, self.config.queue_build_cap, self.config.name, 'OpenStack Swift', self.config.auth_url,
-            self.add_client)
+            self.add_client, validate_func=Connection.head_account, close_func=Connection.close, **get_queue_config(self.config))
 
         self.update_lock = RLock()
         self.logger = getLogger(self.__class__.__name__)
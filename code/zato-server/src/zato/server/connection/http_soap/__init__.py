@@ -11,6 +11,9 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 # stdlib
 from httplib import BAD_REQUEST, CONFLICT, FORBIDDEN, METHOD_NOT_ALLOWED, NOT_FOUND, UNAUTHORIZED
 
+# lxml
+from lxml.etree import _Element as EtreeElement
+
 # Zato
 from zato.common import TOO_MANY_REQUESTS, HTTPException
 
@@ -46,3 +49,64 @@ class Unauthorized(ClientHTTPError):
 class TooManyRequests(ClientHTTPError):
     def __init__(self, cid, msg):
         super(TooManyRequests, self).__init__(cid, msg, TOO_MANY_REQUESTS)
+
+# ################################################################################################################################
+
+class StreamingBody(object):
+    """ A request body of a streaming channel - a file-like object reading from wsgi.input only when the service asks for
+    the data. Iterating over it returns the body in chunks of up to chunk_size bytes.
+    """
+    chunk_size = 65536
+
+    def __init__(self, wsgi_input, content_length=None):
+        self.wsgi_input = wsgi_input
+        self.content_length = content_length
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.wsgi_input.read(size) if size is not None and size >= 0 else self.wsgi_input.read()
+        self.bytes_read += len(data)
+        return data
+
+    def readline(self, size=-1):
+        data = self.wsgi_input.readline(size) if size is not None and size >= 0 else self.wsgi_input.readline()
+        self.bytes_read += len(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            data = self.read(self.chunk_size)
+            if not data:
+                break
+            yield data
+
+    def __repr__(self):
+        return '<{} at {} content_length:`{}` bytes_read:`{}`>'.format(
+            self.__class__.__name__, hex(id(self)), self.content_length, self.bytes_read)
+
+def is_stream(payload):
+    """ Returns True if a response's payload is a file-like object or an iterator that should be sent in chunks
+    rather than serialized to a single string.
+    """
+    # Attribute access on XML elements looks up their children instead
+    if isinstance(payload, EtreeElement):
+        return False
+
+    return hasattr(payload, 'read') or (hasattr(payload, '__iter__') and hasattr(payload, 'next'))
+
+def iter_stream(payload, chunk_size=StreamingBody.chunk_size):
+    """ Yields a streamed response's payload in chunks of bytes, closing it afterwards if it can be closed.
+    """
+    try:
+        if hasattr(payload, 'read'):
+            while True:
+                chunk = payload.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk.encode('utf-8') if isinstance(chunk, unicode) else chunk
+        else:
+            for chunk in payload:
+                yield chunk.encode('utf-8') if isinstance(chunk, unicode) else chunk
+    finally:
+        if hasattr(payload, 'close'):
+            payload.close()
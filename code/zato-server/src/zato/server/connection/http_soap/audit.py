@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import logging
+from collections import OrderedDict
+from contextlib import closing
+from datetime import datetime
+from time import time
+from traceback import format_exc
+
+# gevent
+from gevent import spawn
+from gevent.event import Event
+
+# Zato
+from zato.common import AUDIT_LOG
+from zato.common.odb.model import HTTSOAPAudit
+
+# ################################################################################################################################
+
+logger = logging.getLogger(__name__)
+
+# ################################################################################################################################
+
+def _bytes(value):
+    return value.encode('utf-8') if isinstance(value, unicode) else value
+
+# ################################################################################################################################
+
+# Attributes of channels audit records need, copied when requests arrive because channels may be edited in the meantime
+_channel_attrs = ('id', 'name', 'transport', 'connection', 'username')
+
+class AuditRecord(object):
+    """ Both halves of an audited HTTP invocation. Request payloads are already masked but WSGI environments
+    are not serialized until the record is about to be stored.
+    """
+    __slots__ = ('cid', 'channel', 'created_at', 'req_time', 'req_environ', 'req_payload', 'resp_time', 'resp_environ',
+        'resp_payload', 'size')
+
+    def __init__(self, cid, channel_item, req_environ, req_payload, created_at):
+        self.cid = cid
+        self.channel = dict((name, channel_item.get(name)) for name in _channel_attrs)
+        self.created_at = created_at
+        self.req_time = datetime.utcnow()
+        self.req_environ = req_environ
+        self.req_payload = req_payload
+        self.resp_time = None
+        self.resp_environ = None
+        self.resp_payload = None
+        self.size = AUDIT_LOG.RECORD_OVERHEAD + len(req_payload or '')
+
+# ################################################################################################################################
+
+class AuditBuffer(object):
+    """ Collects audit records of HTTP channels in memory and stores them in ODB in bulk from a background greenlet,
+    every flush_interval seconds or as soon as flush_size of them are complete, whichever comes first, as well as when
+    the worker stops. Payloads are masked as soon as requests arrive, using the configuration their channels have
+    at that time, whereas WSGI environments are serialized in the background greenlet.
+
+    Records take up to max_size bytes, roughly, and once there is no room for new ones, either the oldest ones are dropped
+    or requests wait until there is room again, depending on the overflow policy.
+    """
+    def __init__(self, odb, get_request_payload, dump_wsgi_environ, flush_size=AUDIT_LOG.DEFAULT_FLUSH_SIZE,
+            flush_interval=AUDIT_LOG.DEFAULT_FLUSH_INTERVAL, max_size=AUDIT_LOG.DEFAULT_MAX_BUFFER_SIZE * 1024 * 1024,
+            overflow=AUDIT_LOG.OVERFLOW.DROP_OLDEST, in_flight_timeout=AUDIT_LOG.DEFAULT_IN_FLIGHT_TIMEOUT):
+        self.odb = odb
+        self.get_request_payload = get_request_payload
+        self.dump_wsgi_environ = dump_wsgi_environ
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.overflow = overflow
+        self.in_flight_timeout = in_flight_timeout
+
+        # CID -> AuditRecord, oldest first
+        self.records = OrderedDict()
+        self.size = 0
+        self.complete = 0
+
+        self.flush_needed = Event()
+        self.has_room = Event()
+        self.has_room.set()
+        self.greenlet = None
+
+        # Statistics
+        self.stored = 0
+        self.dropped = 0
+        self.failed = 0
+
+# ################################################################################################################################
+
+    def _make_room(self, size):
+        """ Drops the oldest records or waits until flushes make room for a new one of a given size. A record larger
+        than max_size is still accepted if it is the only one. Requests do not wait longer than flush_interval seconds,
+        after that the oldest records are dropped as if there were no waiting at all.
+        """
+        block = self.overflow == AUDIT_LOG.OVERFLOW.BLOCK
+        deadline = time() + self.flush_interval
+
+        while self.records and self.size + size > self.max_size:
+
+            timeout = deadline - time()
+
+            if block and timeout > 0:
+                self.has_room.clear()
+                self.flush_needed.set()
+                self.has_room.wait(timeout)
+
+            else:
+                _, record = self.records.popitem(False)
+                self._forget(record)
+                self.dropped += 1
+
+    def _forget(self, record):
+        self.size -= record.size
+        if record.resp_time:
+            self.complete -= 1
+
+    def add_request(self, cid, channel_item, payload, wsgi_environ, _time=time):
+        """ Adds the request half of a record.
+        """
+        if not self.greenlet:
+            self.greenlet = spawn(self._flush_forever)
+
+        try:
+            payload = self.get_request_payload(channel_item, payload)
+        except Exception, e:
+            logger.warn('Could not mask audit payload of `%s`, storing the record without it, e:`%s`', cid, format_exc(e))
+            payload = None
+
+        # The environment is modified further down the request path, which is why a copy is needed
+        record = AuditRecord(cid, channel_item, dict(wsgi_environ), payload, _time())
+
+        self._make_room(record.size)
+        self.records[cid] = record
+        self.size += record.size
+
+    def add_response(self, cid, response, wsgi_environ):
+        """ Adds the response half of a record whose request half has not been dropped.
+        """
+        record = self.records.get(cid)
+        if not record:
+            return
+
+        record.resp_time = datetime.utcnow()
+        record.resp_environ = dict(wsgi_environ)
+        record.resp_payload = response
+
+        size = len(response or '')
+        record.size += size
+        self.size += size
+        self.complete += 1
+
+        if self.complete >= self.flush_size:
+            self.flush_needed.set()
+
+# ################################################################################################################################
+
+    def _flush_forever(self):
+        while True:
+            self.flush_needed.wait(self.flush_interval)
+            self.flush_needed.clear()
+
+            try:
+                self.flush()
+            except Exception, e:
+                logger.warn('Could not flush HTTP audit log, e:`%s`', format_exc(e))
+
+    def _get_batch(self, now, store_all):
+        """ Removes from the buffer and returns all the complete records as well as ones with no response for too long,
+        or simply all of them if store_all is True.
+        """
+        batch = []
+
+        for record in self.records.itervalues():
+            if store_all or record.resp_time or now - record.created_at > self.in_flight_timeout:
+                batch.append(record)
+
+        for record in batch:
+            del self.records[record.cid]
+            self._forget(record)
+
+        if batch:
+            self.has_room.set()
+
+        return batch
+
+    def _get_row(self, record):
+        channel = record.channel
+        req_environ = record.req_environ
+
+        row = {
+            'conn_id': channel['id'],
+            'cluster_id': self.odb.cluster.id,
+            'name': channel['name'],
+            'cid': record.cid,
+            'transport': channel['transport'],
+            'connection': channel['connection'],
+            'req_time': record.req_time,
+            'user_token': channel['username'],
+            'remote_addr': req_environ.get('HTTP_X_FORWARDED_FOR') or req_environ.get('REMOTE_ADDR', '(None)'),
+            'req_headers': _bytes(self.dump_wsgi_environ(req_environ)),
+            'req_payload': _bytes(record.req_payload),
+            'resp_time': None,
+            'invoke_ok': None,
+            'auth_ok': None,
+            'resp_headers': None,
+            'resp_payload': None,
+        }
+
+        if record.resp_time:
+            status = record.resp_environ['zato.http.response.status']
+
+            row['resp_time'] = record.resp_time
+            row['invoke_ok'] = status[0] not in ('4', '5')
+            row['auth_ok'] = status[0] != '4'
+            row['resp_headers'] = _bytes(self.dump_wsgi_environ(record.resp_environ))
+            row['resp_payload'] = _bytes(record.resp_payload)
+
+        return row
+
+    def stop(self):
+        """ Stops flushing records in background and stores all of them, including ones whose responses
+        will not arrive anymore.
+        """
+        if self.greenlet:
+            self.greenlet.kill()
+            self.greenlet = None
+
+        self.flush(True)
+
+    def flush(self, store_all=False, _time=time):
+        """ Stores all the complete records, and ones with no responses for too long, in ODB.
+        """
+        batch = self._get_batch(_time(), store_all)
+        if not batch:
+            return
+
+        rows = [self._get_row(record) for record in batch]
+        table = HTTSOAPAudit.__table__
+
+        with closing(self.odb.session()) as session:
+            try:
+                for idx in range(0, len(rows), self.flush_size):
+                    session.execute(table.insert(), rows[idx:idx+self.flush_size])
+                session.commit()
+
+            except Exception:
+                session.rollback()
+                self.failed += len(rows)
+                raise
+
+            else:
+                self.stored += len(rows)
+
+# ################################################################################################################################
+
+    def get_stats(self):
+        return {
+            'size': self.size,
+            'max_size': self.max_size,
+            'records': len(self.records),
+            'complete': self.complete,
+            'stored': self.stored,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+
+# ################################################################################################################################
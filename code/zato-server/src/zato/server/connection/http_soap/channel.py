@@ -26,8 +26,8 @@ from paste.util.converters import asbool
 from zato.common import CHANNEL, DATA_FORMAT, HTTP_RESPONSES, SEC_DEF_TYPE, SIMPLE_IO, TOO_MANY_REQUESTS, TRACE1, \
      URL_PARAMS_PRIORITY, URL_TYPE, zato_namespace, ZATO_ERROR, ZATO_NONE, ZATO_OK
 from zato.common.util import payload_from_request
-from zato.server.connection.http_soap import BadRequest, ClientHTTPError, Forbidden, MethodNotAllowed, NotFound, \
-     TooManyRequests, Unauthorized
+from zato.server.connection.http_soap import BadRequest, ClientHTTPError, Forbidden, is_stream, MethodNotAllowed, NotFound, \
+     StreamingBody, TooManyRequests, Unauthorized
 from zato.server.service.internal import AdminService
 
 logger = logging.getLogger(__name__)
@@ -121,6 +121,22 @@ class RequestDispatcher(object):
 
         return soap_action
 
+    def needs_buffered_request(self, channel_item, _sec_types=(SEC_DEF_TYPE.OAUTH, SEC_DEF_TYPE.WSS, SEC_DEF_TYPE.XPATH_SEC)):
+        """ Returns True if a request to a streaming channel must still be read in full before the service is invoked,
+        i.e. if its security definition, its service's SimpleIO or other features of the channel need the whole body.
+        """
+        if channel_item['audit_enabled'] or channel_item.data_format == DATA_FORMAT.POST:
+            return True
+
+        # RBAC may resolve to any security definition, including ones that need the body
+        sec = self.url_data.url_sec[channel_item['match_target']]
+        if sec.sec_use_rbac or (sec.sec_def != ZATO_NONE and sec.sec_def.sec_type in _sec_types):
+            return True
+
+        # SimpleIO services have their requests parsed before they are invoked
+        service_store = self.request_handler.server.service_store
+        return hasattr(service_store.service_data(channel_item.service_impl_name)['service_class'], 'SimpleIO')
+
     def dispatch(self, cid, req_timestamp, wsgi_environ, worker_store, _status_response=status_response,
         no_url_match=(None, False)):
         """ Base method for dispatching incoming HTTP/SOAP messages. If the security
@@ -149,11 +165,15 @@ class RequestDispatcher(object):
         # This is needed in parallel.py's on_wsgi_request
         wsgi_environ['zato.http.channel_item'] = channel_item
 
-        payload = wsgi_environ['wsgi.input'].read()
-
         # OK, we can possibly handle it
         if url_match not in no_url_match:
 
+            # Services mounted on streaming channels read the body themselves, if they need it at all
+            if channel_item.get('is_streaming') and not self.needs_buffered_request(channel_item):
+                payload = StreamingBody(wsgi_environ['wsgi.input'], wsgi_environ.get('CONTENT_LENGTH'))
+            else:
+                payload = wsgi_environ['wsgi.input'].read()
+
             # This is a synchronous call so that whatever happens next we are always
             # able to have at least initial audit log of requests.
             if channel_item['audit_enabled']:
@@ -399,6 +419,11 @@ class RequestHandler(object):
                 else:
                     response.payload = self._get_xml_admin_payload(service_instance, zato_message_template, None)
         else:
+
+            # Streams are sent as they are, in chunks, by HTTPHandler.on_wsgi_request
+            if is_stream(response.payload):
+                return
+
             if not isinstance(response.payload, basestring):
                 if isinstance(response.payload, dict) and data_format in (DATA_FORMAT.JSON, DATA_FORMAT.DICT):
                     response.payload = dumps(response.payload)
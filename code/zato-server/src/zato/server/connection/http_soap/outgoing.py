@@ -33,7 +33,7 @@ from requests.exceptions import Timeout as RequestsTimeout
 from zato.common import CONTENT_TYPE, DATA_FORMAT, Inactive, SEC_DEF_TYPE, soapenv11_namespace, soapenv12_namespace, TimeoutException, \
      URL_TYPE, ZATO_NONE
 from zato.common.util import get_component_name
-from zato.server.connection.queue import ConnectionQueue
+from zato.server.connection.queue import ConnectionQueue, get_queue_config
 
 logger = getLogger(__name__)
 
@@ -396,7 +396,7 @@ class SudsSOAPWrapper(BaseHTTPSOAPWrapper):
         self.conn_type = 'Suds SOAP'
         self.client = ConnectionQueue(
             self.config['pool_size'], self.config['queue_build_cap'], self.config['name'], self.conn_type, self.address,
-            self.add_client)
+            self.add_client, **get_queue_config(self.config))
 
     def set_auth(self):
         """ Configures the security for requests, if any is to be configured at all.
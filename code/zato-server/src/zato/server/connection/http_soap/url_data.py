@@ -10,6 +10,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import logging
+from base64 import b64decode
 from datetime import datetime
 from hashlib import sha256
 from json import dumps, loads
@@ -36,14 +37,20 @@ from zato.bunch import Bunch
 from zato.common import AUDIT_LOG, DATA_FORMAT, MISC, MSG_PATTERN_TYPE, SEC_DEF_TYPE, TRACE1, URL_TYPE, ZATO_NONE
 from zato.common.broker_message import code_to_name, CHANNEL, SECURITY
 from zato.common.dispatch import dispatcher
+from zato.common.lru import LRUCache
 from zato.common.util import parse_tls_channel_security_definition
 from zato.server.connection.http_soap import Forbidden, Unauthorized
-from zato.server.jwt import JWT
+from zato.server.connection.http_soap.audit import AuditBuffer
+from zato.server.jwt import JWT, TokenCache
 
 logger = logging.getLogger(__name__)
 
 _internal_url_path_indicator = '{}/zato/'.format(MISC.SEPARATOR)
 
+_brace_pattern = re_compile('\{[a-zA-Z0-9 _\$.\-|=~^]+\}')
+_regex_special_chars = frozenset('\\^$*+?()[]{}|.')
+_get_name = attrgetter('name')
+
 class Matcher(object):
     """ Matches incoming URL paths in requests received against the pattern it's configured to react to.
     For instance, '/permission/user/{user_id}/group/{group_id}' gets translated and compiled to the regex
@@ -54,7 +61,7 @@ class Matcher(object):
         self.pattern = pattern
         self.matcher = None
         self.is_static = True
-        self._brace_pattern = re_compile('\{[a-zA-Z0-9 _\$.\-|=~^]+\}')
+        self._brace_pattern = _brace_pattern
         self._elem_re_template = r'(?P<{}>[a-zA-Z0-9 _\$.\-|=~^]+)'
         self._set_up_matcher(self.pattern)
 
@@ -85,6 +92,144 @@ class Matcher(object):
         if m:
             return dict(zip(self.group_names, m.groups()))
 
+# ################################################################################################################################
+
+class _RouteNode(object):
+    """ A single node of URLRouter's tree - one per URL path segment.
+    """
+    __slots__ = ('static', 'dynamic', 'items')
+
+    def __init__(self):
+        self.static = {}     # Literal segment -> _RouteNode
+        self.dynamic = None  # _RouteNode for all segments containing at least one {param}
+        self.items = []      # Channels whose patterns end at this node
+
+class URLRouter(object):
+    """ An index of HTTP channels which lets URLData.match find candidate channels for a request without having to run
+    regular expressions of each channel in turn. Channels are indexed by their SOAP action first and then by each
+    URL path segment, literal segments being looked up in a dict and segments with {params} in them sharing
+    a single wildcard branch. The index only narrows down the list of candidates, each of which is still confirmed with
+    its own Matcher, which means that any pattern the index cannot reason about (e.g. one with regex metacharacters
+    in its literal parts) is kept on a fallback list and always treated as a candidate.
+    """
+    def __init__(self, channel_data=()):
+        self.roots = {}     # SOAP action -> _RouteNode
+        self.fallback = []  # Channels that are not indexed and must always be checked
+        self.size = 0
+
+        for item in channel_data:
+            self.add(item)
+
+    def _get_path(self, match_target, _sep=MISC.SEPARATOR, _special=_regex_special_chars):
+        """ Returns a tuple of SOAP action and URL path segments for a given channel or None if its pattern cannot be indexed.
+        """
+        if _sep not in match_target:
+            return None
+
+        soap_action, url_path = match_target.split(_sep, 1)
+        static_parts = _brace_pattern.sub('', match_target)
+
+        if _sep in url_path or _special & set(static_parts):
+            return None
+
+        return soap_action, [('{' in segment, segment) for segment in url_path.split('/')]
+
+    def _walk(self, root, segments, create=False):
+        """ Returns a node that a list of indexed segments leads to, optionally creating all the intermediate nodes.
+        """
+        node = root
+        for is_dynamic, segment in segments:
+
+            if is_dynamic:
+                if node.dynamic is None:
+                    if not create:
+                        return None
+                    node.dynamic = _RouteNode()
+                node = node.dynamic
+
+            else:
+                next_node = node.static.get(segment)
+                if next_node is None:
+                    if not create:
+                        return None
+                    next_node = node.static[segment] = _RouteNode()
+                node = next_node
+
+        return node
+
+    def add(self, item):
+        """ Indexes a new channel.
+        """
+        path = self._get_path(getattr(item, 'match_target', ''))
+
+        if path is None:
+            self.fallback.append(item)
+        else:
+            soap_action, segments = path
+            root = self.roots.get(soap_action)
+            if root is None:
+                root = self.roots[soap_action] = _RouteNode()
+            self._walk(root, segments, True).items.append(item)
+
+        self.size += 1
+
+    def remove(self, item):
+        """ Removes an existing channel from the index, does nothing if it was never indexed. Nodes left empty afterwards
+        are not pruned - there are as many of them as there are distinct URL path segments so they cost little to keep.
+        """
+        path = self._get_path(getattr(item, 'match_target', ''))
+
+        if path is None:
+            items = self.fallback
+        else:
+            soap_action, segments = path
+            root = self.roots.get(soap_action)
+            node = self._walk(root, segments) if root else None
+            items = node.items if node else []
+
+        for idx, existing in enumerate(items):
+            if existing is item:
+                items.pop(idx)
+                self.size -= 1
+                break
+
+    def _collect(self, node, segments, idx, out):
+        if idx == len(segments):
+            out.extend(node.items)
+            return
+
+        segment = segments[idx]
+
+        next_node = node.static.get(segment)
+        if next_node is not None:
+            self._collect(next_node, segments, idx + 1, out)
+
+        # A {param} never matches an empty string
+        if node.dynamic is not None and segment:
+            self._collect(node.dynamic, segments, idx + 1, out)
+
+    def get_candidates(self, soap_action, url_path):
+        """ Returns all the channels that may possibly match the input, sorted by their names, i.e. in the same order
+        that URLData.channel_data uses.
+        """
+        out = self.fallback[:]
+
+        root = self.roots.get(soap_action)
+        if root is not None:
+
+            # Regex's $ matches right before a trailing newline too
+            if url_path.endswith('\n'):
+                url_path = url_path[:-1]
+
+            self._collect(root, url_path.split('/'), 0, out)
+
+        if len(out) > 1:
+            out.sort(key=_get_name)
+
+        return out
+
+# ################################################################################################################################
+
 class OAuthStore(object):
     def __init__(self, oauth_config):
         self.oauth_config = oauth_config
@@ -95,8 +240,13 @@ class URLData(OAuthDataStore):
     def __init__(self, channel_data=None, url_sec=None, basic_auth_config=None, jwt_config=None, ntlm_config=None, \
                  oauth_config=None, tech_acc_config=None, wss_config=None, apikey_config=None, aws_config=None, \
                  openstack_config=None, xpath_sec_config=None, tls_channel_sec_config=None, tls_key_cert_config=None, \
-                 kvdb=None, broker_client=None, odb=None, json_pointer_store=None, xpath_store=None, jwt_secret=None):
+                 kvdb=None, broker_client=None, odb=None, json_pointer_store=None, xpath_store=None, jwt_secret=None, \
+                 url_path_cache_size=MISC.DEFAULT_URL_PATH_CACHE_SIZE, jwt_token_cache_size=MISC.DEFAULT_JWT_TOKEN_CACHE_SIZE,
+                 jwt_renew_interval=MISC.DEFAULT_JWT_RENEW_INTERVAL, audit_writer=AUDIT_LOG.WRITER.SYNC,
+                 audit_flush_size=AUDIT_LOG.DEFAULT_FLUSH_SIZE, audit_flush_interval=AUDIT_LOG.DEFAULT_FLUSH_INTERVAL,
+                 audit_max_buffer_size=AUDIT_LOG.DEFAULT_MAX_BUFFER_SIZE, audit_overflow=AUDIT_LOG.OVERFLOW.DROP_OLDEST):
         self.channel_data = SortedListWithKey(channel_data, key=attrgetter('name'))
+        self.url_router = URLRouter(self.channel_data)
         self.url_sec = url_sec
         self.basic_auth_config = basic_auth_config
         self.jwt_config = jwt_config
@@ -132,7 +282,19 @@ class URLData(OAuthDataStore):
         self._oauth_server.add_signature_method(OAuthSignatureMethod_HMAC_SHA1())
         self._oauth_server.add_signature_method(OAuthSignatureMethod_PLAINTEXT())
 
-        self.url_path_cache = {}
+        # Maps SOAP actions + URL paths to path parameters and channels they matched
+        self.url_path_cache = LRUCache(url_path_cache_size)
+
+        # JWT backends, one for each security definition, all of them sharing verified tokens
+        self.jwt_token_cache = TokenCache(jwt_token_cache_size, jwt_renew_interval)
+        self.jwt_backends = {}
+
+        # Audit records of HTTP channels are stored in bulk, unless each is to be stored in the request path
+        if audit_writer == AUDIT_LOG.WRITER.BUFFERED:
+            self.audit_buffer = AuditBuffer(self.odb, self.get_audit_payload, self._dump_wsgi_environ, audit_flush_size,
+                audit_flush_interval, audit_max_buffer_size * 1024 * 1024, audit_overflow)
+        else:
+            self.audit_buffer = None
 
         dispatcher.listen_for_updates(SECURITY, self.dispatcher_callback)
 
@@ -276,7 +438,7 @@ class URLData(OAuthDataStore):
                 return False
 
         token = authorization.split('Bearer ', 1)[1]
-        result = JWT(self.kvdb, self.odb, self.jwt_secret).validate(token.encode('utf8'))
+        result = self._get_jwt_backend(sec_def.name).validate(token.encode('utf8'))
 
         if not result.valid:
             if enforce_auth:
@@ -487,6 +649,15 @@ class URLData(OAuthDataStore):
 
         return True
 
+# ################################################################################################################################
+
+    def reindex_channels(self):
+        """ Rebuilds the index of channels from scratch - needs to be called each time self.channel_data is modified
+        other than through the methods that create and delete channels, each of which keeps the index up to date by itself.
+        """
+        self.url_router = URLRouter(self.channel_data)
+        self.url_path_cache.clear()
+
 # ################################################################################################################################
 
     def match(self, url_path, soap_action, has_trace1=logger.isEnabledFor(TRACE1)):
@@ -495,33 +666,52 @@ class URLData(OAuthDataStore):
         """
         target = '{}{}{}'.format(soap_action, self._target_separator, url_path)
 
-        # Return from cache if already seen
-        try:
-            return {}, self.url_path_cache[target]
-        except KeyError:
-            needs_user = not url_path.startswith('/zato')
+        # Return from cache if already seen. Path parameters are copied because callers add query string parameters to them.
+        cached = self.url_path_cache.get(target)
+        if cached:
+            match, item = cached
+            return dict(match), item
 
-            for item in self.channel_data:
-                if needs_user and item.match_target_compiled.is_internal:
-                    continue
+        needs_user = not url_path.startswith('/zato')
+
+        for item in self.url_router.get_candidates(soap_action, url_path):
+            if needs_user and item.match_target_compiled.is_internal:
+                continue
 
-                match = item.match_target_compiled.match(target)
-                if match is not None:
-                    if has_trace1:
-                        logger.log(TRACE1, 'Matched target:`%s` with:`%r` and `%r`', target, match, item)
+            match = item.match_target_compiled.match(target)
+            if match is not None:
+                if has_trace1:
+                    logger.log(TRACE1, 'Matched target:`%s` with:`%r` and `%r`', target, match, item)
 
-                    # Cache that URL if it's a static one, i.e. does not contain dynamically computed variables
-                    if item.match_target_compiled.is_static:
-                        self.url_path_cache[target] = item
+                self.url_path_cache.set(target, (dict(match), item))
 
-                    return match, item
+                return match, item
 
-            return None, None
+        return None, None
 
 # ################################################################################################################################
 
+    def get_rbac_auth_hint(self, wsgi_environ, _basic=SEC_DEF_TYPE.BASIC_AUTH, _jwt=SEC_DEF_TYPE.JWT):
+        """ Returns a tuple of the security type a request's Authorization header, if any, was sent for along with
+        the username given on input if it was Basic Auth. Used to skip security definitions that cannot possibly match.
+        """
+        authorization = wsgi_environ.get('HTTP_AUTHORIZATION') or ''
+
+        if authorization.startswith('Basic '):
+            try:
+                username = b64decode(authorization[6:].strip()).decode('utf-8').split(':', 1)[0]
+            except Exception:
+                username = None
+            return _basic, username
+
+        if authorization.startswith('Bearer '):
+            return _jwt, None
+
+        return None, None
+
     def check_rbac_delegated_security(self, sec, cid, channel_item, path_info, payload, wsgi_environ, post_data, worker_store,
-            sep=MISC.SEPARATOR, plain_http=URL_TYPE.PLAIN_HTTP):
+            sep=MISC.SEPARATOR, plain_http=URL_TYPE.PLAIN_HTTP, _basic=SEC_DEF_TYPE.BASIC_AUTH, _jwt=SEC_DEF_TYPE.JWT,
+            _apikey=SEC_DEF_TYPE.APIKEY):
 
         is_allowed = False
 
@@ -532,27 +722,45 @@ class URLData(OAuthDataStore):
             logger.error('Invalid HTTP method `%s`, cid:`%s`', http_method, cid)
             raise Forbidden(cid, 'You are not allowed to access this URL\n')
 
-        for role_id, perm_id, resource_id in worker_store.rbac.registry._allowed.iterkeys():
+        client_defs = worker_store.rbac.get_client_defs(http_method_permission_id, channel_item['service_id'])
+        hint_sec_type, hint_username = self.get_rbac_auth_hint(wsgi_environ)
+
+        for sec_type, sec_names in client_defs.iteritems():
 
             if is_allowed:
                 break
 
-            if perm_id == http_method_permission_id and resource_id == channel_item['service_id']:
-                for client_def in worker_store.rbac.role_id_to_client_def[role_id]:
-                    _, sec_type, sec_name = client_def.split(sep)
+            # Credentials of these types are in the Authorization header so there is no point in checking them if it is not there
+            if sec_type in (_basic, _jwt) and sec_type != hint_sec_type:
+                continue
+
+            for sec_name in sec_names:
+
+                sec_config = self.sec_config_getter[sec_type](sec_name)
+                if not sec_config:
+                    continue
+
+                sec_def = sec_config['config']
+
+                # Skip definitions for other users or for API keys in headers that were not sent
+                if sec_type == _basic and sec_def.username != hint_username:
+                    continue
+
+                if sec_type == _apikey and sec_def.username not in wsgi_environ:
+                    continue
 
-                    sec = Bunch()
-                    sec.is_active = True
-                    sec.transport = plain_http
-                    sec.sec_use_rbac = False
-                    sec.sec_def = self.sec_config_getter[sec_type](sec_name)['config']
+                sec = Bunch()
+                sec.is_active = True
+                sec.transport = plain_http
+                sec.sec_use_rbac = False
+                sec.sec_def = sec_def
 
-                    is_allowed = self.check_security(
-                        sec, cid, channel_item, path_info, payload, wsgi_environ, post_data, worker_store, False)
+                is_allowed = self.check_security(
+                    sec, cid, channel_item, path_info, payload, wsgi_environ, post_data, worker_store, False)
 
-                    if is_allowed:
-                        self.enrich_with_sec_data(wsgi_environ, sec.sec_def, sec_type)
-                        break
+                if is_allowed:
+                    self.enrich_with_sec_data(wsgi_environ, sec.sec_def, sec_type)
+                    break
 
         if not is_allowed:
             logger.error('Cound not find a matching RBAC definition, cid:`%s`', cid)
@@ -623,7 +831,8 @@ class URLData(OAuthDataStore):
 
         # No error, let's delete channel info
         if match_idx != ZATO_NONE:
-            self.channel_data.pop(match_idx)
+            self.url_router.remove(self.channel_data.pop(match_idx))
+            self.url_path_cache.clear()
 
 # ################################################################################################################################
 
@@ -787,6 +996,24 @@ class URLData(OAuthDataStore):
 
 # ################################################################################################################################
 
+    def _get_jwt_backend(self, name):
+        """ Returns a JWT backend for a security definition, creating it first if there is none yet.
+        """
+        backend = self.jwt_backends.get(name)
+        if not backend:
+            backend = self.jwt_backends[name] = JWT(self.kvdb, self.odb, self.jwt_secret, self.jwt_token_cache)
+
+        return backend
+
+    def _delete_jwt_backend(self, name):
+        """ Deletes a security definition's JWT backend and all of the tokens issued to its user that have been cached.
+        """
+        self.jwt_backends.pop(name, None)
+
+        sec_def = self.jwt_config.get(name)
+        if sec_def:
+            self.jwt_token_cache.delete_by_username(sec_def.config.username)
+
     def _update_jwt(self, name, config):
         self.jwt_config[name] = Bunch()
         self.jwt_config[name].config = config
@@ -808,6 +1035,7 @@ class URLData(OAuthDataStore):
         """ Updates an existing JWT security definition.
         """
         with self.url_sec_lock:
+            self._delete_jwt_backend(msg.old_name)
             del self.jwt_config[msg.old_name]
             self._update_jwt(msg.name, msg)
             self._update_url_sec(msg, SEC_DEF_TYPE.JWT)
@@ -817,6 +1045,7 @@ class URLData(OAuthDataStore):
         """
         with self.url_sec_lock:
             self._delete_channel_data('jwt', msg.name)
+            self._delete_jwt_backend(msg.name)
             del self.jwt_config[msg.name]
             self._update_url_sec(msg, SEC_DEF_TYPE.JWT, True)
 
@@ -824,9 +1053,15 @@ class URLData(OAuthDataStore):
         """ Changes password of a JWT security definition.
         """
         with self.url_sec_lock:
+            self._delete_jwt_backend(msg.name)
             self.jwt_config[msg.name]['config']['password'] = msg.password
             self._update_url_sec(msg, SEC_DEF_TYPE.JWT)
 
+    def on_broker_msg_SECURITY_JWT_TOKEN_DELETE(self, msg, *args):
+        """ Deletes a JWT token from the cache of verified ones after a user logged out, possibly on another server.
+        """
+        self.jwt_token_cache.delete_digest(msg.token_digest)
+
 # ################################################################################################################################
 
     def _update_ntlm(self, name, config):
@@ -1116,6 +1351,8 @@ class URLData(OAuthDataStore):
 
             channel_item[name] = msg[name]
 
+        channel_item.is_streaming = msg.get('is_streaming') or False
+
         if msg.get('security_id'):
             channel_item['sec_type'] = msg['sec_type']
             channel_item['security_id'] = msg['security_id']
@@ -1157,16 +1394,19 @@ class URLData(OAuthDataStore):
 
     def _create_channel(self, msg, old_data):
         """ Creates a new channel, both its core data and the related security definition.
-        Clears out URL cache for that entry, if it existed at all.
+        Clears out URL cache because the new channel may now be a better match for URLs already cached.
         """
         match_target = '{}{}{}'.format(msg.soap_action, MISC.SEPARATOR, msg.url_path)
-        self.channel_data.add(self._channel_item_from_msg(msg, match_target, old_data))
+        channel_item = self._channel_item_from_msg(msg, match_target, old_data)
+
+        self.channel_data.add(channel_item)
+        self.url_router.add(channel_item)
         self.url_sec[match_target] = self._sec_info_from_msg(msg)
-        self.url_path_cache.pop(match_target, None)
+        self.url_path_cache.clear()
 
     def _delete_channel(self, msg):
-        """ Deletes a channel, both its core data and the related security definition. Clears relevant
-        entry in URL cache. Returns the deleted data.
+        """ Deletes a channel, both its core data and the related security definition. Clears URL cache
+        so that no URL keeps pointing to the deleted channel. Returns the deleted data.
         """
         old_match_target = '{}{}{}'.format(
             msg.get('old_soap_action'), MISC.SEPARATOR, msg.get('old_url_path'))
@@ -1180,14 +1420,15 @@ class URLData(OAuthDataStore):
         # No error, let's delete channel info
         if match_idx != ZATO_NONE:
             old_data = self.channel_data.pop(match_idx)
+            self.url_router.remove(old_data)
         else:
             old_data = {}
 
         # Channel's security now
         del self.url_sec[old_match_target]
 
-        # Delete from URL cache
-        self.url_path_cache.pop(old_match_target, None)
+        # Clear URL cache
+        self.url_path_cache.clear()
 
         return old_data
 
@@ -1227,16 +1468,20 @@ class URLData(OAuthDataStore):
     def _dump_wsgi_environ(self, wsgi_environ):
         """ A convenience method to dump WSGI environment with all the element repr'ed.
         """
-        # TODO: There should be another copy of WSGI environ added with password masked out
-        env = wsgi_environ.items()
-        for elem in env:
-            if elem[0] == 'zato.http.channel_item':
-                elem[1]['password'] = AUDIT_LOG.REPLACE_WITH
+        env = dict(wsgi_environ)
 
-        return dumps({key: repr(value) for key, value in env})
+        # Channel items are shared by all requests so only their copies can have passwords masked out
+        channel_item = env.get('zato.http.channel_item')
+        if channel_item is not None:
+            channel_item = dict(channel_item)
+            channel_item['password'] = AUDIT_LOG.REPLACE_WITH
+            env['zato.http.channel_item'] = channel_item
 
-    def audit_set_request(self, cid, channel_item, payload, wsgi_environ):
-        """ Stores initial audit information, right after receiving a request.
+        return dumps({key: repr(value) for key, value in env.iteritems()})
+
+    def get_audit_payload(self, channel_item, payload):
+        """ Returns a request's payload as it is to be stored in audit log, i.e. with patterns replaced and no longer
+        than a given channel allows for.
         """
         if channel_item['audit_repl_patt_type'] == MSG_PATTERN_TYPE.JSON_POINTER.id:
             payload = loads(payload) if payload else ''
@@ -1256,6 +1501,17 @@ class URLData(OAuthDataStore):
         if channel_item['audit_max_payload']:
             payload = payload[:channel_item['audit_max_payload']]
 
+        return payload
+
+    def audit_set_request(self, cid, channel_item, payload, wsgi_environ):
+        """ Stores initial audit information, right after receiving a request.
+        """
+        if self.audit_buffer:
+            self.audit_buffer.add_request(cid, channel_item, payload, wsgi_environ)
+            return
+
+        payload = self.get_audit_payload(channel_item, payload)
+
         remote_addr = wsgi_environ.get('HTTP_X_FORWARDED_FOR')
         if not remote_addr:
             remote_addr = wsgi_environ.get('REMOTE_ADDR', '(None)')
@@ -1267,6 +1523,10 @@ class URLData(OAuthDataStore):
     def audit_set_response(self, cid, response, wsgi_environ):
         """ Stores audit info regarding a response to a previous request.
         """
+        if self.audit_buffer:
+            self.audit_buffer.add_response(cid, response, wsgi_environ)
+            return
+
         payload = dumps({
             'cid': cid,
             'invoke_ok': wsgi_environ['zato.http.response.status'][0] not in ('4', '5'),
@@ -20,7 +20,7 @@ import openerplib
 
 # Zato
 from zato.common.util import ping_odoo
-from zato.server.connection.queue import ConnectionQueue
+from zato.server.connection.queue import ConnectionQueue, get_queue_config
 
 # ################################################################################################################################
 
@@ -36,7 +36,8 @@ class OdooWrapper(object):
         self.server = server
         self.url = '{protocol}://{user}:******@{host}:{port}/{database}'.format(**self.config)
         self.client = ConnectionQueue(
-            self.config.pool_size, self.config.queue_build_cap, self.config.name, 'Odoo', self.url, self.add_client)
+            self.config.pool_size, self.config.queue_build_cap, self.config.name, 'Odoo', self.url, self.add_client,
+            validate_func=ping_odoo, **get_queue_config(self.config))
 
         self.update_lock = RLock()
         self.logger = getLogger(self.__class__.__name__)
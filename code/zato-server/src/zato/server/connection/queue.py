@@ -10,112 +10,322 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import logging
-from datetime import datetime, timedelta
+from bisect import bisect_left
+from collections import deque
+from time import time
 
 # gevent
 import gevent
+from gevent import Timeout
+from gevent.event import AsyncResult, Event
 from gevent.lock import RLock
-from gevent.queue import Empty, Queue
+
+# Zato
+from zato.common import MISC
 
 # A set of utilities for constructing greenlets-safe outgoing connection objects.
 # Used, for instance, in SOAP Suds and OpenStack Swift outconns.
 
 logger = logging.getLogger(__name__)
 
+# Upper bounds, in milliseconds, of buckets that times spent waiting for connections are counted in
+_wait_time_buckets = (1, 10, 100, 1000, 10000)
+
+# ################################################################################################################################
+
+def get_queue_config(config):
+    """ Returns keyword arguments for ConnectionQueue out of a given connection's config, including the ones that
+    workers copy to it from server.conf.
+    """
+    return {
+        'max_pool_size': int(int(config['pool_size']) * float(
+            config.get('queue_max_pool_size_factor', MISC.DEFAULT_QUEUE_MAX_POOL_SIZE_FACTOR))),
+        'acquire_timeout': float(config.get('queue_acquire_timeout', MISC.DEFAULT_QUEUE_ACQUIRE_TIMEOUT)),
+        'idle_timeout': float(config.get('queue_idle_timeout', MISC.DEFAULT_QUEUE_IDLE_TIMEOUT)),
+        'validate_after': float(config.get('queue_validate_after', MISC.DEFAULT_QUEUE_VALIDATE_AFTER)),
+    }
+
 # ################################################################################################################################
 
 class _Connection(object):
-    """ Meant to be used as a part of a 'with' block - returns a connection from its queue each time 'with' is entered
-    assuming the queue isn't empty.
+    """ Meant to be used as a part of a 'with' block - returns a connection from its queue each time 'with' is entered,
+    waiting up to timeout seconds for one to be available.
     """
-    def __init__(self, client_queue, conn_name):
-        self.queue = client_queue
-        self.conn_name = conn_name
+    def __init__(self, conn_queue, timeout):
+        self.conn_queue = conn_queue
+        self.timeout = timeout
         self.client = None
 
     def __enter__(self):
-        try:
-            self.client = self.queue.get(block=False)
-        except Empty:
-            self.client = None
-            msg = 'No free connections to `{}`'.format(self.conn_name)
-            logger.error(msg)
-            raise Exception(msg)
-        else:
-            return self.client
+        self.client = self.conn_queue.acquire(self.timeout)
+        return self.client
 
     def __exit__(self, type, value, traceback):
-        if self.client:
-            self.queue.put(self.client)
+        if self.client is not None:
+            self.conn_queue.release(self.client)
 
 # ################################################################################################################################
 
 class ConnectionQueue(object):
-    """ Holds connections to resources. Each time it's called a connection is fetched from its underlying queue
-    assuming any connection is still available.
+    """ Holds connections to resources. Each time it's called a connection is fetched from its underlying queue,
+    possibly after waiting for one to be released, in the order the callers arrived in.
+
+    With max_pool_size greater than pool_size, new connections are established when there are no free ones,
+    and ones beyond pool_size that have not been used for idle_timeout seconds are closed. Connections that have been idle
+    for validate_after seconds are checked with validate_func before they are handed out and ones that fail
+    are replaced with new ones.
     """
-    def __init__(self, pool_size, queue_build_cap, conn_name, conn_type, address, add_client_func):
-        self.queue = Queue(pool_size)
+    def __init__(self, pool_size, queue_build_cap, conn_name, conn_type, address, add_client_func, max_pool_size=None,
+            acquire_timeout=MISC.DEFAULT_QUEUE_ACQUIRE_TIMEOUT, idle_timeout=MISC.DEFAULT_QUEUE_IDLE_TIMEOUT,
+            validate_func=None, validate_after=MISC.DEFAULT_QUEUE_VALIDATE_AFTER, close_func=None):
+        self.pool_size = pool_size
+        self.max_pool_size = max(max_pool_size or pool_size, pool_size)
         self.queue_build_cap = queue_build_cap
         self.conn_name = conn_name
         self.conn_type = conn_type
         self.address = address
         self.add_client_func = add_client_func
+        self.acquire_timeout = acquire_timeout
+        self.idle_timeout = idle_timeout
+        self.validate_func = validate_func
+        self.validate_after = validate_after
+        self.close_func = close_func
         self.keep_connecting = True
 
+        self.idle = deque()    # (client, released_at) of each free connection, most recently released last
+        self.waiters = deque() # AsyncResult of each greenlet waiting for a connection, in order of arrival
+        self.size = 0          # All the connections, whether free or not
+        self.connecting = 0    # Connections being established
+        self.is_built = Event()
+
+        # Statistics
+        self.acquired = 0
+        self.timeouts = 0
+        self.evicted = 0
+        self.shrunk = 0
+        self.max_waiters = 0
+        self.wait_times = [0] * (len(_wait_time_buckets) + 1)
+
         self.logger = logging.getLogger(self.__class__.__name__)
 
-    def __call__(self):
-        return _Connection(self.queue, self.conn_name)
+    def __call__(self, timeout=None):
+        return _Connection(self, self.acquire_timeout if timeout is None else timeout)
+
+# ################################################################################################################################
+
+    def _connect(self):
+        """ Establishes a new connection, which add_client_func is expected to pass to self.put_client.
+        """
+        try:
+            self.add_client_func()
+        except Exception:
+            self.logger.warn('Could not add `%s` client to %s (%s)', self.conn_name, self.address, self.conn_type, exc_info=True)
+        finally:
+            self.connecting -= 1
+
+    def _grow(self):
+        """ Starts to establish a new connection, if there is room for one and not enough are being established already.
+        """
+        if self.keep_connecting and self.size + self.connecting < self.max_pool_size and self.connecting <= len(self.waiters):
+            self._spawn_connect()
+
+    def _spawn_connect(self):
+        self.connecting += 1
+        gevent.spawn(self._connect)
+
+    def _close(self, client):
+        self.size -= 1
+        if self.close_func:
+            try:
+                self.close_func(client)
+            except Exception:
+                self.logger.warn('Could not close `%s` client to %s (%s)', self.conn_name, self.address, self.conn_type,
+                    exc_info=True)
 
     def put_client(self, client):
-        self.queue.put(client)
+        self.size += 1
+        self.release(client)
+
+        if self.size >= self.pool_size:
+            self.is_built.set()
+
         self.logger.info('Added `%s` client to %s (%s)', self.conn_name, self.address, self.conn_type)
 
-    def _build_queue(self):
+# ################################################################################################################################
 
-        start = datetime.utcnow()
-        build_until = start + timedelta(seconds=self.queue_build_cap)
+    def _is_valid(self, client, released_at, now):
+        if not (self.validate_func and self.validate_after and now - released_at >= self.validate_after):
+            return True
 
         try:
-            while self.keep_connecting:
-                while not self.queue.full():
+            self.validate_func(client)
+        except Exception:
+            self.logger.warn('Evicting invalid `%s` client to %s (%s)', self.conn_name, self.address, self.conn_type,
+                exc_info=True)
+            self.evicted += 1
+            self._close(client)
+            return False
+        else:
+            return True
+
+    def acquire(self, timeout=None, _time=time):
+        """ Returns a free connection, waiting up to timeout seconds for one, and raises an exception if there is none.
+        """
+        timeout = self.acquire_timeout if timeout is None else timeout
+        start = _time()
+
+        while True:
+
+            # Unless other greenlets were here first, a free connection can be used straightaway ..
+            if self.idle and not self.waiters:
+                client, released_at = self.idle.pop()
+
+            # .. otherwise, wait in line, possibly establishing a new connection in the meantime.
+            else:
+                self._grow()
+                remaining = start + timeout - _time()
+
+                if remaining <= 0:
+                    self._on_timeout()
+
+                waiter = AsyncResult()
+                self.waiters.append(waiter)
+                self.max_waiters = max(self.max_waiters, len(self.waiters))
+
+                # A timer of our own so as not to confuse ours with any timeout our caller may have set for itself
+                timer = Timeout.start_new(remaining)
+
+                try:
+                    client, released_at = waiter.get()
+                except Timeout, e:
+
+                    # The connection may have been handed over just as the timeout fired ..
+                    if waiter.ready():
+                        client, released_at = waiter.get()
 
-                    gevent.sleep(0.5)
+                        # .. in which case it needs to be given back if it was not our own timeout.
+                        if e is not timer:
+                            self.release(client)
+                            raise
+                    else:
+                        self.waiters.remove(waiter)
 
-                    now = datetime.utcnow()
+                        if e is not timer:
+                            raise
 
-                    self.logger.info('%d/%d %s clients obtained to `%s` (%s) after %s (cap: %ss)',
-                        self.queue.qsize(), self.queue.maxsize, self.conn_type, self.address, self.conn_name, now - start,
-                        self.queue_build_cap)
+                        self._on_timeout()
+                finally:
+                    timer.cancel()
 
-                    if now >= build_until:
+            now = _time()
 
-                        self.logger.warn('Built %s/%s %s clients to `%s` within %s seconds, sleeping until %s',
-                            self.queue.qsize(), self.queue.maxsize, self.conn_type, self.address, self.queue_build_cap, build_until)
-                        gevent.sleep(self.queue_build_cap)
+            if self._is_valid(client, released_at, now):
+                self.acquired += 1
+                self.wait_times[bisect_left(_wait_time_buckets, (now - start) * 1000)] += 1
+                return client
 
-                        start = datetime.utcnow()
-                        build_until = start + timedelta(seconds=self.queue_build_cap)
+            # Establish a replacement connection and try again
+            self._grow()
 
-                self.logger.info(
-                    'Obtained %d %s clients to `%s` for `%s`', self.queue.maxsize, self.conn_type, self.address, self.conn_name)
+    def _on_timeout(self):
+        self.timeouts += 1
+        msg = 'No free connections to `{}`'.format(self.conn_name)
+        logger.error(msg)
+        raise Exception(msg)
+
+    def release(self, client, _time=time):
+        """ Returns a connection to the queue, handing it over to the first greenlet waiting for one, if there are any.
+        """
+        if not self.keep_connecting:
+            self._close(client)
+
+        elif self.waiters:
+            self.waiters.popleft().set((client, _time()))
+
+        else:
+            self.idle.append((client, _time()))
+
+# ################################################################################################################################
+
+    def shrink(self, _time=time):
+        """ Closes connections beyond pool_size that have not been used for idle_timeout seconds.
+        """
+        now = _time()
+
+        while self.size > self.pool_size and self.idle and now - self.idle[0][1] >= self.idle_timeout:
+            client, _ = self.idle.popleft()
+            self._close(client)
+            self.shrunk += 1
+
+    def _shrink_forever(self):
+        while self.keep_connecting:
+            gevent.sleep(self.idle_timeout)
+            self.shrink()
+
+# ################################################################################################################################
+
+    def _build_queue(self):
+
+        start = time()
+
+        try:
+            while self.keep_connecting and not self.is_built.is_set():
+
+                # Connect in parallel, making up for any connections that could not be established previously
+                for x in range(self.pool_size - self.size - self.connecting):
+                    self._spawn_connect()
+
+                if not self.is_built.wait(self.queue_build_cap):
+                    self.logger.warn('Built %s/%s %s clients to `%s` within %s seconds, trying again',
+                        self.size, self.pool_size, self.conn_type, self.address, self.queue_build_cap)
+
+            self.logger.info('Obtained %d %s clients to `%s` for `%s` after %.3fs',
+                self.size, self.conn_type, self.address, self.conn_name, time() - start)
 
-                # Ok, got all the connections
-                return
         except KeyboardInterrupt:
             self.keep_connecting = False
 
     def build_queue(self):
-        """ Spawns greenlets to populate the queue and waits up to self.queue_build_cap seconds until the queue is full.
-        If it never is, raises an exception stating so.
+        """ Establishes pool_size connections in parallel, in background, and keeps trying for each one that cannot
+        be established within self.queue_build_cap seconds.
         """
-        for x in range(self.queue.maxsize):
-            gevent.spawn(self.add_client_func)
-
-        # Build the queue in background
         gevent.spawn(self._build_queue)
 
+        if self.max_pool_size > self.pool_size:
+            gevent.spawn(self._shrink_forever)
+
+    def close(self):
+        """ Closes all the free connections, as well as each one in use as soon as it is released.
+        """
+        self.keep_connecting = False
+
+        while self.idle:
+            client, _ = self.idle.popleft()
+            self._close(client)
+
+# ################################################################################################################################
+
+    def get_stats(self):
+        """ Returns statistics of the queue, including how long it took to acquire connections, in milliseconds.
+        """
+        in_use = self.size - len(self.idle)
+
+        return {
+            'size': self.size,
+            'pool_size': self.pool_size,
+            'max_pool_size': self.max_pool_size,
+            'idle': len(self.idle),
+            'in_use': in_use,
+            'utilisation': in_use / self.max_pool_size if self.max_pool_size else 0.0,
+            'waiters': len(self.waiters),
+            'max_waiters': self.max_waiters,
+            'acquired': self.acquired,
+            'timeouts': self.timeouts,
+            'evicted': self.evicted,
+            'shrunk': self.shrunk,
+            'wait_times': zip(_wait_time_buckets + (None,), self.wait_times),
+        }
+
 # ################################################################################################################################
 
 class Wrapper(object):
@@ -129,11 +339,19 @@ class Wrapper(object):
 
         self.client = ConnectionQueue(
             self.config.pool_size, self.config.queue_build_cap, self.config.name, self.conn_type, self.config.auth_url,
-            self.add_client)
+            self.add_client, validate_func=self.validate_client, close_func=self.close_client, **get_queue_config(self.config))
 
         self.update_lock = RLock()
         self.logger = logging.getLogger(self.__class__.__name__)
 
+    def validate_client(self, client):
+        """ Raises an exception if a connection to be borrowed cannot be used anymore, subclasses may override it.
+        """
+
+    def close_client(self, client):
+        """ Closes a connection that is no longer needed, subclasses may override it.
+        """
+
     def build_queue(self):
         with self.update_lock:
             if self.config.is_active:
@@ -14,11 +14,13 @@ from zato.common import KVDB, TRACE1
 
 logger = logging.getLogger(__name__)
 
-def should_store(kvdb, service_usage, service_name):
-    """ Decides whether a service's request/response pair should be kept in the DB.
+def should_store(kvdb, service_usage, service_name, freq=None):
+    """ Decides whether a service's request/response pair should be kept in the DB. If freq is not given,
+    it will be looked up in the DB.
     """
     key = '{}{}'.format(KVDB.REQ_RESP_SAMPLE, service_name)
-    freq = int(kvdb.conn.hget(key, 'freq') or 0)
+    if freq is None:
+        freq = int(kvdb.conn.hget(key, 'freq') or 0)
 
     if freq and service_usage % freq == 0:
         return key, freq
@@ -34,6 +34,12 @@ class SolrWrapper(Wrapper):
         # Create a client now
         self.client.put_client(Solr(self.config.address, timeout=self.config.timeout))
 
+    def validate_client(self, client):
+        ping_solr(self.config, client.session)
+
+    def close_client(self, client):
+        client.session.close()
+
 class SolrAPI(BaseAPI):
     """ API to obtain ElasticSearch connections through.
     """
@@ -12,7 +12,9 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import uuid
 from contextlib import closing
 from datetime import datetime
+from hashlib import sha256
 from logging import getLogger
+from time import time
 
 # Bunch
 from bunch import bunchify, Bunch
@@ -24,6 +26,8 @@ from cryptography.fernet import Fernet
 import jwt
 
 # Zato
+from zato.common import MISC
+from zato.common.lru import LRUCache
 from zato.common.odb.model import JWT as JWT_
 from zato.server.cache import RobustCache
 
@@ -33,6 +37,61 @@ logger = getLogger(__name__)
 
 # ################################################################################################################################
 
+class TokenCache(object):
+    """ Tokens already verified by a worker, along with their decoded contents, so that further requests with the same
+    tokens need neither KVDB, ODB nor decrypting and decoding them again. Tokens are kept under their digests and no longer
+    than until they would expire in KVDB, which is why their TTLs there are renewed at least every renew_interval seconds
+    or half of their own TTLs, whichever is shorter.
+    """
+    def __init__(self, max_size=MISC.DEFAULT_JWT_TOKEN_CACHE_SIZE, renew_interval=MISC.DEFAULT_JWT_RENEW_INTERVAL):
+        self.cache = LRUCache(max_size)
+        self.renew_interval = renew_interval
+
+    @staticmethod
+    def get_digest(token):
+        return sha256(token).hexdigest()
+
+    def get(self, token, now):
+        """ Returns a cache entry for a token, unless there is none or the token has already expired.
+        """
+        digest = self.get_digest(token)
+        entry = self.cache.get(digest)
+
+        if entry:
+            if now < entry.expires_at:
+                return entry
+            self.cache.delete(digest)
+
+    def set(self, token, token_data, now):
+        """ Adds a token that has just been verified and had its TTL renewed.
+        """
+        self.cache.set(self.get_digest(token), Bunch(token_data=token_data, renewed_at=now, expires_at=now + token_data.ttl))
+
+    def needs_renewal(self, entry, now):
+        return now - entry.renewed_at >= min(self.renew_interval, entry.token_data.ttl / 2.0)
+
+    def renewed(self, entry, now):
+        entry.renewed_at = now
+        entry.expires_at = now + entry.token_data.ttl
+
+    def delete(self, token):
+        self.delete_digest(self.get_digest(token))
+
+    def delete_digest(self, digest):
+        self.cache.delete(digest)
+
+    def delete_by_username(self, username):
+        """ Deletes all tokens issued to a given user.
+        """
+        for digest, entry in self.cache.data.items():
+            if entry.token_data.get('username') == username:
+                self.cache.delete(digest)
+
+    def get_stats(self):
+        return self.cache.get_stats()
+
+# ################################################################################################################################
+
 class JWT(object):
     """ JWT authentication backend.
     """
@@ -40,13 +99,16 @@ class JWT(object):
 
 # ################################################################################################################################
 
-    def __init__(self, kvdb, odb, secret):
+    def __init__(self, kvdb, odb, secret, token_cache=None):
         self.odb = odb
         self.cache = RobustCache(kvdb, odb)
 
         self.secret = secret
         self.fernet = Fernet(self.secret)
 
+        # Optional - without it each validation needs KVDB and renews the token's TTL in both KVDB and ODB
+        self.token_cache = token_cache
+
 # ################################################################################################################################
 
     def _lookup_jwt(self, username, password):
@@ -91,14 +153,29 @@ class JWT(object):
     def validate(self, token):
         """ Check if the given token is (still) valid.
 
-        1. Look for the token in Cache without decrypting/decoding it.
-        2.a If not found, return "Invalid"
-        2.b If found:
-            3. decrypt
-            4. decode
-            5. renew the cache expiration asyncronouysly (do not wait for the update confirmation).
-            5. return "valid" + the token contents
+        1. Look for the token in the token cache, if there is one.
+        2. If found, renew the cache expiration asynchronously but only if it has not been done recently,
+           return "valid" + the token contents
+        3. Look for the token in Cache without decrypting/decoding it.
+        4.a If not found, return "Invalid"
+        4.b If found:
+            5. decrypt
+            6. decode
+            7. renew the cache expiration asyncronouysly (do not wait for the update confirmation).
+            8. add the token to the token cache, if there is one
+            9. return "valid" + the token contents
         """
+        now = time()
+
+        if self.token_cache:
+            entry = self.token_cache.get(token, now)
+            if entry:
+                if self.token_cache.needs_renewal(entry, now):
+                    self.cache.put(token, token, entry.token_data.ttl, async=True)
+                    self.token_cache.renewed(entry, now)
+
+                return Bunch(valid=True, token=entry.token_data)
+
         if self.cache.get(token):
             decrypted = self.fernet.decrypt(token)
             token_data = bunchify(jwt.decode(decrypted, self.secret))
@@ -106,6 +183,9 @@ class JWT(object):
             # renew the token expiration
             self.cache.put(token, token, token_data.ttl, async=True)
 
+            if self.token_cache:
+                self.token_cache.set(token, token_data, now)
+
             return Bunch(valid=True, token=token_data)
         else:
             return Bunch(valid=False, message='Invalid Token')
@@ -113,8 +193,12 @@ class JWT(object):
 # ################################################################################################################################
 
     def delete(self, token):
-        """ Deletes a token in both KVDB and ODB.
+        """ Deletes a token in both KVDB and ODB, as well as in the token cache, if there is one. Other workers need
+        to be notified through SECURITY.JWT_TOKEN_DELETE.
         """
         self.cache.delete(token)
 
+        if self.token_cache:
+            self.token_cache.delete(token)
+
 # ################################################################################################################################
@@ -56,6 +56,7 @@ class ZatoGunicornApplication(Application):
     def init(self, *ignored_args, **ignored_kwargs):
         self.cfg.set('post_fork', self.zato_wsgi_app.post_fork) # Initializes a worker
         self.cfg.set('on_starting', self.zato_wsgi_app.on_starting) # Generates the deployment key
+        self.cfg.set('worker_exit', self.zato_wsgi_app.worker_exit) # Cleans up after a worker
 
         for k, v in self.config_main.items():
             if k.startswith('gunicorn') and v:
@@ -59,11 +59,10 @@ class ParallelBase(object):
                   'req_ts_utc': self.source.time.utcnow()
                 })
 
-            # Invoke targets
-            for name, payload in targets.items():
-                to_json_string = False if isinstance(payload, basestring) else True
-                self.source.invoke_async(name, payload, self.call_channel, to_json_string=to_json_string,
-                    zato_ctx={self.request_ctx_cid_key: cid})
+            # Invoke targets, all of them at once
+            self.source.invoke_async(
+                [(name, payload if isinstance(payload, basestring) else dumps(payload)) for name, payload in targets.items()],
+                self.call_channel, zato_ctx={self.request_ctx_cid_key: cid})
 
         return cid
 
@@ -129,6 +128,6 @@ class ParallelBase(object):
                     invoked_service.kvdb.conn.delete(data_key)
 
     def invoke_callbacks(self, invoked_service, payload, cb_list, channel, cid):
-        for name in cb_list:
-            if name:
-                invoked_service.invoke_async(name, payload, channel, to_json_string=True, zato_ctx={'fanout_cid': cid})
+        cb_list = [(name, payload) for name in cb_list if name]
+        if cb_list:
+            invoked_service.invoke_async(cb_list, channel, to_json_string=True, zato_ctx={'fanout_cid': cid})
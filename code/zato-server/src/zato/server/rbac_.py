@@ -18,7 +18,7 @@ from rbac.acl import Registry as _Registry
 from gevent.lock import RLock
 
 # Zato
-from zato.common import ZATO_NONE
+from zato.common import MISC, ZATO_NONE
 from zato.common.util import make_repr
 
 # ################################################################################################################################
@@ -28,9 +28,10 @@ logger = getLogger('zato_rbac')
 # ################################################################################################################################
 
 class Registry(_Registry):
-    def __init__(self, delete_role_callback):
+    def __init__(self, delete_role_callback, delete_allow_callback=None):
         super(Registry, self).__init__()
         self.delete_role_callback = delete_role_callback
+        self.delete_allow_callback = delete_allow_callback
 
     def delete_role(self, delete_role):
 
@@ -69,9 +70,16 @@ class Registry(_Registry):
             for value in reg_del[name]:
                 del item[value]
 
+        if self.delete_allow_callback:
+            for value in reg_del['_allowed']:
+                self.delete_allow_callback(value)
+
     def delete_allow(self, config):
         del self._allowed[config]
 
+        if self.delete_allow_callback:
+            self.delete_allow_callback(config)
+
     def delete_deny(self, config):
         del self._denied[config]
 
@@ -79,7 +87,7 @@ class Registry(_Registry):
 
 class RBAC(object):
     def __init__(self):
-        self.registry = Registry(self._delete_callback)
+        self.registry = Registry(self._delete_callback, self._delete_allow_callback)
         self.update_lock = RLock()
         self.permissions = {}
         self.http_permissions = {}
@@ -88,6 +96,13 @@ class RBAC(object):
         self.client_def_to_role_id = {}
         self.role_id_to_client_def = {}
 
+        # (perm_id, resource) -> IDs of roles allowed to obtain that permission for that resource
+        self.perm_resource_to_role_id = {}
+
+        # (perm_id, resource) -> security definitions of clients having such roles, built on demand out of the index above
+        # and role_id_to_client_def, cleared whenever either of them changes.
+        self._client_defs = {}
+
 # ################################################################################################################################
 
     def __repr__(self):
@@ -137,6 +152,17 @@ class RBAC(object):
     def _delete_callback(self, id):
         self._rbac_delete_role(id, self.role_id_to_name[id])
 
+    def _delete_allow_callback(self, config):
+        role_id, perm_id, resource = config
+
+        role_ids = self.perm_resource_to_role_id.get((perm_id, resource))
+        if role_ids:
+            role_ids.discard(role_id)
+            if not role_ids:
+                del self.perm_resource_to_role_id[(perm_id, resource)]
+
+        self._client_defs.clear()
+
     def _rbac_delete_role(self, id, name):
         self.role_id_to_name.pop(id)
         self.role_name_to_id.pop(name)
@@ -165,11 +191,13 @@ class RBAC(object):
 
             self.client_def_to_role_id.setdefault(client_def, set()).add(role_id)
             self.role_id_to_client_def.setdefault(role_id, set()).add(client_def)
+            self._client_defs.clear()
 
     def delete_client_role(self, client_def, role_id):
         with self.update_lock:
             self.client_def_to_role_id[client_def].remove(role_id)
             self.role_id_to_client_def[role_id].remove(client_def)
+            self._client_defs.clear()
 
 # ################################################################################################################################
 
@@ -186,6 +214,8 @@ class RBAC(object):
     def create_role_permission_allow(self, role_id, perm_id, resource):
         with self.update_lock:
             self.registry.allow(role_id, perm_id, resource)
+            self.perm_resource_to_role_id.setdefault((perm_id, resource), set()).add(role_id)
+            self._client_defs.clear()
 
     def create_role_permission_deny(self, role_id, perm_id, resource):
         with self.update_lock:
@@ -218,4 +248,26 @@ class RBAC(object):
         """
         return self.is_client_allowed(client_def, self.http_permissions[http_verb], resource)
 
+    def get_client_defs(self, perm_id, resource, sep=MISC.SEPARATOR):
+        """ Returns security definitions of all clients whose roles are allowed to obtain a given permission
+        for a resource, as a dictionary of security types to lists of names of definitions of each type.
+        """
+        key = (perm_id, resource)
+        client_defs = self._client_defs.get(key)
+
+        if client_defs is None:
+            with self.update_lock:
+                client_defs = {}
+
+                for role_id in self.perm_resource_to_role_id.get(key, ()):
+                    for client_def in self.role_id_to_client_def.get(role_id, ()):
+                        _, sec_type, sec_name = client_def.split(sep)
+                        sec_names = client_defs.setdefault(sec_type, [])
+                        if sec_name not in sec_names:
+                            sec_names.append(sec_name)
+
+                self._client_defs[key] = client_defs
+
+        return client_defs
+
 # ################################################################################################################################
@@ -30,13 +30,15 @@ from gevent import Timeout, spawn
 
 # Zato
 from zato.bunch import Bunch
-from zato.common import BROKER, CHANNEL, DATA_FORMAT, KVDB, PARAMS_PRIORITY, ZatoException
+from zato.common import BROKER, CHANNEL, DATA_FORMAT, KVDB, PARAMS_PRIORITY, SERVICE_STATS, ZatoException
 from zato.common.broker_message import SERVICE
+from zato.common.histogram import get_bucket_field
 from zato.common.nav import DictNav, ListNav
 from zato.common.util import uncamelify, new_cid, payload_from_request, service_name_from_impl
 from zato.server.connection import request_response, slow_response
 from zato.server.connection.amqp.outgoing import PublisherFacade
 from zato.server.connection.email import EMailAPI
+from zato.server.connection.http_soap import is_stream, StreamingBody
 from zato.server.connection.jms_wmq.outgoing import WMQFacade
 from zato.server.connection.search import SearchAPI
 from zato.server.connection.zmq_.outgoing import ZMQFacade
@@ -45,6 +47,8 @@ from zato.server.pattern.fanout import FanOut
 from zato.server.pattern.invoke_retry import InvokeRetry
 from zato.server.pattern.parallel import ParallelExec
 from zato.server.service.reqresp import Cloud, Outgoing, Request, Response
+from zato.server.service.reqresp.sio import SIOPlan
+from zato.server.stats import get_index_key
 
 # Not used here in this module but it's convenient for callers to be able to import everything from a single namespace
 from zato.server.service.reqresp.sio import AsIs, CSV, Boolean, Dict, Float, ForceType, Integer, List, ListOfDicts, Nested, \
@@ -123,14 +127,70 @@ class PatternsFacade(object):
 
 # ################################################################################################################################
 
+class _LazyFacade(object):
+    """ Creates a facade when a service accesses it for the first time in a given invocation and stores it in the service's
+    __dict__ so that each subsequent access is a regular attribute look-up. Services which never access a facade never
+    create it, and assigning to the attribute directly, e.g. in tests, replaces the facade altogether.
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self.name = factory.__name__.replace('_get_', '', 1)
+
+    def __get__(self, service, service_class):
+        if service is None:
+            return self
+
+        value = service.__dict__[self.name] = self.factory(service)
+        return value
+
+def _get_outgoing(service):
+    worker_store = service.worker_store
+    out_ftp, out_odoo, out_plain_http, out_soap = worker_store.worker_config.outgoing_connections()
+
+    return Outgoing(
+        PublisherFacade(service.broker_client), out_ftp, WMQFacade(service.broker_client), out_odoo, out_plain_http,
+        out_soap, worker_store.sql_pool_store, worker_store.stomp_outconn_api, ZMQFacade(service.server))
+
+def _get_cloud(service):
+    cloud = Cloud()
+    cloud.openstack.swift = service.worker_store.worker_config.cloud_openstack_swift
+    cloud.aws.s3 = service.worker_store.worker_config.cloud_aws_s3
+
+    return cloud
+
+def _get_email(service):
+    return EMailAPI(service.worker_store.email_smtp_api, service.worker_store.email_imap_api)
+
+def _get_search(service):
+    return SearchAPI(service.worker_store.search_es_api, service.worker_store.search_solr_api)
+
+def _get_patterns(service):
+    return PatternsFacade(service)
+
+def _get_msg(service):
+    worker_store = service.worker_store
+    return MessageFacade(worker_store.msg_ns_store, worker_store.json_pointer_store, worker_store.xpath_store,
+        worker_store.msg_ns_store, service.request.payload, service.time)
+
+# ################################################################################################################################
+
 class Service(object):
     """ A base class for all services deployed on Zato servers, no matter
     the transport and protocol, be it plain HTTP, SOAP, WebSphere MQ or any other,
     regardless whether they're built-in or user-defined ones.
     """
     _filter_by = None
+    _sio_plan = None
     http_method_handlers = {}
 
+    # Created only if a service accesses them
+    outgoing = _LazyFacade(_get_outgoing)
+    cloud = _LazyFacade(_get_cloud)
+    email = _LazyFacade(_get_email)
+    search = _LazyFacade(_get_search)
+    patterns = _LazyFacade(_get_patterns)
+    msg = _LazyFacade(_get_msg)
+
     def __init__(self, *ignored_args, **ignored_kwargs):
         self.logger = logging.getLogger(self.get_name())
         self.server = None
@@ -139,8 +199,6 @@ class Service(object):
         self.channel = None
         self.cid = None
         self.in_reply_to = None
-        self.outgoing = None
-        self.cloud = None
         self.worker_store = None
         self.odb = None
         self.data_format = None
@@ -159,8 +217,8 @@ class Service(object):
         self.name = self.__class__.get_name()
         self.impl_name = self.__class__.get_impl_name()
         self.time = None
-        self.patterns = None
         self.user_config = None
+        self.cache = None
         self.dictnav = DictNav
         self.listnav = ListNav
         self.has_validate_input = False
@@ -216,65 +274,44 @@ class Service(object):
                 method = name.replace('handle_', '')
                 class_.http_method_handlers[method] = getattr(class_, name)
 
+    @classmethod
+    def compile_sio(class_):
+        """ Compiles the service's SimpleIO definition, if there is one, into a plan its requests and responses are
+        handled with. Called when the service is deployed or, if it was not deployed through the service store,
+        on its first invocation.
+        """
+        class_._sio_plan = SIOPlan(class_.SimpleIO) if hasattr(class_, 'SimpleIO') else None
+
     def _init(self):
         """ Actually initializes the service.
         """
         self.odb = self.worker_store.server.odb
         self.kvdb = self.worker_store.kvdb
         self.pubsub = self.worker_store.pubsub
+        self.cache = self.worker_store.cache
 
         self.slow_threshold = self.server.service_store.services[self.impl_name]['slow_threshold']
 
         # For invoking other servers directly
         self.servers = self.server.servers
 
-        # Queues
-        out_amqp = PublisherFacade(self.broker_client)
-        out_jms_wmq = WMQFacade(self.broker_client)
-        out_zmq = ZMQFacade(self.server)
-
-        # Patterns
-        self.patterns = PatternsFacade(self)
-
-        # SQL
-        out_sql = self.worker_store.sql_pool_store
-
-        # Regular outconns
-        out_ftp, out_odoo, out_plain_http, out_soap = self.worker_store.worker_config.outgoing_connections()
-
-        self.outgoing = Outgoing(
-            out_amqp, out_ftp, out_jms_wmq, out_odoo, out_plain_http, out_soap, None,
-            None, out_zmq)
-
-        self.outgoing = Outgoing(
-            out_amqp, out_ftp, out_jms_wmq, out_odoo, out_plain_http, out_soap, out_sql,
-            self.worker_store.stomp_outconn_api, out_zmq)
-
-        # Cloud
-        self.cloud = Cloud()
-        self.cloud.openstack.swift = self.worker_store.worker_config.cloud_openstack_swift
-        self.cloud.aws.s3 = self.worker_store.worker_config.cloud_aws_s3
-
         # Cassandra
         self.cassandra_conn = self.worker_store.cassandra_api
         self.cassandra_query = self.worker_store.cassandra_query_api
 
-        # E-mail
-        self.email = EMailAPI(self.worker_store.email_smtp_api, self.worker_store.email_imap_api)
-
-        # Search
-        self.search = SearchAPI(self.worker_store.search_es_api, self.worker_store.search_solr_api)
-
         is_sio = hasattr(self, 'SimpleIO')
         self.request.http.init(self.wsgi_environ)
 
         if is_sio:
-            self.request.init(is_sio, self.cid, self.SimpleIO, self.data_format, self.transport, self.wsgi_environ)
-            self.response.init(self.cid, self.SimpleIO, self.data_format)
 
-        self.msg = MessageFacade(self.worker_store.msg_ns_store,
-            self.worker_store.json_pointer_store, self.worker_store.xpath_store, self.worker_store.msg_ns_store,
-            self.request.payload, self.time)
+            # The plan may have been inherited from a superclass with a SimpleIO definition of its own
+            sio_plan = self._sio_plan
+            if not sio_plan or sio_plan.sio is not self.SimpleIO:
+                self.compile_sio()
+                sio_plan = self._sio_plan
+
+            self.request.init(is_sio, self.cid, self.SimpleIO, self.data_format, self.transport, self.wsgi_environ, sio_plan)
+            self.response.init(self.cid, self.SimpleIO, self.data_format, sio_plan)
 
     def set_response_data(self, service, **kwargs):
         response = service.response.payload
@@ -345,7 +382,12 @@ class Service(object):
         # (though possibly with attributes), checking for 'not payload' alone won't suffice - this evaluates
         # to False so we'd be parsing the payload again superfluously.
         if not isinstance(payload, ObjectifiedElement) and not payload:
-            payload = payload_from_request(cid, raw_request, data_format, transport)
+
+            # Bodies of requests to streaming channels are not parsed, services read them on their own
+            if isinstance(raw_request, StreamingBody):
+                payload = raw_request
+            else:
+                payload = payload_from_request(cid, raw_request, data_format, transport)
 
         job_type = kwargs.get('job_type')
         channel_params = kwargs.get('channel_params', {})
@@ -478,9 +520,43 @@ class Service(object):
     def invoke_async(self, name, payload='', channel=CHANNEL.INVOKE_ASYNC, data_format=DATA_FORMAT.DICT,
             transport=None, expiration=BROKER.DEFAULT_EXPIRATION, to_json_string=False, cid=None, callback=None,
             zato_ctx={}, environ={}):
-        """ Invokes a service asynchronously by its name.
+        """ Invokes a service asynchronously by its name. Alternatively, name can be a list of (name, payload) tuples,
+        in which case all the services are invoked with a single KVDB round-trip, each of them gets a CID of its own
+        and a list of the CIDs is returned. All the other parameters are shared by all the services invoked.
+        """
+        if isinstance(name, (list, tuple)):
+            msgs = [self._get_async_msg(elem_name, elem_payload, channel, data_format, transport, to_json_string, None,
+                callback, zato_ctx, environ) for elem_name, elem_payload in name]
+
+            # Just like below, messages to targets are received by all the servers
+            to_publish = [msg for has_target, msg in msgs if has_target]
+            to_invoke = [msg for has_target, msg in msgs if not has_target]
+
+            if to_publish:
+                self.broker_client.publish_many(to_publish, expiration=expiration)
+
+            if to_invoke:
+                self.broker_client.invoke_async_many(to_invoke, expiration=expiration)
+
+            return [msg['cid'] for _, msg in msgs]
+
+        has_target, msg = self._get_async_msg(
+            name, payload, channel, data_format, transport, to_json_string, cid, callback, zato_ctx, environ)
+
+        # If we have a target we need to invoke all the servers
+        # and these which are not able to handle the target will drop the message.
+        (self.broker_client.publish if has_target else self.broker_client.invoke_async)(msg, expiration=expiration)
+
+        return msg['cid']
+
+    def _get_async_msg(self, name, payload, channel, data_format, transport, to_json_string, cid, callback, zato_ctx,
+            environ):
+        """ Returns a broker message to invoke a service asynchronously with, along with a flag indicating
+        whether the service is to be invoked on a specific target.
         """
         name, target = self.extract_target(name)
+
+        zato_ctx = dict(zato_ctx)
         zato_ctx['zato.request_ctx.target'] = target
 
         # Let's first find out if the service can be invoked at all
@@ -521,18 +597,17 @@ class Service(object):
         msg['zato_ctx'] = zato_ctx
         msg['environ'] = environ
 
-        # If we have a target we need to invoke all the servers
-        # and these which are not able to handle the target will drop the message.
-        (self.broker_client.publish if target else self.broker_client.invoke_async)(msg, expiration=expiration)
-
-        return cid
+        return bool(target), msg
 
     def pre_handle(self):
         """ An internal method run just before the service sets to process the payload.
         Used for incrementing the service's usage count and storing the service invocation time.
         """
         if self.server.component_enabled.stats:
-            self.usage = self.kvdb.conn.incr('{}{}'.format(KVDB.SERVICE_USAGE, self.name))
+            if self.server.stats_collector:
+                self.usage = self.server.stats_collector.incr_usage(self.name)
+            else:
+                self.usage = self.kvdb.conn.incr('{}{}'.format(KVDB.SERVICE_USAGE, self.name))
 
         self.invocation_time = datetime.utcnow()
 
@@ -556,37 +631,47 @@ class Service(object):
 
             self.processing_time = int(round(proc_time))
 
-            with self.kvdb.conn.pipeline() as pipe:
+            if self.server.stats_collector:
+                self.server.stats_collector.add(
+                    self.name, self.processing_time, self.handle_return_time.strftime('%Y:%m:%d:%H:%M'))
+
+            else:
+                with self.kvdb.conn.pipeline() as pipe:
 
-                pipe.hset('{}{}'.format(KVDB.SERVICE_TIME_BASIC, self.name), 'last', self.processing_time)
-                pipe.rpush('{}{}'.format(KVDB.SERVICE_TIME_RAW, self.name), self.processing_time)
+                    pipe.hset('{}{}'.format(KVDB.SERVICE_TIME_BASIC, self.name), 'last', self.processing_time)
 
-                key = '{}{}:{}'.format(KVDB.SERVICE_TIME_RAW_BY_MINUTE,
-                    self.name, self.handle_return_time.strftime('%Y:%m:%d:%H:%M'))
-                pipe.rpush(key, self.processing_time)
+                    minute = self.handle_return_time.strftime('%Y:%m:%d:%H:%M')
+                    key = '{}{}:{}'.format(KVDB.SERVICE_TIME_HISTOGRAM_BY_MINUTE, self.name, minute)
+                    pipe.hincrby(key, get_bucket_field(self.processing_time), 1)
+                    pipe.hincrby(key, 'sum', self.processing_time)
 
-                # .. we'll have 5 minutes (5 * 60 seconds = 300 seconds)
-                # to aggregate processing times for a given minute and then it will expire
+                    index_key = get_index_key(KVDB.SERVICE_TIME_HISTOGRAM_BY_MINUTE, minute)
+                    pipe.sadd(index_key, self.name)
 
-                # Note that we need Redis 2.1.3+ otherwise the key has just been overwritten
-                pipe.expire(key, 300)
+                    # .. we'll have 5 minutes (5 * 60 seconds = 300 seconds)
+                    # to aggregate processing times for a given minute and then it will expire
 
-                pipe.execute()
+                    # Note that we need Redis 2.1.3+ otherwise the key has just been overwritten
+                    pipe.expire(key, SERVICE_STATS.HISTOGRAM_BY_MINUTE_EXPIRE)
+                    pipe.expire(index_key, SERVICE_STATS.HISTOGRAM_BY_MINUTE_EXPIRE)
+
+                    pipe.execute()
 
         #
         # Sample requests/responses
         #
-        key, freq = request_response.should_store(self.kvdb, self.usage, self.name)
+        freq = self.server.stats_collector.get_req_resp_freq(self.name) if self.server.stats_collector else None
+        key, freq = request_response.should_store(self.kvdb, self.usage, self.name, freq)
         if freq:
 
             # TODO: Don't parse it here and a moment later below
-            resp = (self.response.payload.getvalue() if hasattr(self.response.payload, 'getvalue') else self.response.payload) or ''
+            resp = self._get_sample_response()
 
             data = {
                 'cid': self.cid,
                 'req_ts': self.invocation_time.isoformat(),
                 'resp_ts': self.handle_return_time.isoformat(),
-                'req': self.request.raw_request or '',
+                'req': self._get_sample_request(),
                 'resp':resp,
             }
             request_response.store(self.kvdb, key, self.usage, freq, **data)
@@ -599,8 +684,7 @@ class Service(object):
             if self.processing_time > self.slow_threshold:
 
                 # TODO: Don't parse it here and a moment earlier above
-                resp = (self.response.payload.getvalue() if hasattr(self.response.payload, 'getvalue')
-                        else self.response.payload) or ''
+                resp = self._get_sample_response()
 
                 data = {
                     'cid': self.cid,
@@ -608,11 +692,25 @@ class Service(object):
                     'slow_threshold': self.slow_threshold,
                     'req_ts': self.invocation_time.isoformat(),
                     'resp_ts': self.handle_return_time.isoformat(),
-                    'req': self.request.raw_request or '',
+                    'req': self._get_sample_request(),
                     'resp': resp,
                 }
                 slow_response.store(self.kvdb, self.name, **data)
 
+    def _get_sample_request(self):
+        """ Returns the request to store as a sample or a slow response, streams are never consumed for that purpose.
+        """
+        return '' if isinstance(self.request.raw_request, StreamingBody) else (self.request.raw_request or '')
+
+    def _get_sample_response(self):
+        """ Returns the response to store as a sample or a slow response, streams are never consumed for that purpose.
+        """
+        payload = self.response.payload
+        if is_stream(payload):
+            return ''
+
+        return (payload.getvalue() if hasattr(payload, 'getvalue') else payload) or ''
+
     def translate(self, *args, **kwargs):
         raise NotImplementedError('An initializer should override this method')
 
@@ -125,7 +125,11 @@ class Create(AdminService):
         f.write(payload)
         f.close()
 
-        for service in self.server.service_store.import_services_from_file(file_name, False, current_work_dir):
+        msgs = []
+        services = self.server.service_store.import_services_from_file(
+            file_name, False, current_work_dir, self.server.hot_deploy_config.incremental)
+
+        for service in services:
 
             impl_name = self.server.service_store.name_to_impl_name[service.get_name()]
             service_id = self.server.service_store.impl_name_to_id[impl_name]
@@ -135,13 +139,17 @@ class Create(AdminService):
             msg['id'] = service_id
             msg['action'] = HOT_DEPLOY.AFTER_DEPLOY.value
 
+            msgs.append(msg)
+
+        if msgs:
+
             # Now, it's possible we don't have the broker_client yet - this will happen if we are deploying
             # missing services found on other servers during our own server's startup. In that case we just
             # need to wait a moment for the server we are on to fully initialize.
             while not self.broker_client:
                 sleep(1)
 
-            self.broker_client.publish(msg)
+            self.broker_client.publish_many(msgs)
 
         return True
 
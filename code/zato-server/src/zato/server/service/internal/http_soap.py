@@ -91,7 +91,7 @@ class GetList(AdminService):
         output_optional = ('service_id', 'service_name', 'security_id', 'security_name', 'sec_type',
             'method', 'soap_action', 'soap_version', 'data_format', 'host', 'ping_method', 'pool_size', 'merge_url_params_req',
             'url_params_pri', 'params_pri', 'serialization_type', 'timeout', 'sec_tls_ca_cert_id', Boolean('has_rbac'),
-            'content_type', Boolean('sec_use_rbac'))
+            'content_type', Boolean('sec_use_rbac'), Boolean('is_streaming'))
         output_repeated = True
 
     def get_data(self, session):
@@ -119,7 +119,8 @@ class Create(_CreateEdit):
         input_required = ('cluster_id', 'name', 'is_active', 'connection', 'transport', 'is_internal', 'url_path')
         input_optional = ('service', 'security_id', 'method', 'soap_action', 'soap_version', 'data_format',
             'host', 'ping_method', 'pool_size', Boolean('merge_url_params_req'), 'url_params_pri', 'params_pri',
-            'serialization_type', 'timeout', 'sec_tls_ca_cert_id', Boolean('has_rbac'), 'content_type')
+            'serialization_type', 'timeout', 'sec_tls_ca_cert_id', Boolean('has_rbac'), 'content_type',
+            Boolean('is_streaming'))
         output_required = ('id', 'name')
 
     def handle(self):
@@ -186,6 +187,7 @@ class Create(_CreateEdit):
                 item.has_rbac = input.get('has_rbac') or input.sec_use_rbac or False
                 item.content_type = input.get('content_type')
                 item.sec_use_rbac = input.sec_use_rbac
+                item.is_streaming = input.get('is_streaming') or False
 
                 sec_tls_ca_cert_id = input.get('sec_tls_ca_cert_id')
                 item.sec_tls_ca_cert_id = sec_tls_ca_cert_id if sec_tls_ca_cert_id and sec_tls_ca_cert_id != ZATO_NONE else None
@@ -229,7 +231,8 @@ class Edit(_CreateEdit):
         input_required = ('id', 'cluster_id', 'name', 'is_active', 'connection', 'transport', 'url_path')
         input_optional = ('service', 'security_id', 'method', 'soap_action', 'soap_version', 'data_format',
             'host', 'ping_method', 'pool_size', Boolean('merge_url_params_req'), 'url_params_pri', 'params_pri',
-            'serialization_type', 'timeout', 'sec_tls_ca_cert_id', Boolean('has_rbac'), 'content_type')
+            'serialization_type', 'timeout', 'sec_tls_ca_cert_id', Boolean('has_rbac'), 'content_type',
+            Boolean('is_streaming'))
         output_required = ('id', 'name')
 
     def handle(self):
@@ -301,6 +304,7 @@ class Edit(_CreateEdit):
                 item.has_rbac = input.get('has_rbac') or input.sec_use_rbac or False
                 item.content_type = input.get('content_type')
                 item.sec_use_rbac = input.sec_use_rbac
+                item.is_streaming = input.get('is_streaming') or False
 
                 sec_tls_ca_cert_id = input.get('sec_tls_ca_cert_id')
                 item.sec_tls_ca_cert_id = sec_tls_ca_cert_id if sec_tls_ca_cert_id and sec_tls_ca_cert_id != ZATO_NONE else None
@@ -429,6 +433,18 @@ class GetURLSecurity(AdminService):
         self.response.payload = dumps(response, sort_keys=True, indent=4)
         self.response.content_type = 'application/json'
 
+class GetURLPathCacheStats(AdminService):
+    """ Returns statistics of the cache of URL paths matched by HTTP channels. Each worker has its own cache
+    so the figures are those of the worker this service runs in.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_http_soap_get_url_path_cache_stats_request'
+        response_elem = 'zato_http_soap_get_url_path_cache_stats_response'
+        output_required = (Integer('size'), Integer('max_size'), Integer('hits'), Integer('misses'), Integer('evictions'))
+
+    def handle(self):
+        self.response.payload = self.server.worker_store.request_dispatcher.url_data.url_path_cache.get_stats()
+
 # ################################################################################################################################
 
 class GetAuditConfig(AdminService):
@@ -49,17 +49,19 @@ class DeleteExpired(AdminService):
 # ################################################################################################################################
 
 class InvokeCallbacks(AdminService):
-    """ Invoked when a server is starting - periodically spawns a greenlet invoking consumer URL callbacks.
+    """ Invoked when a server is starting - periodically spawns a greenlet invoking consumer URL callbacks. Invoked with a list
+    of sub_keys on input, invokes the callbacks of these consumers only, once. Members of consumer groups with the fewest
+    messages in flight are invoked first, each with its share of the group's messages.
     """
     def _reject(self, msg_ids, sub_key, consumer, reason):
         self.pubsub.reject(sub_key, msg_ids)
         self.logger.error('Could not deliver messages `%s`, sub_key `%s` to `%s`, reason `%s`', msg_ids, sub_key, consumer, reason)
 
-    def _invoke_callbacks(self):
-        callback_consumers = list(self.pubsub.impl.get_callback_consumers())
+    def _invoke_callbacks(self, sub_keys=None):
+        callback_consumers = list(self.pubsub.impl.get_callback_consumers(sub_keys))
         self.logger.debug('Callback consumers found `%s`', callback_consumers)
 
-        for consumer in callback_consumers:
+        for consumer, max_batch_size in self.pubsub.get_delivery_plan(callback_consumers):
             with self.lock(consumer.sub_key):
                 msg_ids = []
 
@@ -69,7 +71,7 @@ class InvokeCallbacks(AdminService):
                     'results': []
                 }
 
-                messages = self.pubsub.get(consumer.sub_key, get_format=PUB_SUB.GET_FORMAT.JSON.id)
+                messages = self.pubsub.get(consumer.sub_key, max_batch_size, get_format=PUB_SUB.GET_FORMAT.JSON.id)
 
                 for msg in messages:
                     msg_ids.append(msg['metadata']['msg_id'])
@@ -102,6 +104,11 @@ class InvokeCallbacks(AdminService):
         # TODO: self.logger's name should be 'zato_pubsub' so it got logged to the same location
         # the rest of pub/sub does.
 
+        # Messages have just been moved to these consumers' queues
+        if self.request.payload:
+            self._invoke_callbacks(set(loads(self.request.payload)))
+            return
+
         interval = float(self.server.fs_server_config.pubsub.invoke_callbacks_interval)
 
         while True:
@@ -112,24 +119,49 @@ class InvokeCallbacks(AdminService):
 # ################################################################################################################################
 
 class MoveToTargetQueues(AdminService):
-    """ Invoked when a server is starting - periodically spawns a greenlet moving published messages to recipient queues.
+    """ Invoked when a server is starting - spawns a greenlet moving messages to recipient queues as soon as they are
+    published and, in case any was not moved this way, periodically spawns another one doing it for all topics.
     """
-    def _move_to_target_queues(self):
+    def _move_to_target_queues(self, topics=None):
 
+        moved = set()
         overflown = []
 
-        for item in self.pubsub.impl.move_to_target_queues():
+        for item in self.pubsub.impl.move_to_target_queues(topics):
             for result, target_queue, msg_id in item:
+                # A group's queue is shared by all of its members
+                sub_keys = self.pubsub.get_sub_keys_by_queue(target_queue)
+
                 if result == PUB_SUB.MOVE_RESULT.OVERFLOW:
                     self.logger.warn('Message overflow, queue:`%s`, msg_id:`%s`', target_queue, msg_id)
-                    overflown.append((target_queue[target_queue.rfind(':')+1:], msg_id))
+                    overflown.append((sub_keys[0], msg_id))
+                else:
+                    moved.update(sub_keys)
 
         if overflown:
             self.invoke_async(StoreOverflownMessages.get_name(), overflown, to_json_string=True)
 
+        # Consumers with callbacks do not need to wait for InvokeCallbacks to find their messages
+        if moved:
+            sub_keys = [consumer.sub_key for consumer in self.pubsub.impl.get_callback_consumers(moved)]
+            if sub_keys:
+                self.invoke_async(InvokeCallbacks.get_name(), sub_keys, to_json_string=True)
+
         self.logger.debug('Messages moved to target queues')
 
+    def _move_dirty_topics(self):
+        while True:
+            try:
+                topics = self.pubsub.impl.get_dirty_topics()
+                if topics:
+                    self._move_to_target_queues(topics)
+            except Exception, e:
+                self.logger.warn('Could not move messages of dirty topics, e:`%s`', format_exc(e))
+                sleep(1)
+
     def handle(self):
+        spawn(self._move_dirty_topics)
+
         interval = float(self.server.fs_server_config.pubsub.move_to_target_queues_interval)
 
         while True:
@@ -139,6 +171,33 @@ class MoveToTargetQueues(AdminService):
 
 # ################################################################################################################################
 
+class RedeliverGroupMessages(AdminService):
+    """ Invoked when a server is starting - periodically spawns a greenlet putting messages that members of consumer groups
+    did not acknowledge in time back in their groups' queues.
+    """
+    def _redeliver(self, timeout):
+        redelivered = self.pubsub.redeliver_group_messages(timeout)
+        if redelivered:
+            sub_keys = set()
+            for group_queue in redelivered:
+                sub_keys.update(self.pubsub.get_sub_keys_by_queue(group_queue))
+
+            sub_keys = [consumer.sub_key for consumer in self.pubsub.impl.get_callback_consumers(sub_keys)]
+            if sub_keys:
+                self.invoke_async(InvokeCallbacks.get_name(), sub_keys, to_json_string=True)
+
+    def handle(self):
+        config = self.server.fs_server_config.pubsub
+        interval = float(config.get('redeliver_group_messages_interval', PUB_SUB.GROUP_REDELIVERY_INTERVAL))
+        timeout = float(config.get('group_redelivery_timeout', PUB_SUB.GROUP_REDELIVERY_TIMEOUT))
+
+        while True:
+            self.logger.debug('Redelivering messages of consumer groups, interval %rs', interval)
+            spawn(self._redeliver, timeout)
+            sleep(interval)
+
+# ################################################################################################################################
+
 class StoreOverflownMessages(AdminService):
     """ Stores on filesystem messages that were above a consumer's max backlog and marks them as rejected by the consumer.
     """
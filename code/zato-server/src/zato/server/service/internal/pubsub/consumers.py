@@ -35,7 +35,7 @@ class GetList(AdminService):
         input_required = ('cluster_id', 'topic_name')
         output_required = ('id', 'name', 'is_active', 'sec_type', 'client_id', Int('max_depth'), Int('current_depth'),
             Int('in_flight_depth'), 'sub_key', 'delivery_mode')
-        output_optional = (UTC('last_seen'), 'callback')
+        output_optional = (UTC('last_seen'), 'callback', 'group_name')
         output_repeated = True
 
     def get_data(self, session):
@@ -52,6 +52,35 @@ class GetList(AdminService):
 
 # ################################################################################################################################
 
+class GetGroupList(AdminService):
+    """ Returns a list of consumer groups of a topic along with their members and the depth of their shared queues.
+    """
+    class SimpleIO(GetListAdminSIO):
+        request_elem = 'zato_pubsub_consumers_get_group_list_request'
+        response_elem = 'zato_pubsub_consumers_get_group_list_response'
+        input_required = ('cluster_id', 'topic_name')
+        output_required = ('group_name', 'members', Int('member_count'), Int('current_depth'), Int('in_flight_depth'))
+        output_repeated = True
+
+    def handle(self):
+        groups = {}
+
+        with closing(self.odb.session()) as session:
+            for item in pubsub_consumer_list(session, self.request.input.cluster_id, self.request.input.topic_name)[0]:
+                if item.group_name:
+                    groups.setdefault(item.group_name, []).append(item)
+
+        for group_name, members in sorted(groups.items()):
+            self.response.payload.append({
+                'group_name': group_name,
+                'members': ', '.join(sorted(member.name for member in members)),
+                'member_count': len(members),
+                'current_depth': self.pubsub.get_group_queue_current_depth(self.request.input.topic_name, group_name),
+                'in_flight_depth': sum(self.pubsub.get_consumer_queue_in_flight_depth(member.sub_key) for member in members),
+            })
+
+# ################################################################################################################################
+
 class GetInfo(AdminService):
     """ Returns basic information regarding a consumer.
     """
@@ -113,7 +142,7 @@ class Create(_CreateEdit):
         request_elem = 'zato_pubsub_consumers_create_request'
         response_elem = 'zato_pubsub_consumers_create_response'
         input_required = ('cluster_id', 'client_id', 'topic_name', 'is_active', 'max_depth', 'delivery_mode')
-        input_optional = ('callback_id',)
+        input_optional = ('callback_id', 'group_name')
         output_required = ('id', 'name', 'sub_key')
 
     def handle(self):
@@ -133,7 +162,7 @@ class Create(_CreateEdit):
                 sub_key = new_cid()
                 consumer = PubSubConsumer(
                     None, input.is_active, sub_key, input.max_depth, input.delivery_mode, callback[0],
-                    callback[2], topic.id, input.client_id, input.cluster_id)
+                    callback[2], topic.id, input.client_id, input.cluster_id, input.get('group_name') or None)
 
                 session.add(consumer)
                 session.commit()
@@ -150,6 +179,7 @@ class Create(_CreateEdit):
                 input.sub_key = sub_key
                 input.callback_name = callback[1]
                 input.callback_type = callback[2]
+                input.group_name = consumer.group_name
                 self.broker_client.publish(input)
 
             self.response.payload.id = consumer.id
@@ -165,7 +195,7 @@ class Edit(_CreateEdit):
         request_elem = 'zato_pubsub_consumers_edit_request'
         response_elem = 'zato_pubsub_consumers_edit_response'
         input_required = ('id', 'is_active', 'max_depth', 'delivery_mode')
-        input_optional = ('callback_id',)
+        input_optional = ('callback_id', 'group_name')
         output_required = ('id', 'name')
 
     def handle(self):
@@ -186,6 +216,7 @@ class Edit(_CreateEdit):
                 consumer.max_depth = input.max_depth
                 consumer.delivery_mode = input.delivery_mode
                 consumer.callback_id = callback[0]
+                consumer.group_name = input.get('group_name') or None
 
                 client_id = consumer.sec_def.id
                 client_name = consumer.sec_def.name
@@ -211,6 +242,7 @@ class Edit(_CreateEdit):
                 msg.sub_key = consumer.sub_key
                 msg.delivery_mode = consumer.delivery_mode
                 msg.callback_id = consumer.callback_id
+                msg.group_name = consumer.group_name
 
                 msg.client_id = client_id
                 msg.client_name = client_name
@@ -23,7 +23,7 @@ from zato.common.broker_message import SECURITY
 from zato.common.odb.model import Cluster, JWT
 from zato.common.odb.query import jwt_list
 from zato.server.connection.http_soap import Unauthorized
-from zato.server.jwt import JWT as JWTBackend
+from zato.server.jwt import JWT as JWTBackend, TokenCache
 from zato.server.service import Integer
 from zato.server.service.internal import AdminService, AdminSIO, ChangePasswordBase, GetListAdminSIO
 
@@ -236,6 +236,13 @@ class LogOut(AdminService):
 
         try:
             JWTBackend(self.kvdb, self.odb, self.server.fs_server_config.misc.jwt_secret).delete(token)
+
+            # Let all the workers know they should no longer consider the token verified
+            self.broker_client.publish({
+                'action': SECURITY.JWT_TOKEN_DELETE.value,
+                'token_digest': TokenCache.get_digest(token),
+            })
+
         except Exception, e:
             self.logger.warn(format_exc(e))
             self.response.status_code = BAD_REQUEST
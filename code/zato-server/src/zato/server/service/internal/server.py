@@ -15,8 +15,13 @@ from traceback import format_exc
 # Zato
 from zato.common import ZatoException
 from zato.common.odb.model import Server
+from zato.server.connection.queue import ConnectionQueue
+from zato.server.service import Float, Integer, List
 from zato.server.service.internal import AdminService, AdminSIO
 
+# Types of outgoing connections that may keep a queue of connections, as named in worker config
+_queue_conn_types = ('cloud_aws_s3', 'cloud_openstack_swift', 'out_odoo', 'out_soap', 'search_solr')
+
 class Edit(AdminService):
     """ Updates a server.
     """
@@ -110,3 +115,84 @@ class Delete(AdminService):
                 self.logger.error(msg)
 
                 raise
+
+class GetBrokerDispatchStats(AdminService):
+    """ Returns statistics of the pool of greenlets handling broker messages. Each worker has its own pool
+    so the figures are those of the worker this service runs in. All of them are 0 if the pool is not used.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_server_get_broker_dispatch_stats_request'
+        response_elem = 'zato_server_get_broker_dispatch_stats_response'
+        output_required = (Integer('size'), Integer('in_use'), Integer('dispatched'), Integer('failed'),
+            Integer('saturated'), Integer('max_in_use'))
+
+    def handle(self):
+        dispatch_pool = self.server.broker_client.dispatch_pool
+
+        if dispatch_pool:
+            self.response.payload = dispatch_pool.get_stats()
+        else:
+            self.response.payload = dict((elem.name, 0) for elem in self.SimpleIO.output_required)
+
+class GetBrokerQueueStats(AdminService):
+    """ Returns statistics of the queue of messages invoked asynchronously, as seen by the worker this service runs in.
+    Queue depth and the number of in-flight messages are as of the worker's last heartbeat. All of them are 0 if
+    the queue is not used.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_server_get_broker_queue_stats_request'
+        response_elem = 'zato_server_get_broker_queue_stats_response'
+        output_required = (Integer('queue_depth'), Integer('in_flight'), Integer('delivered'), Integer('recovered'))
+
+    def handle(self):
+        async_queue = self.server.broker_client.async_queue
+
+        if async_queue:
+            self.response.payload = async_queue.get_stats()
+        else:
+            self.response.payload = dict((elem.name, 0) for elem in self.SimpleIO.output_required)
+
+class GetServiceCacheStats(AdminService):
+    """ Returns statistics of the cache services access as self.cache. Each worker keeps its own entries in memory
+    so the figures are those of the worker this service runs in.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_server_get_service_cache_stats_request'
+        response_elem = 'zato_server_get_service_cache_stats_response'
+        output_required = (Integer('size'), Integer('max_size'), Integer('evictions'), Integer('local_hits'),
+            Integer('kvdb_hits'), Integer('kvdb_misses'), Float('hit_ratio'), Float('local_hit_ratio'),
+            Integer('odb_pending'), Integer('odb_flushed'))
+
+    def handle(self):
+        self.response.payload = self.server.worker_store.cache.get_stats()
+
+class GetConnectionQueueStats(AdminService):
+    """ Returns statistics of the queue of connections of an outgoing connection by its type and name. Each worker has
+    its own queues so the figures are those of the worker this service runs in.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_server_get_connection_queue_stats_request'
+        response_elem = 'zato_server_get_connection_queue_stats_response'
+        input_required = ('type', 'name')
+        output_required = (Integer('size'), Integer('pool_size'), Integer('max_pool_size'), Integer('idle'), Integer('in_use'),
+            Float('utilisation'), Integer('waiters'), Integer('max_waiters'), Integer('acquired'), Integer('timeouts'),
+            Integer('evicted'), Integer('shrunk'), List('wait_times'))
+
+    def handle(self):
+        conn_type = self.request.input.type
+        name = self.request.input.name
+
+        if conn_type not in _queue_conn_types:
+            raise ZatoException(self.cid, 'Type `{}` is not one of `{}`'.format(conn_type, _queue_conn_types))
+
+        if conn_type == 'search_solr':
+            wrapper = self.server.worker_store.search_solr_api.get(name, True).conn
+        else:
+            wrapper = getattr(self.server.worker_store.worker_config, conn_type)[name].conn
+
+        queue = getattr(wrapper, 'client', None)
+
+        if not isinstance(queue, ConnectionQueue):
+            raise ZatoException(self.cid, 'Connection `{}` ({}) does not use a queue of connections'.format(name, conn_type))
+
+        self.response.payload = queue.get_stats()
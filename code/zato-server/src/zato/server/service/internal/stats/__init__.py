@@ -31,11 +31,14 @@ from scipy import stats as sp_stats
 # Zato
 from zato.common import KVDB, SECONDS_IN_DAY, StatsElem, ZatoException
 from zato.common.broker_message import STATS
+from zato.common.histogram import Histogram, PERCENTILES
 from zato.common.odb.model import Service
 from zato.server.service import Integer, UTC
 from zato.server.service.internal import AdminService, AdminSIO
+from zato.server.stats import get_aggr_values, get_index_key, get_service_names, get_slice_suffixes
 
 STATS_KEYS = ('usage', 'max', 'rate', 'mean', 'min')
+PERCENTILE_KEYS = tuple(name for name, _ in PERCENTILES)
 
 def stop_excluding_rrset(freq, start, stop):
     rrs = rruleset()
@@ -60,6 +63,47 @@ class Delete(AdminService):
 
 # ##############################################################################
 
+class RebuildIndex(AdminService):
+    """ Adds statistics stored by previous versions, which did not index them, to indexes of their time slices.
+    Keys are found with SCAN rather than KEYS so it is safe to run it against a busy KVDB.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_stats_rebuild_index_request'
+        response_elem = 'zato_stats_rebuild_index_response'
+        output_required = (Integer('keys_indexed'),)
+
+    # Prefixes of all keys that are indexed along with how many parts their time slice suffixes consist of
+    prefixes = (
+        (KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, 5),
+        (KVDB.SERVICE_TIME_AGGREGATED_BY_HOUR, 4),
+        (KVDB.SERVICE_TIME_AGGREGATED_BY_DAY, 3),
+        (KVDB.SERVICE_TIME_AGGREGATED_BY_MONTH, 2),
+        (KVDB.SERVICE_SUMMARY_BY_DAY, 3),
+        (KVDB.SERVICE_SUMMARY_BY_WEEK, 3),
+        (KVDB.SERVICE_SUMMARY_BY_MONTH, 2),
+        (KVDB.SERVICE_SUMMARY_BY_YEAR, 1),
+    )
+
+    def handle(self):
+        expire_after = int(self.server.fs_server_config.get('stats', {}).get('expire_after', 24)) * 60 * 60
+        keys_indexed = 0
+
+        for prefix, suffix_parts in self.prefixes:
+            with self.kvdb.conn.pipeline() as pipe:
+                for key in self.kvdb.conn.scan_iter('{}*'.format(prefix)):
+                    elems = key[len(prefix):].split(':')
+                    index_key = get_index_key(prefix, ':'.join(elems[-suffix_parts:]))
+
+                    pipe.sadd(index_key, ':'.join(elems[:-suffix_parts]))
+                    pipe.expire(index_key, expire_after)
+                    keys_indexed += 1
+
+                pipe.execute()
+
+        self.response.payload.keys_indexed = keys_indexed
+
+# ##############################################################################
+
 class BaseAggregatingService(AdminService):
     """ A base class for all services that process statistics into aggregated values.
     """
@@ -93,22 +137,29 @@ class BaseAggregatingService(AdminService):
         else:
             return 0, 0, 0, 0
 
-    def collect_service_stats(self, keys_pattern, key_prefix, key_suffix, total_seconds,
-                              suffix_needs_colon=True, chop_off_service_name=True, needs_rate=True):
-
+    def collect_service_stats(self, key_prefix, suffixes, total_seconds, needs_rate=True):
+        """ Collects statistics of all the services that have any data under a given prefix
+        in time slices represented by suffixes.
+        """
         service_stats = {}
-        if suffix_needs_colon:
-            key_suffix = ':' + key_suffix
+        pairs = []
+
+        for suffix, service_names in zip(suffixes, get_service_names(self.kvdb.conn, key_prefix, suffixes)):
+            pairs.extend((service_name, suffix) for service_name in service_names)
 
-        for key in self.kvdb.conn.keys(keys_pattern):
-            service_name = key.replace(key_prefix, '').replace(key_suffix, '')
-            if chop_off_service_name:
-                service_name = service_name[:-3]
+        for (service_name, suffix), values in zip(pairs, get_aggr_values(self.kvdb.conn, key_prefix, pairs)):
 
-            values = self.kvdb.conn.hgetall(key)
+            # An index may still list a service whose data has just expired
+            if not values:
+                continue
 
             stats = service_stats.setdefault(service_name, {})
 
+            # Data aggregated before histograms were introduced will not have any
+            histogram = Histogram.from_dict(values)
+            if histogram:
+                stats.setdefault('histogram', Histogram()).merge(histogram)
+
             for name in STATS_KEYS:
 
                 value = values.get(name)
@@ -140,6 +191,12 @@ class BaseAggregatingService(AdminService):
             if mean:
                 values['mean'] = sp_stats.tmean(mean)
 
+            # A merged histogram gives an exact mean, weighted by usage, and percentiles of the whole period
+            histogram = values.get('histogram')
+            if histogram:
+                values['mean'] = histogram.mean
+                values.update(histogram.get_percentiles())
+
             if needs_rate:
                 values['rate'] = values['usage'] / total_seconds
 
@@ -160,31 +217,83 @@ class BaseAggregatingService(AdminService):
             total_seconds = mdays[delta_diff.month] * SECONDS_IN_DAY # TODO: Use calendar.monthrange instead of mdays so leap years are taken into account
 
         key_suffix = delta_diff.strftime(source_strftime_format)
-        service_stats = self.collect_service_stats(
-            '{}*:{}*'.format(source, key_suffix), source, key_suffix, total_seconds)
+        service_stats = self.collect_service_stats(source, get_slice_suffixes(key_suffix), total_seconds)
 
         self.hset_aggr_keys(service_stats, target, key_suffix)
 
+    def get_histogram_stats(self, histogram, total_seconds):
+        """ Returns basic statistics, percentiles and the histogram itself in a form suitable for storing as aggregated data.
+        """
+        values = histogram.to_dict()
+        values.update(histogram.get_percentiles())
+        values.update({
+            'min': histogram.min,
+            'max': histogram.max,
+            'mean': histogram.mean,
+            'usage': histogram.count,
+            'rate': histogram.count / total_seconds,
+        })
+
+        return values
+
     def hset_aggr_keys(self, service_stats, key_prefix, key_suffix):
+        all_values = {}
+
         for service_name, values in service_stats.items():
-            if service_name.endswith(':'):
-                service_name = service_name[:-1]
+            aggr_values = all_values[service_name] = dict((name, values[name]) for name in STATS_KEYS)
 
-            aggr_key = '{}{}:{}'.format(key_prefix, service_name, key_suffix)
-            for name in STATS_KEYS:
-                self.hset_aggr_key(aggr_key, name, values[name])
+            histogram = values.get('histogram')
+            if histogram:
+                aggr_values.update(histogram.to_dict())
+                aggr_values.update((name, values[name]) for name in PERCENTILE_KEYS)
+
+        self.hset_aggr_values(key_prefix, key_suffix, all_values)
 
-    def hset_aggr_key(self, aggr_key, hash_key, hash_value):
-        self.server.kvdb.conn.hset(aggr_key, hash_key, hash_value)
+    def hset_aggr_values(self, key_prefix, key_suffix, all_values):
+        """ Stores aggregated values of services, given as a dictionary keyed by service names, in a time slice
+        represented by key_suffix and adds the services to that slice's index.
+        """
+        if not all_values:
+            return
 
-        # Expire the aggregated key after that many hours
+        # Expire the aggregated keys after that many hours
         expire_after = int(self.server.fs_server_config.get('stats', {}).get('expire_after', 24))
         expire_after = expire_after * 60 * 60 # Hours times minutes in an hour and seconds in a minute
-        self.server.kvdb.conn.expire(aggr_key, expire_after)
+
+        index_key = get_index_key(key_prefix, key_suffix)
+
+        with self.server.kvdb.conn.pipeline() as pipe:
+            for service_name, values in all_values.items():
+                aggr_key = '{}{}:{}'.format(key_prefix, service_name, key_suffix)
+                pipe.hmset(aggr_key, values)
+                pipe.expire(aggr_key, expire_after)
+
+            pipe.sadd(index_key, *all_values.keys())
+            pipe.expire(index_key, expire_after)
+            pipe.execute()
+
+    def set_all_time_stats(self, service_name, batch_min, batch_max, batch_mean):
+        """ Updates all-time minimum, maximum and mean processing times of a service with those from a new batch.
+        """
+        key = KVDB.SERVICE_TIME_BASIC + service_name
+        current_min, current_max, current_mean = self.server.kvdb.conn.hmget(key, 'min_all_time', 'max_all_time', 'mean_all_time')
+
+        current_min = float(current_min or batch_min)
+        current_max = float(current_max or 0)
+        current_mean = float(current_mean or batch_mean)
+
+        self.server.kvdb.conn.hmset(key, {
+            'min_all_time': min(current_min, batch_min),
+            'max_all_time': max(current_max, batch_max),
+            'mean_all_time': sp_stats.tmean((batch_mean, current_mean)),
+        })
 
 # ##############################################################################
 
 class ProcessRawTimes(BaseAggregatingService):
+    """ Processes raw lists of processing times. Services no longer store them, they are kept in per-minute histograms
+    instead, but lists created by previous versions may still exist.
+    """
     def handle(self):
 
         if not self.stats_enabled():
@@ -201,24 +310,16 @@ class ProcessRawTimes(BaseAggregatingService):
             key, value = item.split('=')
             config[key] = int(value)
 
-        for key in self.server.kvdb.conn.keys(KVDB.SERVICE_TIME_RAW + '*'):
+        # There are no new raw lists so there is no index of them either and SCAN needs to be used
+        for key in self.server.kvdb.conn.scan_iter(KVDB.SERVICE_TIME_RAW + '*'):
 
             service_name = key.replace(KVDB.SERVICE_TIME_RAW, '')
 
-            current_mean = float(
-                self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'mean_all_time') or 0)
-            current_min = float(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'min_all_time') or 0)
-            current_max = float(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'max_all_time') or 0)
-
             batch_min, batch_max, batch_mean, batch_total = self.aggregate_raw_times(
                 key, service_name, config.max_batch_size)
 
-            self.server.kvdb.conn.hset(
-               KVDB.SERVICE_TIME_BASIC + service_name, 'mean_all_time', sp_stats.tmean((batch_mean, current_mean)))
-            self.server.kvdb.conn.hset(
-               KVDB.SERVICE_TIME_BASIC + service_name, 'min_all_time', min(current_min, batch_min))
-            self.server.kvdb.conn.hset(
-                KVDB.SERVICE_TIME_BASIC + service_name, 'max_all_time', max(current_max, batch_max))
+            if batch_total:
+                self.set_all_time_stats(service_name, batch_min, batch_max, batch_mean)
 
             # Services use RPUSH for storing raw times so we are safe to use LTRIM
             # in order to do away with the already processed ones
@@ -227,7 +328,7 @@ class ProcessRawTimes(BaseAggregatingService):
 # ##############################################################################
 
 class AggregateByMinute(BaseAggregatingService):
-    """ Aggregates per-minute times.
+    """ Aggregates per-minute histograms of processing times.
     """
     def handle(self):
 
@@ -237,26 +338,28 @@ class AggregateByMinute(BaseAggregatingService):
         # Get all keys from a minute that is sure to have passed, for instance,
         # say it's 13:19 right now (regardless of the seconds part), we'll process everything
         # that happened in 13:17. Hence it's also important that any changes in the minutes
-        # to be picked up here below be kept in sync with the EXPIRE command Service._post_handle uses.
+        # to be picked up here below be kept in sync with SERVICE_STATS.HISTOGRAM_BY_MINUTE_EXPIRE.
 
         now = datetime.utcnow()
         key_suffix = (now - timedelta(minutes=2)).strftime('%Y:%m:%d:%H:%M')
 
-        for key in self.server.kvdb.conn.keys('{}*:{}'.format(KVDB.SERVICE_TIME_RAW_BY_MINUTE, key_suffix)):
+        service_names = get_service_names(self.kvdb.conn, KVDB.SERVICE_TIME_HISTOGRAM_BY_MINUTE, [key_suffix])[0]
+        pairs = [(service_name, key_suffix) for service_name in service_names]
+        all_values = {}
 
-            service_name = key.replace(KVDB.SERVICE_TIME_RAW_BY_MINUTE, '').replace(':' + key_suffix, '')
-            aggr_key = '{}{}:{}'.format(KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, service_name, key_suffix)
+        for (service_name, _), data in zip(pairs, get_aggr_values(self.kvdb.conn, KVDB.SERVICE_TIME_HISTOGRAM_BY_MINUTE, pairs)):
 
-            batch_min, batch_max, batch_mean, batch_total = self.aggregate_raw_times(key, service_name)
+            histogram = Histogram.from_dict(data)
+            if not histogram:
+                continue
 
-            self.hset_aggr_key(aggr_key, 'min', batch_min)
-            self.hset_aggr_key(aggr_key, 'max', batch_max)
-            self.hset_aggr_key(aggr_key, 'mean', batch_mean)
-            self.hset_aggr_key(aggr_key, 'usage', batch_total)
-            self.hset_aggr_key(aggr_key, 'rate', batch_total / 60.0) # I.e. req/s
+            # The histogram is stored along with the aggregated values so that it can be merged into per-hour ones later on
+            values = all_values[service_name] = self.get_histogram_stats(histogram, 60.0) # I.e. req/s
+            self.set_all_time_stats(service_name, values['min'], values['max'], values['mean'])
 
-            # Raw per-minute statistics keys will expire by themselves, we don't need
-            # to delete them manually.
+        self.hset_aggr_values(KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, key_suffix, all_values)
+
+        # Per-minute histograms will expire by themselves, we don't need to delete them manually.
 
 class AggregateByHour(BaseAggregatingService):
     """ Creates per-hour stats.
@@ -315,7 +418,7 @@ class StatsReturningService(AdminService):
         input_optional = ('service_name', Integer('n'), 'n_type')
         output_optional = ('service_name', 'usage', 'mean', 'rate', 'time', 'usage_trend', 'mean_trend',
             'min_resp_time', 'max_resp_time', 'all_services_usage', 'all_services_time',
-            'mean_all_services', 'usage_perc_all_services', 'time_perc_all_services')
+            'mean_all_services', 'usage_perc_all_services', 'time_perc_all_services') + PERCENTILE_KEYS
 
     stats_key_prefix = KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE
 
@@ -382,53 +485,65 @@ class StatsReturningService(AdminService):
             suffixes = self.get_suffixes(start, stop)
 
         # We make several passes. First two passes are made over Redis keys, one gathers the services, if any at all,
-        # and another one actually collects statistics for each service found. Next pass, a partly optional one,
+        # from indexes of time slices and another one actually collects statistics for each service found. Next pass, a partly optional one,
         # computes trends for mean response time and service usage. Another one computes each of the service's
         # average rate and updates other attributes basing on values collected in the previous step.
         # Optionally, the last one will pick only top n elements of a given type (top mean response time
         # or top usage).
 
+        # Pairs of services and time slices that there is any data for
+        pairs = []
+
         # 1st pass
-        for suffix in suffixes:
-            keys = self.server.kvdb.conn.keys('{}{}:{}'.format(stats_key_prefix, service, suffix))
-            for key in keys:
-                service_name = key.replace(stats_key_prefix, '').replace(':{}'.format(suffix), '')
-
-                stats_elem = StatsElem(service_name)
-                stats_elems[service_name] = stats_elem
-
-                # When building statistics, we can't expect there will be data for all the time
-                # elems built above so to guard against it, this is a dictionary whose keys are the
-                # said elems and values are mean/usage for each elem. The values will remain
-                # 0/0.0 if there is no data for the time elem, which may mean that in this
-                # particular time slice the service wasn't invoked at all.
-                stats_elem.expected_time_elems = OrderedDict(
-                    (elem, Bunch({'mean':0, 'usage':0.0})) for elem in suffixes)
+        for suffix, service_names in zip(suffixes, get_service_names(self.server.kvdb.conn, stats_key_prefix, suffixes)):
+            for service_name in service_names:
+
+                if service != '*' and service_name != service:
+                    continue
+
+                pairs.append((service_name, suffix))
+
+        # Histograms of all the time slices, merged per service
+        histograms = {}
 
         # 2nd pass
-        for service, stats_elem in stats_elems.items():
-            for suffix in suffixes:
-                key = '{}{}:{}'.format(stats_key_prefix, service, suffix)
+        for (service_name, suffix), values in zip(pairs, get_aggr_values(self.server.kvdb.conn, stats_key_prefix, pairs)):
 
-                # We can convert all the values to floats here to ease with computing
-                # all the stuff and convert them still to integers later on, when necessary.
-                key_values = Bunch(
-                    ((name, float(value)) for (name, value) in self.server.kvdb.conn.hgetall(key).items()))
+            # We can convert all the values to floats here to ease with computing
+            # all the stuff and convert them still to integers later on, when necessary.
+            key_values = Bunch(((name, float(value)) for (name, value) in values.items()))
 
-                if key_values:
+            # An index may still list a service whose data has just expired
+            if key_values:
 
-                    time = (key_values.usage * key_values.mean)
-                    stats_elem.time += time
+                stats_elem = stats_elems.get(service_name)
+                if not stats_elem:
+                    stats_elem = stats_elems[service_name] = StatsElem(service_name)
 
-                    mean_all_services_list.append(key_values.mean)
-                    all_services_stats.time += time
-                    all_services_stats.usage += key_values.usage
+                    # When building statistics, we can't expect there will be data for all the time
+                    # elems built above so to guard against it, this is a dictionary whose keys are the
+                    # said elems and values are mean/usage for each elem. The values will remain
+                    # 0/0.0 if there is no data for the time elem, which may mean that in this
+                    # particular time slice the service wasn't invoked at all.
+                    stats_elem.expected_time_elems = OrderedDict(
+                        (elem, Bunch({'mean':0, 'usage':0.0})) for elem in suffixes)
 
-                    stats_elem.min_resp_time = min(stats_elem.min_resp_time, key_values.min)
-                    stats_elem.max_resp_time = max(stats_elem.max_resp_time, key_values.max)
+                    histograms[service_name] = Histogram()
 
-                    for attr in('mean', 'usage'):
-                        stats_elem.expected_time_elems[suffix][attr] = key_values[attr]
+                histograms[service_name].merge(Histogram.from_dict(key_values))
+
+                time = (key_values.usage * key_values.mean)
+                stats_elem.time += time
+
+                mean_all_services_list.append(key_values.mean)
+                all_services_stats.time += time
+                all_services_stats.usage += key_values.usage
+
+                stats_elem.min_resp_time = min(stats_elem.min_resp_time, key_values.min)
+                stats_elem.max_resp_time = max(stats_elem.max_resp_time, key_values.max)
+
+                for attr in('mean', 'usage'):
+                    stats_elem.expected_time_elems[suffix][attr] = key_values[attr]
 
         mean_all_services = '{:.0f}'.format(sp_stats.tmean(mean_all_services_list)) if mean_all_services_list else 0
 
@@ -450,6 +565,9 @@ class StatsReturningService(AdminService):
 
             self.set_percent_of_all_services(all_services_stats, stats_elem)
 
+            for name, value in histograms[stats_elem.service_name].get_percentiles().items():
+                setattr(stats_elem, name, value)
+
             if needs_trends:
                 stats_elem.mean_trend = ','.join(str(elem) for elem in stats_elem.mean_trend_int)
                 stats_elem.usage_trend = ','.join(str(elem) for elem in stats_elem.usage_trend_int)
@@ -471,7 +589,7 @@ class GetByService(StatsReturningService):
         response_elem = 'zato_stats_get_by_service_response'
         input_required = StatsReturningService.SimpleIO.input_required + ('service_id',)
         output_optional = ('service_name', 'usage', 'mean', 'rate', 'time', 'usage_trend', 'mean_trend',
-                    'min_resp_time', 'max_resp_time',)
+                    'min_resp_time', 'max_resp_time',) + PERCENTILE_KEYS
 
     def handle(self):
         with closing(self.odb.session()) as session:
@@ -12,7 +12,6 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 from calendar import monthrange
 from copy import deepcopy
 from datetime import date, datetime, timedelta
-from itertools import chain
 from sys import maxint
 from traceback import format_exc
 
@@ -32,6 +31,7 @@ from scipy import stats as sp_stats
 
 # Zato
 from zato.common import KVDB, StatsElem, ZatoException
+from zato.common.histogram import Histogram
 from zato.server.service import Integer, UTC
 from zato.server.service.internal.stats import BaseAggregatingService, STATS_KEYS, StatsReturningService, \
     stop_excluding_rrset
@@ -141,22 +141,22 @@ class BaseSummarizingService(BaseAggregatingService):
 
         return (elem.strftime('%Y') for elem in stop_excluding_rrset(YEARLY, start, stop))
 
-    def _get_patterns(self, now, start, stop, kvdb_key, method):
-        return ('{}*:{}'.format(kvdb_key, elem) for elem in method(now, start, stop))
+    def _get_slices(self, now, start, stop, kvdb_key, method):
+        return kvdb_key, list(method(now, start, stop))
 
-    def get_by_minute_patterns(self, now, start=None, stop=None):
-        return self._get_patterns(now, start, stop, KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, self.get_minutely_suffixes)
+    def get_by_minute_slices(self, now, start=None, stop=None):
+        return self._get_slices(now, start, stop, KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, self.get_minutely_suffixes)
 
-    def get_by_hour_patterns(self, now, start=None, stop=None):
-        return self._get_patterns(now, start, stop, KVDB.SERVICE_TIME_AGGREGATED_BY_HOUR, self.get_hourly_suffixes)
+    def get_by_hour_slices(self, now, start=None, stop=None):
+        return self._get_slices(now, start, stop, KVDB.SERVICE_TIME_AGGREGATED_BY_HOUR, self.get_hourly_suffixes)
 
-    def get_by_day_patterns(self, now, start=None, stop=None):
-        return self._get_patterns(now, start, stop, KVDB.SERVICE_TIME_AGGREGATED_BY_DAY, self.get_daily_suffixes)
+    def get_by_day_slices(self, now, start=None, stop=None):
+        return self._get_slices(now, start, stop, KVDB.SERVICE_TIME_AGGREGATED_BY_DAY, self.get_daily_suffixes)
 
-    def get_by_month_patterns(self, now, start=None, stop=None):
-        return self._get_patterns(now, start, stop, KVDB.SERVICE_TIME_AGGREGATED_BY_MONTH, self.get_monthly_suffixes)
+    def get_by_month_slices(self, now, start=None, stop=None):
+        return self._get_slices(now, start, stop, KVDB.SERVICE_TIME_AGGREGATED_BY_MONTH, self.get_monthly_suffixes)
 
-    def create_summary(self, target, *pattern_names):
+    def create_summary(self, target, *slice_names):
         try:
 
             now = datetime.utcnow()
@@ -170,16 +170,14 @@ class BaseSummarizingService(BaseAggregatingService):
                 key_suffix = now.strftime(DT_PATTERNS.SUMMARY_SUFFIX_PATTERNS[target])
             total_seconds = (now - start).total_seconds()
 
-            patterns = []
-            for name in pattern_names:
-                patterns.append(getattr(self, 'get_by_{}_patterns'.format(name))(now))
+            slices = []
+            for name in slice_names:
+                slices.append(getattr(self, 'get_by_{}_slices'.format(name))(now))
 
             services = {}
 
-            for elem in chain(*patterns):
-                prefix, suffix = elem.split('*')
-                suffix = suffix[1:]
-                stats = self.collect_service_stats(elem, prefix, suffix, None, False, False, False)
+            for prefix, suffixes in slices:
+                stats = self.collect_service_stats(prefix, suffixes, None, False)
 
                 for service_name, values in stats.items():
                     stats = services.setdefault(service_name, deepcopy(DEFAULT_STATS))
@@ -195,9 +193,19 @@ class BaseSummarizingService(BaseAggregatingService):
                         elif name == 'min':
                             stats[name] = min(stats[name], value)
 
+                    histogram = values.get('histogram')
+                    if histogram:
+                        stats.setdefault('histogram', Histogram()).merge(histogram)
+
             for service_name, values in services.items():
 
-                values['mean'] = round(sp_stats.tmean(values['mean']), 2)
+                histogram = values.get('histogram')
+                if histogram:
+                    values['mean'] = round(histogram.mean, 2)
+                    values.update(histogram.get_percentiles())
+                else:
+                    values['mean'] = round(sp_stats.tmean(values['mean']), 2)
+
                 values['rate'] = round(values['usage'] / total_seconds, 2)
 
         except Exception, e:
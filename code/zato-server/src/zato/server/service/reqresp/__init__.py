@@ -32,7 +32,8 @@ from sqlalchemy.util import KeyedTuple
 # Zato
 from zato.common import NO_DEFAULT_VALUE, PARAMS_PRIORITY, SIMPLE_IO, simple_types, TRACE1, ZatoException, ZATO_OK
 from zato.common.util import make_repr
-from zato.server.service.reqresp.sio import AsIs, convert_param, ForceType, ServiceInput, SIOConverter
+from zato.server.service.reqresp.sio import AsIs, convert_param, convert_param_value, convert_sio_value, ForceType, \
+     ServiceInput, SIOConverter
 
 logger = logging.getLogger(__name__)
 
@@ -90,8 +91,9 @@ class Request(SIOConverter):
         self.merge_channel_params = True
         self.params_priority = PARAMS_PRIORITY.DEFAULT
 
-    def init(self, is_sio, cid, sio, data_format, transport, wsgi_environ):
-        """ Initializes the object with an invocation-specific data.
+    def init(self, is_sio, cid, sio, data_format, transport, wsgi_environ, sio_plan=None):
+        """ Initializes the object with an invocation-specific data. If sio_plan is given, it is used instead of
+        looking up all the parameters in sio.
         """
 
         if is_sio:
@@ -100,12 +102,21 @@ class Request(SIOConverter):
             self.transport = transport
             self._wsgi_environ = wsgi_environ
 
-            path_prefix = getattr(sio, 'request_elem', 'request')
-            required_list = getattr(sio, 'input_required', [])
-            optional_list = getattr(sio, 'input_optional', [])
-            default_value = getattr(sio, 'default_value', NO_DEFAULT_VALUE)
-            use_text = getattr(sio, 'use_text', True)
-            use_channel_params_only = getattr(sio, 'use_channel_params_only', False)
+            if sio_plan:
+                path_prefix = sio_plan.request_elem
+                required_list = sio_plan.input_required
+                optional_list = sio_plan.input_optional
+                default_value = sio_plan.default_value
+                use_text = sio_plan.use_text
+                use_channel_params_only = sio_plan.use_channel_params_only
+                required_flags, optional_flags, _ = sio_plan.get_converters(self.simple_io_config)
+            else:
+                path_prefix = getattr(sio, 'request_elem', 'request')
+                required_list = getattr(sio, 'input_required', [])
+                optional_list = getattr(sio, 'input_optional', [])
+                default_value = getattr(sio, 'default_value', NO_DEFAULT_VALUE)
+                use_text = getattr(sio, 'use_text', True)
+                use_channel_params_only = getattr(sio, 'use_channel_params_only', False)
 
             if self.simple_io_config:
                 self.has_simple_io_config = True
@@ -123,12 +134,20 @@ class Request(SIOConverter):
                 if self.payload == '' and not self.channel_params:
                     raise ZatoException(cid, 'Missing input')
 
-                required_params.update(self.get_params(
-                    required_list, use_channel_params_only, path_prefix, default_value, use_text))
+                if sio_plan:
+                    required_params.update(self.get_compiled_params(
+                        required_list, required_flags, use_channel_params_only, path_prefix, default_value, use_text))
+                else:
+                    required_params.update(self.get_params(
+                        required_list, use_channel_params_only, path_prefix, default_value, use_text))
 
             if optional_list:
-                optional_params = self.get_params(
-                    optional_list, use_channel_params_only, path_prefix, default_value, use_text, False)
+                if sio_plan:
+                    optional_params = self.get_compiled_params(
+                        optional_list, optional_flags, use_channel_params_only, path_prefix, default_value, use_text, False)
+                else:
+                    optional_params = self.get_params(
+                        optional_list, use_channel_params_only, path_prefix, default_value, use_text, False)
             else:
                 optional_params = {}
 
@@ -166,6 +185,28 @@ class Request(SIOConverter):
 
         return params
 
+    def get_compiled_params(self, sio_params, flags, use_channel_params_only, path_prefix='', default_value=NO_DEFAULT_VALUE,
+            use_text=True, is_required=True):
+        """ Same as get_params but for parameters of an SIOPlan along with their converter table.
+        """
+        params = {}
+        payload = '' if use_channel_params_only else self.payload
+
+        for sio_param, (is_bool, is_int) in zip(sio_params, flags):
+            try:
+                param_name, value = convert_param_value(
+                    self.cid, payload, sio_param, is_bool, is_int, self.data_format, is_required, default_value,
+                    path_prefix, use_text, self.channel_params, self.params_priority)
+                params[param_name] = value
+
+            except Exception, e:
+                msg = 'Caught an exception, param:`{}`, params_to_visit:`{}`, has_simple_io_config:`{}`, e:`{}`'.format(
+                    sio_param.param, [elem.param for elem in sio_params], self.has_simple_io_config, format_exc(e))
+                self.logger.error(msg)
+                raise Exception(msg)
+
+        return params
+
     def deepcopy(self):
         """ Returns a deep copy of self.
         """
@@ -199,7 +240,7 @@ class SimpleIOPayload(SIOConverter):
     they don't conflict with user-provided data.
     """
     def __init__(self, zato_cid, logger, data_format, required_list, optional_list, simple_io_config, response_elem, namespace,
-            output_repeated):
+            output_repeated, zato_sio_plan=None):
         self.zato_cid = zato_cid
         self.zato_logger = logger
         self.zato_data_format = data_format
@@ -215,14 +256,23 @@ class SimpleIOPayload(SIOConverter):
         self.date_time_format = simple_io_config.get('date_time_format', 'YYYY-MM-DDTHH:MM:SS.mmmmmm+HH:MM')
         self.response_elem = response_elem
         self.namespace = namespace
+        self.zato_sio_plan = zato_sio_plan
 
-        self.zato_all_attrs = set()
-        for name in chain(required_list, optional_list):
-            if isinstance(name, ForceType):
-                name = name.name
-            self.zato_all_attrs.add(name)
+        if zato_sio_plan:
+            self.zato_output_flags = zato_sio_plan.get_converters(simple_io_config)[2]
+            self.zato_all_attrs = zato_sio_plan.output_names
+
+            for name in self.zato_all_attrs:
+                setattr(self, name, '')
+
+        else:
+            self.zato_all_attrs = set()
+            for name in chain(required_list, optional_list):
+                if isinstance(name, ForceType):
+                    name = name.name
+                self.zato_all_attrs.add(name)
 
-        self.set_expected_attrs(required_list, optional_list)
+            self.set_expected_attrs(required_list, optional_list)
 
     def __setslice__(self, i, j, seq):
         """ Assigns a list of output elements to self.zato_output, so that they
@@ -300,6 +350,28 @@ class SimpleIOPayload(SIOConverter):
             return self.convert(name, lookup_name, elem_value, True, self.zato_is_xml, self.bool_parameter_prefixes,
                 self.int_parameters, self.int_parameter_suffixes, None, self.zato_data_format, True)
 
+    def _get_compiled_value(self, sio_param, is_bool, is_int, item, has_attrs, is_sa_namedtuple, is_required):
+        """ Same as _getvalue but for a parameter of an SIOPlan along with its converter flags.
+        """
+        if has_attrs:
+            elem_value = getattr(item, sio_param.name, '')
+        else:
+            elem_value = item.get(sio_param.name, '')
+
+        if isinstance(elem_value, basestring) and not elem_value:
+            msg = self._missing_value_log_msg(sio_param.param, item, is_sa_namedtuple, is_required)
+            if is_required:
+                self.zato_logger.debug(msg)
+                raise ZatoException(self.zato_cid, msg)
+            else:
+                if self.zato_logger.isEnabledFor(TRACE1):
+                    self.zato_logger.log(TRACE1, msg)
+
+        if sio_param.is_as_is:
+            return elem_value
+        else:
+            return convert_sio_value(sio_param.param, sio_param.name, elem_value, is_bool, is_int, self.zato_data_format, True)
+
     def _missing_value_log_msg(self, name, item, is_sa_namedtuple, is_required):
         """ Returns a log message indicating that an element was missing.
         """
@@ -310,6 +382,23 @@ class SimpleIOPayload(SIOConverter):
         return '{} elem:[{}] not found in item:[{}]'.format(
             'Expected' if is_required else 'Optional', name, msg_item)
 
+    def _get_output_values(self, item, is_sa_namedtuple):
+        """ Yields names and values of all the output elements of a given item.
+        """
+        if self.zato_sio_plan:
+            has_attrs = is_sa_namedtuple or self._is_sqlalchemy(item)
+
+            for (is_required, sio_param), (is_bool, is_int) in zip(self.zato_sio_plan.output, self.zato_output_flags):
+                yield sio_param.name, self._get_compiled_value(
+                    sio_param, is_bool, is_int, item, has_attrs, is_sa_namedtuple, is_required)
+
+        else:
+            for is_required, name in chain(self.zato_required, self.zato_optional):
+                leave_as_is = isinstance(name, AsIs)
+                elem_value = self._getvalue(name, item, is_sa_namedtuple, is_required, leave_as_is)
+
+                yield (name.name if isinstance(name, ForceType) else name), elem_value
+
     def getvalue(self, serialize=True):
         """ Gets the actual payload's value converted to a string representing
         either XML or JSON.
@@ -328,8 +417,7 @@ class SimpleIOPayload(SIOConverter):
         if self.zato_output_repeated:
             output = self.zato_output
         else:
-            output = set(dir(self)) & self.zato_all_attrs
-            output = [dict((name, getattr(self, name)) for name in output)]
+            output = [dict((name, getattr(self, name)) for name in self.zato_all_attrs if hasattr(self, name))]
 
         if output:
 
@@ -341,12 +429,8 @@ class SimpleIOPayload(SIOConverter):
                     out_item = Element('item')
                 else:
                     out_item = {}
-                for is_required, name in chain(self.zato_required, self.zato_optional):
-                    leave_as_is = isinstance(name, AsIs)
-                    elem_value = self._getvalue(name, item, is_sa_namedtuple, is_required, leave_as_is)
 
-                    if isinstance(name, ForceType):
-                        name = name.name
+                for name, elem_value in self._get_output_values(item, is_sa_namedtuple):
 
                     if isinstance(elem_value, basestring):
                         elem_value = elem_value if isinstance(elem_value, unicode) else elem_value.decode('utf-8')
@@ -479,8 +563,18 @@ class Response(object):
 
     payload = property(_get_payload, _set_payload)
 
-    def init(self, cid, io, data_format):
+    def init(self, cid, io, data_format, sio_plan=None):
         self.data_format = data_format
+
+        if sio_plan:
+            self.outgoing_declared = sio_plan.output_declared
+
+            if self.outgoing_declared:
+                self._payload = SimpleIOPayload(cid, self.logger, data_format, sio_plan.output_required_list,
+                    sio_plan.output_optional_list, self.simple_io_config, sio_plan.response_elem, sio_plan.namespace,
+                    sio_plan.output_repeated, sio_plan)
+            return
+
         required_list = getattr(io, 'output_required', [])
         optional_list = getattr(io, 'output_optional', [])
         response_elem = getattr(io, 'response_elem', 'response')
@@ -11,6 +11,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 # stdlib
 import logging
 from copy import deepcopy
+from itertools import chain
 from traceback import format_exc
 
 # Bunch
@@ -319,21 +320,31 @@ COMPLEX_VALUE = (Dict, List, ListOfDicts, Nested)
 
 # ################################################################################################################################
 
-def convert_sio(param, param_name, value, has_simple_io_config, is_xml, bool_parameter_prefixes, int_parameters,
-                int_parameter_suffixes, date_time_format=None, data_format=ZATO_NONE, from_sio_to_external=False,
-                special_values=(ZATO_NONE, ZATO_SEC_USE_RBAC)):
+def get_param_flags(sio_param, has_simple_io_config, bool_parameter_prefixes, int_parameters, int_parameter_suffixes):
+    """ Returns a tuple of flags indicating whether a parameter is a boolean or an integer one, either because it uses
+    a ForceType of such a type or because of its name.
+    """
+    name = sio_param.name
+    is_bool = sio_param.is_boolean or any(name.startswith(prefix) for prefix in bool_parameter_prefixes)
+    is_int = bool(has_simple_io_config and (name in int_parameters or
+        any(name.endswith(suffix) for suffix in int_parameter_suffixes)))
+
+    return is_bool, is_int
+
+def convert_sio_value(param, param_name, value, is_bool, is_int, data_format=ZATO_NONE, from_sio_to_external=False,
+        special_values=(ZATO_NONE, ZATO_SEC_USE_RBAC)):
+    """ Converts a value of a parameter whose flags, as returned by get_param_flags, are already known.
+    """
     try:
-        if any(param_name.startswith(prefix) for prefix in bool_parameter_prefixes) or isinstance(param, Boolean):
+        if is_bool:
             value = asbool(value or None) # value can be an empty string and asbool chokes on that
 
         if value is not None:
             if isinstance(param, ForceType):
                 value = param.convert(value, param_name, data_format, from_sio_to_external)
             else:
-                if value and (value not in special_values) and has_simple_io_config:
-                    if any(param_name==elem for elem in int_parameters) or \
-                       any(param_name.endswith(suffix) for suffix in int_parameter_suffixes):
-                        value = int(value)
+                if value and (value not in special_values) and is_int:
+                    value = int(value)
 
         return value
 
@@ -344,6 +355,15 @@ def convert_sio(param, param_name, value, has_simple_io_config, is_xml, bool_par
 
         raise ZatoException(msg=msg)
 
+def convert_sio(param, param_name, value, has_simple_io_config, is_xml, bool_parameter_prefixes, int_parameters,
+                int_parameter_suffixes, date_time_format=None, data_format=ZATO_NONE, from_sio_to_external=False,
+                special_values=(ZATO_NONE, ZATO_SEC_USE_RBAC)):
+    is_bool = any(param_name.startswith(prefix) for prefix in bool_parameter_prefixes) or isinstance(param, Boolean)
+    is_int = has_simple_io_config and (param_name in int_parameters or
+        any(param_name.endswith(suffix) for suffix in int_parameter_suffixes))
+
+    return convert_sio_value(param, param_name, value, is_bool, is_int, data_format, from_sio_to_external, special_values)
+
 # ################################################################################################################################
 
 class SIOConverter(object):
@@ -392,7 +412,19 @@ def convert_param(cid, payload, param, data_format, is_required, default_value,
                   params_priority):
     """ Converts request parameters from any data format supported into Python objects.
     """
-    param_name = param.name if isinstance(param, ForceType) else param
+    sio_param = SIOParam(param)
+    is_bool, is_int = get_param_flags(
+        sio_param, has_simple_io_config, bool_parameter_prefixes, int_parameters, int_parameter_suffixes)
+
+    return convert_param_value(cid, payload, sio_param, is_bool, is_int, data_format, is_required, default_value,
+        path_prefix, use_text, channel_params, params_priority)
+
+def convert_param_value(cid, payload, sio_param, is_bool, is_int, data_format, is_required, default_value, path_prefix,
+        use_text, channel_params, params_priority):
+    """ Same as convert_param but for a parameter whose flags, as returned by get_param_flags, are already known.
+    """
+    param = sio_param.param
+    param_name = sio_param.name
 
     # First thing is to find out if we have parameters in channel_params. If so and they have priority
     # over payload, we don't look further. If they don't have priority, whether the value from channel_params
@@ -403,8 +435,7 @@ def convert_param(cid, payload, param, data_format, is_required, default_value,
 
     # Convert it to a native Python data type
     if channel_value != ZATO_NONE:
-        channel_value = convert_sio(param, param_name, channel_value, has_simple_io_config, False, bool_parameter_prefixes,
-                    int_parameters, int_parameter_suffixes, None, data_format, False)
+        channel_value = convert_sio_value(param, param_name, channel_value, is_bool, is_int, data_format, False)
 
     # Return the value immediately if we already know channel_params are of higer priority
     if params_priority == PARAMS_PRIORITY.CHANNEL_PARAMS_OVER_MSG and channel_value != ZATO_NONE:
@@ -413,7 +444,7 @@ def convert_param(cid, payload, param, data_format, is_required, default_value,
     # Ok, at that point we either don't have anything in channel_params or they don't have priority over payload.
 
     if payload is not None:
-        value = convert_impl[data_format](payload, param_name, cid, is_required, isinstance(param, COMPLEX_VALUE),
+        value = convert_impl[data_format](payload, param_name, cid, is_required, sio_param.is_complex,
                                           default_value, path_prefix, use_text)
     else:
         value = NOT_GIVEN
@@ -437,11 +468,93 @@ def convert_param(cid, payload, param, data_format, is_required, default_value,
                 value = ''
 
     else:
-        if value is not None and not isinstance(param, COMPLEX_VALUE):
+        if value is not None and not sio_param.is_complex:
             value = unicode(value)
 
-        if not isinstance(param, AsIs):
-            return param_name, convert_sio(param, param_name, value, has_simple_io_config, data_format==DATA_FORMAT.XML,
-                bool_parameter_prefixes, int_parameters, int_parameter_suffixes, None, data_format, False)
+        if not sio_param.is_as_is:
+            return param_name, convert_sio_value(param, param_name, value, is_bool, is_int, data_format, False)
 
     return param_name, value
+
+# ################################################################################################################################
+
+class SIOParam(object):
+    """ A SimpleIO parameter along with everything about it that can be found out without knowing the server's
+    SimpleIO configuration.
+    """
+    __slots__ = ('param', 'name', 'is_as_is', 'is_boolean', 'is_complex')
+
+    def __init__(self, param):
+        self.param = param
+        self.name = param.name if isinstance(param, ForceType) else param
+        self.is_as_is = isinstance(param, AsIs)
+        self.is_boolean = isinstance(param, Boolean)
+        self.is_complex = isinstance(param, COMPLEX_VALUE)
+
+# ################################################################################################################################
+
+class SIOPlan(object):
+    """ A service's SimpleIO definition compiled, once per service class, into what is needed to parse its requests
+    and produce its responses. Flags that depend on the server's SimpleIO configuration, i.e. whether parameters are
+    booleans or integers because of their names, are computed once per configuration and kept in converter tables.
+    """
+    # How many SimpleIO configurations to keep converter tables for, in practice there is only one per server
+    max_converters = 16
+
+    def __init__(self, sio):
+        self.sio = sio
+
+        self.request_elem = getattr(sio, 'request_elem', 'request')
+        self.input_required = tuple(SIOParam(param) for param in getattr(sio, 'input_required', []))
+        self.input_optional = tuple(SIOParam(param) for param in getattr(sio, 'input_optional', []))
+        self.default_value = getattr(sio, 'default_value', NO_DEFAULT_VALUE)
+        self.use_text = getattr(sio, 'use_text', True)
+        self.use_channel_params_only = getattr(sio, 'use_channel_params_only', False)
+
+        self.output_required_list = getattr(sio, 'output_required', [])
+        self.output_optional_list = getattr(sio, 'output_optional', [])
+        self.response_elem = getattr(sio, 'response_elem', 'response')
+        self.namespace = getattr(sio, 'namespace', '')
+        self.output_repeated = getattr(sio, 'output_repeated', False)
+        self.output_declared = bool(self.output_required_list or self.output_optional_list)
+
+        # A flat tuple of (is_required, SIOParam) tuples for each output element, in the order they are serialized in
+        self.output = tuple(chain(
+            ((True, SIOParam(param)) for param in self.output_required_list),
+            ((False, SIOParam(param)) for param in self.output_optional_list)))
+
+        self.output_names = frozenset(sio_param.name for _, sio_param in self.output)
+
+        # id(simple_io_config) -> (simple_io_config, converter tables)
+        self._converters = {}
+
+    def get_converters(self, simple_io_config):
+        """ Returns a tuple of three converter tables, for required input, optional input and output, each being
+        a tuple of (is_bool, is_int) flags of the corresponding parameter.
+        """
+        entry = self._converters.get(id(simple_io_config))
+        if entry and entry[0] is simple_io_config:
+            return entry[1]
+
+        config = simple_io_config or {}
+        bool_parameter_prefixes = config.get('bool_parameter_prefixes', [])
+        int_parameters = config.get('int_parameters', [])
+        int_parameter_suffixes = config.get('int_parameter_suffixes', [])
+
+        def _get_flags(sio_params, has_simple_io_config):
+            return tuple(get_param_flags(sio_param, has_simple_io_config, bool_parameter_prefixes, int_parameters,
+                int_parameter_suffixes) for sio_param in sio_params)
+
+        # Integers in responses do not depend on whether there is any SimpleIO configuration
+        converters = (
+            _get_flags(self.input_required, bool(simple_io_config)),
+            _get_flags(self.input_optional, bool(simple_io_config)),
+            _get_flags((sio_param for _, sio_param in self.output), True),
+        )
+
+        if len(self._converters) >= self.max_converters:
+            self._converters.clear()
+
+        self._converters[id(simple_io_config)] = (simple_io_config, converters)
+
+        return converters
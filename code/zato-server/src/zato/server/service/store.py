@@ -9,23 +9,28 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
+import ast
 import inspect
 import logging
 import os
+import sys
 from datetime import datetime
+from functools import wraps
 from hashlib import sha256
 from importlib import import_module
 from json import dumps
+from timeit import default_timer
 from traceback import format_exc
 from uuid import uuid4
 
 # Bunch
-from bunch import bunchify
+from bunch import Bunch, bunchify
 
 # dill
 from dill import dumps as dill_dumps, load as dill_load
 
 # gevent
+from gevent.local import local
 from gevent.lock import RLock
 
 # PyYAML
@@ -59,6 +64,61 @@ def get_service_name(class_obj):
     """
     return getattr(class_obj, 'name', '%s.%s' % (class_obj.__module__, class_obj.__name__))
 
+def get_source_hashes(source):
+    """ Returns a hash of a module's source code other than its top-level classes, and a dictionary of hashes
+    of each of the classes' source code, keyed by class names. Returns None and an empty dictionary if the source
+    cannot be parsed.
+    """
+    try:
+        nodes = ast.parse(source).body
+    except(SyntaxError, TypeError):
+        return None, {}
+
+    lines = source.splitlines(True)
+    module_lines = lines[:]
+    class_hashes = {}
+
+    # Each top-level statement spans all the lines until the next one, including decorators
+    starts = [min([node.lineno] + [elem.lineno for elem in getattr(node, 'decorator_list', [])]) - 1 for node in nodes]
+    ends = starts[1:] + [len(lines)]
+
+    for node, start, end in zip(nodes, starts, ends):
+        if isinstance(node, ast.ClassDef):
+            class_hashes[node.name] = sha256(b''.join(lines[start:end])).hexdigest()
+            module_lines[start:end] = [b''] * (end - start)
+
+    return sha256(b''.join(module_lines)).hexdigest(), class_hashes
+
+# ################################################################################################################################
+
+class _ODBBatch(local):
+    """ Services imported by a greenlet but not added to ODB yet.
+    """
+    def __init__(self):
+        self.depth = 0
+        self.pending = []
+
+def odb_batch(func):
+    """ Makes services imported by the decorated method be added to ODB in bulk once it returns, unless it has been called
+    by another such method, in which case the services are added when the outermost one returns. Services that could not
+    be added are not returned as deployed ones.
+    """
+    @wraps(func)
+    def _odb_batch(self, *args, **kwargs):
+        self._odb_batch.depth += 1
+        not_added = None
+
+        try:
+            deployed = func(self, *args, **kwargs)
+        finally:
+            self._odb_batch.depth -= 1
+            if not self._odb_batch.depth:
+                not_added = self._add_pending_to_odb()
+
+        return [class_ for class_ in deployed if class_ not in not_added] if not_added else deployed
+
+    return _odb_batch
+
 # ################################################################################################################################
 
 class ServiceStore(InitializingObject):
@@ -74,6 +134,11 @@ class ServiceStore(InitializingObject):
         self.update_lock = RLock()
         self.patterns_matcher = Matcher()
 
+        self._odb_batch = _ODBBatch()
+
+        # Absolute paths of modules imported from files -> hashes of their source code and impl names of their services
+        self.deployed_modules = {}
+
 # ################################################################################################################################
 
     def _invoke_hook(self, object_, hook_name):
@@ -190,6 +255,7 @@ class ServiceStore(InitializingObject):
 
 # ################################################################################################################################
 
+    @odb_batch
     def import_services_from_anywhere(self, items, base_dir, work_dir=None):
         """ Imports services from any of the supported sources, be it module names,
         individual files, directories or distutils2 packages (compressed or not).
@@ -217,23 +283,114 @@ class ServiceStore(InitializingObject):
 
 # ################################################################################################################################
 
-    def import_services_from_file(self, file_name, is_internal, base_dir):
-        """ Imports all the services from the path to a file.
+    @odb_batch
+    def import_services_from_file(self, file_name, is_internal, base_dir, incremental=False):
+        """ Imports all the services from the path to a file. If incremental is True, a file whose source code has not changed
+        since it was last imported is not imported again, unless any other deployed module it depends on has changed,
+        and services whose source code has not changed, nor has the rest of their module, are not added to ODB again
+        nor returned as deployed ones.
         """
         deployed = []
 
         try:
-            mod_info = import_module_from_path(file_name, base_dir)
+            path = file_name if os.path.isabs(file_name) else os.path.join(base_dir, file_name)
+            path = os.path.abspath(path)
+
+            source = open(path, 'rb').read()
+            source_hash = sha256(source).hexdigest()
+
+            previous = self.deployed_modules.get(path) if incremental else None
+
+            if previous and previous.source_hash == source_hash and not self._dependencies_changed(previous):
+                logger.info('Skipped unchanged `%s`, services redeployed:0, skipped:%d', path, len(previous.impl_names))
+                return deployed
+
+            mod_info = import_module_from_path(path, base_dir)
+
         except Exception, e:
             msg = 'Could not load source, file_name:`%s`, e:`%s`'
             logger.error(msg, file_name, format_exc(e))
+
         else:
-            deployed.extend(self._visit_module(mod_info.module, is_internal, mod_info.file_name))
-        finally:
-            return deployed
+            module_hash, class_hashes = get_source_hashes(source)
+            mod_name = mod_info.module.__name__
+
+            # Services whose source code is the same as the last time - they keep their IDs and settings
+            unchanged = {}
+
+            if previous and module_hash and previous.module_hash == module_hash:
+                for class_name, class_hash in class_hashes.items():
+                    impl_name = '{}.{}'.format(mod_name, class_name)
+
+                    if previous.class_hashes.get(class_name) == class_hash and impl_name in self.impl_name_to_id:
+                        service = self.services[impl_name]
+                        unchanged[impl_name] = self.impl_name_to_id[impl_name], service['is_active'], service['slow_threshold']
+
+            skipped = []
+            deployed.extend(self._visit_module(mod_info.module, is_internal, mod_info.file_name, unchanged, skipped))
+
+            impl_names = set(class_.get_impl_name() for class_ in deployed + skipped)
+
+            # Services skipped in a module that did change still need to point to its current source code in ODB.
+            # This is done before the module is recorded as deployed so that it is not skipped if it is deployed again
+            # after ODB could not be updated.
+            if skipped and previous.source_hash != source_hash:
+                self._update_deployed_services(mod_info.module, skipped)
+
+            self.deployed_modules[path] = Bunch(source_hash=source_hash, module_hash=module_hash, class_hashes=class_hashes,
+                impl_names=impl_names, dependencies=self._get_dependencies(mod_info.module, path))
+
+            if incremental:
+                logger.info('Deployed `%s`, services redeployed:%d, skipped:%d', path, len(deployed), len(skipped))
+
+                if previous and previous.impl_names - impl_names:
+                    logger.info('Services no longer in `%s`: %s', path, ', '.join(sorted(previous.impl_names - impl_names)))
+
+        return deployed
+
+    def _update_deployed_services(self, mod, classes):
+        """ Updates information about services of given classes that are already deployed, without adding them to ODB again.
+        """
+        timestamp = datetime.utcnow()
+        source_info = self._get_source_code_info(mod)
+        items = []
+
+        for class_ in classes:
+            impl_name = class_.get_impl_name()
+            items.append(Bunch(service_id=self.impl_name_to_id[impl_name], deployment_time=timestamp,
+                details=dumps(str(self.services[impl_name]['deployment_info'])), source_info=source_info))
+
+        self.odb.update_deployed_services(items)
+
+    def _get_dependencies(self, mod, path):
+        """ Returns source hashes of all the other deployed modules that a given one uses, keyed by their paths.
+        """
+        out = {}
+
+        for value in vars(mod).values():
+            dep = value if inspect.ismodule(value) else sys.modules.get(getattr(value, '__module__', None))
+            dep_path = getattr(dep, '__file__', None)
+
+            if dep_path:
+                dep_path = os.path.abspath(dep_path)
+                if dep_path.endswith(('.pyc', '.pyo')):
+                    dep_path = dep_path[:-1]
+
+                if dep_path != path and dep_path in self.deployed_modules:
+                    out[dep_path] = self.deployed_modules[dep_path].source_hash
+
+        return out
+
+    def _dependencies_changed(self, info):
+        """ Returns True if any deployed module that a given one uses has changed since the latter was last imported.
+        """
+        for dep_path, source_hash in info.dependencies.items():
+            if self.deployed_modules[dep_path].source_hash != source_hash:
+                return True
 
 # ################################################################################################################################
 
+    @odb_batch
     def import_services_from_directory(self, dir_name, base_dir):
         """ dir_name points to a directory.
 
@@ -254,6 +411,7 @@ class ServiceStore(InitializingObject):
 
 # ################################################################################################################################
 
+    @odb_batch
     def import_services_from_module(self, mod_name, is_internal):
         """ Imports all the services from a module specified by the given name.
         """
@@ -261,6 +419,7 @@ class ServiceStore(InitializingObject):
 
 # ################################################################################################################################
 
+    @odb_batch
     def import_services_from_module_object(self, mod, is_internal):
         """ Imports all the services from a Python module object.
         """
@@ -317,23 +476,35 @@ class ServiceStore(InitializingObject):
         depl_info = dumps(deployment_info('service-store', str(class_), timestamp.isoformat(), fs_location))
 
         class_.add_http_method_handlers()
+        class_.compile_sio()
 
         name = class_.get_name()
         impl_name = class_.get_impl_name()
 
-        self.services[impl_name] = {}
-        self.services[impl_name]['name'] = name
-        self.services[impl_name]['deployment_info'] = depl_info
-        self.services[impl_name]['service_class'] = class_
+        service = {}
+        service['name'] = name
+        service['deployment_info'] = depl_info
+        service['service_class'] = class_
 
-        si = self._get_source_code_info(mod)
+        # A service being redeployed keeps its current settings until the ones from ODB are known,
+        # so that it can be invoked in the meantime.
+        previous = self.services.get(impl_name)
+        if previous and 'is_active' in previous:
+            service['is_active'] = previous['is_active']
+            service['slow_threshold'] = previous['slow_threshold']
 
-        if not(service_id and is_active is not None and slow_threshold):
-            service_id, is_active, slow_threshold = self.odb.add_service(
-                name, impl_name, is_internal, timestamp, dumps(str(depl_info)), si)
+        self.services[impl_name] = service
 
         deployed.append(class_)
 
+        if service_id and is_active is not None and slow_threshold:
+            self._set_service_info(class_, name, impl_name, service_id, is_active, slow_threshold)
+
+        else:
+            self._odb_batch.pending.append(Bunch(class_=class_, name=name, impl_name=impl_name, is_internal=is_internal,
+                deployment_time=timestamp, details=dumps(str(depl_info)), source_info=self._get_source_code_info(mod)))
+
+    def _set_service_info(self, class_, name, impl_name, service_id, is_active, slow_threshold):
         self.services[impl_name]['is_active'] = is_active
         self.services[impl_name]['slow_threshold'] = slow_threshold
 
@@ -345,10 +516,49 @@ class ServiceStore(InitializingObject):
 
         class_.after_add_to_store(logger)
 
+    def _add_pending_to_odb(self):
+        """ Adds to ODB, in bulk, all the services imported since the last time it was done. Returns a set of classes
+        of services that could not be added.
+        """
+        not_added = set()
+
+        pending, self._odb_batch.pending = self._odb_batch.pending, []
+
+        if not pending:
+            return not_added
+
+        with self.update_lock:
+            start = default_timer()
+
+            try:
+                services = self.odb.add_services(pending)
+            except Exception, e:
+                logger.error('Could not add services to ODB, e:`%s`', format_exc(e))
+                services = {}
+
+            for item in pending:
+                service_info = services.get(item.name)
+
+                if not service_info:
+                    not_added.add(item.class_)
+                    continue
+
+                try:
+                    self._set_service_info(item.class_, item.name, item.impl_name, *service_info)
+                except Exception, e:
+                    logger.error('Could not add service `%s` to store, e:`%s`', item.name, format_exc(e))
+                    not_added.add(item.class_)
+
+            logger.info('Added %d service(s) to ODB in %.3f s', len(pending) - len(not_added), default_timer() - start)
+
+        return not_added
+
 # ################################################################################################################################
 
-    def _visit_module(self, mod, is_internal, fs_location, needs_odb_deployment=True):
-        """ Actually imports services from a module object.
+    def _visit_module(self, mod, is_internal, fs_location, unchanged=None, skipped=None):
+        """ Actually imports services from a module object. Services from the unchanged dictionary, keyed by impl names,
+        are not added to ODB, instead they reuse the IDs, is_active flags and slow thresholds from the dictionary's values
+        and are added to the skipped list rather than returned as deployed.
         """
         deployed = []
 
@@ -361,7 +571,12 @@ class ServiceStore(InitializingObject):
 
                         should_add = item.before_add_to_store(logger)
                         if should_add:
-                            self._visit_class(mod, deployed, item, fs_location, is_internal)
+                            impl_name = item.get_impl_name()
+
+                            if unchanged and impl_name in unchanged:
+                                self._visit_class(mod, skipped, item, fs_location, is_internal, *unchanged[impl_name])
+                            else:
+                                self._visit_class(mod, deployed, item, fs_location, is_internal)
                         else:
                             msg = 'Skipping `{}` from `{}`, should_add:`{}` is not True'.format(
                                 item, fs_location, should_add)
@@ -10,15 +10,68 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import logging
+from calendar import monthrange
+from datetime import datetime, timedelta
+from traceback import format_exc
 
 # dateutil
 from dateutil.rrule import MINUTELY, rrule
 
+# gevent
+from gevent import sleep
+
 # Zato
-from zato.common import KVDB
+from zato.common import KVDB, SERVICE_STATS
+from zato.common.histogram import Histogram
 
 logger = logging.getLogger(__name__)
 
+# ################################################################################################################################
+
+def get_index_key(key_prefix, key_suffix):
+    """ Returns the key of a set listing names of all services that have statistics stored under a given prefix
+    in a time slice given by key_suffix.
+    """
+    return '{}{}{}'.format(KVDB.SERVICE_TIME_INDEX, key_prefix, key_suffix)
+
+def get_slice_suffixes(key_suffix):
+    """ Returns suffixes of all the time slices a given one consists of, e.g. all minutes of an hour
+    or all days of a month.
+    """
+    parts = [int(elem) for elem in key_suffix.split(':')]
+
+    if len(parts) == 1:
+        return ['{}:{:02}'.format(parts[0], month) for month in range(1, 13)]
+
+    elif len(parts) == 2:
+        return ['{}:{:02}:{:02}'.format(parts[0], parts[1], day) for day in range(1, monthrange(*parts)[1] + 1)]
+
+    elif len(parts) == 3:
+        return ['{}:{:02}'.format(key_suffix, hour) for hour in range(24)]
+
+    else:
+        start = datetime(*parts)
+        return [(start + timedelta(minutes=minute)).strftime('%Y:%m:%d:%H:%M') for minute in range(60)]
+
+def get_service_names(conn, key_prefix, suffixes):
+    """ Returns a list of sets, one for each suffix, of names of services that have statistics
+    under a given prefix in a time slice the suffix points to.
+    """
+    with conn.pipeline() as pipe:
+        for suffix in suffixes:
+            pipe.smembers(get_index_key(key_prefix, suffix))
+        return pipe.execute()
+
+def get_aggr_values(conn, key_prefix, pairs):
+    """ Returns statistics stored under a given prefix for each (service_name, suffix) pair given on input.
+    """
+    with conn.pipeline() as pipe:
+        for service_name, suffix in pairs:
+            pipe.hgetall('{}{}:{}'.format(key_prefix, service_name, suffix))
+        return pipe.execute()
+
+# ################################################################################################################################
+
 class MaintenanceTool(object):
     """ A tool for performing maintenance-related tasks, such as deleting the statistics.
     """
@@ -26,10 +79,158 @@ class MaintenanceTool(object):
         self.conn = conn
 
     def delete(self, start, stop, interval):
+        suffixes = [elem.strftime('%Y:%m:%d:%H:%M') for elem in rrule(MINUTELY, dtstart=start, until=stop)]
+        service_names = get_service_names(self.conn, KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, suffixes)
+
         with self.conn.pipeline() as p:
-            suffixes = (elem.strftime(':%Y:%m:%d:%H:%M') for elem in rrule(MINUTELY, dtstart=start, until=stop))
-            for suffix in suffixes:
-                for key in self.conn.keys('{}*{}'.format(KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, suffix)):
-                    p.delete(key)
+            for suffix, names in zip(suffixes, service_names):
+                for name in names:
+                    p.delete('{}{}:{}'.format(KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, name, suffix))
+                p.delete(get_index_key(KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, suffix))
 
             p.execute()
+
+# ################################################################################################################################
+
+class _ServiceStats(object):
+    """ Statistics of a single service accumulated in between two flushes.
+    """
+    __slots__ = ('usage', 'last', 'histogram_by_minute')
+
+    def __init__(self):
+        self.usage = 0
+        self.last = None
+        self.histogram_by_minute = {}
+
+# ################################################################################################################################
+
+class StatsCollector(object):
+    """ Accumulates statistics of services invoked in a given worker process and flushes them to KVDB in batches,
+    every flush_interval seconds, using the same keys that per-invocation updates use so that zato.stats.* services
+    can aggregate them regardless of which of the two is in use. All updates take place in a single thread and a flush swaps out the whole
+    set of pending statistics before it yields control to the hub, so no locks are needed.
+    """
+    def __init__(self, conn, flush_interval=SERVICE_STATS.DEFAULT_FLUSH_INTERVAL):
+        self.conn = conn
+        self.flush_interval = flush_interval
+
+        # Per-worker usage counters, these are never reset
+        self.usage = {}
+
+        # How often request/response pairs of each service should be sampled, refreshed with each flush
+        self.req_resp_freq = {}
+
+        # Statistics not flushed to KVDB yet, keyed by service name
+        self.pending = {}
+
+        self.keep_running = True
+
+    def incr_usage(self, service_name):
+        """ Increments and returns the per-worker usage counter of a service.
+        """
+        usage = self.usage.get(service_name, 0) + 1
+        self.usage[service_name] = usage
+
+        return usage
+
+    def get_req_resp_freq(self, service_name):
+        """ Returns how often a given service should have its request/response pairs stored, as of the last flush.
+        """
+        return self.req_resp_freq.get(service_name, 0)
+
+    def add(self, service_name, proc_time, minute):
+        """ Records a service invocation that took proc_time milliseconds and ended in a given minute,
+        the latter in a format of '%Y:%m:%d:%H:%M'.
+        """
+        stats = self.pending.get(service_name)
+        if not stats:
+            stats = self.pending[service_name] = _ServiceStats()
+
+        histogram = stats.histogram_by_minute.get(minute)
+        if not histogram:
+            histogram = stats.histogram_by_minute[minute] = Histogram()
+
+        stats.usage += 1
+        stats.last = proc_time
+        histogram.record(proc_time)
+
+    def _restore(self, pending):
+        """ Puts statistics that could not be flushed back among pending ones, merging them with any recorded in the meantime.
+        """
+        for service_name, stats in pending.iteritems():
+            current = self.pending.get(service_name)
+
+            if not current:
+                self.pending[service_name] = stats
+                continue
+
+            current.usage += stats.usage
+
+            # The current one is more recent unless it has not been set
+            if current.last is None:
+                current.last = stats.last
+
+            for minute, histogram in stats.histogram_by_minute.iteritems():
+                current_histogram = current.histogram_by_minute.get(minute)
+                if current_histogram:
+                    current_histogram.merge(histogram)
+                else:
+                    current.histogram_by_minute[minute] = histogram
+
+    def flush(self):
+        """ Writes all pending statistics to KVDB in one pipeline and refreshes the request/response sampling
+        configuration of all the services this worker has invoked so far. Statistics are kept until the next flush
+        if they could not be written.
+        """
+        pending, self.pending = self.pending, {}
+
+        try:
+            result, names = self._flush(pending)
+        except Exception:
+            self._restore(pending)
+            raise
+
+        if names:
+            self.req_resp_freq = dict(zip(names, (int(elem or 0) for elem in result[-len(names):])))
+
+        return len(pending)
+
+    def _flush(self, pending):
+        with self.conn.pipeline() as pipe:
+            for service_name, stats in pending.iteritems():
+
+                pipe.incrby('{}{}'.format(KVDB.SERVICE_USAGE, service_name), stats.usage)
+                pipe.hset('{}{}'.format(KVDB.SERVICE_TIME_BASIC, service_name), 'last', stats.last)
+
+                # Histograms from all workers are merged by KVDB itself as they all increment the same counters
+                for minute, histogram in stats.histogram_by_minute.iteritems():
+                    key = '{}{}:{}'.format(KVDB.SERVICE_TIME_HISTOGRAM_BY_MINUTE, service_name, minute)
+                    for field, value in histogram.to_dict().iteritems():
+                        pipe.hincrby(key, field, value)
+                    pipe.expire(key, SERVICE_STATS.HISTOGRAM_BY_MINUTE_EXPIRE)
+
+                    index_key = get_index_key(KVDB.SERVICE_TIME_HISTOGRAM_BY_MINUTE, minute)
+                    pipe.sadd(index_key, service_name)
+                    pipe.expire(index_key, SERVICE_STATS.HISTOGRAM_BY_MINUTE_EXPIRE)
+
+            names = list(self.usage)
+            for service_name in names:
+                pipe.hget('{}{}'.format(KVDB.REQ_RESP_SAMPLE, service_name), 'freq')
+
+            return pipe.execute(), names
+
+    def run(self):
+        """ Flushes statistics every flush_interval seconds until told to stop.
+        """
+        while self.keep_running:
+            sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception, e:
+                logger.warn('Could not flush service statistics, e:`%s`', format_exc(e))
+
+    def stop(self):
+        self.keep_running = False
+        self.flush()
+
+# ################################################################################################################################
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Compares the latency of URLData.match against a linear scan over all channels, which is what URLData.match
+# used to do before URLRouter was added. Run it directly, e.g. python bench_url_data.py
+
+# stdlib
+from random import choice, randint
+from timeit import default_timer
+
+# Bunch
+from bunch import Bunch
+
+# Zato
+from zato.common import MISC
+from zato.server.connection.http_soap import url_data
+
+# ################################################################################################################################
+
+def get_channel_data(count):
+    """ Returns a list of channels using a mix of dynamic and static URL paths.
+    """
+    out = []
+
+    for idx in range(count):
+        if idx % 4 == 0:
+            url_path = '/api/static/{}'.format(idx)
+        else:
+            url_path = '/api/resource{}/{{id}}/item/{{item_id}}'.format(idx)
+
+        item = Bunch()
+        item.name = 'channel-{:06d}'.format(idx)
+        item.match_target = '{}{}{}'.format('', MISC.SEPARATOR, url_path)
+        item.match_target_compiled = url_data.Matcher(item.match_target)
+
+        out.append(item)
+
+    return out
+
+def get_requests(count, how_many):
+    """ Returns URL paths to match, all of them pointing to channels with dynamic URL paths.
+    """
+    out = []
+
+    while len(out) < how_many:
+        idx = randint(0, count - 1)
+        if idx % 4:
+            out.append('/api/resource{}/{}/item/{}'.format(idx, randint(1, 10**6), randint(1, 10**6)))
+
+    return out
+
+def linear_match(channel_data, url_path, soap_action, _sep=MISC.SEPARATOR):
+    """ The original matching loop that goes through all the channels in turn.
+    """
+    target = '{}{}{}'.format(soap_action, _sep, url_path)
+
+    for item in channel_data:
+        match = item.match_target_compiled.match(target)
+        if match is not None:
+            return match, item
+
+    return None, None
+
+# ################################################################################################################################
+
+def run(count, how_many=2000):
+
+    ud = url_data.URLData(get_channel_data(count))
+    requests = get_requests(count, how_many)
+
+    # Both implementations must agree
+    for url_path in requests[:100]:
+        assert ud.match(url_path, '') == linear_match(ud.channel_data, url_path, '')
+
+    for name, func in (('linear', lambda url_path: linear_match(ud.channel_data, url_path, '')),
+                       ('router', lambda url_path: ud.match(url_path, ''))):
+
+        # Linear scans over 10k channels are slow so fewer requests are enough to get a good sample
+        sample = requests if name == 'router' or count < 10000 else [choice(requests) for _ in range(200)]
+
+        start = default_timer()
+        for url_path in sample:
+            func(url_path)
+        elapsed = default_timer() - start
+
+        print('{:>6} channels, {:>6}: {:10.2f} us/match'.format(count, name, elapsed / len(sample) * 10**6))
+
+if __name__ == '__main__':
+    for count in (100, 1000, 10000):
+        run(count)
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from contextlib import closing
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import sleep, spawn
+
+# nose
+from nose.tools import eq_
+
+# SQLAlchemy
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Zato
+from zato.common import AUDIT_LOG
+from zato.common.odb.model import Base, HTTSOAPAudit
+from zato.server.connection.http_soap.audit import AuditBuffer
+
+# ################################################################################################################################
+
+class AuditBufferTestCase(TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+
+        self.odb = Bunch(session=sessionmaker(bind=engine), cluster=Bunch(id=1))
+        self.channel_item = Bunch(id=11, name='my.channel', transport='plain_http', connection='channel', username='user1')
+        self.masked = []
+
+    def get_request_payload(self, channel_item, payload):
+        self.masked.append(payload)
+        return payload.replace('secret', channel_item.get('replace_with', AUDIT_LOG.REPLACE_WITH))
+
+    def dump_wsgi_environ(self, wsgi_environ):
+        return repr(sorted(wsgi_environ.items()))
+
+    def get_buffer(self, **kwargs):
+        kwargs.setdefault('flush_interval', 3600)
+        return AuditBuffer(self.odb, self.get_request_payload, self.dump_wsgi_environ, **kwargs)
+
+    def add(self, buffer, cid, response=None, status='200 OK'):
+        buffer.add_request(cid, self.channel_item, 'req-{}-secret'.format(cid), {'REMOTE_ADDR': '10.0.0.1'})
+        if response:
+            buffer.add_response(cid, response, {'zato.http.response.status': status})
+
+    def get_rows(self):
+        with closing(self.odb.session()) as session:
+            return dict((item.cid, item) for item in session.query(HTTSOAPAudit).all())
+
+# ################################################################################################################################
+
+    def test_flush(self):
+        buffer = self.get_buffer()
+
+        self.add(buffer, 'a', 'resp-a')
+        self.add(buffer, 'b', 'resp-b', '401 Unauthorized')
+        self.add(buffer, 'c')
+
+        # Payloads are masked straightaway but nothing is stored until flushed
+        eq_(self.masked, ['req-a-secret', 'req-b-secret', 'req-c-secret'])
+        eq_(self.get_rows(), {})
+
+        buffer.flush()
+        rows = self.get_rows()
+
+        # Requests with no responses yet are still in the buffer
+        eq_(sorted(rows), ['a', 'b'])
+        eq_(buffer.get_stats()['records'], 1)
+
+        a = rows['a']
+        eq_(a.name, 'my.channel')
+        eq_(a.conn_id, 11)
+        eq_(a.cluster_id, 1)
+        eq_(a.user_token, 'user1')
+        eq_(a.remote_addr, '10.0.0.1')
+        eq_(a.req_payload, b'req-a-' + AUDIT_LOG.REPLACE_WITH.encode('utf-8'))
+        eq_(a.resp_payload, b'resp-a')
+        eq_(a.invoke_ok, True)
+        eq_(a.auth_ok, True)
+        eq_(rows['b'].auth_ok, False)
+
+        # Once the response arrives, the other half is stored too
+        buffer.add_response('c', 'resp-c', {'zato.http.response.status': '500 Internal Server Error'})
+        buffer.flush()
+
+        c = self.get_rows()['c']
+        eq_(c.resp_payload, b'resp-c')
+        eq_(c.invoke_ok, False)
+
+        stats = buffer.get_stats()
+        eq_(stats['stored'], 3)
+        eq_(stats['records'], 0)
+        eq_(stats['size'], 0)
+
+    def test_channel_edited(self):
+        buffer = self.get_buffer()
+        self.add(buffer, 'a', 'resp-a')
+
+        # The channel is edited before the record is stored
+        self.channel_item.name = 'my.channel.2'
+        self.channel_item.replace_with = 'edited'
+        buffer.flush()
+
+        a = self.get_rows()['a']
+        eq_(a.name, 'my.channel')
+        eq_(a.req_payload, b'req-a-' + AUDIT_LOG.REPLACE_WITH.encode('utf-8'))
+
+    def test_stop(self):
+        buffer = self.get_buffer()
+        buffer.greenlet = spawn(buffer._flush_forever)
+
+        self.add(buffer, 'a', 'resp-a')
+        self.add(buffer, 'b')
+
+        buffer.stop()
+
+        # Nothing is lost when a worker stops, including requests still waiting for responses
+        rows = self.get_rows()
+        eq_(sorted(rows), ['a', 'b'])
+        eq_(rows['b'].resp_time, None)
+        eq_(buffer.greenlet, None)
+
+    def test_in_flight_timeout(self):
+        buffer = self.get_buffer(in_flight_timeout=10)
+        buffer.add_request('a', self.channel_item, 'req', {'REMOTE_ADDR': '10.0.0.1'}, _time=lambda: 0)
+
+        buffer.flush(_time=lambda: 5)
+        eq_(self.get_rows(), {})
+
+        # Stored without a response after waiting for too long
+        buffer.flush(_time=lambda: 11)
+        a = self.get_rows()['a']
+        eq_(a.resp_time, None)
+        eq_(a.resp_payload, None)
+
+        # A late response is ignored
+        buffer.add_response('a', 'resp', {'zato.http.response.status': '200 OK'})
+        eq_(buffer.get_stats()['records'], 0)
+
+    def test_flush_size(self):
+        buffer = self.get_buffer(flush_size=2)
+        buffer.greenlet = spawn(buffer._flush_forever)
+
+        self.add(buffer, 'a', 'resp-a')
+        sleep(0)
+        eq_(self.get_rows(), {})
+
+        # Enough complete records to wake up the flusher ahead of its interval
+        self.add(buffer, 'b', 'resp-b')
+        sleep(0)
+        eq_(sorted(self.get_rows()), ['a', 'b'])
+
+        buffer.greenlet.kill()
+
+    def test_overflow_drop_oldest(self):
+        buffer = self.get_buffer(max_size=AUDIT_LOG.RECORD_OVERHEAD * 2 + 100)
+
+        self.add(buffer, 'a')
+        self.add(buffer, 'b')
+        self.add(buffer, 'c')
+
+        eq_(list(buffer.records), ['b', 'c'])
+        eq_(buffer.get_stats()['dropped'], 1)
+
+        buffer.add_response('a', 'resp-a', {'zato.http.response.status': '200 OK'})
+        buffer.add_response('b', 'resp-b', {'zato.http.response.status': '200 OK'})
+        buffer.flush()
+
+        eq_(sorted(self.get_rows()), ['b'])
+
+    def test_overflow_block(self):
+        buffer = self.get_buffer(max_size=AUDIT_LOG.RECORD_OVERHEAD + 100, overflow=AUDIT_LOG.OVERFLOW.BLOCK)
+        buffer.greenlet = spawn(buffer._flush_forever)
+
+        self.add(buffer, 'a', 'resp-a')
+
+        # Waits until the flusher has stored the previous record
+        self.add(buffer, 'b')
+
+        eq_(sorted(self.get_rows()), ['a'])
+        eq_(list(buffer.records), ['b'])
+        eq_(buffer.get_stats()['dropped'], 0)
+
+        buffer.greenlet.kill()
+
+    def test_overflow_block_timeout(self):
+        buffer = self.get_buffer(max_size=AUDIT_LOG.RECORD_OVERHEAD + 100, overflow=AUDIT_LOG.OVERFLOW.BLOCK,
+            flush_interval=0.1)
+        buffer.greenlet = spawn(buffer._flush_forever)
+
+        # No response yet so the flusher cannot make room and the oldest record is dropped after flush_interval
+        self.add(buffer, 'a')
+        self.add(buffer, 'b')
+
+        eq_(list(buffer.records), ['b'])
+        eq_(buffer.get_stats()['dropped'], 1)
+
+        buffer.greenlet.kill()
+
+# ################################################################################################################################
@@ -30,10 +30,11 @@ from lxml import etree
 from nose.tools import eq_
 
 # Zato
-from zato.common import CHANNEL, DATA_FORMAT, SIMPLE_IO, URL_PARAMS_PRIORITY, URL_TYPE, zato_namespace, ZATO_NONE, ZATO_OK
+from zato.common import CHANNEL, DATA_FORMAT, SEC_DEF_TYPE, SIMPLE_IO, URL_PARAMS_PRIORITY, URL_TYPE, zato_namespace, \
+     ZATO_NONE, ZATO_OK
 from zato.common.test import rand_string
 from zato.common.util import new_cid
-from zato.server.connection.http_soap import channel
+from zato.server.connection.http_soap import channel, is_stream, iter_stream, StreamingBody
 from zato.server.service.internal import AdminService, Service
 
 # ##############################################################################
@@ -228,6 +229,11 @@ class TestSetPayloadNonAdminServiceTestCase(MessageHandlingBase):
         ignored, service = self.get_data(None, None, '', payload=payload, service_class=DummyService)
         eq_(payload.value, service.response.payload)
 
+    def test_payload_provided_stream(self):
+        payload = iter(['a', 'b'])
+        ignored, service = self.get_data(None, None, '', payload=payload, service_class=DummyService)
+        self.assertIs(payload, service.response.payload)
+
 # ##############################################################################
 
 class TestRequestDispatcher(MessageHandlingBase):
@@ -557,3 +563,102 @@ class TestRequestHandler(TestCase):
 
         rh.set_content_type(response, rand_string(), rand_string(), None, FakeChannelItem())
         eq_(response.content_type, user_content_type)
+
+# ##############################################################################
+
+class TestStreaming(TestCase):
+
+    def get_handler_payload(self, payload, is_streaming, sec_type='basic_auth', audit_enabled=False, sec_use_rbac=False,
+            service_class=object):
+
+        class DummyRequestHandler(object):
+            server = Bunch(service_store=Bunch(service_data=lambda impl_name: {'service_class':service_class}))
+
+            def handle(self, cid, url_match, channel_item, wsgi_environ, payload, *ignored_args):
+                self.payload = payload
+                self.data = payload.read() if isinstance(payload, StreamingBody) else payload
+                return DummyResponse('dummy_response')
+
+        channel_item = Bunch()
+        channel_item.is_active = True
+        channel_item.is_streaming = is_streaming
+        channel_item.data_format = DATA_FORMAT.JSON
+        channel_item.match_target = uuid4().hex
+        channel_item.audit_enabled = audit_enabled
+        channel_item.method = ''
+        channel_item.service_impl_name = 'my.service.MyService'
+
+        wsgi_environ = {
+            'PATH_INFO':uuid4().hex,
+            'wsgi.input':StringIO(payload),
+            'CONTENT_LENGTH':str(len(payload)),
+            'zato.http.response.headers': {},
+        }
+
+        ud = DummyURLData(Bunch(), channel_item)
+        sec_def = ZATO_NONE if sec_use_rbac else Bunch(sec_type=sec_type)
+        ud.url_sec[channel_item.match_target] = Bunch(sec_def=sec_def, sec_use_rbac=sec_use_rbac)
+        ud.audit_set_request = lambda *ignored_args: None
+
+        rd = channel.RequestDispatcher(ud)
+        rd.request_handler = DummyRequestHandler()
+        rd.dispatch(uuid4().hex, None, wsgi_environ, None)
+
+        return rd.request_handler
+
+    def test_dispatch_streaming(self):
+        payload = uuid4().hex
+
+        handler = self.get_handler_payload(payload, True)
+        self.assertIsInstance(handler.payload, StreamingBody)
+        eq_(handler.data, payload)
+        eq_(handler.payload.bytes_read, len(payload))
+        eq_(handler.payload.content_length, str(len(payload)))
+
+    def test_dispatch_buffered(self):
+        payload = uuid4().hex
+
+        # Not a streaming channel
+        eq_(self.get_handler_payload(payload, False).payload, payload)
+
+        # Security definitions that need the body and audit log always get it in full
+        eq_(self.get_handler_payload(payload, True, SEC_DEF_TYPE.WSS).payload, payload)
+        eq_(self.get_handler_payload(payload, True, audit_enabled=True).payload, payload)
+
+    def test_dispatch_buffered_rbac(self):
+        payload = uuid4().hex
+
+        # RBAC may delegate to definitions that need the body, e.g. WS-Security ones
+        eq_(self.get_handler_payload(payload, True, sec_use_rbac=True).payload, payload)
+
+    def test_dispatch_buffered_sio(self):
+        payload = uuid4().hex
+
+        class MyService(object):
+            class SimpleIO:
+                input_required = ('a',)
+
+        # SimpleIO services need the body to parse it before they are invoked
+        eq_(self.get_handler_payload(payload, True, service_class=MyService).payload, payload)
+
+    def test_streaming_body_iter(self):
+        body = StreamingBody(StringIO(b'a' * 10))
+        body.chunk_size = 4
+
+        eq_(list(body), [b'aaaa', b'aaaa', b'aa'])
+        eq_(body.bytes_read, 10)
+
+    def test_is_stream(self):
+        self.assertTrue(is_stream(StringIO(b'abc')))
+        self.assertTrue(is_stream(iter([])))
+        self.assertTrue(is_stream(elem for elem in []))
+
+        self.assertFalse(is_stream(b'abc'))
+        self.assertFalse(is_stream([]))
+        self.assertFalse(is_stream({}))
+        self.assertFalse(is_stream(DummyPayload('abc')))
+        self.assertFalse(is_stream(etree.fromstring('<read><next/></read>')))
+
+    def test_iter_stream(self):
+        eq_(list(iter_stream(StringIO(b'abcde'), 2)), [b'ab', b'cd', b'e'])
+        eq_(list(iter_stream(iter(['a', b'b', NON_ASCII_STRING]))), [b'a', b'b', NON_ASCII_STRING.encode('utf-8')])
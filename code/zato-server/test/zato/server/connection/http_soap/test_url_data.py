@@ -9,6 +9,7 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
+from base64 import b64encode
 from unittest import TestCase
 from uuid import uuid4
 
@@ -22,10 +23,11 @@ from nose.tools import eq_
 from sortedcontainers import SortedList
 
 # Zato
-from zato.common import DATA_FORMAT, MISC, URL_TYPE, ZATO_NONE
+from zato.common import AUDIT_LOG, DATA_FORMAT, MISC, MSG_PATTERN_TYPE, SEC_DEF_TYPE, URL_TYPE, ZATO_NONE
 from zato.common.test import rand_string
 from zato.common.util import new_cid, payload_from_request
 from zato.server.connection.http_soap import Unauthorized, url_data
+from zato.server.rbac_ import RBAC
 
 # ################################################################################################################################
 
@@ -105,6 +107,7 @@ class URLDataTestCase(TestCase):
         ud.channel_data.append(item2)
         ud.channel_data.append(item1)
         ud.channel_data.append(item3)
+        ud.reindex_channels()
 
         match, _ = ud.match(url_path1, soap_action1)
         eq_(match, {})
@@ -152,6 +155,7 @@ class URLDataTestCase(TestCase):
         ud.channel_data.append(item1)
         ud.channel_data.append(item2)
         ud.channel_data.append(item3)
+        ud.reindex_channels()
 
         match, info = ud.match('/customer/123/order/456', '')
         eq_(sorted(match.items()), [('cid', '123'), ('oid', '456')])
@@ -194,6 +198,7 @@ class URLDataTestCase(TestCase):
             item1.match_target_compiled = url_data.Matcher(item1.match_target)
 
             ud.channel_data.append(item1)
+            ud.reindex_channels()
 
             match, info = ud.match('/customer/{}'.format(cid), '')
             self.assertTrue(bool(match), 'bool(match) is not True, cid:`{}`'.format(cid))
@@ -220,10 +225,210 @@ class URLDataTestCase(TestCase):
         item3.match_target_compiled = url_data.Matcher(item3.match_target)
 
         ud.channel_data.append(item3)
+        ud.reindex_channels()
 
         match, _ = ud.match('/customer/1 23/order/4 56', soap_action3)
         eq_(sorted(match.items()), [(u'cid', u'1 23'), (u'oid', u'4 56')])
 
+# ################################################################################################################################
+
+    def _get_router_item(self, name, soap_action, url_path):
+        item = Bunch()
+        item.name = name
+        item.match_target = '{}{}{}'.format(soap_action, MISC.SEPARATOR, url_path)
+        item.match_target_compiled = url_data.Matcher(item.match_target)
+
+        return item
+
+    def test_url_router_get_candidates(self):
+
+        item1 = self._get_router_item('name-1', '', '/customer/{cid}')
+        item2 = self._get_router_item('name-2', '', '/customer/{cid}/order/{oid}')
+        item3 = self._get_router_item('name-3', '', '/customer/abc/order/{oid}')
+        item4 = self._get_router_item('name-4', 'aaabbbccc', '/customer/{cid}/order')
+        item5 = self._get_router_item('name-5', '', '/file/{name}.{ext}')
+
+        router = url_data.URLRouter([item1, item2, item3, item4, item5])
+        eq_(router.size, 5)
+
+        # item5 uses a dot in its literal part which is a regex metacharacter so it cannot be indexed
+        eq_(router.fallback, [item5])
+
+        eq_(router.get_candidates('', '/customer/123'), [item1, item5])
+        eq_(router.get_candidates('', '/customer/123/order/456'), [item2, item5])
+        eq_(router.get_candidates('', '/customer/abc/order/456'), [item2, item3, item5])
+        eq_(router.get_candidates('aaabbbccc', '/customer/123/order'), [item4, item5])
+        eq_(router.get_candidates('', '/customer/'), [item5])
+        eq_(router.get_candidates(uuid4().hex, '/customer/123'), [item5])
+
+        router.remove(item2)
+        router.remove(item5)
+        eq_(router.size, 3)
+
+        eq_(router.get_candidates('', '/customer/abc/order/456'), [item3])
+        eq_(router.get_candidates('', '/customer/123/order/456'), [])
+
+        # Removing items that were never added does not change anything
+        router.remove(item2)
+        router.remove(self._get_router_item('name-6', '', '/customer'))
+        eq_(router.size, 3)
+
+    def test_match_uses_router(self):
+
+        ud = url_data.URLData([])
+
+        msg = Bunch()
+        msg.soap_action = ''
+        msg.url_path = '/customer/{cid}'
+
+        for name in('connection', 'content_type', 'data_format', 'host', 'id', 'has_rbac', 'is_active', 'is_internal',
+            'merge_url_params_req', 'method', 'params_pri', 'ping_method', 'pool_size', 'service_id', 'service_name',
+            'soap_version', 'transport', 'url_params_pri', 'sec_use_rbac'):
+            msg[name] = None
+
+        msg.name = 'name-1'
+        msg.impl_name = uuid4().hex
+
+        ud.url_sec = {}
+        ud.on_broker_msg_CHANNEL_HTTP_SOAP_CREATE_EDIT(msg)
+
+        match, item = ud.match('/customer/123', '')
+        eq_(match, {'cid': '123'})
+        eq_(item.name, 'name-1')
+        eq_(ud.url_router.size, 1)
+
+        # An edit replaces the channel in the index
+        msg.old_name = msg.name
+        msg.old_soap_action = msg.soap_action
+        msg.old_url_path = msg.url_path
+        msg.url_path = '/client/{cid}'
+
+        ud.on_broker_msg_CHANNEL_HTTP_SOAP_CREATE_EDIT(msg)
+        eq_(ud.url_router.size, 1)
+
+        match, item = ud.match('/customer/123', '')
+        self.assertIsNone(match)
+        self.assertIsNone(item)
+
+        match, item = ud.match('/client/123', '')
+        eq_(match, {'cid': '123'})
+        eq_(item.name, 'name-1')
+
+        msg.old_url_path = msg.url_path
+        ud.on_broker_msg_CHANNEL_HTTP_SOAP_DELETE(msg)
+        eq_(ud.url_router.size, 0)
+
+        match, item = ud.match('/client/123', '')
+        self.assertIsNone(match)
+        self.assertIsNone(item)
+
+    def test_match_router_replace_channel(self):
+
+        ud = url_data.URLData([])
+        ud.url_sec = {}
+
+        def get_msg(name, soap_action, url_path):
+            msg = Bunch()
+            msg.soap_action = soap_action
+            msg.url_path = url_path
+
+            for attr in('connection', 'content_type', 'data_format', 'host', 'id', 'has_rbac', 'is_active', 'is_internal',
+                'merge_url_params_req', 'method', 'params_pri', 'ping_method', 'pool_size', 'service_id', 'service_name',
+                'soap_version', 'transport', 'url_params_pri', 'sec_use_rbac'):
+                msg[attr] = None
+
+            msg.name = name
+            msg.impl_name = uuid4().hex
+
+            return msg
+
+        msg1 = get_msg('name-1', '', '/customer/{cid}')
+        ud.on_broker_msg_CHANNEL_HTTP_SOAP_CREATE_EDIT(msg1)
+
+        match, item = ud.match('/customer/123', '')
+        eq_(item.name, 'name-1')
+
+        # Deleting one channel and creating another one keeps the number of channels intact
+        msg1.old_soap_action = msg1.soap_action
+        msg1.old_url_path = msg1.url_path
+        ud.on_broker_msg_CHANNEL_HTTP_SOAP_DELETE(msg1)
+
+        msg2 = get_msg('name-2', '', '/client/{cid}')
+        ud.on_broker_msg_CHANNEL_HTTP_SOAP_CREATE_EDIT(msg2)
+
+        eq_(len(ud.channel_data), 1)
+        eq_(ud.url_router.size, 1)
+
+        match, item = ud.match('/customer/123', '')
+        self.assertIsNone(match)
+        self.assertIsNone(item)
+
+        match, item = ud.match('/client/123', '')
+        eq_(match, {'cid': '123'})
+        eq_(item.name, 'name-2')
+
+        # Same for renaming a SOAP action
+        msg2.old_name = msg2.name
+        msg2.old_soap_action = msg2.soap_action
+        msg2.old_url_path = msg2.url_path
+        msg2.soap_action = 'my.action'
+        ud.on_broker_msg_CHANNEL_HTTP_SOAP_CREATE_EDIT(msg2)
+
+        eq_(len(ud.channel_data), 1)
+        eq_(ud.url_router.size, 1)
+
+        match, item = ud.match('/client/123', '')
+        self.assertIsNone(match)
+        self.assertIsNone(item)
+
+        match, item = ud.match('/client/123', 'my.action')
+        eq_(match, {'cid': '123'})
+        eq_(item.name, 'name-2')
+
+    def test_match_url_path_cache(self):
+
+        ud = url_data.URLData([], url_path_cache_size=2)
+
+        item1 = self._get_router_item('name-1', '', '/customer/{cid}')
+        item2 = self._get_router_item('name-2', '', '/static')
+        ud.channel_data.append(item1)
+        ud.channel_data.append(item2)
+        ud.reindex_channels()
+
+        match, item = ud.match('/customer/123', '')
+        eq_(match, {'cid': '123'})
+        eq_(item.name, 'name-1')
+
+        # Callers may modify path parameters returned, which must not affect the cache
+        match['qs_param'] = uuid4().hex
+
+        match, item = ud.match('/customer/123', '')
+        eq_(match, {'cid': '123'})
+        eq_(item.name, 'name-1')
+
+        match, item = ud.match('/static', '')
+        eq_(match, {})
+        eq_(item.name, 'name-2')
+
+        # Evicts '/customer/123' which was used less recently than '/static'
+        ud.match('/customer/456', '')
+
+        self.assertIn('{}{}/static'.format('', MISC.SEPARATOR), ud.url_path_cache)
+        self.assertNotIn('{}{}/customer/123'.format('', MISC.SEPARATOR), ud.url_path_cache)
+
+        eq_(ud.url_path_cache.get_stats(), {'size': 2, 'max_size': 2, 'hits': 1, 'misses': 3, 'evictions': 1})
+
+        # Any change to channels clears the cache
+        ud.url_sec = {'{}{}/static'.format('', MISC.SEPARATOR): None}
+        msg = Bunch(old_soap_action='', old_url_path='/static')
+        ud.on_broker_msg_CHANNEL_HTTP_SOAP_DELETE(msg)
+
+        eq_(len(ud.url_path_cache), 0)
+
+        match, item = ud.match('/static', '')
+        self.assertIsNone(match)
+        self.assertIsNone(item)
+
 # ################################################################################################################################
 
     def test_check_security(self):
@@ -1406,7 +1611,8 @@ class URLDataTestCase(TestCase):
             for name in('connection', 'data_format', 'has_rbac', 'host', 'id', 'is_active', 'is_internal', 'method', 'name',
                 'ping_method', 'pool_size', 'service_id', 'impl_name', 'service_name', 'soap_action', 'soap_version',
                 'transport', 'url_path', 'merge_url_params_req', 'url_params_pri', 'params_pri', 'audit_max_payload',
-                'audit_repl_patt_type', 'replace_patterns_json_pointer', 'replace_patterns_xpath', 'content_type'):
+                'audit_repl_patt_type', 'replace_patterns_json_pointer', 'replace_patterns_xpath', 'content_type',
+                'is_streaming'):
                 msg[name] = uuid4().hex
 
             msg['sec_use_rbac'] = False
@@ -1428,15 +1634,15 @@ class URLDataTestCase(TestCase):
                 'is_internal', 'method', 'name', 'ping_method', 'pool_size',
                 'service_id', 'impl_name', 'service_name',
                 'soap_action', 'soap_version', 'transport', 'url_path',
-                'merge_url_params_req', 'url_params_pri', 'params_pri'):
+                'merge_url_params_req', 'url_params_pri', 'params_pri', 'is_streaming'):
                 eq_(msg[name], channel_item[name])
 
             if needs_security_id:
-                eq_(len(channel_item.keys()), 34)
+                eq_(len(channel_item.keys()), 35)
                 for name in('sec_type', 'security_id', 'security_name'):
                     eq_(msg[name], channel_item[name])
             else:
-                eq_(len(channel_item.keys()), 31)
+                eq_(len(channel_item.keys()), 32)
 
         for needs_security_id in(True, False):
             msg = get_msg(needs_security_id)
@@ -1608,3 +1814,96 @@ class URLDataTestCase(TestCase):
         eq_(dummy_lock.enter_called, True)
 
 # ################################################################################################################################
+
+class RBACDelegatedSecurityTestCase(TestCase):
+
+    def get_data(self):
+        rbac = RBAC()
+        rbac.create_permission(1, 'Read')
+        rbac.set_http_permissions()
+        rbac.create_role(2, 'role', None)
+        rbac.create_resource(3)
+        rbac.create_role_permission_allow(2, 1, 3)
+
+        ud = url_data.URLData([], basic_auth_config={}, jwt_config={}, apikey_config={})
+
+        for idx in range(3):
+            name = 'ba{}'.format(idx)
+            ud._update_basic_auth(name, Bunch(id=idx, name=name, username='user{}'.format(idx), password='pass', realm='r',
+                sec_type=SEC_DEF_TYPE.BASIC_AUTH))
+            rbac.create_client_role('sec_def:::basic_auth:::{}'.format(name), 2)
+
+        ud._update_apikey('key1', Bunch(id=10, name='key1', username='X-KEY', password='key', sec_type=SEC_DEF_TYPE.APIKEY))
+        rbac.create_client_role('sec_def:::apikey:::key1', 2)
+
+        # Counts security definitions actually checked
+        ud.checked = []
+        check_security = ud.check_security
+
+        def _check_security(sec, *args, **kwargs):
+            if not sec.sec_use_rbac:
+                ud.checked.append(sec.sec_def.name)
+            return check_security(sec, *args, **kwargs)
+
+        ud.check_security = _check_security
+
+        return ud, Bunch(rbac=rbac), Bunch(service_id=3)
+
+    def check(self, wsgi_environ):
+        ud, worker_store, channel_item = self.get_data()
+        wsgi_environ['REQUEST_METHOD'] = 'GET'
+
+        ud.check_rbac_delegated_security(None, new_cid(), channel_item, '/', '', wsgi_environ, {}, worker_store)
+
+        return ud.checked, wsgi_environ['zato.sec_def']
+
+    def test_basic_auth(self):
+        checked, sec_def = self.check({'HTTP_AUTHORIZATION': 'Basic ' + b64encode('user1:pass')})
+
+        # Only the definition of the user given on input was checked
+        eq_(checked, ['ba1'])
+        eq_(sec_def['name'], 'ba1')
+        eq_(sec_def['type'], SEC_DEF_TYPE.BASIC_AUTH)
+
+    def test_apikey(self):
+        checked, sec_def = self.check({'HTTP_X_KEY': 'key'})
+
+        eq_(checked, ['key1'])
+        eq_(sec_def['name'], 'key1')
+
+    def test_not_allowed(self):
+        for wsgi_environ in ({'HTTP_AUTHORIZATION': 'Basic ' + b64encode('user1:invalid')},
+            {'HTTP_AUTHORIZATION': 'Basic ' + b64encode('user4:pass')}, {'HTTP_AUTHORIZATION': 'Bearer abc'}, {}):
+
+            self.assertRaises(Unauthorized, self.check, wsgi_environ)
+
+# ################################################################################################################################
+
+class AuditTestCase(TestCase):
+
+    def test_dump_wsgi_environ(self):
+        channel_item = {'name': 'my.channel', 'password': 'secret'}
+        dumped = url_data.URLData()._dump_wsgi_environ({'zato.http.channel_item': channel_item})
+
+        # Only the copy that is dumped has its password masked out
+        self.assertIn(AUDIT_LOG.REPLACE_WITH, dumped)
+        self.assertNotIn('secret', dumped)
+        eq_(channel_item['password'], 'secret')
+
+    def test_buffered(self):
+        ud = url_data.URLData(audit_writer=AUDIT_LOG.WRITER.BUFFERED)
+        ud.odb = None # Nothing may be stored in the request path
+
+        channel_item = Bunch(id=1, name='channel1', transport=URL_TYPE.PLAIN_HTTP, connection='channel', username=None,
+            audit_repl_patt_type=MSG_PATTERN_TYPE.XPATH.id, replace_patterns_xpath=[], audit_max_payload=0)
+
+        ud.audit_set_request('cid1', channel_item, 'req', {})
+        ud.audit_set_response('cid1', 'resp', {'zato.http.response.status': '200 OK'})
+
+        record = ud.audit_buffer.records['cid1']
+        eq_(record.req_payload, 'req')
+        eq_(record.resp_payload, 'resp')
+
+        ud.audit_buffer.greenlet.kill()
+
+# ################################################################################################################################
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from itertools import count
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import sleep, spawn, Timeout
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.server.connection.queue import ConnectionQueue, get_queue_config, Wrapper
+
+# ################################################################################################################################
+
+class ConnectionQueueTestCase(TestCase):
+
+    def setUp(self):
+        self.ids = count(1)
+        self.failures = 0
+        self.closed = []
+
+    def get_queue(self, pool_size=2, **kwargs):
+        kwargs.setdefault('acquire_timeout', 1)
+        self.queue = ConnectionQueue(pool_size, 1, 'my.conn', 'Test', 'address', self.add_client,
+            close_func=self.closed.append, **kwargs)
+        self.queue.build_queue()
+        self.queue.is_built.wait(1)
+        return self.queue
+
+    def add_client(self):
+        if self.failures:
+            self.failures -= 1
+            raise Exception('Cannot connect')
+
+        self.queue.put_client(next(self.ids))
+
+    def hold(self, queue, results, duration=0.01, timeout=None):
+        try:
+            with queue(timeout) as client:
+                results.append(client)
+                sleep(duration)
+        except Exception:
+            results.append(None)
+
+# ################################################################################################################################
+
+    def test_build_queue(self):
+        self.failures = 1
+        self.queue = ConnectionQueue(3, 0.05, 'my.conn', 'Test', 'address', self.add_client)
+        self.queue.build_queue()
+
+        # The connection that could not be established is retried after queue_build_cap seconds
+        self.queue.is_built.wait(1)
+        eq_(self.queue.size, 3)
+        eq_(sorted(client for client, _ in self.queue.idle), [1, 2, 3])
+
+    def test_no_waiting(self):
+        self.queue = self.get_queue(acquire_timeout=0)
+        results = []
+
+        greenlets = [spawn(self.hold, self.queue, results) for x in range(3)]
+        sleep(0.05)
+
+        # Without waiting, the one above pool_size fails at once, like it used to
+        eq_(sorted(results), [None, 1, 2])
+        eq_(self.queue.get_stats()['timeouts'], 1)
+
+        for greenlet in greenlets:
+            greenlet.kill()
+
+    def test_fair_waiting(self):
+        self.queue = self.get_queue(pool_size=1)
+        results = []
+
+        for x in range(4):
+            spawn(self.hold, self.queue, results)
+            sleep(0)
+
+        eq_(self.queue.get_stats()['waiters'], 3)
+        sleep(0.1)
+
+        # All of them got the only connection, one by one
+        eq_(results, [1, 1, 1, 1])
+
+        stats = self.queue.get_stats()
+        eq_(stats['waiters'], 0)
+        eq_(stats['max_waiters'], 3)
+        eq_(stats['acquired'], 4)
+        eq_(sum(count for _, count in stats['wait_times']), 4)
+
+    def test_timeout(self):
+        self.queue = self.get_queue(pool_size=1)
+        results = []
+
+        spawn(self.hold, self.queue, results, 0.2)
+        sleep(0)
+
+        self.hold(self.queue, results, timeout=0.01)
+        eq_(results, [1, None])
+        eq_(self.queue.get_stats()['waiters'], 0)
+
+    def test_timeout_caller(self):
+        self.queue = self.get_queue(pool_size=1)
+        results = []
+
+        spawn(self.hold, self.queue, results, 0.05)
+        sleep(0)
+
+        # A timeout set by the caller is propagated as is rather than taken for the queue's own one
+        timeout = Timeout(0.01)
+        with self.assertRaises(Timeout) as ctx:
+            with timeout:
+                self.queue.acquire(1)
+
+        self.assertIs(ctx.exception, timeout)
+        eq_(self.queue.get_stats()['timeouts'], 0)
+        eq_(self.queue.get_stats()['waiters'], 0)
+
+        # The connection is still available to others
+        sleep(0.1)
+        with self.queue(0.01) as client:
+            eq_(client, 1)
+
+    def test_grow_and_shrink(self):
+        self.queue = self.get_queue(max_pool_size=4, idle_timeout=10)
+        results = []
+
+        for x in range(4):
+            spawn(self.hold, self.queue, results, 0.05)
+        sleep(0.01)
+
+        # Two more connections were established for ones that would otherwise wait
+        eq_(self.queue.get_stats()['in_use'], 4)
+        eq_(sorted(results), [1, 2, 3, 4])
+
+        # No more than max_pool_size of them
+        spawn(self.hold, self.queue, results)
+        sleep(0.01)
+        eq_(self.queue.size, 4)
+        sleep(0.1)
+
+        # Only the ones beyond pool_size are closed, once they have been idle for long enough
+        self.queue.shrink()
+        eq_(self.queue.size, 4)
+
+        for idx, (client, _) in enumerate(self.queue.idle):
+            self.queue.idle[idx] = (client, 0)
+
+        self.queue.shrink()
+        eq_(self.queue.size, 2)
+        eq_(len(self.closed), 2)
+        eq_(self.queue.get_stats()['shrunk'], 2)
+
+    def test_validate(self):
+        invalid = set([1])
+
+        def validate(client):
+            if client in invalid:
+                raise Exception('Invalid client')
+
+        self.queue = self.get_queue(pool_size=1, validate_func=validate, validate_after=10)
+
+        # Not idle for long enough to be validated
+        with self.queue() as client:
+            eq_(client, 1)
+
+        self.queue.idle[0] = (1, 0)
+
+        # Evicted and replaced with a new connection
+        with self.queue() as client:
+            eq_(client, 2)
+
+        eq_(self.closed, [1])
+        eq_(self.queue.size, 1)
+        eq_(self.queue.get_stats()['evicted'], 1)
+
+    def test_close(self):
+        self.queue = self.get_queue()
+
+        with self.queue():
+            self.queue.close()
+            eq_(self.closed, [1])
+
+        eq_(sorted(self.closed), [1, 2])
+        eq_(self.queue.size, 0)
+
+    def test_wrapper_close(self):
+        closed = self.closed
+
+        class MyWrapper(Wrapper):
+            def add_client(self):
+                self.client.put_client(1)
+
+            def close_client(self, client):
+                closed.append(client)
+
+        config = Bunch(username=None, pool_size=1, queue_build_cap=1, name='my.conn', auth_url='address', is_active=True)
+        wrapper = MyWrapper(config, 'Test')
+        wrapper.build_queue()
+        wrapper.client.is_built.wait(1)
+
+        # Connections are closed the way the wrapper closes them
+        wrapper.client.close()
+        eq_(self.closed, [1])
+
+    def test_get_queue_config(self):
+        eq_(get_queue_config(Bunch(pool_size=10, queue_acquire_timeout=5, queue_max_pool_size_factor=1.5,
+            queue_idle_timeout=60, queue_validate_after=30)),
+            {'max_pool_size': 15, 'acquire_timeout': 5.0, 'idle_timeout': 60.0, 'validate_after': 30.0})
+
+        # Connections with no such keys in their config behave the way they used to
+        eq_(get_queue_config(Bunch(pool_size=10)), {'max_pool_size': 10, 'acquire_timeout': 0, 'idle_timeout': 300,
+            'validate_after': 0})
+
+# ################################################################################################################################
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Compares invocations per second of a no-op service whose facades (self.outgoing, self.cloud, self.email, self.search,
+# self.patterns and self.msg) are created only on first access with those of one which creates all of them in each
+# invocation, as Service._init used to. Services are invoked through self.invoke and through Service.update_handle the way
+# HTTP channels invoke them once a request's URL and security have been matched, with no KVDB, ODB or statistics involved.
+# Run it directly, e.g. python bench_invoke.py
+
+# stdlib
+from timeit import default_timer
+
+# Bunch
+from bunch import Bunch
+
+# Zato
+from zato.common import CHANNEL, DATA_FORMAT
+from zato.common.test import FakeServer
+from zato.common.util import new_cid
+from zato.server.service import Service
+
+# ################################################################################################################################
+
+class NoOp(Service):
+    def handle(self):
+        pass
+
+class EagerNoOp(NoOp):
+    """ Creates all the facades in each invocation.
+    """
+    def _init(self):
+        super(EagerNoOp, self)._init()
+        (self.outgoing, self.cloud, self.email, self.search, self.patterns, self.msg)
+
+class Caller(Service):
+    def handle(self):
+        pass
+
+# ################################################################################################################################
+
+def get_caller():
+    allow_all = Bunch(is_allowed=lambda name: True)
+
+    worker_config = Bunch(cloud_openstack_swift={}, cloud_aws_s3={})
+    worker_config.outgoing_connections = lambda: ({}, {}, {}, {})
+
+    worker_store = Bunch(pubsub=None, cache=None, sql_pool_store={}, stomp_outconn_api=None, cassandra_api=None,
+        cassandra_query_api=None, email_smtp_api=None, email_imap_api=None, search_es_api=None, search_solr_api=None,
+        msg_ns_store=None, json_pointer_store=None, xpath_store=None, worker_config=worker_config,
+        invoke_matcher=allow_all, target_matcher=allow_all)
+
+    server = FakeServer(None, {NoOp.get_impl_name(): NoOp, EagerNoOp.get_impl_name(): EagerNoOp})
+    server.odb = None
+    server.component_enabled = Bunch(stats=False, slow_response=False)
+    worker_store.server = server
+    worker_store.kvdb = server.kvdb
+
+    caller = Caller()
+    Caller.update(caller, CHANNEL.INVOKE, server, None, worker_store, new_cid(), '', '', simple_io_config={},
+        data_format=DATA_FORMAT.JSON)
+
+    return caller
+
+def run_invoke(caller, class_, how_many):
+    impl_name = class_.get_impl_name()
+    for _ in xrange(how_many):
+        caller.invoke_by_impl_name(impl_name, '{}', data_format=DATA_FORMAT.JSON)
+
+def run_http(caller, class_, how_many):
+    server, worker_store = caller.server, caller.worker_store
+    impl_name = class_.get_impl_name()
+    wsgi_environ = {'REQUEST_METHOD': 'POST', 'zato.request.payload': {'a': 1}}
+
+    for _ in xrange(how_many):
+        service = server.service_store.new_instance(impl_name)
+        service.update_handle(service.set_response_data, service, '{"a": 1}', CHANNEL.HTTP_SOAP, DATA_FORMAT.JSON, None,
+            server, None, worker_store, new_cid(), {}, wsgi_environ=wsgi_environ, serialize=True, as_bunch=False)
+
+# ################################################################################################################################
+
+def run(how_many=20000):
+    caller = get_caller()
+
+    for name, func in (('invoke', run_invoke), ('HTTP channel', run_http)):
+        results = []
+
+        for class_ in (EagerNoOp, NoOp):
+            func(caller, class_, 100) # Warm-up
+
+            start = default_timer()
+            func(caller, class_, how_many)
+            results.append(how_many / (default_timer() - start))
+
+        print('{:>28}: {:10.0f} invocations/s, lazy facades {:10.0f} invocations/s ({:+.0%})'.format(
+            name, results[0], results[1], results[1] / results[0] - 1))
+
+if __name__ == '__main__':
+    run()
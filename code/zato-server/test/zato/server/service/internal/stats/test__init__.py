@@ -68,7 +68,8 @@ class StatsReturningServiceTestCase(ServiceTestCase):
         self.assertEquals(self.sio.input_optional, ('service_name', self.wrap_force_type(Integer('n')), 'n_type'))
         self.assertEquals(self.sio.output_optional, ('service_name', 'usage', 'mean', 'rate', 'time', 'usage_trend', 'mean_trend',
                                                      'min_resp_time', 'max_resp_time', 'all_services_usage', 'all_services_time',
-                                                     'mean_all_services', 'usage_perc_all_services', 'time_perc_all_services'))
+                                                     'mean_all_services', 'usage_perc_all_services', 'time_perc_all_services',
+                                                     'p50', 'p90', 'p99', 'p999'))
         self.assertEquals(self.sio.namespace, zato_namespace)
         self.assertRaises(AttributeError, getattr, self.sio, 'output_required')
         self.assertRaises(AttributeError, getattr, self.sio, 'output_repeated')
@@ -100,7 +101,7 @@ class GetByServiceTestCase(ServiceTestCase):
         self.assertEquals(self.sio.response_elem, 'zato_stats_get_by_service_response')
         self.assertEquals(self.sio.input_required, (self.wrap_force_type(UTC('start')), self.wrap_force_type(UTC('stop')), 'service_id'))
         self.assertEquals(self.sio.output_optional, ('service_name', 'usage', 'mean', 'rate', 'time', 'usage_trend', 'mean_trend',
-                                                     'min_resp_time', 'max_resp_time',))
+                                                     'min_resp_time', 'max_resp_time', 'p50', 'p90', 'p99', 'p999'))
         self.assertEquals(self.sio.namespace, zato_namespace)
         self.assertRaises(AttributeError, getattr, self.sio, 'output_required')
         self.assertRaises(AttributeError, getattr, self.sio, 'output_repeated')
@@ -46,7 +46,7 @@ class GetListTestCase(ServiceTestCase):
         self.assertEquals(self.sio.output_optional, ('service_id', 'service_name', 'security_id', 'security_name', 'sec_type',
             'method', 'soap_action', 'soap_version', 'data_format', 'host',
             'ping_method', 'pool_size', 'merge_url_params_req', 'url_params_pri', 'params_pri', 'serialization_type', 'timeout',
-            'sec_tls_ca_cert_id', Bool('has_rbac'), 'content_type', Bool('sec_use_rbac')))
+            'sec_tls_ca_cert_id', Bool('has_rbac'), 'content_type', Bool('sec_use_rbac'), Bool('is_streaming')))
         self.assertEquals(self.sio.namespace, zato_namespace)
 
     def test_impl(self):
@@ -77,7 +77,8 @@ class CreateTestCase(ServiceTestCase):
         self.assertEquals(self.sio.input_required, ('cluster_id', 'name', 'is_active', 'connection', 'transport', 'is_internal', 'url_path'))
         self.assertEquals(self.sio.input_optional, ('service', 'security_id', 'method', 'soap_action', 'soap_version', 'data_format', 'host',
             'ping_method', 'pool_size', ForceTypeWrapper(Bool('merge_url_params_req')), 'url_params_pri', 'params_pri',
-            'serialization_type', 'timeout', 'sec_tls_ca_cert_id', ForceTypeWrapper(Bool('has_rbac')), 'content_type'))
+            'serialization_type', 'timeout', 'sec_tls_ca_cert_id', ForceTypeWrapper(Bool('has_rbac')), 'content_type',
+            ForceTypeWrapper(Bool('is_streaming'))))
         self.assertEquals(self.sio.output_required, ('id', 'name'))
         self.assertEquals(self.sio.namespace, zato_namespace)
         self.assertRaises(AttributeError, getattr, self.sio, 'output_optional')
@@ -111,7 +112,7 @@ class EditTestCase(ServiceTestCase):
         self.assertEquals(self.sio.input_optional, ('service', 'security_id', 'method', 'soap_action', 'soap_version',
             'data_format', 'host', 'ping_method', 'pool_size', ForceTypeWrapper(Bool('merge_url_params_req')), 'url_params_pri',
             'params_pri', 'serialization_type', 'timeout', 'sec_tls_ca_cert_id', ForceTypeWrapper(Bool('has_rbac')),
-            'content_type'))
+            'content_type', ForceTypeWrapper(Bool('is_streaming'))))
         self.assertEquals(self.sio.output_required, ('id', 'name'))
         self.assertEquals(self.sio.namespace, zato_namespace)
         self.assertRaises(AttributeError, getattr, self.sio, 'output_optional')
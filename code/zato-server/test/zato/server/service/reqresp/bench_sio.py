@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Compares parsing of requests and serialization of responses with and without SimpleIO definitions compiled
+# into SIOPlan objects, using the services from zato.server.service.internal.checks.sio and the requests CheckSIO
+# sends them. Each service asserts its input so both ways are also checked to produce the same results.
+# Run it directly, e.g. python bench_sio.py
+
+# stdlib
+from json import dumps, loads
+from timeit import default_timer
+
+# Zato
+from zato.common import DATA_FORMAT, SIMPLE_IO
+from zato.common.util import new_cid
+from zato.server.service.internal.checks import sio as sio_checks
+
+# ################################################################################################################################
+
+simple_io_config = {
+    'int_parameters': SIMPLE_IO.INT_PARAMETERS.VALUES,
+    'int_parameter_suffixes': SIMPLE_IO.INT_PARAMETERS.SUFFIXES,
+    'bool_parameter_prefixes': SIMPLE_IO.BOOL_PARAMETERS.SUFFIXES,
+}
+
+# ################################################################################################################################
+
+class _Request(Exception):
+    pass
+
+class _CheckSIO(object):
+    """ Stands in for CheckSIO, collecting requests instead of sending them.
+    """
+    def invoke_check_json(self, service, payload=None):
+        raise _Request(service, payload)
+
+def get_corpus():
+    """ Returns a list of (service class, request) tuples, one for each JSON check of CheckSIO.
+    """
+    services = {}
+    for item in vars(sio_checks).values():
+        if isinstance(item, type) and issubclass(item, sio_checks.CheckTargetService) and hasattr(item, 'SimpleIO'):
+            services[item.get_name()] = item
+
+    out = []
+
+    for name in sorted(dir(sio_checks.CheckSIO)):
+        if name.startswith('json_check_'):
+            try:
+                getattr(sio_checks.CheckSIO, name).im_func(_CheckSIO())
+            except _Request, e:
+                service_name, payload = e.args
+                out.append((services[service_name], payload))
+
+    return out
+
+def invoke(class_, payload, sio_plan):
+    service = class_()
+    service.cid = new_cid()
+    service.request.payload = payload
+    service.request.raw_request = dumps(payload)
+    service.request.simple_io_config = simple_io_config
+    service.response.simple_io_config = simple_io_config
+
+    service.request.init(True, service.cid, class_.SimpleIO, DATA_FORMAT.JSON, None, {}, sio_plan)
+    service.response.init(service.cid, class_.SimpleIO, DATA_FORMAT.JSON, sio_plan)
+    service.handle()
+
+    # As in CheckTargetService.after_handle, for services that do not set their output in handle
+    if class_.set_payload.im_func is not sio_checks.CheckTargetService.set_payload.im_func:
+        service.set_payload()
+
+    # Some of the services return their own dicts rather than SimpleIO payloads
+    payload = service.response.payload
+    return payload.getvalue() if hasattr(payload, 'getvalue') else dumps(payload)
+
+# ################################################################################################################################
+
+def run(how_many=2000):
+
+    for class_, payload in get_corpus():
+        class_.compile_sio()
+
+        # Both ways must agree
+        assert loads(invoke(class_, payload, None)) == loads(invoke(class_, payload, class_._sio_plan))
+
+        results = []
+
+        for sio_plan in (None, class_._sio_plan):
+            start = default_timer()
+            for _ in range(how_many):
+                invoke(class_, payload, sio_plan)
+            results.append((default_timer() - start) / how_many * 10**6)
+
+        print('{:>28}: {:8.2f} us/invocation, compiled {:8.2f} us/invocation ({:+.0%})'.format(
+            class_.__name__, results[0], results[1], results[1] / results[0] - 1))
+
+if __name__ == '__main__':
+    run()
@@ -20,7 +20,7 @@ from zato.common.test import rand_bool, rand_csv, rand_date_utc, rand_dict, rand
      rand_nested, rand_opaque, rand_string, rand_unicode
 from zato.common.util import new_cid
 from zato.server.service.reqresp.sio import Boolean, convert_param, CSV, Dict, Float, Integer, List, ListOfDicts, Nested, \
-     Opaque, Unicode, UTC, ValidationException
+     Opaque, SIOPlan, Unicode, UTC, ValidationException
 
 class SIOTestCase(TestCase):
     def test_dict_no_keys_specified(self):
@@ -293,3 +293,55 @@ class ConvertParamTestCase(TestCase):
                 self.assertEquals(expected_value, given_value)
 
 # ################################################################################################################################
+
+class SIOPlanTestCase(TestCase):
+
+    def test_plan(self):
+
+        class SimpleIO:
+            input_required = ('user_id', Boolean('flag'), 'name')
+            input_optional = (Integer('size'),)
+            output_required = ('is_active', 'cust_id')
+            output_optional = (Opaque('data'),)
+            response_elem = 'my_response'
+
+        plan = SIOPlan(SimpleIO)
+
+        eq_([elem.name for elem in plan.input_required], ['user_id', 'flag', 'name'])
+        eq_([elem.name for elem in plan.input_optional], ['size'])
+        eq_([(is_required, elem.name) for is_required, elem in plan.output],
+            [(True, 'is_active'), (True, 'cust_id'), (False, 'data')])
+        eq_(plan.output_names, frozenset(['is_active', 'cust_id', 'data']))
+        eq_(plan.response_elem, 'my_response')
+        eq_(plan.request_elem, 'request')
+        self.assertTrue(plan.output_declared)
+
+    def test_get_converters(self):
+
+        class SimpleIO:
+            input_required = ('user_id', Boolean('flag'), 'is_x')
+            input_optional = ('size',)
+            output_required = ('is_active', 'cust_id', 'name')
+
+        simple_io_config = {
+            'int_parameters': ['size'],
+            'int_parameter_suffixes': ['_id'],
+            'bool_parameter_prefixes': ['is_'],
+        }
+
+        plan = SIOPlan(SimpleIO)
+        required, optional, output = plan.get_converters(simple_io_config)
+
+        eq_(required, ((False, True), (True, False), (True, False)))
+        eq_(optional, ((False, True),))
+        eq_(output, ((True, False), (False, True), (False, False)))
+
+        # Converters are computed once per SimpleIO configuration
+        self.assertIs(plan.get_converters(simple_io_config)[0], required)
+
+        # Without any configuration, names of input parameters do not make them integers
+        required, optional, output = plan.get_converters({})
+        eq_(required, ((False, False), (True, False), (False, False)))
+        eq_(optional, ((False, False),))
+
+# ################################################################################################################################
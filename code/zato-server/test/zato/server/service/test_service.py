@@ -431,3 +431,94 @@ class RESTTargetType(ServiceTestCase):
 
         MyService2.add_http_method_handlers()
         self.assertDictEqual(MyService2.http_method_handlers, {})
+
+# ################################################################################################################################
+
+class InvokeAsyncTestCase(TestCase):
+
+    def get_service(self):
+
+        class FakeBrokerClient(object):
+            def __init__(self):
+                self.calls = []
+
+            def __getattr__(self, name):
+                def _call(msg, **kwargs):
+                    self.calls.append((name, msg))
+                return _call
+
+        service = Service()
+        service.name = 'my.service'
+        service.cid = rand_string()
+        service.broker_client = FakeBrokerClient()
+        service.server = Bunch(service_store=Bunch(name_to_impl_name={'a':'a.A', 'b':'b.B'}))
+        service.worker_store = Bunch(invoke_matcher=Bunch(is_allowed=lambda impl_name: True))
+
+        return service
+
+    def test_invoke_async(self):
+        service = self.get_service()
+        cid = service.invoke_async('a', {'x':1}, to_json_string=True)
+
+        eq_(len(service.broker_client.calls), 1)
+
+        func_name, msg = service.broker_client.calls[0]
+        eq_(func_name, 'invoke_async')
+        eq_(msg['cid'], cid)
+        eq_(msg['service'], 'a')
+        eq_(loads(msg['payload']), {'x':1})
+
+    def test_invoke_async_many(self):
+        service = self.get_service()
+        zato_ctx = {'key':'value'}
+        cids = service.invoke_async([('a', {'x':1}), ('b', {'x':2}), ('a@server2', {'x':3})], to_json_string=True,
+            zato_ctx=zato_ctx)
+
+        eq_(len(cids), 3)
+        eq_(len(set(cids)), 3)
+
+        # All messages without targets are sent at once and so are all the ones with targets
+        eq_(len(service.broker_client.calls), 2)
+
+        func_name, msgs = service.broker_client.calls[0]
+        eq_(func_name, 'publish_many')
+        eq_(len(msgs), 1)
+        eq_(msgs[0]['service'], 'a')
+        eq_(msgs[0]['cid'], cids[2])
+        eq_(msgs[0]['zato_ctx'], {'key':'value', 'zato.request_ctx.target':'server2'})
+
+        func_name, msgs = service.broker_client.calls[1]
+        eq_(func_name, 'invoke_async_many')
+        eq_([msg['service'] for msg in msgs], ['a', 'b'])
+        eq_([msg['cid'] for msg in msgs], cids[:2])
+        eq_([loads(msg['payload']) for msg in msgs], [{'x':1}, {'x':2}])
+        eq_(msgs[0]['zato_ctx'], {'key':'value', 'zato.request_ctx.target':''})
+
+        # Input context is not modified
+        eq_(zato_ctx, {'key':'value'})
+
+# ################################################################################################################################
+
+class LazyFacadeTestCase(ServiceTestCase):
+
+    def test_lazy_facades(self):
+
+        class MyService(Service):
+            def handle(self):
+                pass
+
+        instance = self.invoke(MyService, {}, None)
+
+        # Nothing is created unless accessed ..
+        for name in ('outgoing', 'cloud', 'email', 'search', 'patterns', 'msg'):
+            self.assertNotIn(name, instance.__dict__)
+
+        # .. and each facade is created only once.
+        outgoing = instance.outgoing
+        self.assertIs(instance.outgoing, outgoing)
+        self.assertIs(instance.outgoing.sql, instance.worker_store.sql_pool_store)
+        self.assertIs(instance.patterns.fanout.source, instance)
+
+        # Facades can be still replaced, e.g. with mocks
+        instance.cloud = 'abc'
+        eq_(instance.cloud, 'abc')
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import os
+import sys
+from contextlib import closing
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# nose
+from nose.tools import eq_
+
+# SQLAlchemy
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+# Zato
+from zato.common import TRUE_FALSE
+from zato.common.odb.api import ODBManager
+from zato.common.odb.model import Base, DeployedService, Service
+from zato.server.service.store import get_source_hashes, ServiceStore
+
+# ################################################################################################################################
+
+_service_template = """
+from zato.server.service import Service
+
+class MyService{idx}(Service):
+    name = '{prefix}.service.{idx}'
+"""
+
+# ################################################################################################################################
+
+class ServiceStoreTestCase(TestCase):
+
+    def setUp(self):
+        self.dir_name = mkdtemp()
+        self.statements = []
+
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+
+        event.listen(engine, 'before_cursor_execute', lambda *args: self.statements.append(args[2]))
+
+        self.odb = ODBManager()
+        self.odb._Session = sessionmaker(bind=engine)
+        self.odb._session = self.odb._Session()
+        self.odb.cluster = Bunch(id=1)
+        self.odb.server = Bunch(id=2)
+
+    def tearDown(self):
+        rmtree(self.dir_name)
+
+    def write_services(self, file_name, how_many, prefix='my'):
+        path = os.path.join(self.dir_name, file_name)
+
+        with open(path, 'w') as f:
+            for idx in range(how_many):
+                f.write(_service_template.format(idx=idx, prefix=prefix))
+
+        return path
+
+    def get_store(self):
+        store = ServiceStore({}, odb=self.odb)
+        store.patterns_matcher.read_config({'order': TRUE_FALSE, '*': True})
+        return store
+
+    def get_rows(self, model):
+        with closing(self.odb.session()) as session:
+            return session.query(model).all()
+
+# ################################################################################################################################
+
+    def test_bulk_registration(self):
+
+        # Added by another server already
+        with closing(self.odb.session()) as session:
+            session.execute(Service.__table__.insert(), {'name': 'my.service.1', 'is_active': False,
+                'impl_name': 'abc.MyService1', 'is_internal': False, 'slow_threshold': 123, 'cluster_id': 1})
+            session.commit()
+
+        store = self.get_store()
+        deployed = store.import_services_from_file(self.write_services('my_services.py', 3), False, self.dir_name)
+
+        eq_(sorted(class_.get_name() for class_ in deployed), ['my.service.0', 'my.service.1', 'my.service.2'])
+
+        services = dict((item.name, item) for item in self.get_rows(Service))
+        eq_(sorted(services), ['my.service.0', 'my.service.1', 'my.service.2'])
+
+        # Existing services keep their settings
+        impl_name = store.name_to_impl_name['my.service.1']
+        eq_(store.impl_name_to_id[impl_name], services['my.service.1'].id)
+        eq_(store.services[impl_name]['is_active'], False)
+        eq_(store.services[impl_name]['slow_threshold'], 123)
+
+        # New ones are added with default ones
+        impl_name = store.name_to_impl_name['my.service.0']
+        eq_(store.id_to_impl_name[services['my.service.0'].id], impl_name)
+        eq_(store.services[impl_name]['is_active'], True)
+        eq_(store.services[impl_name]['slow_threshold'], 99999)
+
+        deployed_services = self.get_rows(DeployedService)
+        eq_(sorted(item.service_id for item in deployed_services), sorted(item.id for item in services.values()))
+        eq_(set(item.server_id for item in deployed_services), set([2]))
+        eq_(set(item.source_hash_method for item in deployed_services), set(['SHA-256']))
+
+        # Services of another worker of the same server are deployed over the existing ones
+        store = self.get_store()
+        store.import_services_from_file(self.write_services('my_services.py', 3), False, self.dir_name)
+
+        eq_(len(self.get_rows(Service)), 3)
+        eq_(len(self.get_rows(DeployedService)), 3)
+
+    def test_redeploy_keeps_settings(self):
+        store = self.get_store()
+        path = self.write_services('redeployed.py', 1)
+
+        store.import_services_from_file(path, False, self.dir_name)
+        impl_name = store.name_to_impl_name['my.service.0']
+        store.services[impl_name]['slow_threshold'] = 123
+
+        # Services being redeployed can be invoked before they are added to ODB again
+        def add_services(items):
+            eq_(store.services[impl_name]['slow_threshold'], 123)
+            eq_(store.services[impl_name]['service_class'], sys.modules['redeployed'].MyService0)
+            return add_services_orig(items)
+
+        add_services_orig, self.odb.add_services = self.odb.add_services, add_services
+
+        eq_(len(store.import_services_from_file(path, False, self.dir_name)), 1)
+        eq_(store.services[impl_name]['slow_threshold'], 99999)
+
+    def test_statements(self):
+        store = self.get_store()
+
+        store.import_services_from_file(self.write_services('few.py', 2, 'few'), False, self.dir_name)
+        few = len(self.statements)
+
+        store.import_services_from_file(self.write_services('many.py', 50, 'many'), False, self.dir_name)
+        many = len(self.statements) - few
+
+        # The number of statements does not depend on how many services there are
+        eq_(few, many)
+        eq_(len(self.get_rows(Service)), 52)
+
+# ################################################################################################################################
+
+    def test_get_source_hashes(self):
+        source = b"""
+import os
+
+@my_decorator
+class A(object):
+    pass
+
+def b():
+    pass
+
+class C(object):
+    pass
+"""
+        module_hash, class_hashes = get_source_hashes(source)
+        eq_(sorted(class_hashes), ['A', 'C'])
+
+        # Changing a class does not change the rest of the module nor the other classes
+        changed_module_hash, changed_class_hashes = get_source_hashes(source.replace(b'@my_decorator', b'@my_decorator2'))
+        eq_(changed_module_hash, module_hash)
+        eq_(changed_class_hashes['C'], class_hashes['C'])
+        self.assertNotEqual(changed_class_hashes['A'], class_hashes['A'])
+
+        changed_module_hash, changed_class_hashes = get_source_hashes(source.replace(b'import os', b'import sys'))
+        self.assertNotEqual(changed_module_hash, module_hash)
+        eq_(changed_class_hashes, class_hashes)
+
+        eq_(get_source_hashes(b'class A(:'), (None, {}))
+
+    def test_incremental(self):
+        store = self.get_store()
+        path = self.write_services('my_services.py', 3)
+
+        deployed = store.import_services_from_file(path, False, self.dir_name, True)
+        eq_(len(deployed), 3)
+
+        ids = dict(store.impl_name_to_id)
+        service_class = store.services[store.name_to_impl_name['my.service.0']]['service_class']
+        self.statements[:] = []
+
+        # Unchanged file - not imported again and nothing is added to ODB
+        eq_(store.import_services_from_file(path, False, self.dir_name, True), [])
+        eq_(self.statements, [])
+        self.assertIs(store.services[store.name_to_impl_name['my.service.0']]['service_class'], service_class)
+
+        # Only the changed service is added to ODB again, the rest is still updated in the store with their new classes
+        with open(path, 'a') as f:
+            f.write('    def handle(self):\n        pass\n')
+
+        deployed = store.import_services_from_file(path, False, self.dir_name, True)
+        eq_([class_.get_name() for class_ in deployed], ['my.service.2'])
+        eq_(store.impl_name_to_id, ids)
+
+        for impl_name in ids:
+            eq_(store.services[impl_name]['service_class'].__module__, 'my_services')
+            eq_(store.services[impl_name]['service_class'], getattr(sys.modules['my_services'], impl_name.split('.')[-1]))
+
+        # Skipped services point to the current source code of their module too
+        source = open(path, 'rb').read()
+        eq_(set(item.source for item in self.get_rows(DeployedService)), set([source]))
+
+        # A change outside of classes means all of them are added again
+        with open(path, 'a') as f:
+            f.write('\nMY_CONSTANT = 1\n')
+
+        eq_(len(store.import_services_from_file(path, False, self.dir_name, True)), 3)
+
+        # Without incremental imports, everything is always added
+        eq_(len(store.import_services_from_file(path, False, self.dir_name)), 3)
+
+    def test_incremental_dependencies(self):
+        store = self.get_store()
+
+        helpers_path = os.path.join(self.dir_name, 'my_helpers.py')
+        with open(helpers_path, 'w') as f:
+            f.write('def get_value():\n    return 1\n')
+
+        path = self.write_services('my_dep_services.py', 1, 'dep')
+        with open(path, 'a') as f:
+            f.write('\nfrom my_helpers import get_value\n')
+
+        store.import_services_from_file(helpers_path, False, self.dir_name, True)
+        store.import_services_from_file(path, False, self.dir_name, True)
+
+        impl_name = store.name_to_impl_name['dep.service.0']
+        service_class = store.services[impl_name]['service_class']
+
+        # Neither the file nor the modules it depends on have changed
+        eq_(store.import_services_from_file(path, False, self.dir_name, True), [])
+        self.assertIs(store.services[impl_name]['service_class'], service_class)
+
+        # A module it depends on has changed so it is imported again, though nothing is added to ODB
+        with open(helpers_path, 'w') as f:
+            f.write('def get_value():\n    return 2\n')
+
+        store.import_services_from_file(helpers_path, False, self.dir_name, True)
+        self.statements[:] = []
+
+        eq_(store.import_services_from_file(path, False, self.dir_name, True), [])
+        eq_(self.statements, [])
+        self.assertIsNot(store.services[impl_name]['service_class'], service_class)
+        eq_(sys.modules['my_dep_services'].get_value(), 2)
+
+    def test_incremental_odb_error(self):
+        store = self.get_store()
+        path = self.write_services('my_odb_error_services.py', 2, 'odb.error')
+        store.import_services_from_file(path, False, self.dir_name, True)
+
+        with open(path, 'a') as f:
+            f.write('    def handle(self):\n        pass\n')
+
+        def update_deployed_services(items):
+            raise Exception('Cannot update')
+
+        # Services skipped in a changed module could not be updated in ODB, which is reported to the caller ..
+        update_deployed_services_orig = self.odb.update_deployed_services
+        self.odb.update_deployed_services = update_deployed_services
+
+        with self.assertRaises(Exception) as ctx:
+            store.import_services_from_file(path, False, self.dir_name, True)
+        eq_(ctx.exception.args, ('Cannot update',))
+
+        # .. and the module is not skipped when it is deployed again.
+        self.odb.update_deployed_services = update_deployed_services_orig
+        deployed = store.import_services_from_file(path, False, self.dir_name, True)
+        eq_([class_.get_name() for class_ in deployed], ['odb.error.service.1'])
+
+        source = open(path, 'rb').read()
+        eq_(set(item.source for item in self.get_rows(DeployedService)), set([source]))
+
+# ################################################################################################################################
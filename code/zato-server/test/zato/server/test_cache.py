@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from contextlib import closing
+from unittest import TestCase
+
+# gevent
+from gevent import sleep
+
+# Bunch
+from bunch import Bunch
+
+# nose
+from nose.tools import eq_
+
+# SQLAlchemy
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Zato
+from zato.common.broker_message import CACHE
+from zato.common.odb.model import Base, KVData
+from zato.server.cache import RobustCache
+
+# ################################################################################################################################
+
+class FakeConn(object):
+    def __init__(self):
+        self.data = {}
+        self.gets = 0
+
+    def get(self, key):
+        self.gets += 1
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def expire(self, key, ttl):
+        pass
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+class FakeBrokerClient(object):
+    def __init__(self):
+        self.published = []
+        self.caches = []
+
+    def publish(self, msg):
+        self.published.append(msg)
+
+        for cache in self.caches:
+            cache.on_invalidate(Bunch(msg))
+
+# ################################################################################################################################
+
+class RobustCacheTestCase(TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+
+        self.odb = Bunch(session=sessionmaker(bind=engine))
+        self.kvdb = Bunch(conn=FakeConn())
+        self.broker_client = FakeBrokerClient()
+
+    def get_cache(self, **kwargs):
+        return RobustCache(self.kvdb, self.odb, broker_client=self.broker_client, **kwargs)
+
+    def get_odb_data(self):
+        with closing(self.odb.session()) as session:
+            return dict((item.key, item.value) for item in session.query(KVData).all())
+
+    def test_no_local_cache(self):
+        cache = self.get_cache()
+
+        cache.put('a', 'b', async=False)
+        eq_(cache.get('a'), 'b')
+        eq_(cache.get('a'), 'b')
+
+        eq_(self.kvdb.conn.gets, 2)
+        eq_(self.get_odb_data(), {'a': 'b'})
+        eq_(self.broker_client.published, [])
+
+    def test_local_cache(self):
+        cache = self.get_cache(local_cache_size=10, key_prefix='prefix:')
+
+        cache.put('a', 'b', async=False)
+
+        # Served from memory
+        eq_(cache.get('a'), 'b')
+        eq_(self.kvdb.conn.gets, 0)
+
+        # Other workers are told to drop their own copies
+        eq_(self.broker_client.published, [{'action': CACHE.INVALIDATE.value, 'key': 'prefix:a', 'origin': cache.origin}])
+
+        # Keys put elsewhere are read from KVDB once and then kept in memory
+        self.kvdb.conn.set('prefix:c', 'd')
+        eq_(cache.get('c'), 'd')
+        eq_(cache.get('c'), 'd')
+        eq_(self.kvdb.conn.gets, 1)
+
+        eq_(cache.get('e'), None)
+        eq_(self.kvdb.conn.gets, 2)
+
+        stats = cache.get_stats()
+        eq_(stats['local_hits'], 2)
+        eq_(stats['kvdb_hits'], 1)
+        eq_(stats['kvdb_misses'], 1)
+        eq_(stats['hit_ratio'], 0.75)
+        eq_(stats['local_hit_ratio'], 0.5)
+
+    def test_local_ttl(self):
+        cache = self.get_cache(local_cache_size=10, local_ttl=1)
+        cache.put('a', 'b', async=False)
+
+        eq_(cache.get('a', _time=lambda: 0), 'b')
+        eq_(self.kvdb.conn.gets, 0)
+
+        # Expired in memory, hence read from KVDB again
+        self.kvdb.conn.set('a', 'c')
+        eq_(cache.get('a', _time=lambda: 10**10), 'c')
+        eq_(self.kvdb.conn.gets, 1)
+
+    def test_invalidate(self):
+        cache = self.get_cache(local_cache_size=10)
+
+        self.kvdb.conn.set('a', 'b')
+        eq_(cache.get('a'), 'b')
+
+        # Own invalidations are ignored ..
+        cache.on_invalidate(Bunch(key='a', origin=cache.origin))
+        eq_(cache.get('a'), 'b')
+        eq_(self.kvdb.conn.gets, 1)
+
+        # .. but ones from other workers are not.
+        self.kvdb.conn.set('a', 'c')
+        cache.on_invalidate(Bunch(key='a', origin='other'))
+        eq_(cache.get('a'), 'c')
+        eq_(self.kvdb.conn.gets, 2)
+
+    def test_invalidate_after_kvdb_put(self):
+        cache1 = self.get_cache(local_cache_size=10)
+        cache2 = self.get_cache(local_cache_size=10)
+        self.broker_client.caches.extend([cache1, cache2])
+
+        cache1.put('a', 'b', async=False)
+        eq_(cache2.get('a'), 'b')
+
+        # cache2 reads the key after the put but before the invalidation reaches it ..
+        cache1.put('a', 'c')
+        eq_(cache2.get('a'), 'b')
+
+        # .. and the invalidation is published only once the new value is in KVDB, so it is the new value that is kept.
+        sleep(0)
+        eq_(self.broker_client.published[-1]['key'], 'a')
+        eq_(cache2.get('a'), 'c')
+        eq_(cache2.get('a'), 'c')
+        eq_(cache1.get('a'), 'c')
+
+    def test_delete(self):
+        cache = self.get_cache(local_cache_size=10)
+
+        cache.put('a', 'b', async=False)
+        cache.delete('a')
+
+        eq_(cache.get('a'), None)
+        eq_(self.get_odb_data(), {})
+        eq_(len(self.broker_client.published), 2)
+
+    def test_write_behind(self):
+        cache = self.get_cache(write_behind_interval=3600)
+        cache.put('a', 'b')
+        cache.put('c', 'd', 10)
+
+        # Nothing is in ODB until the entries are flushed
+        eq_(self.get_odb_data(), {})
+        cache.flush()
+        eq_(self.get_odb_data(), {'a': 'b', 'c': 'd'})
+
+        # Only the latest version of each key is stored, existing keys are updated and deleted ones removed
+        cache.put('a', 'e')
+        cache.put('a', 'f')
+        cache.put('g', 'h')
+        cache.delete('c')
+        eq_(cache.get_stats()['odb_pending'], 3)
+
+        cache.flush()
+        eq_(self.get_odb_data(), {'a': 'f', 'g': 'h'})
+        eq_(cache.get_stats()['odb_flushed'], 5)
+
+        # Synchronous puts are in ODB straightaway
+        cache.put('i', 'j', async=False)
+        eq_(self.get_odb_data(), {'a': 'f', 'g': 'h', 'i': 'j'})
+
+    def test_write_behind_newer_kept(self):
+        cache1 = self.get_cache(write_behind_interval=3600)
+        cache2 = self.get_cache(write_behind_interval=3600)
+
+        cache1.put('a', 'old')
+        cache1.put('b', 'old')
+        cache1.delete('c')
+
+        cache2.put('a', 'new')
+        cache2.put('b', 'new')
+        cache2.put('c', 'new')
+        cache2.flush()
+
+        # Entries of the other worker are older than the ones already in ODB
+        cache1.flush()
+        eq_(self.get_odb_data(), {'a': 'new', 'b': 'new', 'c': 'new'})
+
+    def test_stop(self):
+        cache = self.get_cache(write_behind_interval=3600)
+        cache.put('a', 'b')
+
+        cache.stop()
+
+        # Nothing pending is lost when a worker stops
+        eq_(self.get_odb_data(), {'a': 'b'})
+        eq_(cache.flusher, None)
+
+    def test_miss_fallback(self):
+        cache = self.get_cache(miss_fallback=True, write_behind_interval=3600)
+        cache.put('a', 'b')
+
+        # Not in KVDB nor in ODB yet but still pending
+        self.kvdb.conn.data.clear()
+        eq_(cache.get('a'), 'b')
+
+        cache.flush()
+        eq_(cache.get('a'), 'b')
+
+# ################################################################################################################################
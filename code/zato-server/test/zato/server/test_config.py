@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import os, stat
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.bunch import Bunch
+from zato.common import CONFIG_SNAPSHOT
+from zato.server.config import ConfigDict, ConfigSnapshot
+
+# ################################################################################################################################
+
+class ConfigSnapshotTestCase(TestCase):
+
+    def setUp(self):
+        self.dir_name = mkdtemp()
+        self.path = os.path.join(self.dir_name, CONFIG_SNAPSHOT.FILE_NAME)
+
+    def tearDown(self):
+        rmtree(self.dir_name)
+
+    def get_config(self):
+        config = Bunch()
+        config.out_sql = ConfigDict('out_sql', Bunch())
+        config.out_sql['my.conn'] = Bunch(config=Bunch(id=1, name='my.conn', pool_size=5))
+        config.http_soap = [Bunch(id=2, name='my.channel', replace_patterns_xpath=['abc'])]
+        return config
+
+    def test_save_load(self):
+        ConfigSnapshot(self.path, 'key1').save(self.get_config())
+
+        config = ConfigSnapshot(self.path, 'key1').load()
+        eq_(sorted(config), ['http_soap', 'out_sql'])
+        eq_(config.http_soap[0].replace_patterns_xpath, ['abc'])
+
+        # ConfigDict objects can be used as usual
+        out_sql = config.out_sql
+        eq_(out_sql.name, 'out_sql')
+        eq_(out_sql['my.conn'].config.pool_size, 5)
+        out_sql['my.conn2'] = Bunch()
+        eq_(sorted(out_sql.keys()), ['my.conn', 'my.conn2'])
+
+        # Nothing is left behind except for the snapshot itself
+        eq_(os.listdir(self.dir_name), [CONFIG_SNAPSHOT.FILE_NAME])
+
+    def test_not_used(self):
+
+        # No snapshot at all
+        eq_(ConfigSnapshot(self.path, 'key1').load(), None)
+
+        ConfigSnapshot(self.path, 'key1', 60).save(self.get_config(), _time=lambda: 1000)
+
+        # Taken during a previous deployment
+        eq_(ConfigSnapshot(self.path, 'key2', 60).load(_time=lambda: 1000), None)
+
+        # Snapshots that cannot be used are deleted
+        self.assertFalse(os.path.exists(self.path))
+
+        # Too old
+        ConfigSnapshot(self.path, 'key1', 60).save(self.get_config(), _time=lambda: 1000)
+        eq_(len(ConfigSnapshot(self.path, 'key1', 60).load(_time=lambda: 1059)), 2)
+        eq_(ConfigSnapshot(self.path, 'key1', 60).load(_time=lambda: 1061), None)
+        self.assertFalse(os.path.exists(self.path))
+
+        # Not a snapshot
+        with open(self.path, 'wb') as f:
+            f.write(b'abc')
+
+        eq_(ConfigSnapshot(self.path, 'key1').load(), None)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_delete(self):
+        snapshot = ConfigSnapshot(self.path, 'key1')
+        snapshot.save(self.get_config())
+
+        # Credentials in the snapshot are not readable to anyone but its owner
+        eq_(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+        snapshot.delete()
+        self.assertFalse(os.path.exists(self.path))
+        eq_(snapshot.load(), None)
+
+        # Deleting a snapshot that does not exist is not an error
+        snapshot.delete()
+
+# ################################################################################################################################
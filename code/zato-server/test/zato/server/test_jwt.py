@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# Cryptography
+from cryptography.fernet import Fernet
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.server.jwt import JWT, TokenCache
+
+# ################################################################################################################################
+
+class FakeCache(object):
+    def __init__(self):
+        self.data = {}
+        self.gets = 0
+        self.puts = 0
+
+    def get(self, key):
+        self.gets += 1
+        return self.data.get(key)
+
+    def put(self, key, value, ttl=None, async=True):
+        self.puts += 1
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+# ################################################################################################################################
+
+class TokenCacheTestCase(TestCase):
+
+    def test_get_set(self):
+        cache = TokenCache(10, 60)
+        cache.set(b'abc', Bunch(ttl=100, username='a'), 1000)
+
+        eq_(cache.get(b'abc', 1000).token_data.username, 'a')
+        eq_(cache.get(b'abc', 1099).token_data.username, 'a')
+        eq_(cache.get(b'def', 1000), None)
+
+        # Expired tokens are deleted
+        eq_(cache.get(b'abc', 1100), None)
+        eq_(len(cache.cache), 0)
+
+    def test_needs_renewal(self):
+        cache = TokenCache(10, 60)
+
+        cache.set(b'abc', Bunch(ttl=1000), 0)
+        entry = cache.get(b'abc', 0)
+
+        self.assertFalse(cache.needs_renewal(entry, 59))
+        self.assertTrue(cache.needs_renewal(entry, 60))
+
+        cache.renewed(entry, 60)
+        eq_(entry.expires_at, 1060)
+        self.assertFalse(cache.needs_renewal(entry, 119))
+
+        # Tokens with short TTLs are renewed more often so that they do not expire in KVDB in the meantime
+        cache.set(b'def', Bunch(ttl=30), 0)
+        entry = cache.get(b'def', 0)
+
+        self.assertFalse(cache.needs_renewal(entry, 14))
+        self.assertTrue(cache.needs_renewal(entry, 15))
+
+    def test_delete(self):
+        cache = TokenCache(10, 60)
+
+        cache.set(b'abc', Bunch(ttl=100, username='a'), 0)
+        cache.set(b'def', Bunch(ttl=100, username='b'), 0)
+        cache.set(b'ghi', Bunch(ttl=100, username='b'), 0)
+
+        cache.delete(b'abc')
+        eq_(cache.get(b'abc', 0), None)
+
+        cache.delete_by_username('b')
+        eq_(len(cache.cache), 0)
+
+        cache.set(b'abc', Bunch(ttl=100, username='a'), 0)
+        cache.delete_digest(TokenCache.get_digest(b'abc'))
+        eq_(cache.get(b'abc', 0), None)
+
+# ################################################################################################################################
+
+class JWTTestCase(TestCase):
+
+    def get_backend(self, token_cache):
+        backend = JWT(None, None, Fernet.generate_key(), token_cache)
+        backend.cache = FakeCache()
+        return backend
+
+    def test_validate_token_cache(self):
+        backend = self.get_backend(TokenCache(10, 60))
+
+        token = backend._create_token(username='a', ttl=100)
+        backend.cache.put(token, token)
+        backend.cache.puts = 0
+
+        for _ in range(3):
+            result = backend.validate(token)
+            self.assertTrue(result.valid)
+            eq_(result.token.username, 'a')
+
+        # Only the first validation needed KVDB and renewed the token
+        eq_(backend.cache.gets, 1)
+        eq_(backend.cache.puts, 1)
+
+        # Once deleted, the token is no longer valid
+        backend.delete(token)
+        self.assertFalse(backend.validate(token).valid)
+
+    def test_validate_no_token_cache(self):
+        backend = self.get_backend(None)
+
+        token = backend._create_token(username='a', ttl=100)
+        backend.cache.put(token, token)
+        backend.cache.puts = 0
+
+        for _ in range(3):
+            self.assertTrue(backend.validate(token).valid)
+
+        eq_(backend.cache.gets, 3)
+        eq_(backend.cache.puts, 3)
+
+        self.assertFalse(backend.validate(b'abc').valid)
+
+# ################################################################################################################################
@@ -792,3 +792,69 @@ class IsAllowedTestCase(TestCase):
         self.assertFalse(rbac.is_role_allowed(role_id1, perm_id1, res_name2))
 
 # ################################################################################################################################
+
+class ClientDefsTestCase(TestCase):
+
+    def get_rbac(self):
+        rbac = RBAC()
+
+        rbac.create_role(1, 'role1', None)
+        rbac.create_role(2, 'role2', None)
+        rbac.create_role(3, 'role3', 1)
+
+        rbac.create_permission(11, 'perm1')
+        rbac.create_permission(22, 'perm2')
+
+        rbac.create_resource('res1')
+        rbac.create_resource('res2')
+
+        rbac.create_client_role('sec_def:::basic_auth:::ba1', 1)
+        rbac.create_client_role('sec_def:::basic_auth:::ba2', 2)
+        rbac.create_client_role('sec_def:::jwt:::jwt1', 2)
+        rbac.create_client_role('sec_def:::apikey:::key1', 3)
+
+        rbac.create_role_permission_allow(1, 11, 'res1')
+        rbac.create_role_permission_allow(2, 11, 'res1')
+        rbac.create_role_permission_allow(3, 22, 'res2')
+
+        return rbac
+
+    def test_get_client_defs(self):
+        rbac = self.get_rbac()
+
+        client_defs = rbac.get_client_defs(11, 'res1')
+        self.assertEqual(sorted(client_defs), ['basic_auth', 'jwt'])
+        self.assertEqual(sorted(client_defs['basic_auth']), ['ba1', 'ba2'])
+        self.assertEqual(client_defs['jwt'], ['jwt1'])
+
+        self.assertEqual(rbac.get_client_defs(22, 'res2'), {'apikey': ['key1']})
+        self.assertEqual(rbac.get_client_defs(22, 'res1'), {})
+
+    def test_get_client_defs_updates(self):
+        rbac = self.get_rbac()
+
+        rbac.create_client_role('sec_def:::basic_auth:::ba3', 1)
+        self.assertEqual(sorted(rbac.get_client_defs(11, 'res1')['basic_auth']), ['ba1', 'ba2', 'ba3'])
+
+        rbac.delete_client_role('sec_def:::basic_auth:::ba3', 1)
+        self.assertEqual(sorted(rbac.get_client_defs(11, 'res1')['basic_auth']), ['ba1', 'ba2'])
+
+        rbac.delete_role_permission_allow(2, 11, 'res1')
+        self.assertEqual(rbac.get_client_defs(11, 'res1'), {'basic_auth': ['ba1']})
+
+        # Deleting a role deletes its children along with their permissions
+        rbac.delete_role(1, 'role1')
+        self.assertEqual(rbac.get_client_defs(11, 'res1'), {})
+        self.assertEqual(rbac.get_client_defs(22, 'res2'), {})
+        self.assertEqual(rbac.perm_resource_to_role_id, {})
+
+        rbac = self.get_rbac()
+        rbac.delete_resource('res1')
+        self.assertEqual(rbac.get_client_defs(11, 'res1'), {})
+        self.assertEqual(rbac.get_client_defs(22, 'res2'), {'apikey': ['key1']})
+
+        rbac = self.get_rbac()
+        rbac.delete_permission(22)
+        self.assertEqual(rbac.get_client_defs(22, 'res2'), {})
+
+# ################################################################################################################################
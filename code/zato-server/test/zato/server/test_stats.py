@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2016 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Nose
+from nose.tools import eq_
+
+# Zato
+from zato.common import KVDB, SERVICE_STATS
+from zato.common.histogram import get_bucket_field
+from zato.server.stats import get_index_key, get_slice_suffixes, StatsCollector
+
+# ################################################################################################################################
+
+class FakePipeline(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *ignored):
+        pass
+
+    def __getattr__(self, name):
+        def _command(*args):
+            self.commands.append((name,) + args)
+        return _command
+
+    def execute(self):
+        if self.conn.fail:
+            raise Exception('Cannot connect')
+
+        self.conn.commands.extend(self.commands)
+        return [self.conn.freq.get(elem[1]) if elem[0] == 'hget' else None for elem in self.commands]
+
+class FakeConn(object):
+    def __init__(self, freq=None):
+        self.commands = []
+        self.freq = freq or {}
+        self.fail = False
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+# ################################################################################################################################
+
+class StatsCollectorTestCase(TestCase):
+
+    def test_incr_usage(self):
+        collector = StatsCollector(FakeConn())
+
+        eq_(collector.incr_usage('a'), 1)
+        eq_(collector.incr_usage('a'), 2)
+        eq_(collector.incr_usage('b'), 1)
+
+        # Usage is per-worker and is not reset by flushing
+        collector.flush()
+        eq_(collector.incr_usage('a'), 3)
+
+    def test_flush(self):
+        conn = FakeConn()
+        collector = StatsCollector(conn)
+
+        collector.add('a', 0, '2016:01:02:03:04')
+        collector.add('a', 7, '2016:01:02:03:04')
+        collector.add('a', 20000, '2016:01:02:03:05')
+        collector.add('b', 3, '2016:01:02:03:05')
+
+        eq_(collector.flush(), 2)
+        eq_(collector.pending, {})
+
+        commands = [elem for elem in conn.commands if elem[1].endswith('a') or ':a:' in elem[1]]
+
+        self.assertIn(('incrby', KVDB.SERVICE_USAGE + 'a', 3), commands)
+        self.assertIn(('hset', KVDB.SERVICE_TIME_BASIC + 'a', 'last', 20000), commands)
+
+        key1 = KVDB.SERVICE_TIME_HISTOGRAM_BY_MINUTE + 'a:2016:01:02:03:04'
+        key2 = KVDB.SERVICE_TIME_HISTOGRAM_BY_MINUTE + 'a:2016:01:02:03:05'
+
+        self.assertIn(('hincrby', key1, get_bucket_field(0), 1), commands)
+        self.assertIn(('hincrby', key1, get_bucket_field(7), 1), commands)
+        self.assertIn(('hincrby', key1, 'sum', 7), commands)
+        self.assertIn(('hincrby', key2, get_bucket_field(20000), 1), commands)
+        self.assertIn(('hincrby', key2, 'sum', 20000), commands)
+        self.assertIn(('expire', key1, SERVICE_STATS.HISTOGRAM_BY_MINUTE_EXPIRE), commands)
+        self.assertIn(('expire', key2, SERVICE_STATS.HISTOGRAM_BY_MINUTE_EXPIRE), commands)
+        eq_(len([elem for elem in commands if elem[0] == 'hincrby']), 5)
+
+        index_key = get_index_key(KVDB.SERVICE_TIME_HISTOGRAM_BY_MINUTE, '2016:01:02:03:05')
+        self.assertIn(('sadd', index_key, 'a'), conn.commands)
+        self.assertIn(('sadd', index_key, 'b'), conn.commands)
+        self.assertIn(('expire', index_key, SERVICE_STATS.HISTOGRAM_BY_MINUTE_EXPIRE), conn.commands)
+
+        # Nothing is pending so nothing is written
+        conn.commands[:] = []
+        eq_(collector.flush(), 0)
+        eq_(conn.commands, [])
+
+    def test_flush_failed(self):
+        conn = FakeConn()
+        collector = StatsCollector(conn)
+
+        collector.add('a', 1, '2016:01:02:03:04')
+        collector.add('b', 2, '2016:01:02:03:04')
+
+        conn.fail = True
+        self.assertRaises(Exception, collector.flush)
+
+        # Nothing is lost, statistics recorded in the meantime are merged with ones that could not be flushed
+        collector.add('a', 5, '2016:01:02:03:04')
+        collector.add('a', 7, '2016:01:02:03:05')
+
+        conn.fail = False
+        eq_(collector.flush(), 2)
+
+        key1 = KVDB.SERVICE_TIME_HISTOGRAM_BY_MINUTE + 'a:2016:01:02:03:04'
+        key2 = KVDB.SERVICE_TIME_HISTOGRAM_BY_MINUTE + 'a:2016:01:02:03:05'
+
+        self.assertIn(('incrby', KVDB.SERVICE_USAGE + 'a', 3), conn.commands)
+        self.assertIn(('incrby', KVDB.SERVICE_USAGE + 'b', 1), conn.commands)
+        self.assertIn(('hset', KVDB.SERVICE_TIME_BASIC + 'a', 'last', 7), conn.commands)
+        self.assertIn(('hset', KVDB.SERVICE_TIME_BASIC + 'b', 'last', 2), conn.commands)
+        self.assertIn(('hincrby', key1, 'sum', 6), conn.commands)
+        self.assertIn(('hincrby', key2, 'sum', 7), conn.commands)
+
+    def test_stop(self):
+        conn = FakeConn()
+        collector = StatsCollector(conn)
+
+        collector.add('a', 1, '2016:01:02:03:04')
+        collector.stop()
+
+        # Nothing recorded since the last flush is lost when a worker stops
+        self.assertFalse(collector.keep_running)
+        self.assertIn(('incrby', KVDB.SERVICE_USAGE + 'a', 1), conn.commands)
+        eq_(collector.pending, {})
+
+    def test_req_resp_freq(self):
+        conn = FakeConn({KVDB.REQ_RESP_SAMPLE + 'a': '5'})
+        collector = StatsCollector(conn)
+
+        collector.incr_usage('a')
+        collector.incr_usage('b')
+        collector.add('a', 1, '2016:01:02:03:04')
+
+        eq_(collector.get_req_resp_freq('a'), 0)
+
+        collector.flush()
+
+        eq_(collector.get_req_resp_freq('a'), 5)
+        eq_(collector.get_req_resp_freq('b'), 0)
+        eq_(collector.get_req_resp_freq('c'), 0)
+
+# ################################################################################################################################
+
+class IndexTestCase(TestCase):
+
+    def test_get_index_key(self):
+        eq_(get_index_key(KVDB.SERVICE_TIME_AGGREGATED_BY_HOUR, '2016:01:02:03'),
+            'zato:stats:index:zato:stats:service:time:aggr-by-hour:2016:01:02:03')
+
+    def test_get_slice_suffixes(self):
+
+        suffixes = get_slice_suffixes('2016:02:28:23')
+        eq_(len(suffixes), 60)
+        eq_(suffixes[0], '2016:02:28:23:00')
+        eq_(suffixes[-1], '2016:02:28:23:59')
+
+        suffixes = get_slice_suffixes('2016:02:28')
+        eq_(len(suffixes), 24)
+        eq_(suffixes[0], '2016:02:28:00')
+        eq_(suffixes[-1], '2016:02:28:23')
+
+        # A leap year
+        suffixes = get_slice_suffixes('2016:02')
+        eq_(len(suffixes), 29)
+        eq_(suffixes[0], '2016:02:01')
+        eq_(suffixes[-1], '2016:02:29')
+
+        suffixes = get_slice_suffixes('2016')
+        eq_(len(suffixes), 12)
+        eq_(suffixes[0], '2016:01')
+        eq_(suffixes[-1], '2016:12')
@@ -71,6 +71,7 @@ $.fn.zato.http_soap.data_table.new_row = function(item, data, include_tr) {
 
     var is_active = item.is_active == true;
     var merge_url_params_req = item.merge_url_params_req == true;
+    var is_streaming = item.is_streaming == true;
 
     var cluster_id = $(document).getUrlParam('cluster');
     var connection = $(document).getUrlParam('connection');
@@ -86,6 +87,7 @@ $.fn.zato.http_soap.data_table.new_row = function(item, data, include_tr) {
     var merge_url_params_req_tr = '';
     var url_params_pri_tr = '';
     var params_pri_tr = '';
+    var is_streaming_tr = '';
     var serialization_type = item.serialization_type ? item.serialization_type : 'string';
 
     if(is_soap) {
@@ -100,6 +102,7 @@ $.fn.zato.http_soap.data_table.new_row = function(item, data, include_tr) {
         merge_url_params_req_tr += String.format('<td class="ignore">{0}</td>', merge_url_params_req);
         url_params_pri_tr += String.format('<td class="ignore">{0}</td>', item.url_params_pri);
         params_pri_tr += String.format('<td class="ignore">{0}</td>', item.params_pri);
+        is_streaming_tr += String.format('<td class="ignore">{0}</td>', is_streaming);
 
     }
 
@@ -159,6 +162,7 @@ $.fn.zato.http_soap.data_table.new_row = function(item, data, include_tr) {
         row += merge_url_params_req_tr;
         row += url_params_pri_tr;
         row += params_pri_tr;
+        row += is_streaming_tr;
     }
 
     row += String.format('<td>{0}</td>', String.format("<a href=\"javascript:$.fn.zato.http_soap.edit('{0}')\">Edit</a>", item.id));
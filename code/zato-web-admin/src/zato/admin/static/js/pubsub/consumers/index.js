@@ -52,6 +52,7 @@ $.fn.zato.pubsub.consumers.data_table.new_row = function(item, data, include_tr)
     row += String.format('<td>{0}</td>', data.sub_key);
     row += String.format('<td>{0}</td>', is_active ? "Yes": "No");
     row += String.format('<td>{0}</td>', item.delivery_mode);
+    row += String.format('<td>{0}</td>', item.group_name ? item.group_name : '');
     row += String.format('<td>{0}</td>', data.current_depth);
     row += String.format('<td>{0}</td>', data.in_flight_depth ? data.in_flight_depth : "0");
     row += String.format('<td>{0}</td>', item.max_depth);
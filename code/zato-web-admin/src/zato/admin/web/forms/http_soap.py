@@ -35,6 +35,7 @@ class CreateForm(DataFormatForm):
     merge_url_params_req = forms.BooleanField(required=False, widget=forms.CheckboxInput(attrs={'checked':'checked'}))
     url_params_pri = forms.ChoiceField(widget=forms.Select())
     params_pri = forms.ChoiceField(widget=forms.Select())
+    is_streaming = forms.BooleanField(required=False, widget=forms.CheckboxInput())
     serialization_type = forms.ChoiceField(widget=forms.Select())
     sec_tls_ca_cert_id = forms.ChoiceField(widget=forms.Select())
     method = forms.CharField(widget=forms.TextInput(attrs={'style':'width:20%'}))
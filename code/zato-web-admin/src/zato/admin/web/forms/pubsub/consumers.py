@@ -25,6 +25,7 @@ class CreateForm(forms.Form):
     callback_id = forms.ChoiceField(widget=forms.Select())
     max_depth = forms.CharField(
         initial=PUB_SUB.DEFAULT_MAX_BACKLOG, widget=forms.TextInput(attrs={'class':'required', 'style':'width:20%'}))
+    group_name = forms.CharField(required=False, widget=forms.TextInput(attrs={'style':'width:100%'}))
 
     def __init__(self, prefix=None, post_data=None, client_ids=None, callback_ids=None):
         super(CreateForm, self).__init__(post_data, prefix=prefix)
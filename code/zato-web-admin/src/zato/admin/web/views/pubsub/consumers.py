@@ -37,7 +37,7 @@ class Index(_Index):
         input_required = ('cluster_id', 'topic_name')
         output_required = ('id', 'name', 'is_active', 'sec_type', 'client_id', 'last_seen', 'max_depth', 'current_depth',
             'in_flight_depth', 'sub_key', 'delivery_mode')
-        output_optional = ('callback_id',)
+        output_optional = ('callback_id', 'group_name')
         output_repeated = True
 
     def handle(self):
@@ -75,7 +75,7 @@ class _CreateEdit(CreateEdit):
 
     class SimpleIO(CreateEdit.SimpleIO):
         input_required = ('id', 'cluster_id', 'client_id', 'is_active', 'topic_name', 'max_depth', 'delivery_mode')
-        input_optional = ('callback_id',)
+        input_optional = ('callback_id', 'group_name')
         output_required = ('id', 'name', 'last_seen', 'current_depth', 'in_flight_depth', 'sub_key')
 
     def success_message(self, item):
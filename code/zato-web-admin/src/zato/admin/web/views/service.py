@@ -217,7 +217,8 @@ def overview(req, service_name):
 
             response = req.zato.client.invoke('zato.stats.get-by-service', {'service_id':service.id, 'start':start, 'stop':now})
             if response.has_data:
-                for name in('mean_trend', 'usage_trend', 'min_resp_time', 'max_resp_time', 'mean', 'usage', 'rate'):
+                for name in('mean_trend', 'usage_trend', 'min_resp_time', 'max_resp_time', 'mean', 'usage', 'rate',
+                        'p50', 'p90', 'p99', 'p999'):
                     value = getattr(response.data, name)
                     if not value or value == ZATO_NONE:
                         value = ''
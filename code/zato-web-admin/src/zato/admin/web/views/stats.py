@@ -350,7 +350,7 @@ def _get_stats(client, start, stop, n, n_type, stats_type=None):
 def _stats_data_csv(user_profile, req_input, client, ignored, stats_type, is_custom, req):
 
     n_type_keys = {
-        'mean': ['start', 'stop', 'service_name', 'mean', 'mean_all_services',
+        'mean': ['start', 'stop', 'service_name', 'mean', 'p50', 'p90', 'p99', 'p999', 'mean_all_services',
                   'usage_perc_all_services', 'time_perc_all_services', 'all_services_usage', 'mean_trend'],
         'usage': ['start', 'stop', 'service_name', 'usage', 'rate', 'usage_perc_all_services',
                   'time_perc_all_services', 'all_services_usage', 'usage_trend'],